@@ -1356,6 +1356,23 @@ def task():
                               rheader = s3db.s3_scheduler_rheader,
                               )
 
+# -----------------------------------------------------------------------------
+@auth.s3_requires_membership(1)
+def task_queue():
+    """
+        Scheduler task queues: depth and latency status (JSON)
+    """
+
+    window = get_vars.get("window")
+    try:
+        window = int(window) if window else 3600
+    except ValueError:
+        window = 3600
+
+    import json
+    response.headers["Content-Type"] = "application/json"
+    return json.dumps(s3task.queue_status(window=window))
+
 # =============================================================================
 def result():
     """
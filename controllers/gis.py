@@ -682,147 +682,31 @@ def ldata():
                }
          }
 
-        @ToDo: DRY with S3LocationSelector _locations()
+        - served from the hierarchy cache, with ETag/Last-Modified
+          headers for cheap revalidation (see GIS.get_ldata)
     """
 
     req_args = request.args
     try:
-        location_id = req_args[0]
-    except:
+        location_id = int(req_args[0])
+    except (IndexError, ValueError):
         raise HTTP(400)
 
     s3base.s3_keep_messages()
     response.headers["Content-Type"] = "application/json"
 
     if len(req_args) > 1:
-        output_level = int(req_args[1])
+        try:
+            output_level = int(req_args[1])
+        except ValueError:
+            raise HTTP(400)
     else:
         output_level = None
 
-    # Translate options using gis_location_name?
-    language = session.s3.language
-    if language in ("en", "en-gb"):
-        translate = False
-    else:
-        translate = settings.get_L10n_translate_gis_location()
-
-    table = s3db.gis_location
-    query = (table.deleted == False) & \
-            (table.end_date == None) & \
-            (table.level != None)
-    if output_level:
-        # We will be reading all descendants, which is inefficient, but otherwise we cannot support individual locations with missing levels
-        # Filter out results from the missing level as otherwise these show up like individual locations with missing levels
-        filter_level = output_level - 1
-        query &= (table.level != "L%s" % filter_level) & \
-                 ((table.path.like(location_id + "/%")) | \
-                  (table.path.like("%/" + location_id + "/%")))
-    else:
-        query &= (table.parent == location_id)
-    fields = [table.id,
-              table.name,
-              table.level,
-              table.parent,
-              table.lon_min,
-              table.lat_min,
-              table.lon_max,
-              table.lat_max,
-              ]
-    if translate:
-        ntable = s3db.gis_location_name
-        fields.append(ntable.name_l10n)
-        left = ntable.on((ntable.deleted == False) & \
-                         (ntable.language == language) & \
-                         (ntable.location_id == table.id))
-    else:
-        left = None
-
-    locations = db((table.id == location_id) | query).select(*fields,
-                                                             left=left)
+    output, last_modified = gis.get_ldata(location_id, output_level)
+    gis.revalidate(output, last_modified)
 
-    location_id = int(location_id)
-    if not output_level:
-        # Introspect it
-        if translate:
-            try:
-                id_level = int(locations.as_dict(key="gis_location.id")[location_id]["gis_location"]["level"][1:])
-            except:
-                return "{}"
-        else:
-            try:
-                id_level = int(locations.as_dict()[location_id]["level"][1:])
-            except:
-                return "{}"
-
-        output_level = id_level + 1
-
-    search_level = "L%s" % output_level
-
-    location_dict = {}
-    if translate:
-        for location in locations:
-            l = location["gis_location"]
-            if l.level == search_level:
-                this_level = output_level
-                # In case we're using a missing level, use the pseudo-parent
-                #f = int(l.parent)
-                f = location_id
-            else:
-                # An individual location with a Missing Level
-                this_level = int(l.level[1:])
-                parent = l.parent
-                if parent:
-                    f = int(parent)
-                else:
-                    f = None
-            name = location["gis_location_name.name_l10n"] or l.name
-            if l.lon_min is not None:
-                location_dict[int(l.id)] = {"n": name,
-                                            "l": this_level,
-                                            "f": f,
-                                            "b": [l.lon_min,
-                                                  l.lat_min,
-                                                  l.lon_max,
-                                                  l.lat_max
-                                                  ],
-                                            }
-            else:
-                location_dict[int(l.id)] = {"n": name,
-                                            "l": this_level,
-                                            "f": f,
-                                            }
-    else:
-        for l in locations:
-            if l.level == search_level:
-                this_level = output_level
-                # In case we're using a missing level, use the pseudo-parent
-                #f = int(l.parent)
-                f = location_id
-            else:
-                # An individual location with a Missing Level
-                this_level = int(l.level[1:])
-                parent = l.parent
-                if parent:
-                    f = int(parent)
-                else:
-                    f = None
-            if l.lon_min is not None:
-                location_dict[int(l.id)] = {"n": l.name,
-                                            "l": this_level,
-                                            "f": f,
-                                            "b": [l.lon_min,
-                                                  l.lat_min,
-                                                  l.lon_max,
-                                                  l.lat_max
-                                                  ],
-                                            }
-            else:
-                location_dict[int(l.id)] = {"n": l.name,
-                                            "l": this_level,
-                                            "f": f,
-                                            }
-
-    return json.dumps(location_dict, separators=SEPARATORS)
+    return output
 
 # -----------------------------------------------------------------------------
 def hdata():
@@ -2901,6 +2785,19 @@ def cache_feed():
         # Unzip & Follow Network Links
         #download_kml.delay(url)
 
+    if request.extension == "geojson" and not request.args:
+        source = get_vars.get("cache.source")
+        if source:
+            # Serve the features from the cache, filtered by BBOX
+            # - the cache is refreshed by the gis_refresh_feeds task
+            if not auth.s3_has_permission("read", "gis_cache"):
+                auth.permission.fail()
+            bbox = get_vars.get("bbox")
+            if isinstance(bbox, list):
+                bbox = bbox[-1]
+            response.headers["Content-Type"] = "application/json"
+            return gis.get_cached_features(source, bbox)
+
     output = s3_rest_controller("gis", "cache")
     return output
 
@@ -3910,6 +3807,46 @@ def potlatch2():
         session.warning = T("To edit OpenStreetMap, you need to edit the OpenStreetMap settings in your Map Config")
         redirect(URL(c="pr", f="person", args=["config"]))
 
+# =============================================================================
+def tile_cache():
+    """
+        Tile Cache for WMS/TMS layers (see proxy), for Map Admins:
+            - GET: statistics (JSON)
+            - POST: seed the cache (async) with the tiles of a bounding
+                    box and zoom range of a layer
+                    (layer_id, bbox=lon_min,lat_min,lon_max,lat_max,
+                     zoom_min, zoom_max)
+    """
+
+    if not auth.s3_has_role("MAP_ADMIN"):
+        auth.permission.fail()
+
+    response.headers["Content-Type"] = "application/json"
+
+    if request.env.request_method == "POST":
+        post_vars = request.post_vars
+        try:
+            layer_id = int(post_vars.layer_id)
+            bbox = [float(c) for c in post_vars.bbox.split(",")]
+            zoom_min = int(post_vars.zoom_min or 0)
+            zoom_max = int(post_vars.zoom_max)
+        except (AttributeError, TypeError, ValueError):
+            bbox = None
+        if not bbox or len(bbox) != 4 or not 0 <= zoom_min <= zoom_max < 30:
+            raise HTTP(400, body=current.xml.json_message(False, 400, "Invalid parameters"))
+        if not s3base.S3TileCache.get_layer(layer_id):
+            raise HTTP(404, body=current.xml.json_message(False, 404, "Layer not found"))
+        s3task.run_async("gis_seed_tiles",
+                         vars = {"layer_id": layer_id,
+                                 "bbox": bbox,
+                                 "zoom_min": zoom_min,
+                                 "zoom_max": zoom_max,
+                                 },
+                         )
+        return current.xml.json_message(True, 200, "Seeding scheduled")
+
+    return json.dumps(s3base.S3TileCache.statistics(), separators=SEPARATORS)
+
 # =============================================================================
 def proxy():
     """
@@ -3930,6 +3867,42 @@ def proxy():
     from s3compat import URLError, urllib2, urlopen
     import cgi
 
+    if request.args(0) == "tile":
+        # Tile Cache for WMS/TMS layers:
+        # gis/proxy/tile/<layer_id>[/<TMS path>][?<WMS params>]
+        from gluon.contenttype import contenttype
+        from s3compat import HTTPError
+        try:
+            layer_id = int(request.args(1))
+        except (TypeError, ValueError):
+            raise HTTP(400, body=current.xml.json_message(False, 400, "Invalid layer"))
+        cache = s3base.S3TileCache.get_layer(layer_id)
+        if not cache:
+            raise HTTP(404, body=current.xml.json_message(False, 404, "Layer not found"))
+        try:
+            url, key, extension = cache.request(request.args[2:], request.get_vars)
+        except ValueError:
+            if cache.tablename != "gis_layer_wms":
+                raise HTTP(400)
+            # Not a tile (e.g. GetFeatureInfo) => forward without caching
+            try:
+                content, ct = cache.forward(request.get_vars)
+            except (HTTPError, URLError, IOError):
+                raise HTTP(504, "Unable to reach host")
+            if ct:
+                response.headers["Content-Type"] = ct
+            return content
+        try:
+            tile = cache.get(url, key, extension)
+        except HTTPError as e:
+            raise HTTP(502, "Service error: %s" % e.code)
+        except (URLError, IOError, ValueError):
+            raise HTTP(504, "Unable to retrieve tile")
+        ttl = cache.layer.tile_cache
+        response.headers["Content-Type"] = contenttype(".%s" % extension)
+        response.headers["Cache-Control"] = "max-age=%s" % min(ttl or 86400, 86400)
+        return tile
+
     if auth.is_logged_in():
         # Authenticated users can use our Proxy
         allowedHosts = None
@@ -334,6 +334,12 @@ def log():
                               list_btn=list_btn,
                               )
 
+# -----------------------------------------------------------------------------
+def run():
+    """ Synchronization Status: RESTful CRUD controller """
+
+    return s3_rest_controller()
+
 # -----------------------------------------------------------------------------
 def task():
     """ Sync Tasks: RESTful CRUD controller """
@@ -214,12 +214,14 @@ def s3_rest_controller(prefix=None, resourcename=None, **attr):
                                redirect(URL(args = "create",
                                             vars = {"from_record":r.id})))
     set_handler("deduplicate", s3base.S3Merge)
+    set_handler("export_job", s3base.S3ExportJobs, http=("GET", "POST"))
     set_handler("filter", s3base.S3Filter)
     set_handler("grouped", s3base.S3GroupedItemsReport)
     set_handler("hierarchy", s3base.S3HierarchyCRUD)
     set_handler("import", s3base.S3Importer)
     set_handler("map", s3base.S3Map)
     set_handler("mform", s3base.S3MobileCRUD, representation="json")
+    set_handler("mvt", s3base.S3VectorTiles)
     set_handler("organize", s3base.S3Organizer)
     set_handler("profile", s3base.S3Profile)
     set_handler("report", s3base.S3Report) # For HTML, JSON
@@ -89,6 +89,41 @@ def maintenance(period = "daily"):
 
     return result
 
+# -----------------------------------------------------------------------------
+def s3_export_job(job_id, user_id=None):
+    """
+        Render an asynchronous export (S3ExportJob)
+
+        @param job_id: the s3_export_job record ID
+        @param user_id: calling request's auth.user.id or None
+    """
+    if user_id:
+        # Authenticate
+        auth.s3_impersonate(user_id)
+    # Run the Task & return the result
+    result = s3base.S3ExportJob.run(job_id)
+    db.commit()
+    return result
+
+# -----------------------------------------------------------------------------
+def s3_audit_prune(days=None, user_id=None):
+    """
+        Remove old entries from the audit trail
+        - to be scheduled daily if security.audit_retention is set
+
+        @param days: remove entries older than this number of days
+                     (default: security.audit_retention setting)
+        @param user_id: calling request's auth.user.id or None
+    """
+    if user_id:
+        # Authenticate
+        auth.s3_impersonate(user_id)
+
+    # Run the Task & return the result
+    result = audit.prune(days=days)
+    db.commit()
+    return result
+
 # -----------------------------------------------------------------------------
 # GIS: always-enabled
 # -----------------------------------------------------------------------------
@@ -112,6 +147,81 @@ def gis_download_kml(record_id, filename, session_id_name, session_id,
     db.commit()
     return result
 
+# -----------------------------------------------------------------------------
+def gis_import_admin_areas(source="gadmv1", countries=None, levels=None, user_id=None):
+    """
+        Import Admin Boundaries into the Locations table
+            - progress is reported as task output, visible while the task
+              is running if scheduled with sync_output, e.g.:
+              s3task.schedule_task("gis_import_admin_areas",
+                                   vars = {"countries": ["NP"]},
+                                   timeout = 86400,
+                                   sync_output = 10,
+                                   )
+
+        @param source: the source to import from (see GIS.import_admin_areas)
+        @param countries: list of ISO2 country codes (default: all)
+        @param levels: list of levels to import (default: L0, L1, L2)
+        @param user_id: calling request's auth.user.id or None
+    """
+    if user_id:
+        # Authenticate
+        auth.s3_impersonate(user_id)
+
+    import sys
+
+    def progress(level, count):
+        # Scheduler shows only the output after the last !clear!
+        sys.stdout.write("!clear!%s: %s features imported\n" % (level, count))
+        sys.stdout.flush()
+
+    # Run the Task & return the result
+    gis.import_admin_areas(source = source,
+                           countries = countries or [],
+                           levels = levels or ["L0", "L1", "L2"],
+                           progress = progress,
+                           )
+    db.commit()
+
+# -----------------------------------------------------------------------------
+def gis_refresh_feeds(layer_ids=None, force=False, user_id=None):
+    """
+        Refresh the cached copies of remote KML/GeoRSS feeds
+            - scheduled, so that map requests never need to fetch feeds
+
+        @param layer_ids: only refresh these layers (list of layer_ids)
+        @param force: refresh regardless of the refresh interval
+        @param user_id: calling request's auth.user.id or None
+    """
+    if user_id:
+        # Authenticate
+        auth.s3_impersonate(user_id)
+    # Run the Task & return the result
+    result = gis.refresh_feeds(layer_ids, force=force)
+    db.commit()
+    return result
+
+# -----------------------------------------------------------------------------
+def gis_seed_tiles(layer_id, bbox, zoom_min, zoom_max, user_id=None):
+    """
+        Fetch the tiles of a WMS/TMS layer into the Tile Cache
+
+        @param layer_id: the layer_id
+        @param bbox: the bounding box [lon_min, lat_min, lon_max, lat_max]
+        @param zoom_min: the minimum zoom level
+        @param zoom_max: the maximum zoom level
+        @param user_id: calling request's auth.user.id or None
+    """
+    if user_id:
+        # Authenticate
+        auth.s3_impersonate(user_id)
+    # Run the Task & return the result
+    cache = s3base.S3TileCache.get_layer(layer_id)
+    if not cache:
+        return "Layer not found"
+    count, failed = cache.seed(bbox, zoom_min, zoom_max)
+    return "%s tiles seeded, %s failed" % (count - failed, failed)
+
 # -----------------------------------------------------------------------------
 def gis_update_location_tree(feature, user_id=None):
     """
@@ -130,6 +240,42 @@ def gis_update_location_tree(feature, user_id=None):
     db.commit()
     return path
 
+# -----------------------------------------------------------------------------
+def gis_update_simplified(location_ids=None, user_id=None):
+    """
+        Precompute simplified geometries of polygon locations
+            - will normally be done Asynchronously if there is a worker alive
+
+        @param location_ids: list of gis_location record IDs, or None to
+                             process all polygons without simplified
+                             geometries
+        @param user_id: calling request's auth.user.id or None
+    """
+    if user_id:
+        # Authenticate
+        auth.s3_impersonate(user_id)
+    # Run the Task & return the result
+    result = gis.update_simplified(location_ids)
+    db.commit()
+    return result
+
+# -----------------------------------------------------------------------------
+def gis_geocode_pending(user_id=None):
+    """
+        Geocode all imported addresses which have no Lat/Lon yet
+            - each distinct address only once, respecting the rate limit
+              of the geocoder service
+
+        @param user_id: calling request's auth.user.id or None
+    """
+    if user_id:
+        # Authenticate
+        auth.s3_impersonate(user_id)
+    # Run the Task & return the result
+    result = gis.geocode_pending()
+    db.commit()
+    return result
+
 # -----------------------------------------------------------------------------
 # Org: always-enabled
 # -----------------------------------------------------------------------------
@@ -151,8 +297,15 @@ tasks = {"dummy": dummy,
          "s3db_task": s3db_task,
          "settings_task": settings_task,
          "maintenance": maintenance,
+         "s3_audit_prune": s3_audit_prune,
+         "s3_export_job": s3_export_job,
          "gis_download_kml": gis_download_kml,
+         "gis_import_admin_areas": gis_import_admin_areas,
+         "gis_refresh_feeds": gis_refresh_feeds,
+         "gis_seed_tiles": gis_seed_tiles,
          "gis_update_location_tree": gis_update_location_tree,
+         "gis_update_simplified": gis_update_simplified,
+         "gis_geocode_pending": gis_geocode_pending,
          "org_site_check": org_site_check,
          }
 
@@ -661,6 +814,8 @@ if has_module("sync"):
     def sync_synchronize(repository_id, user_id=None, manual=False):
         """
             Run all tasks for a repository, to be called from scheduler
+            - tasks are queued as separate runs, which are executed
+              concurrently (see S3SyncScheduler)
         """
         if user_id:
             # Authenticate
@@ -671,9 +826,10 @@ if has_module("sync"):
                 (rtable.id == repository_id)
         repository = db(query).select(limitby=(0, 1)).first()
         if repository:
-            sync = s3base.S3Sync()
-            status = sync.get_status()
-            if status.running:
+            scheduler = s3base.S3SyncScheduler()
+            run_ids = scheduler.schedule(repository, manual=manual)
+            if run_ids is None:
+                sync = scheduler.sync
                 message = "Synchronization already active - skipping run"
                 sync.log.write(repository_id=repository.id,
                                resource_name=None,
@@ -685,16 +841,27 @@ if has_module("sync"):
                                message=message)
                 db.commit()
                 return sync.log.ERROR
-            sync.set_status(running=True, manual=manual)
-            try:
-                sync.synchronize(repository)
-            finally:
-                sync.set_status(running=False, manual=False)
         db.commit()
         return s3base.S3SyncLog.SUCCESS
 
     tasks["sync_synchronize"] = sync_synchronize
 
+    # -------------------------------------------------------------------------
+    def sync_run(run_id, user_id=None):
+        """
+            Execute a queued synchronization run (=a single sync task),
+            to be called from scheduler
+        """
+        if user_id:
+            # Authenticate
+            auth.s3_impersonate(user_id)
+
+        success = s3base.S3SyncScheduler().run(run_id)
+        db.commit()
+        return s3base.S3SyncLog.SUCCESS if success else s3base.S3SyncLog.ERROR
+
+    tasks["sync_run"] = sync_run
+
 # -----------------------------------------------------------------------------
 # Instantiate Scheduler instance with the list of tasks
 s3.tasks = tasks
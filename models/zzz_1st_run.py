@@ -189,6 +189,14 @@ if len(pop_list) > 0:
                          repeats = 0     # unlimited
                          )
 
+    # Refresh cached KML/GeoRSS feeds every 5 minutes
+    # (each feed as per the refresh interval of its layer)
+    s3task.schedule_task("gis_refresh_feeds",
+                         period = 300,  # seconds
+                         timeout = 300, # seconds
+                         repeats = 0    # unlimited
+                         )
+
     # =========================================================================
     # Import PrePopulate data
     #
@@ -429,6 +437,16 @@ if len(pop_list) > 0:
         # autovacuum should be on anyway so will run ANALYZE after 50 rows inserted/updated/deleted
         #db.executesql("VACUUM ANALYZE;")
 
+    # Add index for BBOX queries of cached feeds
+    tablename = "gis_cache"
+    db.executesql("CREATE INDEX %s_bbox__idx on %s(lon_min,lat_min,lon_max,lat_max);" % (tablename, tablename))
+
+    # Add index for pruning of the audit trail
+    tablename = "s3_audit"
+    if tablename in db:
+        field = "timestmp"
+        db.executesql("CREATE INDEX %s_%s__idx on %s(%s);" % (tablename, field, tablename, field))
+
     # =========================================================================
     info("\n*** FIRST RUN COMPLETE ***\n")
 
@@ -90,6 +90,9 @@ from .s3crud import *
 from .s3forms import *
 from .s3organizer import *
 
+# Exports
+from .s3export import *
+
 # Filtering
 from .s3filter import *
 
@@ -126,6 +129,8 @@ from .s3track import *
 
 # GIS Mapping
 from .s3gis import *
+from .s3spatial import *
+from .s3tiles import *
 
 # Messaging
 from .s3msg import *
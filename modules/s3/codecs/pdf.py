@@ -30,8 +30,12 @@
 
 __all__ = ("S3RL_PDF",)
 
+from collections import deque
 from copy import deepcopy
 import os
+import tempfile
+import unicodedata
+from xml.sax.saxutils import escape
 
 from gluon import current, redirect, URL, \
                   A, DIV, H1, H2, H3, H4, H5, H6, IMG, P, \
@@ -39,14 +43,12 @@ from gluon import current, redirect, URL, \
 from gluon.storage import Storage
 from gluon.contenttype import contenttype
 from gluon.languages import lazyT
+from gluon.streamer import DEFAULT_CHUNK_SIZE
 
 from s3compat import PY2, BytesIO, basestring, xrange
 from ..s3codec import S3Codec
 from ..s3utils import s3_strip_markup, s3_unicode, s3_str
 
-if not PY2:
-    import unicodedata
-
 try:
     from reportlab.graphics.shapes import Drawing, Line
     from reportlab.lib import colors
@@ -76,12 +78,25 @@ except ImportError:
 try:
     from bidi.algorithm import get_display
     import arabic_reshaper
-    import unicodedata
     biDiImported = True
 except ImportError:
     biDiImported = False
     current.log.warning("PDF Codec", "BiDirectional Support not available: Install Python-BiDi")
 
+try:
+    from pypdf import PdfReader
+    from pypdf.generic import ArrayObject, DictionaryObject, \
+                              IndirectObject, StreamObject
+    pypdfImported = True
+except ImportError:
+    try:
+        from PyPDF2 import PdfReader
+        from PyPDF2.generic import ArrayObject, DictionaryObject, \
+                                   IndirectObject, StreamObject
+        pypdfImported = True
+    except ImportError:
+        pypdfImported = False
+
 PDF_WIDTH = 0
 PDF_HEIGHT = 1
 
@@ -219,6 +234,9 @@ class S3RL_PDF(S3Codec):
             @keyword use_colour:      True to add colour to the cells. default False
 
             @keyword pdf_html_styles: styles for S3html2pdf (dict)
+
+            @keyword as_stream: return the output as file-like object
+                                rather than as string
         """
 
         if not reportLabImported:
@@ -296,6 +314,7 @@ class S3RL_PDF(S3Codec):
 
         # Get data for the body of the text
         body_flowable = None
+        output = None
 
         doc.calc_body_size(header_flowable, footer_flowable)
 
@@ -320,22 +339,39 @@ class S3RL_PDF(S3Codec):
 
         elif r.component or attr_get("method", "list") != "read":
             # Use the requested resource
-            body_flowable = self.get_resource_flowable(resource, doc)
+            query = self.get_resource_query(resource)
+            output = self.get_resource_chunked(resource,
+                                               doc,
+                                               query,
+                                               header_flowable,
+                                               footer_flowable,
+                                               )
+            if output is None:
+                body_flowable = self.get_resource_flowable(resource,
+                                                           doc,
+                                                           query = query,
+                                                           )
+
+        if output is None:
+            styleSheet = getSampleStyleSheet()
+            style = styleSheet["Normal"]
+            style.fontName = self.font_name
+            style.fontSize = 9
+            if not body_flowable:
+                body_flowable = [Paragraph("", style)]
+            self.normalstyle = style
+
+            # Build the PDF
+            doc.build(header_flowable,
+                      body_flowable,
+                      footer_flowable,
+                      canvasmaker = S3NumberedCanvas,
+                      )
+            output = doc.output
+            output.seek(0)
 
-        styleSheet = getSampleStyleSheet()
-        style = styleSheet["Normal"]
-        style.fontName = self.font_name
-        style.fontSize = 9
-        if not body_flowable:
-            body_flowable = [Paragraph("", style)]
-        self.normalstyle = style
-
-        # Build the PDF
-        doc.build(header_flowable,
-                  body_flowable,
-                  footer_flowable,
-                  canvasmaker = S3NumberedCanvas,
-                  )
+        if attr_get("as_stream", False):
+            return output
 
         # Return the generated PDF
         response = current.response
@@ -356,7 +392,16 @@ class S3RL_PDF(S3Codec):
             response.headers["Content-Type"] = contenttype(".pdf")
             response.headers["Content-disposition"] = disposition
 
-        return doc.output.getvalue()
+        if isinstance(output, BytesIO):
+            return output.getvalue()
+        elif response:
+            # Chunked output in temporary file
+            return response.stream(output,
+                                   chunk_size = DEFAULT_CHUNK_SIZE,
+                                   request = current.request,
+                                   )
+        else:
+            return output.read()
 
     # -------------------------------------------------------------------------
     def get_html_flowable(self, rules, printable_width, styles=None):
@@ -402,11 +447,16 @@ class S3RL_PDF(S3Codec):
         return result
 
     # -------------------------------------------------------------------------
-    def get_resource_flowable(self, resource, doc):
+    def get_resource_query(self, resource):
         """
             Get a list of fields, if the list_fields attribute is provided
             then use that to extract the fields that are required, otherwise
-            use the list of readable fields.
+            use the list of readable fields; apply the datatable filter
+            to the resource
+
+            @param resource: the S3Resource
+
+            @returns: tuple (list_fields, orderby, left)
         """
 
         fields = self.list_fields
@@ -422,6 +472,24 @@ class S3RL_PDF(S3Codec):
         dtfilter, orderby, left = resource.datatable_filter(list_fields, get_vars)
         resource.add_filter(dtfilter)
 
+        return list_fields, orderby, left
+
+    # -------------------------------------------------------------------------
+    def get_resource_flowable(self, resource, doc, query=None):
+        """
+            Extract the data from the resource and convert them into
+            flowables (table or list)
+
+            @param resource: the S3Resource
+            @param doc: the EdenDocTemplate
+            @param query: the result of get_resource_query, if already
+                          applied to the resource
+        """
+
+        if query is None:
+            query = self.get_resource_query(resource)
+        list_fields, orderby, left = query
+
         # Should we limit the number of rows in the export?
         max_rows = current.deployment_settings.get_pdf_max_rows()
         limit, count = (max_rows, True) if max_rows else (None, False)
@@ -454,6 +522,266 @@ class S3RL_PDF(S3Codec):
                                 ).build()
         return output
 
+    # -------------------------------------------------------------------------
+    def get_resource_chunked(self,
+                             resource,
+                             doc,
+                             query,
+                             header_flowable=None,
+                             footer_flowable=None,
+                             ):
+        """
+            Render large table exports in chunks: the table layout is
+            computed from the first chunk, then each chunk is rendered
+            into a partial document (in parallel worker processes, if
+            configured), and the partial documents are concatenated
+            page by page with header, footer and page numbers added
+
+            - chunks are rendered as plain text, i.e. markup in represented
+              values (e.g. links, line breaks, formatting) is stripped, and
+              exports including image fields are therefore never chunked
+
+            @param resource: the S3Resource
+            @param doc: the EdenDocTemplate
+            @param query: the result of get_resource_query
+            @param header_flowable: the header flowables
+            @param footer_flowable: the footer flowables
+
+            @returns: a temporary file with the PDF document, or None
+                      if the resource shall not be rendered in chunks
+        """
+
+        settings = current.deployment_settings
+
+        chunk_size = settings.get_pdf_chunk_size()
+        if not chunk_size or not pypdfImported or \
+           self.pdf_groupby or resource.get_config("pdf_format") == "list":
+            return None
+
+        list_fields, orderby, left = query
+
+        # Images can not be rendered in chunks
+        rfields = resource.resolve_selectors(list_fields)[0]
+        if any(rfield.ftype == "upload" for rfield in rfields):
+            return None
+
+        # Count the records
+        max_rows = settings.get_pdf_max_rows()
+        totalrows = resource.count(left=left)
+        numrows = min(totalrows, max_rows) if max_rows else totalrows
+        if numrows <= chunk_size:
+            return None
+
+        # Add the primary key to the orderby to make paging stable
+        from ..s3export import S3Exporter
+        orderby = S3Exporter.stable_orderby(resource.table, orderby)
+
+        chunks = S3Exporter.chunks(resource,
+                                   list_fields,
+                                   chunk_size,
+                                   orderby,
+                                   left = left,
+                                   limit = numrows,
+                                   represent = True,
+                                   as_rows = False,
+                                   )
+
+        # Compute the table layout from the first chunk
+        try:
+            data = next(chunks)
+        except StopIteration:
+            return None
+        rfields = data.rfields
+        table = S3PDFTable(doc,
+                           rfields,
+                           data.rows,
+                           autogrow = "H" if self.table_autogrow in ("H", "B") else None,
+                           )
+        if not table.build():
+            return None
+        doc.calc_body_size(header_flowable, footer_flowable)
+
+        col_widths = table.col_widths
+        parts = []
+        offset = 0
+        for widths in col_widths:
+            end = offset + len(widths)
+            labels = table.labels[offset:end]
+            style = table.table_style(0, 0, len(widths) - 1)
+            parts.append((labels, widths, style, offset, end))
+            offset = end
+
+        # Font files for the worker processes
+        fonts = []
+        font_set = settings.get_pdf_export_font()
+        if font_set and table.font_name == font_set[0]:
+            folder = os.path.join(current.request.folder, "static", "fonts")
+            for font_name in font_set[:2]:
+                fonts.append((font_name,
+                              os.path.join(folder, "%s.ttf" % font_name),
+                              ))
+
+        frame = (doc.leftMargin,
+                 doc.bottomMargin + doc.footer_height,
+                 doc.printable_width,
+                 doc.body_height,
+                 )
+
+        rtl = current.response.s3.rtl
+        def spec(data, hint=None):
+            # The render specification for a chunk
+            rows = []
+            for row in data.rows:
+                row_data = [biDiText(s3_strip_markup(s3_str(row[rfield.colname])))
+                            for rfield in rfields
+                            ]
+                if rtl:
+                    row_data.reverse()
+                rows.append(row_data)
+            return {"pagesize": tuple(doc.pagesize),
+                    "frame": frame,
+                    "fonts": fonts,
+                    "font_name": table.font_name,
+                    "fontsize": table.fontsize,
+                    "parts": parts,
+                    "rows": rows,
+                    "hint": hint,
+                    }
+
+        # Hint for too many records
+        hint = None
+        if totalrows > numrows:
+            hint = current.T("Too many records - %(number)s more records not included") % \
+                                {"number": totalrows - numrows}
+            hint = s3_str(hint)
+
+        def specs():
+            # Generator for the render specifications
+            num = len(data.rows)
+            yield spec(data, hint if num >= numrows else None)
+            for chunk in chunks:
+                num += len(chunk.rows)
+                yield spec(chunk, hint if num >= numrows else None)
+
+        # Render the chunks into temporary files
+        paths = []
+        try:
+            for path in self.render_parts(specs(), settings.get_pdf_workers()):
+                paths.append(path)
+
+            # Count the pages
+            page_counts = [len(PdfReader(path).pages) for path in paths]
+            page_count = sum(page_counts)
+
+            # Concatenate the partial documents, adding header, footer
+            # and page numbers to the pages of one part at a time
+            doc.header_flowable = header_flowable
+            doc.footer_flowable = footer_flowable
+            output = tempfile.TemporaryFile()
+            merger = S3PDFMerger(output)
+            first = 1
+            for path, num_pages in zip(paths, page_counts):
+                decorations = self.decorations(doc, first, num_pages, page_count)
+                pages = PdfReader(path).pages
+                for page, decoration in zip(pages, PdfReader(decorations).pages):
+                    page.merge_page(decoration)
+                merger.add_pages(pages)
+                first += num_pages
+            merger.close()
+        finally:
+            for path in paths:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        output.seek(0)
+
+        return output
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def decorations(doc, first, num_pages, page_count):
+        """
+            Render the header, footer and page numbers for a sequence
+            of pages into a separate PDF document, to be merged with
+            the pages of a partial document
+
+            @param doc: the EdenDocTemplate
+            @param first: the number of the first page
+            @param num_pages: the number of pages
+            @param page_count: the total number of pages in the document
+
+            @returns: the PDF document (BytesIO)
+        """
+
+        output = BytesIO()
+        c = S3NumberedCanvas(output, pagesize=doc.pagesize)
+        for page_number in xrange(first, first + num_pages):
+            doc.add_page_decorators(c, doc)
+            c.draw_page_number(page_count, page_number=page_number)
+            canvas.Canvas.showPage(c)
+        canvas.Canvas.save(c)
+        output.seek(0)
+
+        return output
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def render_parts(specs, workers=None):
+        """
+            Render chunks of a table into partial PDF documents, using
+            a process pool if more than one worker is available
+
+            @param specs: iterable of render specifications
+            @param workers: the maximum number of worker processes,
+                            None for the number of CPUs
+
+            @returns: generator yielding the file paths of the partial
+                      documents in order of the specifications; the caller
+                      is responsible for removing the files
+        """
+
+        if workers is None:
+            try:
+                import multiprocessing
+                workers = multiprocessing.cpu_count()
+            except (ImportError, NotImplementedError):
+                workers = 1
+
+        executor = None
+        if workers > 1:
+            try:
+                from concurrent.futures import ProcessPoolExecutor
+                executor = ProcessPoolExecutor(max_workers = workers)
+            except (ImportError, NotImplementedError, OSError):
+                current.log.warning("PDF Codec", "Process pool not available, rendering sequentially")
+
+        if executor is None:
+            for spec in specs:
+                yield render_pdf_part(spec)
+            return
+
+        # Limit the number of chunks in flight to keep memory bounded
+        pending = deque()
+        try:
+            for spec in specs:
+                pending.append(executor.submit(render_pdf_part, spec))
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+            # Remove the files of chunks that have not been collected
+            for future in pending:
+                if not future.cancelled() and future.exception() is None:
+                    try:
+                        os.remove(future.result())
+                    except OSError:
+                        pass
+
 # =============================================================================
 class EdenDocTemplate(BaseDocTemplate):
     """
@@ -2196,12 +2524,346 @@ class S3NumberedCanvas(canvas.Canvas):
             canvas.Canvas.showPage(self)
         canvas.Canvas.save(self)
 
-    def draw_page_number(self, page_count):
+    def draw_page_number(self, page_count, page_number=None):
 
+        if page_number is None:
+            page_number = self._pageNumber
         self.setFont("Helvetica", 7)
         self.drawRightString(self._pagesize[0] - 12,
                              self._pagesize[1] - 12,
-                             "%d / %d" % (self._pageNumber, page_count),
+                             "%d / %d" % (page_number, page_count),
                              )
 
+# =============================================================================
+class S3PDFMerger(object):
+    """
+        Concatenation of PDF documents page by page, writing the objects
+        of each page to the output as soon as they are added, so that
+        only the object offsets and page references are kept in memory
+        until the document is closed
+    """
+
+    def __init__(self, output):
+        """
+            @param output: the output stream (file-like object)
+        """
+
+        self.output = output
+        self.offsets = [None]
+        self.pages = []
+
+        output.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        self.pages_id = self.reserve()
+
+    # -------------------------------------------------------------------------
+    def reserve(self):
+        """
+            Reserve a number for a new object
+
+            @returns: the object number
+        """
+
+        offsets = self.offsets
+        offsets.append(None)
+        return len(offsets) - 1
+
+    # -------------------------------------------------------------------------
+    def add_pages(self, pages):
+        """
+            Add pages to the document, along with all objects they
+            refer to (e.g. content streams, fonts, images)
+
+            @param pages: the pages (pypdf PageObjects)
+        """
+
+        self.numbers = {}
+        self.queue = deque()
+
+        for page in pages:
+            page_id = self.reserve()
+            self.pages.append(page_id)
+
+            # Direct references to the page (e.g. from annotations)
+            ref = getattr(page, "indirect_reference", None)
+            if ref is not None:
+                self.numbers[(id(ref.pdf), ref.idnum, ref.generation)] = page_id
+
+            page = DictionaryObject(page)
+            page.pop("/Parent", None)
+            self.write_object(page_id, page, parent=self.pages_id)
+
+            # Write all objects referenced by the page
+            queue = self.queue
+            while queue:
+                object_id, obj = queue.popleft()
+                self.write_object(object_id, obj)
+
+        # Release the objects of these pages
+        self.numbers = self.queue = None
+
+    # -------------------------------------------------------------------------
+    def reference(self, ref):
+        """
+            Map a reference to an object in the source document to
+            the number of the object in the output document, and
+            queue the object for writing if it has not been written yet
+
+            @param ref: the IndirectObject
+
+            @returns: the object number
+        """
+
+        key = (id(ref.pdf), ref.idnum, ref.generation)
+        numbers = self.numbers
+
+        object_id = numbers.get(key)
+        if object_id is None:
+            object_id = numbers[key] = self.reserve()
+            self.queue.append((object_id, ref.get_object()))
+
+        return object_id
+
+    # -------------------------------------------------------------------------
+    def write_object(self, object_id, obj, parent=None):
+        """
+            Write an indirect object
+
+            @param object_id: the object number
+            @param obj: the object
+            @param parent: the number of the page tree node, when
+                           writing a page object
+        """
+
+        output = self.output
+        self.offsets[object_id] = output.tell()
+
+        output.write(("%d 0 obj\n" % object_id).encode("ascii"))
+        if isinstance(obj, StreamObject):
+            self.write_stream(obj)
+        elif parent is not None:
+            output.write(("<</Parent %d 0 R\n" % parent).encode("ascii"))
+            self.write_entries(obj)
+            output.write(b">>")
+        else:
+            self.write_value(obj)
+        output.write(b"\nendobj\n")
+
+    # -------------------------------------------------------------------------
+    def write_stream(self, obj):
+        """
+            Write a stream object; the data are decoded and compressed
+            again, except for image data (JPEG, JPEG2000) which are passed
+            through as-is by the decoder anyway
+
+            @param obj: the StreamObject
+        """
+
+        output = self.output
+
+        data = obj.get_data()
+
+        filters = obj.get("/Filter")
+        if isinstance(filters, IndirectObject):
+            filters = filters.get_object()
+        if not isinstance(filters, ArrayObject):
+            filters = [filters] if filters else []
+        images = [f for f in filters if f in ("/DCTDecode", "/JPXDecode")]
+        if images:
+            encoding = images[-1]
+        else:
+            import zlib
+            data = zlib.compress(data)
+            encoding = "/FlateDecode"
+
+        output.write(b"<<")
+        self.write_entries(obj, exclude=("/Length", "/Filter", "/DecodeParms"))
+        output.write(("/Filter %s\n" % encoding).encode("ascii"))
+        output.write(("/Length %d\n>>\nstream\n" % len(data)).encode("ascii"))
+        output.write(data)
+        output.write(b"\nendstream")
+
+    # -------------------------------------------------------------------------
+    def write_entries(self, obj, exclude=None):
+        """
+            Write the entries of a dictionary object (without delimiters)
+
+            @param obj: the DictionaryObject
+            @param exclude: keys to skip
+        """
+
+        output = self.output
+        for key, value in obj.items():
+            if exclude and key in exclude:
+                continue
+            key.write_to_stream(output, None)
+            output.write(b" ")
+            self.write_value(value)
+            output.write(b"\n")
+
+    # -------------------------------------------------------------------------
+    def write_value(self, value):
+        """
+            Write a direct object, replacing references by references
+            to objects in the output document
+
+            @param value: the object
+        """
+
+        output = self.output
+
+        if isinstance(value, IndirectObject):
+            output.write(("%d 0 R" % self.reference(value)).encode("ascii"))
+
+        elif isinstance(value, StreamObject):
+            # Streams must be indirect objects (e.g. merged contents)
+            object_id = self.reserve()
+            self.queue.append((object_id, value))
+            output.write(("%d 0 R" % object_id).encode("ascii"))
+
+        elif isinstance(value, DictionaryObject):
+            output.write(b"<<")
+            self.write_entries(value)
+            output.write(b">>")
+
+        elif isinstance(value, ArrayObject):
+            output.write(b"[")
+            for index, item in enumerate(value):
+                if index:
+                    output.write(b" ")
+                self.write_value(item)
+            output.write(b"]")
+
+        else:
+            value.write_to_stream(output, None)
+
+    # -------------------------------------------------------------------------
+    def close(self):
+        """
+            Write the page tree, the catalog, the cross-reference table
+            and the trailer, i.e. finalize the document
+        """
+
+        output = self.output
+        pages = self.pages
+
+        # Page tree
+        self.offsets[self.pages_id] = output.tell()
+        kids = " ".join("%d 0 R" % page_id for page_id in pages)
+        output.write(("%d 0 obj\n<</Type /Pages /Kids [%s] /Count %d>>\nendobj\n" %
+                      (self.pages_id, kids, len(pages))).encode("ascii"))
+
+        # Catalog
+        root_id = self.reserve()
+        self.offsets[root_id] = output.tell()
+        output.write(("%d 0 obj\n<</Type /Catalog /Pages %d 0 R>>\nendobj\n" %
+                      (root_id, self.pages_id)).encode("ascii"))
+
+        # Cross-reference table
+        offsets = self.offsets
+        xref = output.tell()
+        output.write(("xref\n0 %d\n0000000000 65535 f \n" % len(offsets)).encode("ascii"))
+        for offset in offsets[1:]:
+            output.write(("%010d 00000 n \n" % offset).encode("ascii"))
+
+        # Trailer
+        output.write(("trailer\n<</Size %d /Root %d 0 R>>\nstartxref\n%d\n%%%%EOF\n" %
+                      (len(offsets), root_id, xref)).encode("ascii"))
+
+# =============================================================================
+def render_pdf_part(spec):
+    """
+        Render a chunk of a table export as partial PDF document;
+        used as worker function for S3RL_PDF.render_parts, must
+        therefore not rely on the request environment
+
+        @param spec: the render specification, a dict with
+                     pagesize: the page size (width, height)
+                     frame: the body frame (x, y, width, height)
+                     fonts: list of tuples (font_name, path) of
+                            TrueType fonts to register
+                     font_name: the font name
+                     fontsize: the font size
+                     parts: the horizontal table parts, list of tuples
+                            (labels, col_widths, style, start, end)
+                     rows: the table rows, lists of strings
+                     hint: a hint to add below the table
+
+        @returns: the path of the PDF document (temporary file)
+    """
+
+    registered = pdfmetrics.getRegisteredFontNames()
+    for font_name, path in spec["fonts"]:
+        if font_name not in registered:
+            pdfmetrics.registerFont(TTFont(font_name, path))
+
+    font_name = spec["font_name"]
+    fontsize = spec["fontsize"]
+
+    para_style = getSampleStyleSheet()["Normal"]
+    para_style.fontName = font_name
+    para_style.fontSize = fontsize
+    para_style.leading = fontsize * 1.2
+
+    # Paddings as in the default Table style
+    padding = 12
+
+    rows = spec["rows"]
+    flowables = []
+    for labels, col_widths, style, start, end in spec["parts"]:
+        data = [labels]
+        append = data.append
+        for row in rows:
+            cells = []
+            for index, value in enumerate(row[start:end]):
+                width = col_widths[index] - padding
+                if "\n" in value or \
+                   pdfmetrics.stringWidth(value, font_name, fontsize) > width:
+                    # Wrap in Paragraph for automatic line breaks
+                    value = Paragraph(escape(value).replace("\n", "<br/>"),
+                                      para_style,
+                                      )
+                cells.append(value)
+            append(cells)
+        if flowables:
+            flowables.append(PageBreak())
+        flowables.append(Table(data,
+                               repeatRows = 1,
+                               style = style,
+                               hAlign = "LEFT",
+                               colWidths = col_widths,
+                               ))
+
+    hint = spec["hint"]
+    if hint:
+        style = getSampleStyleSheet()["Normal"]
+        style.textColor = colors.red
+        style.fontSize = 12
+        flowables.append(PageBreak())
+        flowables.append(Paragraph(hint, style))
+
+    x, y, width, height = spec["frame"]
+    frame = Frame(x, y, width, height,
+                  leftPadding = 0,
+                  bottomPadding = 0,
+                  rightPadding = 0,
+                  topPadding = 0,
+                  id = "body",
+                  )
+    pagesize = spec["pagesize"]
+
+    handle, path = tempfile.mkstemp(suffix=".pdf")
+    os.close(handle)
+    try:
+        doc = BaseDocTemplate(path, pagesize=pagesize)
+        doc.addPageTemplates(PageTemplate(id = "Normal",
+                                          frames = [frame],
+                                          pagesize = pagesize,
+                                          ))
+        doc.build(flowables)
+    except:
+        os.remove(path)
+        raise
+
+    return path
+
 # END =========================================================================
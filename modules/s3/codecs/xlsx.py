@@ -0,0 +1,563 @@
+# -*- coding: utf-8 -*-
+
+"""
+    S3 Microsoft Excel (XLSX) codec
+
+    @copyright: 2021 (c) Sahana Software Foundation
+    @license: MIT
+
+    Permission is hereby granted, free of charge, to any person
+    obtaining a copy of this software and associated documentation
+    files (the "Software"), to deal in the Software without
+    restriction, including without limitation the rights to use,
+    copy, modify, merge, publish, distribute, sublicense, and/or sell
+    copies of the Software, and to permit persons to whom the
+    Software is furnished to do so, subject to the following
+    conditions:
+
+    The above copyright notice and this permission notice shall be
+    included in all copies or substantial portions of the Software.
+
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+    EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+    OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+    NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+    HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+    WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+    OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+__all__ = ("S3XLSX",
+           )
+
+import datetime
+import tempfile
+
+from gluon import HTTP, current
+from gluon.contenttype import contenttype
+from gluon.storage import Storage
+from gluon.streamer import DEFAULT_CHUNK_SIZE
+
+from s3compat import xrange
+from ..s3codec import S3Codec
+from ..s3utils import s3_str, s3_strip_markup, s3_unicode
+from .xls import S3XLS
+
+# =============================================================================
+class S3XLSX(S3Codec):
+    """
+        Streaming Microsoft Excel (Office Open XML) format codec
+
+        - writes rows incrementally into a single write-only worksheet,
+          reading the resource in chunks of CHUNK_SIZE records, so that
+          memory use is bounded regardless of the number of rows
+        - unlike S3XLS, there is no need to split the output across
+          multiple sheets (XLSX supports up to 1,048,576 rows per sheet)
+    """
+
+    # Number of records to extract per database query
+    CHUNK_SIZE = 2000
+
+    # Maximum number of rows per worksheet
+    MAX_ROWS = 1048576
+
+    # XLSX supports up to 32767 characters per cell
+    MAX_CELL_SIZE = 32767
+
+    # Column widths (in characters)
+    MIN_COL_WIDTH = 8
+    MAX_COL_WIDTH = 80
+
+    # Colours (RGB hex, matching the xlwt palette colours used in S3XLS)
+    LARGE_HEADER_COLOUR = "99CCFF" # pale_blue
+    HEADER_COLOUR = "99CCFF" # pale_blue
+    SUB_HEADER_COLOUR = "9999FF" # periwinkle
+    SUB_TOTALS_COLOUR = "333399"
+    TOTALS_COLOUR = "000000"
+    ROW_ALTERNATING_COLOURS = ["CCFFCC", # light_green
+                               "FFFF99", # light_yellow
+                               ]
+
+    ERROR = Storage(
+        OPENPYXL_ERROR = "XLSX export requires python-openpyxl module to be installed on server",
+    )
+
+    # -------------------------------------------------------------------------
+    def extract(self, resource, list_fields, chunk_size=None):
+        """
+            Extract the rows from the resource in chunks
+
+            @param resource: the resource
+            @param list_fields: fields to include in list views
+            @param chunk_size: the number of records per chunk
+
+            @returns: tuple (title, types, lfields, heading, rows), where
+                      rows is a generator yielding the extracted rows
+                      one by one
+        """
+
+        if chunk_size is None:
+            chunk_size = self.CHUNK_SIZE
+
+        title = self.crud_string(resource.tablename, "title_list")
+
+        get_vars = dict(current.request.vars)
+        get_vars["iColumns"] = len(list_fields)
+        query, orderby, left = resource.datatable_filter(list_fields,
+                                                         get_vars,
+                                                         )
+        resource.add_filter(query)
+
+        if orderby is None:
+            orderby = resource.get_config("orderby")
+
+        # Add the primary key to the orderby to make paging stable
+        from ..s3export import S3Exporter
+        orderby = S3Exporter.stable_orderby(resource.table, orderby)
+
+        # Hierarchical FK Expansion:
+        # setting = {field_selector: [LevelLabel, LevelLabel, ...]}
+        expand_hierarchy = resource.get_config("xls_expand_hierarchy")
+
+        def select(start):
+            return resource.select(list_fields,
+                                   left = left,
+                                   start = start,
+                                   limit = chunk_size,
+                                   orderby = orderby,
+                                   represent = True,
+                                   show_links = False,
+                                   raw_data = True if expand_hierarchy else False,
+                                   )
+
+        # Extract the first chunk to determine the columns
+        data = select(0)
+        rfields = data.rfields
+
+        types = []
+        lfields = []
+        heading = {}
+        expand = []
+        for rfield in rfields:
+            if rfield.show:
+                if expand_hierarchy:
+                    levels = expand_hierarchy.get(rfield.selector)
+                else:
+                    levels = None
+                if levels:
+                    num_levels = len(levels)
+                    colnames = S3XLS.expand_hierarchy(rfield, num_levels, data.rows)
+                    if colnames:
+                        expand.append((rfield, num_levels))
+                    lfields.extend(colnames)
+                    types.extend(["string"] * num_levels)
+                    T = current.T
+                    for i, colname in enumerate(colnames):
+                        heading[colname] = T(levels[i])
+                else:
+                    lfields.append(rfield.colname)
+                    heading[rfield.colname] = rfield.label or \
+                                rfield.field.name.capitalize().replace("_", " ")
+                    if rfield.ftype == "virtual":
+                        types.append("string")
+                    else:
+                        types.append(rfield.ftype)
+
+        def rows():
+            """ Generator for all rows, one chunk at a time """
+
+            chunk = data.rows
+            start = 0
+            while chunk:
+                for row in chunk:
+                    yield row
+                if len(chunk) < chunk_size:
+                    break
+                start += chunk_size
+                chunk = select(start).rows
+                for rfield, num_levels in expand:
+                    S3XLS.expand_hierarchy(rfield, num_levels, chunk)
+
+        return (title, types, lfields, heading, rows())
+
+    # -------------------------------------------------------------------------
+    def encode(self, resource, **attr):
+        """
+            Export data as a Microsoft Excel (XLSX) spreadsheet
+
+            @param resource: the source of the data that is to be encoded
+                             as a spreadsheet, can be either of:
+                                1) an S3Resource
+                                2) an array of value dicts (dict of
+                                   column labels as first item, list of
+                                   field types as second item)
+                                3) a dict like:
+                                   {columns: [key, ...],
+                                    headers: {key: label},
+                                    types: {key: type},
+                                    rows: [{key:value}],
+                                    }
+
+            @param attr: keyword arguments (see below)
+
+            @keyword as_stream: return the file (temporary file) rather
+                                than streaming its contents to the client,
+                                useful when the output is supposed to be
+                                stored locally
+            @keyword title: the main title of the report
+            @keyword list_fields: fields to include in list views
+            @keyword dt_group: index of the column to group the rows by
+            @keyword use_colour: True to add colour to the cells, default False
+            @keyword evenodd: render different background colours
+                              for even/odd rows ("stripes")
+            @keyword chunk_size: number of records to extract per query
+        """
+
+        # Do not redirect from here!
+        # ...but raise proper status code, which can be caught by caller
+        try:
+            from openpyxl import Workbook
+            from openpyxl.cell import WriteOnlyCell
+        except ImportError:
+            error = self.ERROR.OPENPYXL_ERROR
+            current.log.error(error)
+            raise HTTP(503, body=error)
+
+        MAX_CELL_SIZE = self.MAX_CELL_SIZE
+
+        # Get the attributes
+        attr_get = attr.get
+        title = attr_get("title")
+        if title is None:
+            title = current.T("Report")
+        list_fields = attr_get("list_fields")
+        group = attr_get("dt_group")
+        use_colour = attr_get("use_colour", False)
+        evenodd = attr_get("evenodd", True)
+
+        # Extract the data from the resource
+        if isinstance(resource, dict):
+            headers = resource.get("headers", {})
+            lfields = resource.get("columns", list_fields)
+            column_types = resource.get("types")
+            types = [column_types[col] for col in lfields]
+            rows = resource.get("rows")
+        elif isinstance(resource, (list, tuple)):
+            headers = resource[0]
+            types = resource[1]
+            rows = resource[2:]
+            lfields = list_fields
+        else:
+            if not list_fields:
+                list_fields = resource.list_fields()
+            (title, types, lfields, headers, rows) = \
+                self.extract(resource,
+                             list_fields,
+                             chunk_size = attr_get("chunk_size"),
+                             )
+
+        # Grouping
+        report_groupby = lfields[group] if group else None
+
+        # Date/Time formats from L10N deployment settings
+        settings = current.deployment_settings
+        date_format_str = str(settings.get_L10n_date_format())
+
+        dt_format_translate = S3XLS.dt_format_translate
+        date_format = dt_format_translate(date_format_str)
+        time_format = dt_format_translate(settings.get_L10n_time_format())
+        datetime_format = dt_format_translate(settings.get_L10n_datetime_format())
+
+        # Callable title rows are xlwt-specific, so fall back to the
+        # standard title rows if configured
+        title_row = settings.get_xls_title_row()
+
+        # Get styles
+        styles = self._styles(use_colour = use_colour,
+                              evenodd = evenodd,
+                              )
+
+        # Create the workbook (write-only mode => streaming)
+        book = Workbook(write_only=True)
+
+        # Can't have a / in the sheet_name, so replace any with a space
+        sheet_name = s3_str(title).replace("/", " ")
+        if len(sheet_name) > 31:
+            # Sheet name cannot be over 31 chars
+            sheet_name = sheet_name[:31]
+        sheet = book.create_sheet(title=sheet_name)
+
+        def styled(value, style, number_format=None):
+            """ Helper to produce a styled cell """
+
+            cell = WriteOnlyCell(sheet, value=value)
+            if style:
+                font, fill = style
+                if font is not None:
+                    cell.font = font
+                if fill is not None:
+                    cell.fill = fill
+            if number_format:
+                cell.number_format = number_format
+            return cell
+
+        # Determine the output columns
+        columns = []
+        for col_index, selector in enumerate(lfields):
+            if selector == report_groupby:
+                continue
+            label = headers[selector]
+            if label in ("Id", "Sort") or types[col_index] == "sort":
+                continue
+            columns.append((col_index, selector, s3_str(label)))
+        total_cols = len(columns)
+
+        # Column widths must be set before writing any rows in write-only
+        # mode, so estimate them from the column labels and types
+        from openpyxl.utils import get_column_letter
+        for write_col_index, (col_index, selector, label) in enumerate(columns):
+            width = len(label) + 2
+            if types[col_index] in ("date", "datetime"):
+                width = max(width, 18)
+            width = min(max(width, self.MIN_COL_WIDTH), self.MAX_COL_WIDTH)
+            letter = get_column_letter(write_col_index + 1)
+            sheet.column_dimensions[letter].width = width
+
+        # Freeze the header row
+        header_row_index = 3 if title_row else 1
+        sheet.freeze_panes = "A%s" % (header_row_index + 1)
+
+        # Number of worksheet rows written so far
+        written = [0]
+
+        def append(cells):
+            """ Helper to append a row to the worksheet """
+
+            sheet.append(cells)
+            written[0] += 1
+
+        # Title row (optional, deployment setting)
+        if title_row:
+            T = current.T
+            append([styled(s3_str(title), styles["large_header"])])
+            append([styled("%s:" % s3_str(T("Date Exported")), styles["notes"]),
+                    styled(current.request.now, styles["notes"], datetime_format),
+                    ])
+            append([])
+
+        # Header row
+        header_style = styles["header"]
+        append([styled(label, header_style) for _, _, label in columns])
+
+        # Write the table contents
+        subheading = None
+        odd_style = styles["odd"]
+        even_style = styles["even"]
+        subheader_style = styles["subheader"]
+
+        max_rows = self.MAX_ROWS
+        row_index = 0
+        for row in rows:
+
+            # Start of a new group?
+            new_group = None
+            if report_groupby:
+                represent = s3_strip_markup(s3_unicode(row[report_groupby]))
+                if subheading != represent:
+                    new_group = represent
+
+            # Number of worksheet rows needed for this row
+            needed = 1 if new_group is None else 2
+            if "_group" in row:
+                group_info = row["_group"]
+                if group_info.get("label") and group_info.get("totals") and \
+                   group_info.get("span") == 0:
+                    needed += 1
+
+            if written[0] + needed > max_rows:
+                current.log.warning("XLSX export truncated at %s rows" % written[0])
+                break
+
+            row_index += 1
+            style = even_style if row_index % 2 == 0 else odd_style
+
+            # Group headers
+            if new_group is not None:
+                # Start of new group - write group header
+                subheading = new_group
+                append([styled(subheading, subheader_style)] +
+                       [styled(None, subheader_style)
+                        for _ in xrange(total_cols - 1)])
+                row_index += 1
+                style = even_style if row_index % 2 == 0 else odd_style
+
+            cells = []
+            remaining = columns
+
+            # Custom row style?
+            row_style = None
+            if "_style" in row:
+                stylename = row["_style"]
+                if stylename in styles:
+                    row_style = styles[stylename]
+
+            # Group header/footer row?
+            if "_group" in row:
+                group_info = row["_group"]
+                label = group_info.get("label")
+                totals = group_info.get("totals")
+                if label:
+                    label = s3_strip_markup(s3_unicode(label))
+                    label_style = row_style or subheader_style
+                    span = group_info.get("span")
+                    if span == 0:
+                        append([styled(label, label_style)] +
+                               [styled(None, label_style)
+                                for _ in xrange(total_cols - 1)])
+                        if totals:
+                            # Write totals into the next row
+                            row_index += 1
+                    else:
+                        cells.append(styled(label, label_style))
+                        cells.extend(styled(None, label_style)
+                                     for _ in xrange(span - 1))
+                        remaining = [c for c in columns if c[0] >= span]
+                if not totals:
+                    if cells:
+                        append(cells)
+                    continue
+
+            cell_style = row_style or style
+            for col_index, field, label in remaining:
+
+                if field not in row:
+                    represent = ""
+                else:
+                    represent = s3_strip_markup(s3_unicode(row[field]))
+                if len(represent) > MAX_CELL_SIZE:
+                    represent = represent[:MAX_CELL_SIZE]
+
+                value, number_format = self.convert(represent,
+                                                    types[col_index],
+                                                    date_format_str,
+                                                    date_format = date_format,
+                                                    time_format = time_format,
+                                                    datetime_format = datetime_format,
+                                                    )
+                cells.append(styled(value, cell_style, number_format))
+
+            append(cells)
+
+        # Write output
+        output = tempfile.TemporaryFile()
+        book.save(output)
+        output.seek(0)
+
+        if attr_get("as_stream", False):
+            return output
+
+        # Response headers
+        request = current.request
+        filename = "%s_%s.xlsx" % (request.env.server_name, s3_str(title))
+        disposition = "attachment; filename=\"%s\"" % filename
+        response = current.response
+        response.headers["Content-Type"] = contenttype(".xlsx")
+        response.headers["Content-disposition"] = disposition
+
+        return response.stream(output,
+                               chunk_size = DEFAULT_CHUNK_SIZE,
+                               request = request,
+                               )
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def convert(represent,
+                coltype,
+                date_format_str,
+                date_format=None,
+                time_format=None,
+                datetime_format=None):
+        """
+            Convert a represented value into a native cell value
+
+            @param represent: the represented value (unicode)
+            @param coltype: the column type
+            @param date_format_str: the Python date format used by the
+                                    representation
+            @param date_format: the Excel date format
+            @param time_format: the Excel time format
+            @param datetime_format: the Excel date/time format
+
+            @returns: tuple (value, number_format)
+        """
+
+        value = represent
+        number_format = None
+
+        strptime = datetime.datetime.strptime
+        try:
+            if coltype == "date":
+                value = strptime(value, date_format_str).date()
+                number_format = date_format
+            elif coltype == "datetime":
+                value = strptime(value, date_format_str)
+                number_format = datetime_format
+            elif coltype == "time":
+                value = strptime(value, date_format_str).time()
+                number_format = time_format
+            elif coltype == "integer":
+                value = int(value)
+                number_format = "0"
+            elif coltype == "double":
+                value = float(value)
+                number_format = "0.00"
+        except (ValueError, TypeError):
+            value = represent
+            number_format = None
+
+        return value, number_format
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def _styles(cls, use_colour=False, evenodd=True):
+        """
+            XLSX encoder standard cell styles
+
+            @param use_colour: use background colour in cells
+            @param evenodd: render different background colours
+                            for even/odd rows ("stripes")
+
+            @returns: dict {stylename: (Font, PatternFill)}
+        """
+
+        from openpyxl.styles import Font, PatternFill
+
+        def fill(colour):
+            if not use_colour:
+                return None
+            return PatternFill(fill_type = "solid",
+                               start_color = colour,
+                               end_color = colour,
+                               )
+
+        bold = Font(bold=True)
+
+        if use_colour and evenodd:
+            odd = (None, fill(cls.ROW_ALTERNATING_COLOURS[0]))
+            even = (None, fill(cls.ROW_ALTERNATING_COLOURS[1]))
+        else:
+            odd = even = None
+
+        return {"large_header": (Font(bold=True, size=20),
+                                 fill(cls.LARGE_HEADER_COLOUR)),
+                "notes": (Font(italic=True, size=8), None),
+                "header": (bold, fill(cls.HEADER_COLOUR)),
+                "subheader": (bold, fill(cls.SUB_HEADER_COLOUR)),
+                "subtotals": (bold, fill(cls.SUB_TOTALS_COLOUR)),
+                "totals": (bold, fill(cls.TOTALS_COLOUR)),
+                "odd": odd,
+                "even": even,
+                }
+
+# End =========================================================================
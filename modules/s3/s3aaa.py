@@ -63,7 +63,7 @@ from .s3error import S3PermissionError
 from .s3fields import S3MetaFields, S3Represent, s3_comments
 from .s3rest import S3Method, S3Request
 from .s3track import S3Tracker
-from .s3utils import s3_addrow, s3_get_extension, s3_mark_required, s3_str
+from .s3utils import s3_addrow, s3_get_extension, s3_mark_required, s3_on_commit, s3_str
 from .s3validators import IS_ISO639_2_LANGUAGE_CODE
 
 # =============================================================================
@@ -4018,149 +4018,319 @@ Please go to %(url)s to approve this user."""
                 # Group memberships have no realms (policy 5 and below)
                 self.user["realms"] = Storage([(row.group_id, None) for row in rows])
                 self.user["delegations"] = Storage()
+                self.user.pop("realms_stamp", None)
 
             else:
                 # Group memberships are limited to realms (policy 6 and above)
-                realms = {}
-                delegations = {}
+                # - re-use the realms from the previous request or the
+                #   persisted snapshot, if still valid
+                user = self.user
+                version = self.s3_realms_version()
+                stamp = (version, self.s3_realms_digest(rows))
+                if version is None or user.get("realms_stamp") != stamp:
+                    snapshot = self.s3_get_realms_snapshot(user_id, stamp)
+                    if snapshot:
+                        realms, delegations = snapshot
+                    else:
+                        realms, delegations = self.s3_compute_realms(rows)
+                        self.s3_save_realms_snapshot(user_id,
+                                                     stamp,
+                                                     realms,
+                                                     delegations,
+                                                     )
+                    user["realms"] = realms
+                    user["delegations"] = delegations
+                    user["realms_stamp"] = stamp
 
-                # These roles can't be realm-restricted:
-                unrestrictable = (system_roles.ADMIN,
-                                  system_roles.ANONYMOUS,
-                                  system_roles.AUTHENTICATED,
-                                  )
+            if ANONYMOUS:
+                # Anonymous role has no realm
+                self.user["realms"][ANONYMOUS] = None
+
+    # -------------------------------------------------------------------------
+    def s3_compute_realms(self, memberships):
+        """
+            Compute the realms and delegations of the current user
+            (policy 6 and above)
+
+            @param memberships: the auth_membership Rows of the user
+                                (group_id, pe_id)
+
+            @returns: tuple (realms, delegations)
+        """
+
+        db = current.db
+        s3db = current.s3db
 
-                default_realm = s3db.pr_realm(self.user["pe_id"])
+        permission = self.permission
+        system_roles = self.get_system_roles()
+
+        rows = memberships
+
+        realms = {}
+        delegations = {}
+
+        # These roles can't be realm-restricted:
+        unrestrictable = (system_roles.ADMIN,
+                          system_roles.ANONYMOUS,
+                          system_roles.AUTHENTICATED,
+                          )
+
+        default_realm = s3db.pr_realm(self.user["pe_id"])
 
-                # Store the realms:
+        # Store the realms:
+        for row in rows:
+            group_id = row.group_id
+            if group_id in realms and realms[group_id] is None:
+                continue
+            if group_id in unrestrictable:
+                realms[group_id] = None
+                continue
+            if group_id not in realms:
+                realms[group_id] = []
+            realm = realms[group_id]
+            pe_id = row.pe_id
+            if pe_id is None:
+                if default_realm:
+                    realm.extend([e for e in default_realm
+                                    if e not in realm])
+                if not realm:
+                    del realms[group_id]
+            elif pe_id == 0:
+                # Site-wide
+                realms[group_id] = None
+            elif pe_id not in realm:
+                realms[group_id].append(pe_id)
+
+        if permission.entity_hierarchy:
+            # Realms include subsidiaries of the realm entities
+
+            # Get all entities in realms
+            all_entities = []
+            append = all_entities.append
+            for realm in realms.values():
+                if realm is not None:
+                    for entity in realm:
+                        if entity not in all_entities:
+                            append(entity)
+
+            # Lookup all delegations to any OU ancestor of the user
+            if permission.delegations and self.user.pe_id:
+
+                ancestors = s3db.pr_get_ancestors(self.user.pe_id)
+
+                dtable = s3db.pr_delegation
+                rtable = s3db.pr_role
+                atable = s3db.pr_affiliation
+
+                dn = dtable._tablename
+                rn = rtable._tablename
+                an = atable._tablename
+
+                query = (dtable.deleted != True) & \
+                        (atable.role_id == dtable.role_id) & \
+                        (atable.pe_id.belongs(ancestors)) & \
+                        (rtable.id == dtable.role_id)
+                rows = db(query).select(rtable.pe_id,
+                                        dtable.group_id,
+                                        atable.pe_id,
+                                        cacheable=True)
+
+                extensions = []
+                partners = []
+                for row in rows:
+                    extensions.append(row[rn].pe_id)
+                    partners.append(row[an].pe_id)
+            else:
+                rows = []
+                extensions = []
+                partners = []
+
+            # Lookup the subsidiaries of all realms and extensions
+            entities = all_entities + extensions + partners
+            descendants = s3db.pr_descendants(entities)
+
+            pmap = {}
+            for p in partners:
+                if p in all_entities:
+                    pmap[p] = [p]
+                elif p in descendants:
+                    d = descendants[p]
+                    pmap[p] = [e for e in all_entities if e in d] or [p]
+
+            # Add the subsidiaries to the realms
+            for group_id in realms:
+                realm = realms[group_id]
+                if realm is None:
+                    continue
+                append = realm.append
+                for entity in list(realm):
+                    if entity in descendants:
+                        for subsidiary in descendants[entity]:
+                            if subsidiary not in realm:
+                                append(subsidiary)
+
+            # Process the delegations
+            if permission.delegations:
                 for row in rows:
-                    group_id = row.group_id
-                    if group_id in realms and realms[group_id] is None:
+
+                    # owner == delegates group_id to ==> partner
+                    owner = row[rn].pe_id
+                    partner = row[an].pe_id
+                    group_id = row[dn].group_id
+
+                    if group_id in delegations and \
+                       owner in delegations[group_id]:
+                        # Duplicate
                         continue
-                    if group_id in unrestrictable:
-                        realms[group_id] = None
+                    if partner not in pmap:
                         continue
-                    if group_id not in realms:
-                        realms[group_id] = []
-                    realm = realms[group_id]
-                    pe_id = row.pe_id
-                    if pe_id is None:
-                        if default_realm:
-                            realm.extend([e for e in default_realm
-                                            if e not in realm])
-                        if not realm:
-                            del realms[group_id]
-                    elif pe_id == 0:
-                        # Site-wide
-                        realms[group_id] = None
-                    elif pe_id not in realm:
-                        realms[group_id].append(pe_id)
-
-                if permission.entity_hierarchy:
-                    # Realms include subsidiaries of the realm entities
-
-                    # Get all entities in realms
-                    all_entities = []
-                    append = all_entities.append
-                    for realm in realms.values():
-                        if realm is not None:
-                            for entity in realm:
-                                if entity not in all_entities:
-                                    append(entity)
-
-                    # Lookup all delegations to any OU ancestor of the user
-                    if permission.delegations and self.user.pe_id:
-
-                        ancestors = s3db.pr_get_ancestors(self.user.pe_id)
-
-                        dtable = s3db.pr_delegation
-                        rtable = s3db.pr_role
-                        atable = s3db.pr_affiliation
-
-                        dn = dtable._tablename
-                        rn = rtable._tablename
-                        an = atable._tablename
-
-                        query = (dtable.deleted != True) & \
-                                (atable.role_id == dtable.role_id) & \
-                                (atable.pe_id.belongs(ancestors)) & \
-                                (rtable.id == dtable.role_id)
-                        rows = db(query).select(rtable.pe_id,
-                                                dtable.group_id,
-                                                atable.pe_id,
-                                                cacheable=True)
-
-                        extensions = []
-                        partners = []
-                        for row in rows:
-                            extensions.append(row[rn].pe_id)
-                            partners.append(row[an].pe_id)
-                    else:
-                        rows = []
-                        extensions = []
-                        partners = []
-
-                    # Lookup the subsidiaries of all realms and extensions
-                    entities = all_entities + extensions + partners
-                    descendants = s3db.pr_descendants(entities)
-
-                    pmap = {}
-                    for p in partners:
-                        if p in all_entities:
-                            pmap[p] = [p]
-                        elif p in descendants:
-                            d = descendants[p]
-                            pmap[p] = [e for e in all_entities if e in d] or [p]
-
-                    # Add the subsidiaries to the realms
-                    for group_id in realms:
-                        realm = realms[group_id]
-                        if realm is None:
-                            continue
-                        append = realm.append
-                        for entity in list(realm):
-                            if entity in descendants:
-                                for subsidiary in descendants[entity]:
-                                    if subsidiary not in realm:
-                                        append(subsidiary)
-
-                    # Process the delegations
-                    if permission.delegations:
-                        for row in rows:
-
-                            # owner == delegates group_id to ==> partner
-                            owner = row[rn].pe_id
-                            partner = row[an].pe_id
-                            group_id = row[dn].group_id
-
-                            if group_id in delegations and \
-                               owner in delegations[group_id]:
-                                # Duplicate
-                                continue
-                            if partner not in pmap:
-                                continue
 
-                            # Find the realm
-                            if group_id not in delegations:
-                                delegations[group_id] = Storage()
-                            groups = delegations[group_id]
+                    # Find the realm
+                    if group_id not in delegations:
+                        delegations[group_id] = Storage()
+                    groups = delegations[group_id]
 
-                            r = [owner]
-                            if owner in descendants:
-                                r.extend(descendants[owner])
+                    r = [owner]
+                    if owner in descendants:
+                        r.extend(descendants[owner])
 
-                            for p in pmap[partner]:
-                                if p not in groups:
-                                    groups[p] = []
-                                realm = groups[p]
-                                realm.extend(r)
+                    for p in pmap[partner]:
+                        if p not in groups:
+                            groups[p] = []
+                        realm = groups[p]
+                        realm.extend(r)
 
-                self.user["realms"] = realms
-                self.user["delegations"] = delegations
+        return realms, delegations
 
-            if ANONYMOUS:
-                # Anonymous role has no realm
-                self.user["realms"][ANONYMOUS] = None
+    # -------------------------------------------------------------------------
+    def s3_realms_digest(self, memberships):
+        """
+            Compute a digest of everything (other than affiliations and
+            delegations) the realms of the current user depend on, i.e.
+            the user's pe_id, memberships and the permission policy
+
+            @param memberships: the auth_membership Rows of the user
+                                (group_id, pe_id)
+
+            @returns: the digest (string)
+        """
+
+        import hashlib
+
+        permission = self.permission
+
+        items = sorted((row.group_id, -1 if row.pe_id is None else row.pe_id)
+                       for row in memberships)
+        key = "%s|%s|%s|%s" % (self.user.pe_id,
+                               permission.entity_hierarchy,
+                               permission.delegations,
+                               items,
+                               )
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def s3_realms_version():
+        """
+            Get the current version stamp of the realm snapshots
+
+            @returns: the version stamp (integer), or None if realm
+                      snapshots are not available
+        """
+
+        table = current.s3db.table("auth_realm_version")
+        if table is None:
+            return None
+
+        version = table.version.max()
+        row = current.db(table.id > 0).select(version).first()
+
+        return (row[version] or 0) if row else 0
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def s3_bump_realms_version(*args):
+        """
+            Invalidate the realm snapshots of all users by incrementing
+            the version stamp; called after writes to pr_role,
+            pr_affiliation and pr_delegation (DAL callback, hence accepts
+            and ignores any arguments)
+        """
+
+        table = current.s3db.table("auth_realm_version")
+        if table is None:
+            return
+
+        db = current.db
+        if not db(table.id > 0).update(version = table.version + 1):
+            table.insert(version = 1)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def s3_get_realms_snapshot(user_id, stamp):
+        """
+            Load the persisted realms and delegations of a user
+
+            @param user_id: the user ID
+            @param stamp: tuple (version, digest) the snapshot must match
+
+            @returns: tuple (realms, delegations), or None if there is
+                      no valid snapshot
+        """
+
+        table = current.s3db.table("auth_realm_snapshot")
+        if table is None or stamp[0] is None:
+            return None
+
+        query = (table.user_id == user_id)
+        row = current.db(query).select(table.version,
+                                       table.digest,
+                                       table.realms,
+                                       table.delegations,
+                                       limitby = (0, 1),
+                                       ).first()
+        if not row or (row.version, row.digest) != stamp:
+            return None
+
+        # JSON object keys are strings
+        realms = {}
+        for group_id, realm in (row.realms or {}).items():
+            realms[int(group_id)] = realm
+
+        delegations = {}
+        for group_id, groups in (row.delegations or {}).items():
+            delegations[int(group_id)] = Storage((int(pe_id), realm)
+                                                 for pe_id, realm in groups.items())
+
+        return realms, delegations
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def s3_save_realms_snapshot(user_id, stamp, realms, delegations):
+        """
+            Persist the realms and delegations of a user
+
+            @param user_id: the user ID
+            @param stamp: tuple (version, digest) the realms were computed for
+            @param realms: the realms
+            @param delegations: the delegations
+        """
+
+        table = current.s3db.table("auth_realm_snapshot")
+        version, digest = stamp
+        if table is None or version is None:
+            return
+
+        data = {"version": version,
+                "digest": digest,
+                "realms": realms,
+                "delegations": delegations,
+                "modified_on": current.request.utcnow,
+                }
+        query = (table.user_id == user_id)
+        if not current.db(query).update(**data):
+            data["user_id"] = user_id
+            table.insert(**data)
 
     # -------------------------------------------------------------------------
     def s3_create_role(self, role, description=None, *acls, **args):
@@ -5115,6 +5285,49 @@ Please go to %(url)s to approve this user."""
 
         return authorised
 
+    # -------------------------------------------------------------------------
+    def s3_has_permission_bulk(self, method, table, record_ids, c=None, f=None):
+        """
+            Check whether the user can access multiple records in manner
+            "method", for list views with per-record actions
+
+            @param method: the access method as string, one of
+                           "create", "read", "update", "delete"
+            @param table: the table or tablename
+            @param record_ids: the record IDs
+            @param c: the controller name (overrides current.request)
+            @param f: the function name (overrides current.request)
+
+            @returns: dict {record_id: True|False}
+        """
+
+        if self.override:
+            return dict((record_id, True) for record_id in record_ids)
+
+        policy = current.deployment_settings.get_security_policy()
+        if policy in (3, 4, 5, 6, 7, 8):
+            if not hasattr(table, "_tablename"):
+                table = current.s3db.table(table, db_only=True)
+                if table is None:
+                    return dict((record_id, False) for record_id in record_ids)
+            # Use S3Permission ACLs, single query
+            return self.permission.has_permission_bulk(method,
+                                                       table,
+                                                       record_ids,
+                                                       c = c,
+                                                       f = f,
+                                                       )
+
+        # Other policies: check per record
+        has_permission = self.s3_has_permission
+        return dict((record_id, bool(has_permission(method,
+                                                    table,
+                                                    record_id = record_id,
+                                                    c = c,
+                                                    f = f,
+                                                    )))
+                    for record_id in record_ids)
+
     # -------------------------------------------------------------------------
     def s3_accessible_query(self, method, table, c=None, f=None):
         """
@@ -6944,6 +7157,85 @@ class S3Permission(object):
 
         return permitted
 
+    # -------------------------------------------------------------------------
+    def has_permission_bulk(self, method, table, record_ids, c=None, f=None):
+        """
+            Check permission to access multiple records with method, with
+            a single query rather than one has_permission per record
+            - e.g. for the row actions in list views
+
+            @param method: the access method (string), or a list of
+                           methods (permitted if any is permitted)
+            @param table: the table or tablename
+            @param record_ids: the record IDs
+            @param c: the controller name (falls back to current request)
+            @param f: the function name (falls back to current request)
+
+            @returns: dict {record_id: True|False}
+
+            @note: like has_permission, unapproved records are permitted
+                   for their owners and for users permitted to review them
+        """
+
+        # Map the record IDs as passed-in to integers
+        ids = {}
+        for record_id in record_ids:
+            try:
+                ids[record_id] = int(record_id)
+            except (TypeError, ValueError):
+                ids[record_id] = None
+        if not ids:
+            return {}
+
+        if self.auth.override:
+            return dict((record_id, True) for record_id in ids)
+
+        # Get the table
+        if not hasattr(table, "_tablename"):
+            tablename = table
+            error = AttributeError("undefined table %s" % tablename)
+            table = current.s3db.table(tablename,
+                                       db_only = True,
+                                       default = error,
+                                       )
+
+        db = current.db
+        approval_methods = ("review", "approve", "reject")
+        review = self.requires_approval(table) and \
+                 "approved_by" in table.fields
+
+        permitted = set()
+        values = set(v for v in ids.values() if v)
+
+        methods = method if isinstance(method, (list, tuple)) else [method]
+        for m in methods:
+            if not values:
+                break
+
+            # Permitted for at least some records?
+            if not self.has_permission(m, c=c, f=f, t=table):
+                continue
+
+            query = self.accessible_query(m, table, c=c, f=f) & \
+                    table._id.belongs(values)
+            rows = db(query).select(table._id)
+            accessible = set(row[table._id] for row in rows)
+
+            # Unapproved records are also permitted for reviewers
+            remaining = values - accessible
+            if review and remaining and m not in approval_methods:
+                query = self.accessible_query([m, "review"], table, c=c, f=f) & \
+                        (table.approved_by == None) & \
+                        table._id.belongs(remaining)
+                rows = db(query).select(table._id)
+                accessible |= set(row[table._id] for row in rows)
+
+            permitted |= accessible
+            values -= accessible
+
+        return dict((record_id, value in permitted)
+                    for record_id, value in ids.items())
+
     # -------------------------------------------------------------------------
     def accessible_query(self, method, table, c=None, f=None, deny=True):
         """
@@ -7746,6 +8038,12 @@ class S3Permission(object):
 class S3Audit(object):
     """ S3 Audit Trail Writer Class """
 
+    # Maximum number of buffered entries before writing them out
+    BUFFER_SIZE = 500
+
+    # Maximum number of rows per (multi-row) INSERT
+    INSERT_SIZE = 100
+
     def __init__(self,
                  tablename = "s3_audit",
                  migrate = True,
@@ -7760,6 +8058,10 @@ class S3Audit(object):
             @note: this defines the audit table
         """
 
+        # Entries to write at the end of the request
+        self.buffer = []
+        self.hooked = False
+
         settings = current.deployment_settings
         audit_read = settings.get_security_audit_read()
         audit_write = settings.get_security_audit_write()
@@ -7795,6 +8097,13 @@ class S3Audit(object):
         else:
             self.user_id = None
 
+        # Buffer entries and write them in bulk at the end of the request
+        # - not in shell/scheduler which commit explicitly
+        request = current.request
+        self.buffered = settings.get_security_audit_buffer() and \
+                        not request.is_shell and \
+                        not request.is_scheduler
+
     # -------------------------------------------------------------------------
     def __call__(self, method, prefix, name,
                  form = None,
@@ -7872,17 +8181,9 @@ class S3Audit(object):
                 # Don't Audit
                 return True
 
-        if method in ("list", "read"):
-            table.insert(timestmp = datetime.datetime.utcnow(),
-                         user_id = self.user_id,
-                         method = method,
-                         tablename = tablename,
-                         record_id = record,
-                         representation = representation,
-                         repository_id = current.response.s3.repository_id,
-                         )
-
-        elif method == "create":
+        old_value = new_value = None
+
+        if method == "create":
             if form:
                 form_vars = form.vars
                 if not record:
@@ -7891,15 +8192,6 @@ class S3Audit(object):
                              for var in form_vars if form_vars[var]]
             else:
                 new_value = []
-            table.insert(timestmp = datetime.datetime.utcnow(),
-                         user_id = self.user_id,
-                         method = method,
-                         tablename = tablename,
-                         record_id = record,
-                         representation = representation,
-                         new_value = new_value,
-                         repository_id = current.response.s3.repository_id,
-                         )
 
         elif method == "update":
             if form:
@@ -7917,38 +8209,199 @@ class S3Audit(object):
             else:
                 new_value = []
                 old_value = []
-            table.insert(timestmp = datetime.datetime.utcnow(),
-                         user_id = self.user_id,
-                         method = method,
-                         tablename = tablename,
-                         record_id = record,
-                         representation = representation,
-                         old_value = old_value,
-                         new_value = new_value,
-                         repository_id = current.response.s3.repository_id,
-                         )
-
-        elif method == "delete":
-            db = current.db
-            query = (db[tablename].id == record)
-            row = db(query).select(limitby = (0, 1)
-                                   ).first()
-            old_value = []
-            if row:
-                old_value = ["%s:%s" % (field, row[field])
-                             for field in row]
-            table.insert(timestmp = datetime.datetime.utcnow(),
-                         user_id = self.user_id,
-                         method = method,
-                         tablename = tablename,
-                         record_id = record,
-                         representation = representation,
-                         old_value = old_value,
-                         repository_id = current.response.s3.repository_id,
-                         )
+
+        # NB old_value of deletions is looked up when writing the entry
+        self.write({"timestmp": datetime.datetime.utcnow(),
+                    "user_id": self.user_id,
+                    "method": method,
+                    "tablename": tablename,
+                    "record_id": record,
+                    "representation": representation,
+                    "old_value": old_value,
+                    "new_value": new_value,
+                    "repository_id": current.response.s3.repository_id,
+                    })
 
         return True
 
+    # -------------------------------------------------------------------------
+    def write(self, entry):
+        """
+            Write an audit entry, or add it to the buffer
+
+            @param entry: the audit entry, a dict {fieldname: value}
+        """
+
+        if self.buffered:
+            if not self.hooked:
+                self.hook()
+            buffer = self.buffer
+            buffer.append(entry)
+            if len(buffer) >= self.BUFFER_SIZE:
+                self.flush()
+        else:
+            self.lookup_old_values([entry])
+            self.table.insert(**entry)
+
+    # -------------------------------------------------------------------------
+    def hook(self):
+        """
+            Write out the buffer before every commit of the request, i.e.
+            within the same transaction as the changes - both at the end
+            of the request and for explicit commits during the request
+            (e.g. S3Delete committing per row)
+
+            @note: if the request is not committed (i.e. rolled back),
+                   then the buffered entries are discarded - just like
+                   the changes they describe
+        """
+
+        s3_on_commit(self.flush, before=True)
+        self.hooked = True
+
+    # -------------------------------------------------------------------------
+    def flush(self):
+        """
+            Write all buffered entries
+        """
+
+        buffer = self.buffer
+        if not buffer or not self.table:
+            return
+        self.buffer = []
+
+        self.lookup_old_values(buffer)
+        self.insert(buffer)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def lookup_old_values(entries):
+        """
+            Look up the old values for delete-entries, with one query
+            per table
+
+            @param entries: list of audit entries
+        """
+
+        records = {}
+        for entry in entries:
+            if entry["method"] == "delete" and entry["old_value"] is None:
+                entry["old_value"] = []
+                record_id = entry["record_id"]
+                if record_id:
+                    tablename = entry["tablename"]
+                    if tablename in records:
+                        records[tablename].append(entry)
+                    else:
+                        records[tablename] = [entry]
+        if not records:
+            return
+
+        db = current.db
+        s3db = current.s3db
+
+        for tablename, items in records.items():
+            table = s3db.table(tablename)
+            if not table:
+                continue
+            record_ids = set(entry["record_id"] for entry in items)
+            query = (table._id.belongs(record_ids))
+            rows = db(query).select(limitby = (0, len(record_ids)))
+            rows = dict((row[table._id.name], row) for row in rows)
+            for entry in items:
+                row = rows.get(entry["record_id"])
+                if row:
+                    entry["old_value"] = ["%s:%s" % (field, row[field])
+                                          for field in row]
+
+    # -------------------------------------------------------------------------
+    def insert(self, entries):
+        """
+            Insert audit entries into the audit table, using multi-row
+            INSERTs where the database supports them
+
+            @param entries: list of audit entries, dicts {fieldname: value}
+        """
+
+        table = self.table
+
+        db_type = current.deployment_settings.get_database_type()
+        if db_type not in ("sqlite", "postgres", "mysql"):
+            for entry in entries:
+                table.insert(**entry)
+            return
+
+        db = current.db
+        represent = db._adapter.represent
+
+        fieldnames = [fn for fn in table.fields if fn != table._id.name]
+        fields = [table[fn] for fn in fieldnames]
+
+        sql = "INSERT INTO %s(%s) VALUES %%s;" % (table._tablename,
+                                                  ",".join(fieldnames),
+                                                  )
+        size = self.INSERT_SIZE
+        for i in range(0, len(entries), size):
+            values = ["(%s)" % ",".join(represent(entry.get(field.name),
+                                                  field.type,
+                                                  )
+                                        for field in fields)
+                      for entry in entries[i:i + size]
+                      ]
+            db.executesql(sql % ",".join(values))
+
+    # -------------------------------------------------------------------------
+    def prune(self, days=None, chunk_size=10000):
+        """
+            Remove old entries from the audit table, in chunks of
+            consecutive record IDs to keep transactions (and locks)
+            short
+
+            @param days: remove entries older than this number of days
+                         (default: security.audit_retention setting)
+            @param chunk_size: the maximum number of entries to remove
+                               per transaction
+
+            @returns: the number of removed entries
+        """
+
+        table = self.table
+        if not table:
+            return 0
+
+        if days is None:
+            days = current.deployment_settings.get_security_audit_retention()
+            if not days:
+                # Keep all entries
+                return 0
+
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+
+        db = current.db
+
+        # Entries are appended in chronological order, so all entries
+        # up to the last one before the cutoff date can be removed
+        query = (table.timestmp < cutoff)
+        maxid = table.id.max()
+        row = db(query).select(maxid).first()
+        last = row[maxid] if row else None
+        if not last:
+            return 0
+
+        minid = table.id.min()
+        row = db(table.id <= last).select(minid).first()
+        first = row[minid] if row else None
+
+        removed = 0
+        while first is not None and first <= last:
+            upper = min(first + chunk_size - 1, last)
+            query = (table.id >= first) & (table.id <= upper)
+            removed += db(query).delete()
+            db.commit()
+            first = upper + 1
+
+        return removed
+
     # -------------------------------------------------------------------------
     def represent(self, records):
         """
@@ -809,6 +809,11 @@ class S3CRUD(S3Method):
             exporter = S3Exporter().xls
             output = exporter(resource, list_fields=list_fields)
 
+        elif representation == "xlsx":
+            list_fields = resource.list_fields()
+            exporter = S3Exporter().xlsx
+            output = exporter(resource, list_fields=list_fields)
+
         elif representation == "json":
             exporter = S3Exporter().json
 
@@ -1355,7 +1360,9 @@ class S3CRUD(S3Method):
         elif representation == "csv":
 
             exporter = S3Exporter().csv
-            return exporter(resource)
+            return exporter(resource,
+                            stream = self._stream(self.request.get_vars),
+                            )
 
         elif representation == "json":
 
@@ -1378,6 +1385,7 @@ class S3CRUD(S3Method):
                             limit = limit,
                             represent = represent,
                             tooltip = tooltip,
+                            stream = self._stream(get_vars),
                             )
 
         elif representation == "pdf":
@@ -1414,6 +1422,12 @@ class S3CRUD(S3Method):
                             report_groupby = report_groupby,
                             **attr)
 
+        elif representation == "xlsx":
+            exporter = S3Exporter().xlsx
+            return exporter(resource,
+                            list_fields = list_fields,
+                            **attr)
+
         elif representation == "msg":
             if r.http == "POST":
                 from .s3notify import S3Notifications
@@ -3367,4 +3381,22 @@ class S3CRUD(S3Method):
 
         return start, limit
 
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _stream(get_vars):
+        """
+            Determine whether an export shall be streamed in chunks
+
+            @param get_vars: the GET vars
+
+            @returns: boolean
+        """
+
+        stream = get_vars.get("stream")
+        if stream is None:
+            return current.deployment_settings.get_base_stream_exports()
+        if isinstance(stream, list):
+            stream = stream[-1]
+        return str(stream).lower() in ("1", "true")
+
 # END =========================================================================
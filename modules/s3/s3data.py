@@ -549,8 +549,8 @@ class S3DataTable(object):
         return export_options
 
     # -------------------------------------------------------------------------
-    @staticmethod
-    def defaultActionButtons(resource,
+    def defaultActionButtons(self,
+                             resource,
                              custom_actions = None,
                              r = None
                              ):
@@ -592,33 +592,62 @@ class S3DataTable(object):
         tablename = resource.tablename
         get_config = current.s3db.get_config
 
+        # Records in this table, for record-level permission checks
+        pkey = str(table._id)
+        record_ids = [row[pkey] for row in self.data if row.get(pkey)]
+
+        def restrict(method):
+            # Records permitted for method (as strings, for the client),
+            # None if not limited by record ownership
+            if not ownership_required(method, table):
+                return None
+            permitted = auth.s3_has_permission_bulk(method, table, record_ids)
+            return [str(record_id) for record_id in record_ids
+                    if permitted.get(record_id)]
+
         # "Open" button
         editable = get_config(tablename, "editable", True)
-        if editable and has_permission("update", table) and \
-           not ownership_required("update", table):
+        if editable and has_permission("update", table):
+            updatable = restrict("update")
+        else:
+            updatable = []
+        if updatable is None:
             update_url = URL(c=c, f=f, args=args + ["update"])
             S3CRUD.action_button(labels.UPDATE, update_url,
                                  icon = "edit",
                                  _class="action-btn edit")
         else:
+            if updatable:
+                # User is permitted to edit only some of the records
+                update_url = URL(c=c, f=f, args=args + ["update"])
+                S3CRUD.action_button(labels.UPDATE, update_url,
+                                     icon = "edit",
+                                     _class="action-btn edit",
+                                     restrict = updatable)
             read_url = URL(c=c, f=f, args=args)
             S3CRUD.action_button(labels.READ, read_url,
                                  icon = "file",
-                                 _class="action-btn read")
+                                 _class="action-btn read",
+                                 exclude = updatable)
 
         # Delete button
-        # @todo: does not apply selective action (renders DELETE for
-        #        all items even if the user is only permitted to delete
-        #        some of them) => should implement "restrict", see
-        #        S3CRUD.action_buttons
         deletable = get_config(tablename, "deletable", True)
-        if deletable and \
-           has_permission("delete", table) and \
-           not ownership_required("delete", table):
+        if deletable and has_permission("delete", table):
+            deletable = restrict("delete")
+        else:
+            deletable = []
+        if deletable is None:
             delete_url = URL(c=c, f=f, args=args + ["delete"])
             S3CRUD.action_button(labels.DELETE, delete_url,
                                  icon = "delete",
                                  _class="delete-btn")
+        elif deletable:
+            # User is permitted to delete only some of the records
+            delete_url = URL(c=c, f=f, args=args + ["delete"])
+            S3CRUD.action_button(labels.DELETE, delete_url,
+                                 icon = "delete",
+                                 _class="delete-btn",
+                                 restrict = deletable)
 
         # Append custom actions
         if custom_actions:
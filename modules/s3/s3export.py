@@ -31,11 +31,25 @@
     OTHER DEALINGS IN THE SOFTWARE.
 """
 
-__all__ = ("S3Exporter",)
+__all__ = ("S3Exporter",
+           "S3ExportJob",
+           "S3ExportJobs",
+           )
 
-from gluon import current
+import datetime
+import hashlib
+import json
+import sys
+import time
 
+from gluon import current, HTTP
+from gluon.contenttype import contenttype
+from gluon.storage import Storage
+from gluon.streamer import DEFAULT_CHUNK_SIZE
+
+from s3compat import basestring
 from .s3codec import S3Codec
+from .s3rest import S3Method
 
 # =============================================================================
 class S3Exporter(object):
@@ -44,11 +58,16 @@ class S3Exporter(object):
     """
 
     # -------------------------------------------------------------------------
-    def csv(self, resource):
+    def csv(self, resource, stream=False, chunk_size=None, progress=None):
         """
             Export resource as CSV
 
             @param resource: the resource to export
+            @param stream: return a generator producing the CSV in chunks
+                           rather than the complete document as string
+            @param chunk_size: number of records per chunk (when streaming)
+            @param progress: callback function progress(done, total)
+                             to report the progress of a streamed export
 
             @note: export does not include components!
 
@@ -65,9 +84,51 @@ class S3Exporter(object):
             response.headers["Content-Type"] = contenttype(".csv")
             response.headers["Content-disposition"] = "attachment; filename=%s" % filename
 
+        if stream:
+            return self.csv_stream(resource,
+                                   chunk_size = chunk_size,
+                                   progress = progress,
+                                   )
+
         rows = resource.select(None, as_rows=True)
         return str(rows)
 
+    # -------------------------------------------------------------------------
+    def csv_stream(self, resource, chunk_size=None, progress=None):
+        """
+            Generator to export a resource as CSV in chunks
+
+            @param resource: the resource to export
+            @param chunk_size: number of records per chunk
+            @param progress: callback function progress(done, total)
+
+            @note: stops extracting data when the generator is closed,
+                   e.g. because the client has disconnected
+        """
+
+        from s3compat import StringIO
+
+        table = resource.table
+        orderby = table._id
+
+        total = resource.count()
+        done = 0
+        write_colnames = True
+
+        try:
+            for rows in self.chunks(resource, None, chunk_size, orderby):
+                output = StringIO()
+                rows.export_to_csv_file(output, write_colnames=write_colnames)
+                write_colnames = False
+                done += len(rows)
+                if progress:
+                    progress(done, total)
+                yield output.getvalue()
+        except GeneratorExit:
+            current.log.debug("CSV export of %s cancelled after %s records" %
+                              (resource.tablename, done))
+            raise
+
     # -------------------------------------------------------------------------
     def json(self, resource,
              start=None,
@@ -75,7 +136,10 @@ class S3Exporter(object):
              fields=None,
              orderby=None,
              represent=False,
-             tooltip=None):
+             tooltip=None,
+             stream=False,
+             chunk_size=None,
+             progress=None):
         """
             Export a resource as JSON
 
@@ -94,6 +158,11 @@ class S3Exporter(object):
                             to return a dict {k:tooltip} => used by
                             filterOptionsS3 to extract onhover-tooltips for
                             Ajax-update of options
+            @param stream: return a generator producing the JSON in chunks
+                           rather than the complete document as string
+            @param chunk_size: number of records per chunk (when streaming)
+            @param progress: callback function progress(done, total)
+                             to report the progress of a streamed export
         """
 
         if fields is None:
@@ -109,6 +178,7 @@ class S3Exporter(object):
             orderby = resource.get_config("orderby", None)
 
         tooltip_function = None
+        kname = vname = None
         if tooltip:
             if type(tooltip) is list:
                 tooltip = tooltip[-1]
@@ -127,6 +197,26 @@ class S3Exporter(object):
                 if tooltip not in fields:
                     fields.append(tooltip)
 
+        # Set response headers
+        response = current.response
+        if response:
+            response.headers["Content-Type"] = "application/json"
+
+        if stream:
+            return self.json_stream(resource,
+                                    fields,
+                                    start = start,
+                                    limit = limit,
+                                    orderby = orderby,
+                                    represent = represent,
+                                    tooltip = tooltip,
+                                    tooltip_function = tooltip_function,
+                                    kname = kname,
+                                    vname = vname,
+                                    chunk_size = chunk_size,
+                                    progress = progress,
+                                    )
+
         # Get the data
         _rows = resource.select(fields,
                                 start=start,
@@ -134,6 +224,177 @@ class S3Exporter(object):
                                 orderby=orderby,
                                 represent=represent).rows
 
+        rows = self._json_rows(resource,
+                               _rows,
+                               tooltip = tooltip,
+                               tooltip_function = tooltip_function,
+                               kname = kname,
+                               vname = vname,
+                               )
+
+        # Return as JSON
+        from gluon.serializers import json as jsons
+        return jsons(rows)
+
+    # -------------------------------------------------------------------------
+    def json_stream(self,
+                    resource,
+                    fields,
+                    start=None,
+                    limit=None,
+                    orderby=None,
+                    represent=False,
+                    tooltip=None,
+                    tooltip_function=None,
+                    kname=None,
+                    vname=None,
+                    chunk_size=None,
+                    progress=None):
+        """
+            Generator to export a resource as JSON array in chunks,
+            parameters see json()
+
+            @note: stops extracting data when the generator is closed,
+                   e.g. because the client has disconnected
+        """
+
+        from gluon.serializers import json as jsons
+
+        # Make paging stable
+        orderby = self.stable_orderby(resource.table, orderby)
+
+        total = resource.count()
+        if limit is not None:
+            total = min(total, limit)
+        done = 0
+
+        yield "["
+        try:
+            for data in self.chunks(resource,
+                                    fields,
+                                    chunk_size,
+                                    orderby,
+                                    start = start,
+                                    limit = limit,
+                                    represent = represent,
+                                    as_rows = False,
+                                    ):
+                rows = self._json_rows(resource,
+                                       data.rows,
+                                       tooltip = tooltip,
+                                       tooltip_function = tooltip_function,
+                                       kname = kname,
+                                       vname = vname,
+                                       )
+                if not rows:
+                    continue
+                # Strip the enclosing brackets, separate chunks by comma
+                chunk = jsons(rows)[1:-1]
+                yield chunk if not done else ",%s" % chunk
+                done += len(rows)
+                if progress:
+                    progress(done, total)
+        except GeneratorExit:
+            current.log.debug("JSON export of %s cancelled after %s records" %
+                              (resource.tablename, done))
+            raise
+        yield "]"
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def stable_orderby(table, orderby):
+        """
+            Add the primary key to an orderby, to make paging stable
+
+            @param table: the table
+            @param orderby: the orderby (expression, list/tuple of
+                            expressions, string, or None)
+
+            @returns: the extended orderby
+        """
+
+        pkey = table._id
+        if orderby is None:
+            orderby = pkey
+        elif isinstance(orderby, (list, tuple)):
+            orderby = list(orderby) + [pkey]
+        elif isinstance(orderby, basestring):
+            if str(pkey) not in orderby:
+                orderby = "%s, %s" % (orderby, pkey)
+        else:
+            orderby = orderby | pkey
+        return orderby
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def chunks(resource,
+               fields,
+               chunk_size,
+               orderby,
+               start=None,
+               limit=None,
+               represent=False,
+               as_rows=True,
+               left=None):
+        """
+            Generator to extract the records of a resource in chunks
+
+            @param resource: the resource
+            @param fields: the fields to extract (selector strings)
+            @param chunk_size: the number of records per chunk
+            @param orderby: orderby-expression (must be unique per record
+                            for stable paging)
+            @param start: index of the first record
+            @param limit: maximum number of records
+            @param represent: render field value representations
+            @param as_rows: yield Rows rather than S3ResourceData
+            @param left: left joins required for the orderby
+
+            @returns: Rows or S3ResourceData per chunk
+        """
+
+        if not chunk_size:
+            chunk_size = current.deployment_settings.get_base_export_chunk_size()
+
+        offset = start or 0
+        remaining = limit
+        while remaining is None or remaining > 0:
+            size = chunk_size if remaining is None else min(chunk_size, remaining)
+            data = resource.select(fields,
+                                   left = left,
+                                   start = offset,
+                                   limit = size,
+                                   orderby = orderby,
+                                   represent = represent,
+                                   as_rows = as_rows,
+                                   )
+            rows = data if as_rows else data.rows
+            if not rows:
+                break
+            yield data
+            if len(rows) < size:
+                break
+            offset += size
+            if remaining is not None:
+                remaining -= size
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _json_rows(resource,
+                   _rows,
+                   tooltip=None,
+                   tooltip_function=None,
+                   kname=None,
+                   vname=None):
+        """
+            Convert extracted rows into JSON-serializable dicts,
+            parameters see json()
+
+            @param _rows: the extracted rows (S3ResourceData.rows)
+
+            @returns: list of dicts
+        """
+
         # Simplify to plain fieldnames for fields in this table
         tn = "%s." % resource.tablename
         rows = []
@@ -205,13 +466,7 @@ class S3Exporter(object):
                         if value:
                             row["_tooltip"] = s3_unicode(value)
 
-        # Return as JSON
-        response = current.response
-        if response:
-            response.headers["Content-Type"] = "application/json"
-
-        from gluon.serializers import json as jsons
-        return jsons(rows)
+        return rows
 
     # -------------------------------------------------------------------------
     def pdf(self, *args, **kwargs):
@@ -243,4 +498,593 @@ class S3Exporter(object):
         codec = S3Codec.get_codec("xls").encode
         return codec(*args, **kwargs)
 
+    # -------------------------------------------------------------------------
+    def xlsx(self, *args, **kwargs):
+
+        codec = S3Codec.get_codec("xlsx").encode
+        return codec(*args, **kwargs)
+
+# =============================================================================
+class S3ExportJob(object):
+    """
+        Asynchronous export jobs with result caching
+
+        - export requests are queued as S3Task, the task renders the
+          export into a file in the s3_export_job store
+        - results are shared between identical requests, i.e. same
+          resource, filter, fields, format and permissions, until the
+          underlying table has been modified (modified_on)
+    """
+
+    # Formats which can be exported asynchronously {format: file extension}
+    FORMATS = {"csv": "csv",
+               "pdf": "pdf",
+               "xls": "xls",
+               "xlsx": "xlsx",
+               "xml": "xml",
+               }
+
+    TASK = "s3_export_job"
+
+    # Timeout for the export task (seconds)
+    TIMEOUT = 3600
+
+    # Grace period after the timeout before a job which is still
+    # QUEUED/RUNNING is considered stale (seconds)
+    GRACE = 600
+
+    # Minimum interval between two progress updates (seconds)
+    PROGRESS_INTERVAL = 5
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def submit(cls, resource, representation, list_fields=None):
+        """
+            Submit an export request: return an existing job with the same
+            job key if it is still valid or in progress, otherwise create
+            a new job and queue the task
+
+            @param resource: the S3Resource (filtered)
+            @param representation: the export format
+            @param list_fields: the fields to export (selectors)
+
+            @returns: the s3_export_job Row
+        """
+
+        db = current.db
+        table = current.s3db.s3_export_job
+
+        if list_fields is None:
+            list_fields = resource.list_fields()
+        list_fields = [str(f) for f in list_fields]
+
+        auth_key = cls.auth_key(resource.table)
+        job_key = cls.job_key(resource, representation, list_fields, auth_key)
+
+        # Check for a reusable job
+        data_mtime = cls.data_mtime(resource.table)
+        query = (table.job_key == job_key) & \
+                (table.status.belongs(("QUEUED", "RUNNING", "COMPLETED"))) & \
+                (table.deleted == False)
+        rows = db(query).select(table.ALL,
+                                orderby = ~table.created_on,
+                                )
+        for job in rows:
+            if job.status != "COMPLETED":
+                if not cls.stale(job):
+                    return job
+                # Worker died or task timed out => fail the job
+                job.update_record(status = "FAILED",
+                                  error = "Export job expired",
+                                  )
+            elif data_mtime is not None and job.data_mtime is not None and \
+                 job.data_mtime >= data_mtime:
+                return job
+
+        # Store the filter to rebuild the resource in the task
+        query, record_ids = cls.filter_sql(resource)
+
+        job_id = table.insert(job_key = job_key,
+                              auth_key = auth_key,
+                              tablename = resource.tablename,
+                              representation = representation,
+                              query = query,
+                              record_ids = record_ids,
+                              fields = list_fields,
+                              status = "QUEUED",
+                              )
+
+        # Commit before queuing the task, so the worker can see the job
+        db.commit()
+
+        task_id = current.s3task.run_async(cls.TASK,
+                                           args = [job_id],
+                                           timeout = cls.TIMEOUT,
+                                           )
+        if task_id:
+            db(table.id == job_id).update(task_id = task_id)
+
+        return db(table.id == job_id).select(table.ALL,
+                                             limitby = (0, 1),
+                                             ).first()
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def run(cls, job_id):
+        """
+            Run an export job (inside the task)
+
+            @param job_id: the s3_export_job record ID
+
+            @returns: the final job status
+        """
+
+        db = current.db
+        s3db = current.s3db
+
+        table = s3db.s3_export_job
+        job = db(table.id == job_id).select(table.ALL,
+                                            limitby = (0, 1),
+                                            ).first()
+        if not job or job.status not in ("QUEUED", "FAILED"):
+            return None
+
+        # Record the data mtime before rendering, so that any concurrent
+        # changes will invalidate the result
+        ttable = s3db.table(job.tablename)
+        data_mtime = cls.data_mtime(ttable) if ttable is not None else None
+
+        job.update_record(status = "RUNNING",
+                          data_mtime = data_mtime,
+                          progress = 0,
+                          error = None,
+                          )
+        db.commit()
+
+        # Report the progress of streamed exports in the job record
+        # (also keeps the job from becoming stale while running)
+        updated = [time.time()]
+        def progress(done, total):
+            now = time.time()
+            if now - updated[0] < cls.PROGRESS_INTERVAL:
+                return
+            updated[0] = now
+            percent = min(100 * done // total, 100) if total else 100
+            db(table.id == job_id).update(progress = percent)
+            db.commit()
+
+        representation = job.representation
+        try:
+            resource = cls.resource(job)
+            output = cls.render(resource,
+                                representation,
+                                job.fields,
+                                progress = progress,
+                                )
+            filename = "%s.%s" % (job.tablename, cls.FORMATS[representation])
+            stored = table.file.store(output, filename)
+        except HTTP as e:
+            status, error = "FAILED", e.body
+        except Exception:
+            status, error = "FAILED", str(sys.exc_info()[1])
+        else:
+            status, error = "COMPLETED", None
+
+        if status == "COMPLETED":
+            job.update_record(status = status,
+                              progress = 100,
+                              file = stored,
+                              filename = filename,
+                              completed_on = current.request.utcnow,
+                              )
+            # Remove superseded results
+            cls.cleanup(job_key=job.job_key, keep=job.id)
+        else:
+            current.log.error("Export job %s failed: %s" % (job_id, error))
+            job.update_record(status = status,
+                              error = error,
+                              )
+        db.commit()
+
+        return status
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def render(cls, resource, representation, list_fields, progress=None):
+        """
+            Render the export file
+
+            @param resource: the S3Resource
+            @param representation: the export format
+            @param list_fields: the fields to export (selectors)
+            @param progress: callback function progress(done, total)
+                             to report the progress of streamed exports
+
+            @returns: a file-like object with the output
+        """
+
+        from s3compat import BytesIO
+
+        exporter = S3Exporter()
+        if representation == "xml":
+            output = resource.export_xml(stream = True,
+                                         progress = progress,
+                                         )
+        elif representation == "csv":
+            output = exporter.csv(resource,
+                                  stream = True,
+                                  progress = progress,
+                                  )
+        elif representation == "pdf":
+            # No S3Request available in the task
+            r = Storage(tablename = resource.tablename,
+                        component = None,
+                        id = None,
+                        representation = representation,
+                        )
+            output = exporter.pdf(resource,
+                                  request = r,
+                                  list_fields = list_fields,
+                                  as_stream = True,
+                                  )
+        elif representation in ("xls", "xlsx"):
+            encode = getattr(exporter, representation)
+            output = encode(resource,
+                            list_fields = list_fields,
+                            as_stream = True,
+                            )
+        else:
+            raise ValueError("Unsupported export format: %s" % representation)
+
+        if hasattr(output, "read"):
+            return output
+
+        if isinstance(output, (bytes, basestring)):
+            if not isinstance(output, bytes):
+                output = output.encode("utf-8")
+            return BytesIO(output)
+
+        # Generator (streamed export) => write chunks into a temporary file
+        import tempfile
+        stream = tempfile.TemporaryFile()
+        for chunk in output:
+            if not isinstance(chunk, bytes):
+                chunk = chunk.encode("utf-8")
+            stream.write(chunk)
+        stream.seek(0)
+        return stream
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def filter_sql(resource):
+        """
+            Serialize the filter of a resource, so that it can be rebuilt
+            in the export task
+
+            @param resource: the S3Resource (filtered)
+
+            @returns: tuple (query, record_ids), where query is the SQL
+                      sub-select for the record IDs matching the filter
+                      (including the permission filter of the current user),
+                      and record_ids is a list of record IDs if the resource
+                      has virtual or extra filters which can not be expressed
+                      in SQL (otherwise None)
+        """
+
+        rfilter = resource.rfilter
+        if rfilter is None:
+            rfilter = resource.build_query()
+
+        query = rfilter.get_query()
+        if rfilter.get_filter() is not None or rfilter.get_extra_filters():
+            # Filters applied after the query => need the actual record IDs
+            rows = resource.select(["id"], limit=None, as_rows=True)
+            record_ids = [row[resource._id.name] for row in rows]
+            return None, record_ids
+
+        table = resource.table
+        sql = current.db(query)._select(table._id,
+                                        join = rfilter.get_joins(),
+                                        left = rfilter.get_joins(left=True),
+                                        )
+        return sql, None
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def resource(job):
+        """
+            Rebuild the resource for an export job
+
+            @param job: the s3_export_job Row
+
+            @returns: the S3Resource
+        """
+
+        s3db = current.s3db
+
+        if job.query:
+            table = s3db.table(job.tablename)
+            query = (table._id.belongs(job.query))
+            resource = s3db.resource(table, filter=query)
+        else:
+            resource = s3db.resource(job.tablename, id=job.record_ids or [0])
+        return resource
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def stale(cls, job):
+        """
+            Check whether an unfinished job is stale, i.e. its task has
+            ended, or it has not been updated for longer than the task
+            timeout (e.g. because the worker died)
+
+            @param job: the s3_export_job Row
+
+            @returns: True if the job is stale
+        """
+
+        if job.status not in ("QUEUED", "RUNNING"):
+            return False
+
+        db = current.db
+
+        if job.task_id and "scheduler_task" in db:
+            ttable = db.scheduler_task
+            task = db(ttable.id == job.task_id).select(ttable.status,
+                                                        limitby = (0, 1),
+                                                        ).first()
+            if not task or task.status not in ("QUEUED", "ASSIGNED", "RUNNING"):
+                # Task has ended without completing the job
+                return True
+            if job.status == "QUEUED" and task.status != "RUNNING":
+                # Still waiting for a worker
+                return False
+
+        timeout = datetime.timedelta(seconds = cls.TIMEOUT + cls.GRACE)
+        modified_on = job.modified_on
+        return modified_on is None or \
+               modified_on < current.request.utcnow - timeout
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def data_mtime(table):
+        """
+            Get the latest modification date of any record in a table
+
+            @param table: the Table
+
+            @returns: datetime, or None if the table has no modified_on
+        """
+
+        if "modified_on" not in table.fields:
+            return None
+
+        field = table.modified_on
+        latest = field.max()
+        row = current.db(table.id > 0).select(latest).first()
+        return row[latest] if row else None
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def auth_key(table):
+        """
+            Hash the permissions of the current user which determine
+            the accessible records
+
+            @param table: the exported Table
+
+            @returns: the hash (hex string)
+        """
+
+        auth = current.auth
+
+        user = auth.user
+        if user:
+            realms = user.realms or {}
+            delegations = user.delegations or {}
+            permissions = {"roles": sorted(current.session.s3.roles or []),
+                           "realms": sorted((str(k), sorted(v) if v else v)
+                                            for k, v in realms.items()),
+                           "delegations": sorted((str(k), str(v))
+                                                 for k, v in delegations.items()),
+                           }
+            # Record owner permissions are user-specific
+            if "owned_by_user" in table.fields:
+                permissions["user_id"] = user.id
+        else:
+            permissions = {"roles": sorted(current.session.s3.roles or [])}
+
+        data = json.dumps(permissions, sort_keys=True, default=str)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def job_key(resource, representation, list_fields, auth_key):
+        """
+            Compute the job key for an export request
+
+            @param resource: the S3Resource (filtered)
+            @param representation: the export format
+            @param list_fields: the fields to export (selectors)
+            @param auth_key: the permissions hash
+
+            @returns: the job key (hex string)
+        """
+
+        query = resource.get_query()
+        efilters = resource.rfilter.get_extra_filters()
+
+        data = json.dumps([resource.tablename,
+                           str(query),
+                           [(m, str(e)) for m, e in efilters],
+                           list_fields,
+                           representation,
+                           auth_key,
+                           ])
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def cleanup(cls, job_key=None, keep=None, expire=None):
+        """
+            Remove superseded or expired export results
+
+            @param job_key: remove all results with this job key
+            @param keep: record ID of the job to keep
+            @param expire: remove all results completed before this
+                           datetime, and fail all stale jobs
+        """
+
+        db = current.db
+        table = current.s3db.s3_export_job
+
+        if expire:
+            # Fail stale QUEUED/RUNNING jobs
+            query = (table.status.belongs(("QUEUED", "RUNNING"))) & \
+                    (table.deleted == False)
+            rows = db(query).select(table.ALL)
+            for job in rows:
+                if cls.stale(job):
+                    job.update_record(status = "FAILED",
+                                      error = "Export job expired",
+                                      )
+
+        if job_key:
+            query = (table.job_key == job_key)
+        elif expire:
+            query = (table.created_on < expire)
+        else:
+            return
+        query &= (table.status.belongs(("COMPLETED", "FAILED")))
+        if keep:
+            query &= (table.id != keep)
+
+        # Delete the records (autodelete removes the files)
+        rows = db(query).select(table.id)
+        for row in rows:
+            db(table.id == row.id).delete()
+
+# =============================================================================
+class S3ExportJobs(S3Method):
+    """
+        REST method to submit asynchronous export jobs, poll their status
+        and download the results:
+
+        - POST  <resource>/export_job.<format>?<filters>
+                => queue job, returns JSON {"job": id, "status": status}
+        - GET   <resource>/export_job.<format>?job=<id>
+                => JSON {"job": id, "status": status}
+        - GET   <resource>/export_job.<format>?job=<id>&download=1
+                => the export file (if COMPLETED)
+    """
+
+    # -------------------------------------------------------------------------
+    def apply_method(self, r, **attr):
+        """
+            Entry point for REST interface
+
+            @param r: the S3Request
+            @param attr: controller attributes
+        """
+
+        representation = r.representation
+        if representation not in S3ExportJob.FORMATS:
+            r.error(415, current.ERROR.BAD_FORMAT)
+
+        if not self._permitted("read"):
+            r.unauthorised()
+
+        job_id = r.get_vars.get("job")
+        if job_id:
+            job = self.get_job(job_id)
+            if job is None:
+                r.error(404, current.ERROR.BAD_RECORD)
+            if r.get_vars.get("download"):
+                return self.download(r, job)
+
+        elif r.http == "POST":
+            resource = self.resource
+            list_fields = resource.list_fields()
+            job = S3ExportJob.submit(resource,
+                                     representation,
+                                     list_fields = list_fields,
+                                     )
+        else:
+            r.error(405, current.ERROR.BAD_METHOD)
+
+        output = {"job": job.id,
+                  "status": job.status,
+                  }
+        if job.status == "RUNNING":
+            output["progress"] = job.progress or 0
+        elif job.status == "COMPLETED":
+            output["url"] = r.url(method = "export_job",
+                                  vars = {"job": job.id, "download": 1},
+                                  )
+        elif job.status == "FAILED":
+            output["error"] = job.error
+
+        current.response.headers["Content-Type"] = "application/json"
+        return json.dumps(output)
+
+    # -------------------------------------------------------------------------
+    def get_job(self, job_id):
+        """
+            Look up a job, verifying that the current user is permitted
+            to access its result (=has the same permissions as the user
+            who has submitted the job)
+
+            @param job_id: the job record ID
+
+            @returns: the s3_export_job Row, or None if not found
+        """
+
+        table = current.s3db.s3_export_job
+
+        try:
+            job_id = int(job_id)
+        except (ValueError, TypeError):
+            return None
+
+        query = (table.id == job_id) & \
+                (table.tablename == self.tablename) & \
+                (table.deleted == False)
+        job = current.db(query).select(table.ALL,
+                                       limitby = (0, 1),
+                                       ).first()
+        if job and job.auth_key != S3ExportJob.auth_key(self.table):
+            job = None
+        return job
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def download(r, job):
+        """
+            Stream the result of a completed job to the client
+
+            @param r: the S3Request
+            @param job: the s3_export_job Row
+        """
+
+        if job.status != "COMPLETED" or not job.file:
+            r.error(404, current.ERROR.BAD_RECORD)
+
+        table = current.s3db.s3_export_job
+        try:
+            filename, stream = table.file.retrieve(job.file)
+        except (IOError, OSError):
+            r.error(404, current.ERROR.BAD_RECORD)
+
+        filename = job.filename or filename
+        extension = filename.rsplit(".", 1)[-1]
+
+        response = current.response
+        response.headers["Content-Type"] = contenttype(".%s" % extension)
+        response.headers["Content-disposition"] = "attachment; filename=\"%s\"" % filename
+
+        return response.stream(stream,
+                               chunk_size = DEFAULT_CHUNK_SIZE,
+                               request = current.request,
+                               )
+
 # End =========================================================================
@@ -2733,17 +2733,23 @@ class S3SQLInlineComponent(S3SQLSubForm):
                     }
                     for rfield in rfields if rfield.fname != pkey]
 
+        # Check the update-permission for all records at once
+        pkey_colname = str(table._id)
+        permitted = current.auth.s3_has_permission_bulk("update",
+                                                         tablename,
+                                                         [record["_row"][pkey_colname]
+                                                          for record in records],
+                                                         )
+
         items = []
-        has_permission = current.auth.s3_has_permission
         for record in records:
 
             row = record["_row"]
-            row_id = row[str(table._id)]
+            row_id = row[pkey_colname]
 
             item = {"_id": row_id}
 
-            permitted = has_permission("update", tablename, row_id)
-            if not permitted:
+            if not permitted.get(row_id):
                 item["_readonly"] = True
 
             for rfield in rfields:
@@ -2907,6 +2913,20 @@ class S3SQLInlineComponent(S3SQLSubForm):
         if not multiple:
             # Mark to client-side JS that we should open Edit Row
             _class = "%s single" % _class
+
+        # Check the permissions for all existing items at once
+        record_ids = [item["_id"] for item in items
+                      if "_id" in item and not item.get("_delete")]
+        has_permission_bulk = current.auth.s3_has_permission_bulk
+        if _editable and record_ids:
+            editable_ids = has_permission_bulk("update", tablename, record_ids)
+        else:
+            editable_ids = {}
+        if _deletable and record_ids:
+            deletable_ids = has_permission_bulk("delete", tablename, record_ids)
+        else:
+            deletable_ids = {}
+
         item = None
         for i in xrange(len(items)):
             has_rows = True
@@ -2916,15 +2936,9 @@ class S3SQLInlineComponent(S3SQLSubForm):
                 continue
             elif "_id" in item:
                 record_id = item["_id"]
-                # Check permissions to edit this item
-                if _editable:
-                    editable = has_permission("update", tablename, record_id)
-                else:
-                    editable = False
-                if _deletable:
-                    deletable = has_permission("delete", tablename, record_id)
-                else:
-                    deletable = False
+                # Permissions to edit this item
+                editable = editable_ids.get(record_id, False)
+                deletable = deletable_ids.get(record_id, False)
             else:
                 record_id = None
                 editable = bool(_editable)
@@ -34,6 +34,7 @@
 __all__ = ("GIS",
            "MAP2",
            "S3Map",
+           "S3OfflineGeocoder",
            "S3ExportPOI",
            "S3ImportPOI",
            )
@@ -65,14 +66,15 @@ from gluon.languages import lazyT, regex_translate
 from gluon.settings import global_settings
 from gluon.storage import Storage
 
-from s3compat import Cookie, HTTPError, StringIO, URLError, basestring, urllib_quote
+from s3compat import BytesIO, Cookie, HTTPError, StringIO, URLError, basestring, urllib_quote, urlopen
 from s3dal import Rows
 from .s3datetime import s3_format_datetime, s3_parse_datetime
 from .s3fields import s3_all_meta_field_names
 from .s3rest import S3Method
 from .s3rtb import S3ResourceTree
+from .s3spatial import S3SpatialIndex
 from .s3track import S3Trackable
-from .s3utils import s3_include_ext, s3_include_underscore, s3_str
+from .s3utils import s3_include_ext, s3_include_underscore, s3_on_commit, s3_str, s3_unicode
 
 # Map WKT types to db types
 GEOM_TYPES = {"point": 1,
@@ -234,6 +236,9 @@ class GIS(object):
     # updates should still be enabled.
     disable_update_location_tree = False
 
+    # Time of the last Geocoder request (for rate limiting)
+    _geocode_last = 0
+
     def __init__(self):
         messages = current.messages
         #messages.centroid_error = str(A("Shapely", _href="http://pypi.python.org/pypi/Shapely/", _target="_blank")) + " library not found, so can't find centroid!"
@@ -338,7 +343,7 @@ class GIS(object):
                 pass
 
     # -------------------------------------------------------------------------
-    def fetch_kml(self, url, filepath, session_id_name, session_id):
+    def fetch_kml(self, url, filepath, session_id_name, session_id, content=None):
         """
             Fetch a KML file:
                 - unzip it if-required
@@ -347,6 +352,9 @@ class GIS(object):
             Returns a file object
 
             Designed as a helper function for download_kml()
+
+            @param content: the contents of the KML file if already
+                            downloaded (skips the download)
         """
 
         from gluon.tools import fetch
@@ -356,40 +364,47 @@ class GIS(object):
 
         warning = ""
 
-        local = False
-        if not url.startswith("http"):
-            local = True
-            url = "%s%s" % (public_url, url)
-        elif len(url) > len(public_url) and url[:len(public_url)] == public_url:
-            local = True
-        if local:
-            # Keep Session for local URLs
-            cookie = Cookie.SimpleCookie()
-            cookie[session_id_name] = session_id
-            # For sync connections
-            current.session._unlock(response)
-            try:
-                file = fetch(url, cookie=cookie)
-            except HTTPError:
-                warning = "HTTPError"
-                return warning
-            except URLError:
-                warning = "URLError"
-                return warning
+        if content is not None:
+            file = content
         else:
-            try:
-                file = fetch(url)
-            except HTTPError:
-                warning = "HTTPError"
-                return warning
-            except URLError:
-                warning = "URLError"
-                return warning
+            local = False
+            if not url.startswith("http"):
+                local = True
+                url = "%s%s" % (public_url, url)
+            elif len(url) > len(public_url) and url[:len(public_url)] == public_url:
+                local = True
+            if local and session_id_name:
+                # Keep Session for local URLs
+                cookie = Cookie.SimpleCookie()
+                cookie[session_id_name] = session_id
+                # For sync connections
+                current.session._unlock(response)
+                try:
+                    file = fetch(url, cookie=cookie)
+                except HTTPError:
+                    warning = "HTTPError"
+                    return warning
+                except URLError:
+                    warning = "URLError"
+                    return warning
+            else:
+                try:
+                    file = fetch(url)
+                except HTTPError:
+                    warning = "HTTPError"
+                    return warning
+                except URLError:
+                    warning = "URLError"
+                    return warning
+
+        # Work with bytes, regardless whether downloaded or passed-in
+        if not isinstance(file, bytes):
+            file = s3_unicode(file).encode("utf-8")
 
         filenames = []
-        if file[:2] == "PK":
+        if file[:2] == b"PK":
             # Unzip
-            fp = StringIO(file)
+            fp = BytesIO(file)
             import zipfile
             myfile = zipfile.ZipFile(fp)
             files = myfile.infolist()
@@ -440,12 +455,17 @@ class GIS(object):
             file = myfile.read(main)
             myfile.close()
 
+        # Parse the bytes (XML may contain an encoding declaration),
+        # but search and rewrite the text
+        data = file
+        file = s3_unicode(data)
+
         # Check for NetworkLink
         if "<NetworkLink>" in file:
             try:
                 # Remove extraneous whitespace
                 parser = etree.XMLParser(recover=True, remove_blank_text=True)
-                tree = etree.XML(file, parser)
+                tree = etree.XML(data, parser)
                 # Find contents of href tag (must be a better way?)
                 url = ""
                 for element in tree.iter():
@@ -453,7 +473,11 @@ class GIS(object):
                         url = element.text
                 if url:
                     # Follow NetworkLink (synchronously)
-                    warning2 = self.fetch_kml(url, filepath)
+                    warning2 = self.fetch_kml(url,
+                                              filepath,
+                                              session_id_name,
+                                              session_id,
+                                              )
                     warning += warning2
             except (etree.XMLSyntaxError,):
                 e = sys.exc_info()[1]
@@ -474,12 +498,360 @@ class GIS(object):
             file = file.replace(filename, replace)
 
         # Write main file to cache
-        f = open(filepath, "w")
-        f.write(file)
+        f = open(filepath, "wb")
+        f.write(file.encode("utf-8"))
         f.close()
 
         return warning
 
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def kml_cache_filename(name):
+        """
+            Get the name of the cache file for a KML layer
+
+            @param name: the layer name
+        """
+
+        _name = urllib_quote(s3_str(name)).replace("%", "_")
+        return "gis_cache2.file.%s.kml" % _name
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def refresh_feeds(layer_ids=None, force=False):
+        """
+            Refresh the cached copies of remote KML/GeoRSS feeds which are
+            due for refresh (as per the layer's refresh interval)
+
+            - designed to be run as scheduled task (gis_refresh_feeds), so
+              that map requests never need to fetch remote feeds
+
+            @param layer_ids: only refresh these layers (layer_ids)
+            @param force: refresh regardless of the refresh interval
+
+            @returns: the number of feeds which have changed
+        """
+
+        db = current.db
+        s3db = current.s3db
+
+        ftable = s3db.gis_feed
+        now = current.request.utcnow
+
+        changed = 0
+        for tablename in ("gis_layer_georss", "gis_layer_kml"):
+
+            table = s3db[tablename]
+            query = (table.deleted == False) & \
+                    (table.url != None) & \
+                    (table.url != "")
+            if layer_ids:
+                query &= (table.layer_id.belongs(layer_ids))
+            fields = [table.id,
+                      table.layer_id,
+                      table.name,
+                      table.url,
+                      table.refresh,
+                      ftable.refreshed_on,
+                      ]
+            if tablename == "gis_layer_georss":
+                fields.extend((table.data, table.image))
+            left = ftable.on((ftable.layer_id == table.layer_id) & \
+                             (ftable.deleted == False))
+            rows = db(query).select(*fields, left=left)
+
+            for row in rows:
+                layer = row[tablename]
+                refreshed_on = row.gis_feed.refreshed_on
+                if not force and refreshed_on:
+                    refresh = layer.refresh
+                    if refresh == 0:
+                        # Static file, no need to refresh
+                        continue
+                    cutoff = refreshed_on + datetime.timedelta(seconds=refresh or 900)
+                    if now < cutoff:
+                        continue
+                try:
+                    if GIS.refresh_feed(tablename, layer):
+                        changed += 1
+                except Exception as exception:
+                    db.rollback()
+                    current.log.error("GIS: Feed %s refresh failed: %s" % \
+                                      (layer.url, exception))
+                else:
+                    db.commit()
+
+        return changed
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def refresh_feed(tablename, layer):
+        """
+            Refresh the cached copy of a remote KML/GeoRSS feed:
+                - conditional GET, using ETag/Last-Modified of the
+                  previous download
+                - parse the features and store them as GeoJSON in
+                  gis_cache (replacing the previous copy)
+                - for KML, also update the cached KML file
+
+            @param tablename: the layer table name
+            @param layer: the layer Row (id, layer_id, name, url and,
+                          for GeoRSS, data, image)
+
+            @returns: True if the feed has changed, otherwise False
+        """
+
+        db = current.db
+        s3db = current.s3db
+
+        ftable = s3db.gis_feed
+        now = current.request.utcnow
+
+        source = layer.url
+        if source.startswith("http"):
+            url = source
+        else:
+            # Local URL
+            url = "%s%s" % (current.deployment_settings.get_base_public_url(),
+                            source)
+
+        feed = db(ftable.layer_id == layer.layer_id).select(ftable.id,
+                                                            ftable.url,
+                                                            ftable.etag,
+                                                            ftable.last_modified,
+                                                            limitby = (0, 1),
+                                                            ).first()
+        headers = {}
+        if feed and feed.url == source:
+            if feed.etag:
+                headers["If-None-Match"] = feed.etag
+            if feed.last_modified:
+                headers["If-Modified-Since"] = feed.last_modified
+
+        def update_feed(**fields):
+            fields["refreshed_on"] = now
+            if feed:
+                feed.update_record(**fields)
+            else:
+                ftable.insert(layer_id = layer.layer_id,
+                              url = source,
+                              **fields)
+
+        try:
+            content, etag, last_modified = GIS.fetch_feed(url, headers)
+        except HTTPError as e:
+            if e.code == 304:
+                # Not modified
+                update_feed(error = None)
+            else:
+                update_feed(error = "HTTP %s" % e.code)
+            return False
+        except (URLError, IOError, ValueError) as e:
+            update_feed(error = s3_str(e))
+            return False
+
+        if tablename == "gis_layer_kml":
+            # Update the KML file for the client
+            cachetable = s3db.gis_cache2
+            filename = GIS.kml_cache_filename(layer.name)
+            filepath = os.path.join(current.request.folder,
+                                    "uploads",
+                                    "gis_cache",
+                                    filename,
+                                    )
+            current.gis.fetch_kml(url, filepath, None, None, content=content)
+            query = (cachetable.name == layer.name)
+            if not db(query).update(file = filename):
+                cachetable.insert(name = layer.name,
+                                  file = filename,
+                                  )
+            content = GIS.kml_document(content)
+
+        features = GIS.parse_feed(tablename, layer, content)
+
+        # Replace the cached features
+        ctable = s3db.gis_cache
+        db(ctable.source == source).delete()
+        for feature in features:
+            feature["source"] = source
+            ctable.insert(**feature)
+
+        update_feed(url = source,
+                    etag = etag,
+                    last_modified = last_modified,
+                    error = None,
+                    )
+        return True
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def fetch_feed(url, headers=None, timeout=60):
+        """
+            Fetch a remote feed
+
+            @param url: the URL
+            @param headers: additional request headers (e.g. for
+                            conditional GET)
+            @param timeout: the timeout in seconds
+
+            @returns: tuple (content, ETag, Last-Modified)
+
+            @raises HTTPError: for HTTP error status (incl. 304 Not Modified)
+        """
+
+        from s3compat import urllib2
+
+        request = urllib2.Request(url, headers=headers or {})
+        f = urlopen(request, timeout=timeout)
+        try:
+            content = f.read()
+            info = f.info()
+        finally:
+            f.close()
+
+        return content, info.get("ETag"), info.get("Last-Modified")
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def kml_document(content):
+        """
+            Extract the main KML document from a KMZ file
+
+            @param content: the file contents (KML or KMZ)
+
+            @returns: the KML document
+        """
+
+        if content[:2] not in ("PK", b"PK"):
+            return content
+
+        import zipfile
+
+        kmz = zipfile.ZipFile(BytesIO(content))
+        names = [n for n in kmz.namelist() if n[-4:] == ".kml"]
+        if not names:
+            raise ValueError("KMZ contains no KML Files")
+        main = "doc.kml" if "doc.kml" in names else names[0]
+        document = kmz.read(main)
+        kmz.close()
+        return document
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def parse_feed(tablename, layer, content):
+        """
+            Parse the features of a KML/GeoRSS feed, using the same
+            stylesheets as the import of feeds into gis_cache
+
+            @param tablename: the layer table name
+            @param layer: the layer Row
+            @param content: the feed document
+
+            @returns: list of dicts for gis_cache records, with
+                      the feature as GeoJSON and its bounding box
+        """
+
+        xml = current.xml
+        if not isinstance(content, bytes):
+            content = content.encode("utf-8")
+        tree = xml.parse(BytesIO(content))
+        if tree is None:
+            raise ValueError("Feed could not be parsed: %s" % xml.error)
+
+        fmt = "kml" if tablename == "gis_layer_kml" else "georss"
+        stylesheet = os.path.join(current.request.folder,
+                                  "static",
+                                  "formats",
+                                  fmt,
+                                  "import.xsl",
+                                  )
+        args = {"name": "cache",
+                "source_url": layer.url,
+                }
+        if fmt == "georss":
+            args["data_field"] = layer.data or ""
+            args["image_field"] = layer.image or ""
+        tree = xml.transform(tree, stylesheet, **args)
+        if tree is None:
+            raise ValueError("Feed could not be transformed: %s" % xml.error)
+
+        properties = ("title", "description", "link", "data", "image", "marker")
+
+        features = []
+        for resource in tree.getroot().iterfind("resource[@name='gis_cache']"):
+            values = {}
+            for data in resource.iterfind("data"):
+                text = data.text
+                if text:
+                    values[data.get("field")] = text.strip()
+            try:
+                lat = float(values["lat"])
+                lon = float(values["lon"])
+            except (KeyError, ValueError):
+                # No geometry
+                continue
+
+            record = dict((fn, values.get(fn)) for fn in properties)
+            record.update(lat = lat,
+                          lon = lon,
+                          lat_min = lat,
+                          lat_max = lat,
+                          lon_min = lon,
+                          lon_max = lon,
+                          )
+
+            feature = {"type": "Feature",
+                       "geometry": {"type": "Point",
+                                    "coordinates": [lon, lat],
+                                    },
+                       "properties": {"name": record["title"] or "",
+                                      "description": record["description"] or "",
+                                      "link": record["link"] or "",
+                                      "data": record["data"] or "",
+                                      "image": record["image"] or "",
+                                      "marker": record["marker"] or "",
+                                      },
+                       }
+            record["geojson"] = json.dumps(feature, separators=SEPARATORS)
+            features.append(record)
+
+        return features
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def get_cached_features(source, bbox=None):
+        """
+            Get the cached features of a KML/GeoRSS feed as GeoJSON
+
+            @param source: the feed URL
+            @param bbox: the bounding box to filter by, as string
+                         "lon_min,lat_min,lon_max,lat_max"
+
+            @returns: the GeoJSON FeatureCollection (string)
+        """
+
+        table = current.s3db.gis_cache
+
+        query = (table.source == source) & \
+                (table.deleted == False) & \
+                (table.geojson != None)
+        if bbox:
+            try:
+                lon_min, lat_min, lon_max, lat_max = [float(c) for c in bbox.split(",")]
+            except ValueError:
+                # Badly-formed bbox - ignore
+                pass
+            else:
+                query &= (table.lon_max >= lon_min) & \
+                         (table.lon_min <= lon_max) & \
+                         (table.lat_max >= lat_min) & \
+                         (table.lat_min <= lat_max)
+
+        rows = current.db(query).select(table.geojson)
+
+        return '{"type":"FeatureCollection","features":[%s]}' % \
+               ",".join(row.geojson for row in rows)
+
     # -------------------------------------------------------------------------
     @staticmethod
     def geocode(address, postcode=None, Lx_ids=None, geocoder=None):
@@ -487,36 +859,160 @@ class GIS(object):
             Geocode an Address
             - used by S3LocationSelector
                       settings.get_gis_geocode_imported_addresses
+            - results are cached in gis_geocode_cache
 
             @param address: street address
             @param postcode: postcode
             @param Lx_ids: list of ancestor IDs
             @param geocoder: which geocoder service to use
+
+            @returns: dict {"lat": lat, "lon": lon}, or an error message
         """
 
-        try:
-            from geopy import geocoders
-        except ImportError:
-            current.log.error("S3GIS unresolved dependency: geopy required for Geocoder support")
-            return "S3GIS unresolved dependency: geopy required for Geocoder support"
+        settings = current.deployment_settings
+        if geocoder is None:
+            geocoder = settings.get_gis_geocode_service()
+
+        ttl = settings.get_gis_geocode_cache_ttl()
+        if not ttl or geocoder == "offline":
+            return GIS._geocode(address, postcode, Lx_ids, geocoder)[0]
+
+        db = current.db
+        table = current.s3db.gis_geocode_cache
+        now = current.request.utcnow
+
+        # Look up the cache
+        key, normalised = GIS.geocode_key(address, postcode, Lx_ids, geocoder)
+        query = (table.address_key == key)
+        row = db(query).select(table.id,
+                               table.lat,
+                               table.lon,
+                               table.error,
+                               table.expires_on,
+                               limitby = (0, 1),
+                               ).first()
+        if row and row.expires_on and row.expires_on > now:
+            if row.error:
+                return row.error
+            return {"lat": row.lat,
+                    "lon": row.lon,
+                    }
+
+        output, cacheable = GIS._geocode(address, postcode, Lx_ids, geocoder)
+        if cacheable:
+            if isinstance(output, dict):
+                expires_on = now + datetime.timedelta(days=ttl)
+                values = {"lat": output["lat"],
+                          "lon": output["lon"],
+                          "error": None,
+                          }
+            else:
+                # Cache negative results for a shorter time, in case the
+                # geocoder service gets better data
+                expires_on = now + datetime.timedelta(days=min(ttl, 1))
+                values = {"lat": None,
+                          "lon": None,
+                          "error": s3_str(output),
+                          }
+            values["expires_on"] = expires_on
+            if row:
+                row.update_record(**values)
+            else:
+                # Another request may have cached the same address in
+                # the meantime => insert within a savepoint, and update
+                # the existing row if the address_key is already taken
+                IntegrityError = db._adapter.driver.IntegrityError
+                db.executesql("SAVEPOINT gis_geocode_cache;")
+                try:
+                    table.insert(address_key = key,
+                                 address = normalised,
+                                 geocoder = s3_str(getattr(geocoder, "__name__", geocoder)),
+                                 **values)
+                except IntegrityError:
+                    db.executesql("ROLLBACK TO SAVEPOINT gis_geocode_cache;")
+                    db(query).update(**values)
+                else:
+                    db.executesql("RELEASE SAVEPOINT gis_geocode_cache;")
+
+        return output
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def geocode_key(address, postcode=None, Lx_ids=None, geocoder=None):
+        """
+            Get the cache key for a Geocoder request
+
+            @param address: street address
+            @param postcode: postcode
+            @param Lx_ids: list of ancestor IDs
+            @param geocoder: the geocoder service
+
+            @returns: tuple (key, normalised address)
+        """
+
+        import hashlib
+
+        normalise = lambda text: ",".join(" ".join(s3_str(part).lower().split())
+                                          for part in s3_str(text).split(","))
+
+        normalised = normalise(address or "")
+        if postcode:
+            normalised = "%s,%s" % (normalised, normalise(postcode))
+
+        context = ",".join(str(i) for i in sorted(set(Lx_ids))) if Lx_ids else ""
+        service = s3_str(getattr(geocoder, "__name__", geocoder))
+
+        text = "%s|%s|%s" % (normalised, context, service)
+        key = hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+        return key, normalised
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _geocode(address, postcode=None, Lx_ids=None, geocoder=None):
+        """
+            Geocode an Address (without caching)
+
+            @param address: street address
+            @param postcode: postcode
+            @param Lx_ids: list of ancestor IDs
+            @param geocoder: which geocoder service to use
+
+            @returns: tuple (output, cacheable), where output is a dict
+                      {"lat": lat, "lon": lon} or an error message, and
+                      cacheable indicates whether the output is a valid
+                      answer of the geocoder (rather than a failure to
+                      reach it)
+        """
 
         settings = current.deployment_settings
         if geocoder is None:
             geocoder = settings.get_gis_geocode_service()
 
-        if geocoder == "nominatim":
+        if geocoder == "offline":
+            g = S3OfflineGeocoder()
+        elif geocoder in ("nominatim", "geonames", "google"):
+            try:
+                from geopy import geocoders
+            except ImportError:
+                current.log.error("S3GIS unresolved dependency: geopy required for Geocoder support")
+                return "S3GIS unresolved dependency: geopy required for Geocoder support", False
+
+        if geocoder == "offline":
+            pass
+        elif geocoder == "nominatim":
             g = geocoders.Nominatim(user_agent = "Sahana Eden")
         elif geocoder == "geonames":
             username = settings.get_gis_api_google()
             if not username:
                 current.log.error("Geocoder: No Username defined for GeoNames")
-                return "No Username"
+                return "No Username", False
             g = geocoders.GeoNames(username = username)
         elif geocoder == "google":
             api_key = settings.get_gis_geonames_username()
             if not api_key:
                 current.log.error("Geocoder: No API Key defined for Google")
-                return "No API Key"
+                return "No API Key", False
             g = geocoders.GoogleV3(api_key = api_key)
             #if current.gis.google_geocode_retry:
             #    # Retry when reaching maximum requests per second
@@ -544,7 +1040,13 @@ class GIS(object):
         else:
             raise NotImplementedError
 
-        geocode_ = lambda names, g=g, **kwargs: g.geocode(names, **kwargs)
+        if geocoder == "offline":
+            geocode_ = g.geocode
+        else:
+            def geocode_(names, g=g, **kwargs):
+                # Respect the rate limit of the geocoder service
+                GIS.geocode_throttle()
+                return g.geocode(names, **kwargs)
 
         location = address
         if postcode:
@@ -597,11 +1099,13 @@ class GIS(object):
                         L5 = l.id
                 Lx = Lx.as_dict()
 
+        cacheable = True
         try:
             results = geocode_(location, exactly_one=False)
         except:
             error = sys.exc_info()[1]
             output = str(error)
+            cacheable = False
         else:
             if results is None:
                 output = "No results found"
@@ -706,7 +1210,109 @@ class GIS(object):
                               "lon": lon,
                               }
 
-        return output
+        return output, cacheable
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def geocode_throttle():
+        """
+            Wait until the rate limit of the Geocoder service allows
+            the next request (settings.gis.geocode_rate_limit)
+        """
+
+        import time
+
+        rate_limit = current.deployment_settings.get_gis_geocode_rate_limit()
+        if rate_limit:
+            wait = GIS._geocode_last + rate_limit - time.time()
+            if wait > 0:
+                time.sleep(wait)
+        GIS._geocode_last = time.time()
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def geocode_pending(limit=None):
+        """
+            Geocode all imported addresses which have no Lat/Lon yet,
+            each distinct address only once
+            - run as background task gis_geocode_pending
+
+            @param limit: maximum number of distinct addresses to geocode
+
+            @returns: the number of locations updated
+        """
+
+        db = current.db
+        table = current.s3db.gis_location
+        gis = current.gis
+
+        query = (table.addr_street != None) & \
+                (table.addr_street != "") & \
+                (table.lat == None) & \
+                (table.lon == None) & \
+                (table.deleted == False)
+        rows = db(query).select(table.id,
+                                table.addr_street,
+                                table.addr_postcode,
+                                table.parent,
+                                orderby = table.id,
+                                )
+
+        # Group locations by address (deduplicate)
+        pending = OrderedDict()
+        for row in rows:
+            key = (GIS.geocode_key(row.addr_street, row.addr_postcode)[1],
+                   row.parent,
+                   )
+            if key in pending:
+                pending[key][1].append(row.id)
+            else:
+                pending[key] = (row, [row.id])
+
+        spatialdb = current.deployment_settings.get_gis_spatialdb()
+
+        updated = 0
+        for i, (row, location_ids) in enumerate(pending.values()):
+            if limit and i >= limit:
+                break
+
+            parent = row.parent
+            if parent:
+                Lx_ids = gis.get_parents(parent, ids_only=True)
+                if Lx_ids:
+                    Lx_ids.append(parent)
+                else:
+                    Lx_ids = [parent]
+            else:
+                Lx_ids = None
+
+            results = GIS.geocode(row.addr_street, row.addr_postcode, Lx_ids)
+            if not isinstance(results, dict):
+                current.log.warning("Geocoder: %s (%s)" % (results, row.addr_street))
+                continue
+
+            lat, lon = results["lat"], results["lon"]
+            wkt = "POINT (%s %s)" % (lon, lat)
+            values = {"gis_feature_type": 1,
+                      "inherited": False,
+                      "lat": lat,
+                      "lon": lon,
+                      "lat_min": lat,
+                      "lat_max": lat,
+                      "lon_min": lon,
+                      "lon_max": lon,
+                      "wkt": wkt,
+                      }
+            if spatialdb:
+                values["the_geom"] = wkt
+            db(table.id.belongs(location_ids)).update(**values)
+            updated += len(location_ids)
+
+            if i % 50 == 49:
+                # Keep results in case the task times out
+                db.commit()
+
+        return updated
 
     # -------------------------------------------------------------------------
     @staticmethod
@@ -1152,6 +1758,379 @@ class GIS(object):
                                     table.name)
         return children
 
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def ldata(location_id, output_level=None, language=None):
+        """
+            Build the location hierarchy data for S3LocationSelector
+            (i.e. the children of a location), as served by gis/ldata
+
+            @param location_id: the parent location ID
+            @param output_level: the level to return (for a level after
+                                 a missed level), as integer
+            @param language: the language to translate names into
+                             (None for no translation)
+
+            @returns: dict {id: {"n": name,
+                                 "l": level,
+                                 "f": parent,
+                                 "b": [lon_min, lat_min, lon_max, lat_max],
+                                 }}
+        """
+
+        db = current.db
+        s3db = current.s3db
+
+        location_id = int(location_id)
+        term = str(location_id)
+
+        table = s3db.gis_location
+        query = (table.deleted == False) & \
+                (table.end_date == None) & \
+                (table.level != None)
+        if output_level:
+            # We will be reading all descendants, which is inefficient, but otherwise we cannot support individual locations with missing levels
+            # Filter out results from the missing level as otherwise these show up like individual locations with missing levels
+            filter_level = output_level - 1
+            query &= (table.level != "L%s" % filter_level) & \
+                     ((table.path.like(term + "/%")) | \
+                      (table.path.like("%/" + term + "/%")))
+        else:
+            query &= (table.parent == location_id)
+        fields = [table.id,
+                  table.name,
+                  table.level,
+                  table.parent,
+                  table.lon_min,
+                  table.lat_min,
+                  table.lon_max,
+                  table.lat_max,
+                  ]
+        if language:
+            ntable = s3db.gis_location_name
+            fields.append(ntable.name_l10n)
+            left = ntable.on((ntable.deleted == False) & \
+                             (ntable.language == language) & \
+                             (ntable.location_id == table.id))
+        else:
+            left = None
+
+        rows = db((table.id == location_id) | query).select(*fields,
+                                                            left = left)
+
+        if not output_level:
+            # Introspect it
+            for row in rows:
+                l = row.gis_location if language else row
+                if l.id == location_id:
+                    try:
+                        output_level = int(l.level[1:]) + 1
+                    except (TypeError, ValueError):
+                        pass
+                    break
+            if not output_level:
+                return {}
+
+        search_level = "L%s" % output_level
+
+        location_dict = {}
+        for row in rows:
+            if language:
+                l = row.gis_location
+                name = row["gis_location_name.name_l10n"] or l.name
+            else:
+                l = row
+                name = l.name
+            if l.level == search_level:
+                this_level = output_level
+                # In case we're using a missing level, use the pseudo-parent
+                #f = int(l.parent)
+                f = location_id
+            else:
+                # An individual location with a Missing Level
+                this_level = int(l.level[1:])
+                parent = l.parent
+                if parent:
+                    f = int(parent)
+                else:
+                    f = None
+            data = {"n": name,
+                    "l": this_level,
+                    "f": f,
+                    }
+            if l.lon_min is not None:
+                data["b"] = [l.lon_min,
+                             l.lat_min,
+                             l.lon_max,
+                             l.lat_max,
+                             ]
+            location_dict[int(l.id)] = data
+
+        return location_dict
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def ldata_children(parent, language=None):
+        """
+            Build the data for the Lx dropdown options below a parent
+            location, as used by S3LocationSelector to populate the form
+
+            @param parent: the parent location ID
+            @param language: the language to translate names into
+                             (None for no translation)
+
+            @returns: dict {id: {"n": name,
+                                 "l": level,
+                                 "f": parent,
+                                 "b": [lon_min, lat_min, lon_max, lat_max],
+                                 }}, "b" only for locations which do not
+                      inherit their bounds
+        """
+
+        s3db = current.s3db
+
+        table = s3db.gis_location
+        query = (table.parent == parent) & \
+                (table.level != None) & \
+                (table.deleted == False) & \
+                (table.end_date == None)
+        fields = [table.id,
+                  table.name,
+                  table.level,
+                  table.parent,
+                  table.inherited,
+                  table.lat_min,
+                  table.lon_min,
+                  table.lat_max,
+                  table.lon_max,
+                  ]
+        if language:
+            ntable = s3db.gis_location_name
+            fields.append(ntable.name_l10n)
+            left = ntable.on((ntable.deleted == False) & \
+                             (ntable.language == language) & \
+                             (ntable.location_id == table.id))
+        else:
+            left = None
+
+        rows = current.db(query).select(*fields, left=left)
+
+        location_dict = {}
+        for row in rows:
+            if language:
+                l = row.gis_location
+                name = row["gis_location_name.name_l10n"] or l.name
+            else:
+                l = row
+                name = l.name
+            data = {"n": name,
+                    "l": int(l.level[1]),
+                    "f": int(l.parent),
+                    }
+            if not l.inherited:
+                data["b"] = [l.lon_min,
+                             l.lat_min,
+                             l.lon_max,
+                             l.lat_max,
+                             ]
+            location_dict[int(l.id)] = data
+
+        return location_dict
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def ldata_language():
+        """
+            Get the language to translate location names into for
+            hierarchy data (ldata)
+
+            @returns: the language code, or None if no translation
+                      is required
+        """
+
+        language = current.session.s3.language
+        if language in ("en", "en-gb"):
+            # We assume that Location names default to the English version
+            return None
+        if not current.deployment_settings.get_L10n_translate_gis_location():
+            return None
+        return language
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def get_ldata(location_id, output_level=None, children=False):
+        """
+            Get the location hierarchy data below a location as JSON,
+            from the hierarchy cache if possible
+
+            - the JSON is generated once per (parent, level, language)
+              and stored in uploads/gis_cache/hierarchy/<parent>,
+              from where it is discarded when locations below the
+              parent change (see clear_ldata)
+
+            @param location_id: the parent location ID
+            @param output_level: the level to return (for a level after
+                                 a missed level), as integer
+            @param children: return the data for the S3LocationSelector
+                             dropdowns (ldata_children) rather than for
+                             gis/ldata
+
+            @returns: tuple (JSON, last_modified), last_modified is a
+                      timestamp (None if the data are not cached)
+        """
+
+        location_id = int(location_id)
+        language = GIS.ldata_language()
+
+        if children:
+            build = lambda: GIS.ldata_children(location_id, language)
+            name = "children"
+        else:
+            build = lambda: GIS.ldata(location_id, output_level, language)
+            name = "ldata-%s" % (output_level or 0)
+        name = "%s-%s.json" % (name, language or "default")
+
+        if not current.deployment_settings.get_gis_hierarchy_cache():
+            return json.dumps(build(), separators=SEPARATORS), None
+
+        folder = GIS.ldata_cache_path(location_id)
+        path = os.path.join(folder, name)
+        try:
+            with open(path, "r") as source:
+                return source.read(), os.path.getmtime(path)
+        except (IOError, OSError):
+            # Not cached yet
+            pass
+
+        output = json.dumps(build(), separators=SEPARATORS)
+
+        # Write to a temporary file first, so that concurrent requests
+        # never read a partial file
+        import tempfile
+        try:
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            handle, tmp = tempfile.mkstemp(dir=folder)
+            with os.fdopen(handle, "w") as target:
+                target.write(output)
+            os.rename(tmp, path)
+            last_modified = os.path.getmtime(path)
+        except (IOError, OSError):
+            current.log.warning("S3GIS: could not cache hierarchy data in %s" % path)
+            last_modified = None
+
+        return output, last_modified
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def ldata_cache_path(location_id=None):
+        """
+            Get the folder for cached hierarchy data
+
+            @param location_id: the parent location ID (None for the
+                                folder of all cached hierarchy data)
+        """
+
+        folder = os.path.join(current.request.folder,
+                              "uploads",
+                              "gis_cache",
+                              "hierarchy",
+                              )
+        if location_id is not None:
+            folder = os.path.join(folder, str(int(location_id)))
+        return folder
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def clear_ldata(location_ids=None, ancestors=False):
+        """
+            Discard cached hierarchy data, both immediately and after
+            commit of the current transaction
+
+            @param location_ids: the IDs of the locations whose hierarchy
+                                 data have become outdated, i.e. the parents
+                                 of changed locations (None to discard all
+                                 cached hierarchy data)
+            @param ancestors: also discard the hierarchy data of all
+                              ancestors of these locations (whose data
+                              include descendants across missing levels)
+        """
+
+        import shutil
+
+        if location_ids is None:
+            folders = [GIS.ldata_cache_path()]
+        else:
+            if not isinstance(location_ids, (list, tuple, set)):
+                location_ids = [location_ids]
+            location_ids = set(int(i) for i in location_ids if i)
+            if ancestors and location_ids:
+                table = current.s3db.gis_location
+                query = (table.id.belongs(location_ids))
+                rows = current.db(query).select(table.parent,
+                                                table.path,
+                                                )
+                for row in rows:
+                    if row.parent:
+                        location_ids.add(row.parent)
+                    if row.path:
+                        location_ids.update(int(i) for i in row.path.split("/") if i)
+            folders = [GIS.ldata_cache_path(i) for i in location_ids]
+
+        def remove(folders):
+            for folder in folders:
+                if os.path.exists(folder):
+                    shutil.rmtree(folder, ignore_errors=True)
+        remove(folders)
+
+        # A concurrent request could rebuild the cache from the committed
+        # (i.e. still outdated) data before this transaction is committed,
+        # so discard the cached data again after commit
+        s3 = current.response.s3
+        cleared = s3.ldata_cleared
+        if cleared is None:
+            cleared = s3.ldata_cleared = set()
+            s3_on_commit(lambda: remove(list(cleared)))
+        cleared.update(folders)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def revalidate(output, last_modified):
+        """
+            Set ETag/Last-Modified headers for a cached response, so that
+            clients can revalidate their copy cheaply, and answer with
+            304 Not Modified if their copy is still current
+
+            @param output: the response body (string)
+            @param last_modified: the time of last modification (timestamp)
+
+            @raises HTTP: 304 if the client's copy is still current
+        """
+
+        import hashlib
+        from email.utils import formatdate, mktime_tz, parsedate_tz
+
+        request = current.request
+        headers = current.response.headers
+
+        etag = '"%s"' % hashlib.md5(s3_str(output).encode("utf-8")).hexdigest()
+
+        headers["ETag"] = etag
+        headers["Cache-Control"] = "private, no-cache"
+        if last_modified:
+            headers["Last-Modified"] = formatdate(last_modified, usegmt=True)
+
+        env = request.env
+        if_none_match = env.http_if_none_match
+        if if_none_match:
+            if etag in [t.strip() for t in if_none_match.split(",")] or \
+               if_none_match.strip() == "*":
+                raise HTTP(304, **headers)
+        elif last_modified and env.http_if_modified_since:
+            since = parsedate_tz(env.http_if_modified_since)
+            if since and int(last_modified) <= mktime_tz(since):
+                raise HTTP(304, **headers)
+
     # -------------------------------------------------------------------------
     @staticmethod
     def get_parents(feature_id, feature=None, ids_only=False):
@@ -1396,6 +2375,47 @@ class GIS(object):
            _gis.config.id == config_id:
             return
 
+        if force_update_cache:
+            config = GIS._read_config(config_id)
+        else:
+            # Use the cached config, if available
+            if config_id:
+                key = "config_%s" % config_id
+            else:
+                # Depends on the user's personal and OU configs
+                auth = current.auth
+                user = auth.user if auth.is_logged_in() else None
+                if user:
+                    key = "config_%s_%s_%s_%s" % (user.get("pe_id"),
+                                                  user.organisation_id,
+                                                  user.site_id,
+                                                  user.org_group_id,
+                                                  )
+                else:
+                    key = "config"
+            config = GIS.config_cache(key, lambda: GIS._read_config(config_id))
+
+        # Copy, so that the cached config remains unchanged
+        cache = Storage(config)
+        if "ids" in cache:
+            cache["ids"] = list(cache["ids"])
+
+        # Store the values
+        _gis.config = cache
+        return cache
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _read_config(config_id=None):
+        """
+            Read (and merge) the GIS config from the DB, helper for
+            set_config
+
+            @param config_id: the config ID (see set_config)
+
+            @returns: the merged config (Storage)
+        """
+
         db = current.db
         s3db = current.s3db
         ctable = s3db.gis_config
@@ -1474,7 +2494,6 @@ class GIS(object):
                                                            ).first()
             if not row:
                 # No configs found at all
-                _gis.config = cache
                 return cache
 
         # If no id supplied, extend the site config with any personal or OU configs
@@ -1585,7 +2604,6 @@ class GIS(object):
 
             if not row:
                 # No configs found at all
-                _gis.config = cache
                 return cache
 
         if not cache:
@@ -1603,9 +2621,14 @@ class GIS(object):
                 cache["marker_%s" % key] = marker[key] if key in marker \
                                                        else None
 
-        # Store the values
-        _gis.config = cache
-        return cache
+        # Keep only values (no Row methods or back-references), so that
+        # the config can be cached across requests
+        keep = set(ctable.fields)
+        keep.update(("ids",
+                     "epsg", "maxExtent", "proj4js", "units",
+                     "marker_image", "marker_height", "marker_width",
+                     ))
+        return Storage((k, v) for k, v in cache.items() if k in keep)
 
     # -------------------------------------------------------------------------
     @staticmethod
@@ -1627,6 +2650,158 @@ class GIS(object):
 
         return _gis.config
 
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def config_cache(key, build):
+        """
+            Get an item of static GIS configuration (merged configs, map
+            layer definitions) from the cross-request cache, or build and
+            cache it
+
+            - the cache is invalidated (for all processes) whenever any of
+              the gis_config/gis_layer_*/gis_style tables is written to,
+              see clear_config_cache
+
+            @param key: the cache key for the item
+            @param build: function to build the item
+
+            @returns: the (cached) item
+        """
+
+        expire = current.deployment_settings.get_gis_config_cache()
+        if not expire:
+            return build()
+
+        key = "gis_config_cache_%s_%s" % (GIS.config_cache_version(), key)
+        return current.cache.ram(key, build, time_expire=expire)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def config_cache_version():
+        """
+            Get the current version stamp of the GIS configuration
+            (read once per request)
+
+            @returns: the version stamp (string)
+        """
+
+        _gis = current.response.s3.gis
+
+        version = _gis.config_cache_version
+        if version is None:
+            path = GIS.config_cache_path()
+            try:
+                with open(path, "r") as stamp:
+                    version = stamp.read().strip()
+            except (IOError, OSError):
+                version = None
+            if not version:
+                version = GIS.renew_config_cache_version()
+            _gis.config_cache_version = version
+
+        return version
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def clear_config_cache(*args):
+        """
+            Invalidate the cached GIS configuration for all processes,
+            by renewing the version stamp; called after writes to the
+            gis_config/gis_layer_*/gis_style tables (DAL callback, hence
+            accepts and ignores any arguments)
+
+            - DAL callbacks run before the transaction is committed, so
+              another process could still cache the previous data under
+              the new stamp => the stamp is renewed once more after
+              commit
+
+            @returns: the new version stamp
+        """
+
+        version = GIS.renew_config_cache_version()
+
+        # Renew the stamp again after commit
+        _gis = current.response.s3.gis
+        if not _gis.config_cache_hooked:
+            s3_on_commit(GIS.renew_config_cache_version)
+            _gis.config_cache_hooked = True
+
+        return version
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def renew_config_cache_version():
+        """
+            Write a new version stamp for the GIS config cache, and
+            remove outdated items from the cache of this process
+
+            @returns: the new version stamp
+        """
+
+        from uuid import uuid4
+
+        version = uuid4().hex
+
+        path = GIS.config_cache_path()
+        folder = os.path.dirname(path)
+        try:
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            with open(path, "w") as stamp:
+                stamp.write(version)
+        except (IOError, OSError):
+            current.log.warning("S3GIS: could not write %s" % path)
+
+        # Remove outdated items from the cache of this process
+        current.cache.ram.clear(regex="^gis_config_cache_")
+
+        current.response.s3.gis.config_cache_version = version
+        return version
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def config_cache_path():
+        """
+            Get the path of the version stamp file for the GIS config cache
+        """
+
+        return os.path.join(current.request.folder,
+                            "uploads",
+                            "gis_cache",
+                            "config.version",
+                            )
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def layer_cache_key(config, openlayers, catalogue_layers=False):
+        """
+            Get the cache key for map layer definitions, which depend on
+            the config chain, the user's roles and the language (and some
+            request parameters)
+
+            @param config: the current GIS config
+            @param openlayers: the OpenLayers version
+            @param catalogue_layers: whether all catalogue layers are shown
+
+            @returns: the cache key (string)
+        """
+
+        import hashlib
+
+        session_s3 = current.session.s3
+        roles = sorted(session_s3.roles or [])
+
+        key = json.dumps([config.ids or [config.id],
+                          roles,
+                          session_s3.language,
+                          openlayers,
+                          bool(catalogue_layers),
+                          current.request.get_vars.get("layers"),
+                          ],
+                         separators = SEPARATORS,
+                         )
+        return "layers_%s" % hashlib.sha1(key.encode("utf-8")).hexdigest()
+
     # -------------------------------------------------------------------------
     def get_location_hierarchy(self, level=None, location=None):
         """
@@ -2033,63 +3208,41 @@ class GIS(object):
             query &= (table.deleted == False)
         # @ToDo: Check AAA (do this as a resource filter?)
 
-        features = db(query).select(locations.wkt,
-                                    locations.lat,
-                                    locations.lon,
-                                    table.ALL
-                                    )
+        # 1st select Features within the bbox of the Polygon (faster)
+        if lon_min is None:
+            lon_min, lat_min, lon_max, lat_max = polygon.bounds
+        features = self._select_in_bbox(lon_min, lat_min, lon_max, lat_max,
+                                         query,
+                                         (locations.wkt,
+                                          locations.lat,
+                                          locations.lon,
+                                          table.ALL,
+                                          ))
+
         output = Rows()
         # @ToDo: provide option to use PostGIS/Spatialite
         # settings = current.deployment_settings
         # if settings.gis.spatialdb and settings.database.db_type == "postgres":
-        if lon_min is None:
-            # We have no BBOX so go straight to the full geometry check
-            for row in features:
-                _location = row.gis_location
-                wkt = _location.wkt
-                if wkt is None:
-                    lat = _location.lat
-                    lon = _location.lon
-                    if lat is not None and lon is not None:
-                        wkt = self.latlon_to_wkt(lat, lon)
-                    else:
-                        continue
-                try:
-                    shape = wkt_loads(wkt)
-                    if shape.intersects(polygon):
-                        # Save Record
-                        output.records.append(row)
-                except ReadingError:
-                    current.log.error("Error reading wkt of location with id",
-                                      value=row.id)
-        else:
-            # 1st check for Features included within the bbox (faster)
-            def in_bbox(row):
-                _location = row.gis_location
-                return (_location.lon > lon_min) & \
-                       (_location.lon < lon_max) & \
-                       (_location.lat > lat_min) & \
-                       (_location.lat < lat_max)
-            for row in features.find(lambda row: in_bbox(row)):
-                # Search within this subset with a full geometry check
-                # Uses Shapely.
-                _location = row.gis_location
-                wkt = _location.wkt
-                if wkt is None:
-                    lat = _location.lat
-                    lon = _location.lon
-                    if lat is not None and lon is not None:
-                        wkt = self.latlon_to_wkt(lat, lon)
-                    else:
-                        continue
-                try:
-                    shape = wkt_loads(wkt)
-                    if shape.intersects(polygon):
-                        # Save Record
-                        output.records.append(row)
-                except ReadingError:
-                    current.log.error("Error reading wkt of location with id",
-                                      value = row.id)
+        for row in features:
+            # Search within this subset with a full geometry check
+            # Uses Shapely.
+            _location = row.gis_location
+            wkt = _location.wkt
+            if wkt is None:
+                lat = _location.lat
+                lon = _location.lon
+                if lat is not None and lon is not None:
+                    wkt = self.latlon_to_wkt(lat, lon)
+                else:
+                    continue
+            try:
+                shape = wkt_loads(wkt)
+                if shape.intersects(polygon):
+                    # Save Record
+                    output.records.append(row)
+            except ReadingError:
+                current.log.error("Error reading wkt of location with id",
+                                  value = row.id)
         return output
 
     # -------------------------------------------------------------------------
@@ -2276,39 +3429,35 @@ class GIS(object):
             # shortcut
             locations = db.gis_location
 
-            query = (locations.lat > bbox["lat_min"]) & \
-                    (locations.lat < bbox["lat_max"]) & \
-                    (locations.lon > bbox["lon_min"]) & \
-                    (locations.lon < bbox["lon_max"])
             deleted = (locations.deleted == False)
             empty = (locations.lat != None) & (locations.lon != None)
-            query = deleted & empty & query
-
+            query = deleted & empty
+
+            fields = [locations.id,
+                      locations.name,
+                      locations.level,
+                      locations.lat,
+                      locations.lon,
+                      locations.lat_min,
+                      locations.lon_min,
+                      locations.lat_max,
+                      locations.lon_max,
+                      ]
             if tablename:
                 # Lookup the resource
                 table = current.s3db[tablename]
                 query &= (table.location_id == locations.id)
-                records = db(query).select(table.ALL,
-                                           locations.id,
-                                           locations.name,
-                                           locations.level,
-                                           locations.lat,
-                                           locations.lon,
-                                           locations.lat_min,
-                                           locations.lon_min,
-                                           locations.lat_max,
-                                           locations.lon_max)
-            else:
+                fields.insert(0, table.ALL)
+            #else:
                 # Lookup the raw Locations
-                records = db(query).select(locations.id,
-                                           locations.name,
-                                           locations.level,
-                                           locations.lat,
-                                           locations.lon,
-                                           locations.lat_min,
-                                           locations.lon_min,
-                                           locations.lat_max,
-                                           locations.lon_max)
+
+            records = self._select_in_bbox(bbox["lon_min"],
+                                           bbox["lat_min"],
+                                           bbox["lon_max"],
+                                           bbox["lat_max"],
+                                           query,
+                                           fields,
+                                           )
             features = Rows()
             for row in records:
                 # Calculate the Great Circle distance
@@ -2378,11 +3527,17 @@ class GIS(object):
                       query,
                       join = True,
                       geojson = True,
+                      zoom = None,
+                      bbox = None,
                       ):
         """
             Returns the locations for an XML export
             - used by GIS.get_location_data() and S3PivotTable.geojson()
 
+            @param zoom: the zoom level of the map (to select the level
+                         of precomputed simplified polygons)
+            @param bbox: the bbox of the map (alternative to zoom)
+
             @ToDo: Support multiple locations for a single resource
                    (e.g. a Project working in multiple Communities)
         """
@@ -2435,14 +3590,36 @@ class GIS(object):
                     else:
                         output[key] = [row.wkt]
         else:
-            rows = db(query).select(table.id,
-                                    gtable.wkt)
+            if join:
+                rows = db(query).select(table.id,
+                                        gtable.id,
+                                        gtable.wkt)
+            else:
+                rows = db(query).select(table.id,
+                                        gtable.wkt)
+
+            # Use precomputed simplified polygons where available
+            level = GIS.get_simplify_level(zoom, bbox) if tolerance else None
+            if level is not None:
+                if join:
+                    location_ids = [row["gis_location"].id for row in rows]
+                else:
+                    location_ids = [row.id for row in rows]
+                simplified = GIS.get_simplified(location_ids,
+                                                level,
+                                                geojson = geojson,
+                                                ).get
+            else:
+                simplified = lambda location_id: None
+
             simplify = GIS.simplify
             if geojson:
                 # Simplify the polygon to reduce download size
                 if join:
                     for row in rows:
-                        g = simplify(row["gis_location"].wkt,
+                        location = row["gis_location"]
+                        g = simplified(location.id) or \
+                            simplify(location.wkt,
                                      tolerance=tolerance,
                                      output="geojson")
                         if g:
@@ -2454,7 +3631,8 @@ class GIS(object):
                 else:
                     # gis_location: always single
                     for row in rows:
-                        g = simplify(row.wkt,
+                        g = simplified(row.id) or \
+                            simplify(row.wkt,
                                      tolerance=tolerance,
                                      output="geojson")
                         if g:
@@ -2467,7 +3645,9 @@ class GIS(object):
                         # & also to work around the recursion limit in libxslt
                         # http://blog.gmane.org/gmane.comp.python.lxml.devel/day=20120309
                         for row in rows:
-                            wkt = simplify(row["gis_location"].wkt)
+                            location = row["gis_location"]
+                            wkt = simplified(location.id) or \
+                                  simplify(location.wkt)
                             if wkt:
                                 key = row[tablename].id
                                 if key in output:
@@ -2487,7 +3667,7 @@ class GIS(object):
                     # gis_location: always single
                     if tolerance:
                         for row in rows:
-                            wkt = simplify(row.wkt)
+                            wkt = simplified(row.id) or simplify(row.wkt)
                             if wkt:
                                 output[row.id] = wkt
                     else:
@@ -2525,6 +3705,18 @@ class GIS(object):
             if count and \
                count > current.deployment_settings.get_gis_max_features():
                 headers = {"Content-Type": "application/json"}
+                get_vars = current.request.get_vars
+                zoom = get_vars.get("zoom")
+                if zoom is not None:
+                    # Return clustered features instead
+                    clusters = GIS.get_clusters(resource,
+                                                zoom,
+                                                layer_id = get_vars.get("layer"),
+                                                )
+                    if clusters is not None:
+                        raise HTTP(200,
+                                   body=json.dumps(clusters, separators=SEPARATORS),
+                                   **headers)
                 message = "Too Many Records"
                 status = 509
                 raise HTTP(status,
@@ -2597,13 +3789,15 @@ class GIS(object):
                                       ftable.trackable,
                                       )
             if len(layers) > 1:
-                layers.exclude(lambda row: row.style_default == False)
-                if len(layers) > 1:
-                    # We can't provide details for the whole layer, but need to do a per-record check
-                    return None
+                default_layers = layers.find(lambda row: row.style_default == True)
+                if default_layers:
+                    layers = default_layers
+                # else: Markers are resolved per record (see get_markers),
+                #       attributes are taken from the first layer
             if layers:
                 layer = layers.first()
-                layer_id = layer.layer_id
+                if len(layers) == 1:
+                    layer_id = layer.layer_id
 
         if not attr_fields:
             # Try get_vars
@@ -2735,11 +3929,11 @@ class GIS(object):
                     for record in resource:
                         m[record[pkey]] = marker_fn(record)
                 else:
-                    # No configuration found so use default marker for all
-                    c, f = tablename.split("_", 1)
-                    m = GIS.get_marker(c, f)
+                    # Resolve from the layer styles, in bulk
+                    m = GIS.get_markers(resource, layer_id)
 
-                markers[tablename] = m
+                if m:
+                    markers[tablename] = m
 
             if individual:
                 # Add a per-feature Style
@@ -2763,14 +3957,15 @@ class GIS(object):
             marker_fn = s3db.get_config(tablename, "marker_fn")
             if marker_fn:
                 # Add a per-feature Marker
+                m = {}
                 for record in resource:
-                    markers[record[pkey]] = marker_fn(record)
+                    m[record[pkey]] = marker_fn(record)
             else:
-                # No configuration found so use default marker for all
-                c, f = tablename.split("_", 1)
-                markers = GIS.get_marker(c, f)
+                # Resolve from the layer styles, in bulk
+                m = GIS.get_markers(resource, layer_id)
 
-            markers[tablename] = markers
+            if m:
+                markers[tablename] = m
 
         # Lookup the LatLons now so that it can be done as a single
         # query rather than per record
@@ -2850,7 +4045,10 @@ class GIS(object):
                     return None
 
             if geojson and not points:
-                geojsons[tablename] = GIS.get_locations(table, query, join, geojson)
+                geojsons[tablename] = GIS.get_locations(table, query, join, geojson,
+                                                        zoom = get_vars.get("zoom"),
+                                                        bbox = get_vars.get("bbox"),
+                                                        )
             # @ToDo: Support Polygons in KML, GPX & GeoRSS
             #else:
             #    wkts[tablename] = GIS.get_locations(table, query, join, geojson)
@@ -2895,6 +4093,157 @@ class GIS(object):
                 "styles": styles,
                 }
 
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def get_clusters(resource, zoom, layer_id=None):
+        """
+            Cluster the features of a resource server-side, for GeoJSON
+            layers with too many features to transfer individually
+
+            Features are clustered on a grid of cluster_distance pixels at
+            the requested zoom level (and separately per value of the layer's
+            cluster_attribute); grid cells with fewer than cluster_threshold
+            features return their features individually.
+
+            @param resource: the S3Resource (already filtered by bbox)
+            @param zoom: the zoom level of the map
+            @param layer_id: the layer_id of the Feature Layer, to look
+                             up its cluster options
+
+            @returns: GeoJSON FeatureCollection (dict), or None if
+                      clustering is disabled or not possible
+        """
+
+        try:
+            zoom = max(0, min(int(zoom), 22))
+        except (TypeError, ValueError):
+            return None
+
+        import math
+        from .s3tiles import S3VectorTiles
+
+        selector = S3VectorTiles.location_selector(resource)
+        if selector is None:
+            return None
+
+        # Cluster options
+        distance = CLUSTER_DISTANCE
+        threshold = CLUSTER_THRESHOLD
+        attribute = None
+        if layer_id:
+            db = current.db
+            s3db = current.s3db
+            ftable = s3db.gis_layer_feature
+            layer = db(ftable.layer_id == layer_id).select(ftable.cluster_attribute,
+                                                           limitby = (0, 1),
+                                                           ).first()
+            if layer:
+                attribute = layer.cluster_attribute
+            stable = s3db.gis_style
+            query = (stable.layer_id == layer_id) & \
+                    (stable.record_id == None) & \
+                    (stable.deleted == False)
+            style = db(query).select(stable.cluster_distance,
+                                     stable.cluster_threshold,
+                                     limitby = (0, 1),
+                                     ).first()
+            if style:
+                if style.cluster_distance:
+                    distance = style.cluster_distance
+                if style.cluster_threshold is not None:
+                    threshold = style.cluster_threshold
+        if not threshold:
+            # Clustering disabled
+            return None
+
+        # Extract the locations
+        fields = ["id", "%slat" % selector, "%slon" % selector]
+        if attribute:
+            try:
+                rfield = resource.resolve_selector(attribute)
+            except (AttributeError, SyntaxError):
+                rfield = None
+            if rfield and rfield.field:
+                fields.append(attribute)
+            else:
+                # Not a field (e.g. a style attribute) => ignore
+                attribute = None
+        data = resource.select(fields,
+                               limit = None,
+                               raw_data = True,
+                               represent = False,
+                               )
+        colnames = [resource.resolve_selector(f).colname for f in fields]
+
+        # Map size in pixels at this zoom level (256px tiles)
+        size = 256.0 * (1 << zoom)
+        max_lat = 85.0511287798066
+
+        cells = {}
+        seen = set()
+        for row in data.rows:
+            raw = row["_row"]
+            record_id = raw[colnames[0]]
+            lat = raw[colnames[1]]
+            lon = raw[colnames[2]]
+            if lat is None or lon is None or record_id in seen:
+                continue
+            seen.add(record_id)
+            value = raw[colnames[3]] if attribute else None
+            if value is not None and \
+               not isinstance(value, (basestring, int, float, bool)):
+                value = s3_str(value)
+
+            # Grid cell (Spherical Mercator pixels)
+            y = math.radians(max(min(lat, max_lat), -max_lat))
+            px = (lon + 180.0) / 360.0 * size
+            py = (1.0 - math.log(math.tan(y) + 1.0 / math.cos(y)) / math.pi) / 2.0 * size
+            key = (int(px // distance), int(py // distance), value)
+
+            cell = cells.get(key)
+            if cell is None:
+                cell = cells[key] = [0, 0.0, 0.0, []]
+            cell[0] += 1
+            cell[1] += lon
+            cell[2] += lat
+            if cell[0] < threshold:
+                cell[3].append((record_id, lon, lat))
+
+        features = []
+        append = features.append
+        for key, (count, lon_sum, lat_sum, members) in cells.items():
+            value = key[2]
+            if count >= threshold:
+                properties = {"count": count,
+                              "cluster": 1,
+                              }
+                if attribute:
+                    properties[attribute] = value
+                append({"type": "Feature",
+                        "geometry": {"type": "Point",
+                                     "coordinates": [round(lon_sum / count, 6),
+                                                     round(lat_sum / count, 6),
+                                                     ],
+                                     },
+                        "properties": properties,
+                        })
+            else:
+                for record_id, lon, lat in members:
+                    properties = {"id": record_id}
+                    if attribute:
+                        properties[attribute] = value
+                    append({"type": "Feature",
+                            "id": record_id,
+                            "geometry": {"type": "Point",
+                                         "coordinates": [lon, lat],
+                                         },
+                            "properties": properties,
+                            })
+
+        return {"type": "FeatureCollection",
+                "features": features,
+                }
+
     # -------------------------------------------------------------------------
     @staticmethod
     def get_marker(controller=None,
@@ -2909,59 +4258,384 @@ class GIS(object):
 
         marker = None
         if controller and function:
-            # Lookup marker in the gis_style table
+            # Lookup marker in the (cached) Feature Layer styles
+            layers = [layer for layer in GIS.get_feature_styles(controller, function)
+                      if not layer["aggregate"]]
+            if filter:
+                layers = [layer for layer in layers if layer["filter"] == filter]
+            if len(layers) > 1:
+                layers = [layer for layer in layers if layer["style_default"]]
+            if len(layers) == 1:
+                # Copy, so callers can't modify the cached marker
+                _marker = layers[0]["marker"]
+                if _marker:
+                    marker = dict(_marker)
+            # else: Can't differentiate
+
+        if not marker:
+            # Default
+            marker = Marker().as_dict()
+
+        return marker
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def get_marker_metadata():
+        """
+            Get the image, height and width of all markers, from the
+            cross-request cache (see config_cache), to look up markers
+            without a query per feature or layer
+
+            NB the returned structure is shared, so must not be modified
+
+            @returns: dict {"id": {marker_id: marker},
+                            "name": {name: marker},
+                            "image": {image: marker},
+                            }, where marker is a dict with
+                      image, height and width
+        """
+
+        def build():
+            table = current.s3db.gis_marker
+            rows = current.db(table.deleted == False).select(table.id,
+                                                             table.name,
+                                                             table.image,
+                                                             table.height,
+                                                             table.width,
+                                                             )
+            by_id = {}
+            by_name = {}
+            by_image = {}
+            for row in rows:
+                image = row.image
+                if not image:
+                    continue
+                marker = {"image": image,
+                          "height": row.height,
+                          "width": row.width,
+                          }
+                by_id[row.id] = by_name[row.name] = marker
+                by_image.setdefault(image, marker)
+
+            return {"id": by_id,
+                    "name": by_name,
+                    "image": by_image,
+                    }
+
+        return GIS.config_cache("markers", build)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def get_feature_styles(controller, function):
+        """
+            Get the marker definitions of all Feature Layers for a
+            controller/function, from the cross-request cache (see
+            config_cache)
+
+            - rule-based styles are parsed into marker rules, resolving
+              the externalGraphic of each rule against gis_marker
+
+            @param controller: the controller
+            @param function: the function
+
+            @returns: list of layer dicts with the keys:
+                      layer_id, filter, style_default, aggregate,
+                      marker: the layer marker (or None),
+                      rules: list of rules (kind, prop, value, high, marker),
+                             where kind is "cat" or "range",
+                      fallback: the marker of the fallback rule (or None)
+        """
+
+        config = GIS.get_config()
+        config_id = config.id if config else None
+
+        # Marker metadata (cached separately)
+        metadata = GIS.get_marker_metadata()
+
+        def build():
             db = current.db
             s3db = current.s3db
             ftable = s3db.gis_layer_feature
             stable = s3db.gis_style
-            mtable = s3db.gis_marker
-            config = GIS.get_config()
+
             query = (ftable.controller == controller) & \
                     (ftable.function == function) & \
-                    (ftable.aggregate == False)
-            left = (stable.on((stable.layer_id == ftable.layer_id) & \
-                              (stable.record_id == None) & \
-                              ((stable.config_id == config.id) | \
-                               (stable.config_id == None))),
-                    mtable.on(mtable.id == stable.marker_id),
-                    )
-            if filter:
-                query &= (ftable.filter == filter)
+                    (ftable.deleted == False)
+            left = stable.on((stable.layer_id == ftable.layer_id) & \
+                             (stable.record_id == None) & \
+                             (stable.aggregate != True) & \
+                             ((stable.config_id == config_id) | \
+                              (stable.config_id == None)) & \
+                             (stable.deleted == False))
             if current.deployment_settings.get_database_type() == "postgres":
                 # None is last
-                orderby = stable.config_id
+                orderby = ftable.id | stable.config_id
             else:
                 # None is 1st
-                orderby = ~stable.config_id
-            layers = db(query).select(mtable.image,
-                                      mtable.height,
-                                      mtable.width,
-                                      ftable.style_default,
-                                      stable.gps_marker,
-                                      left=left,
-                                      orderby=orderby)
-            if len(layers) > 1:
-                layers.exclude(lambda row: row["gis_layer_feature.style_default"] == False)
-            if len(layers) == 1:
-                layer = layers.first()
-            else:
-                # Can't differentiate
-                layer = None
+                orderby = ftable.id | ~stable.config_id
+            rows = db(query).select(ftable.layer_id,
+                                    ftable.filter,
+                                    ftable.style_default,
+                                    ftable.aggregate,
+                                    stable.marker_id,
+                                    stable.gps_marker,
+                                    stable.style,
+                                    left = left,
+                                    orderby = orderby,
+                                    )
 
-            if layer:
-                _marker = layer["gis_marker"]
-                if _marker.image:
-                    marker = {"image": _marker.image,
-                              "height": _marker.height,
-                              "width": _marker.width,
-                              "gps_marker": layer["gis_style"].gps_marker,
-                              }
+            by_id = metadata["id"]
+            by_image = metadata["image"]
+            prefix = "img/markers/"
 
-        if not marker:
-            # Default
-            marker = Marker().as_dict()
+            def add_gps_marker(marker, gps_marker):
+                if marker and gps_marker:
+                    marker = dict(marker, gps_marker=gps_marker)
+                return marker
 
-        return marker
+            layers = []
+            seen = set()
+            for row in rows:
+                layer = row.gis_layer_feature
+                if layer.layer_id in seen:
+                    # Config-specific style already found
+                    continue
+                seen.add(layer.layer_id)
+
+                style = row.gis_style
+                gps_marker = style.gps_marker
+                marker = add_gps_marker(by_id.get(style.marker_id), gps_marker)
+
+                rules = []
+                fallback = None
+                definition = style.style
+                if isinstance(definition, list):
+                    for rule in definition:
+                        if not isinstance(rule, dict):
+                            continue
+                        graphic = rule.get("externalGraphic")
+                        if not graphic or not graphic.startswith(prefix):
+                            # Served from elsewhere, can't be used as marker
+                            continue
+                        rule_marker = by_image.get(graphic[len(prefix):])
+                        if not rule_marker:
+                            continue
+                        rule_marker = add_gps_marker(rule_marker, gps_marker)
+                        if "fallback" in rule:
+                            fallback = rule_marker
+                            continue
+                        prop = rule.get("prop") or "value"
+                        if "cat" in rule:
+                            rules.append(("cat", prop, s3_str(rule["cat"]), None, rule_marker))
+                        else:
+                            try:
+                                low = rule.get("low")
+                                low = float(low) if low is not None else None
+                                high = rule.get("high")
+                                high = float(high) if high is not None else None
+                            except (TypeError, ValueError):
+                                continue
+                            rules.append(("range", prop, low, high, rule_marker))
+
+                layers.append({"layer_id": layer.layer_id,
+                               "filter": layer.filter,
+                               "style_default": layer.style_default,
+                               "aggregate": layer.aggregate,
+                               "marker": marker,
+                               "rules": rules,
+                               "fallback": fallback,
+                               })
+            return layers
+
+        key = "feature_styles_%s_%s_%s" % (controller, function, config_id)
+        return GIS.config_cache(key, build)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def get_markers(resource, layer_id=None):
+        """
+            Resolve the markers for all features of a resource in bulk,
+            from the styles of the Feature Layers of its table
+            - called by get_location_data() for exports
+
+            Records are assigned to layers by the layer filters (one query
+            per filtered layer), and the style rule attributes of all
+            records are extracted in a single select; rules are evaluated
+            once per distinct combination of attribute values.
+
+            @param resource: the S3Resource
+            @param layer_id: the layer_id of the Feature Layer to use
+                             (default: all layers for the table)
+
+            @returns: a single marker dict if all features have the same
+                      marker, otherwise a dict {record_id: marker}
+        """
+
+        default = Marker().as_dict()
+
+        c, f = resource.tablename.split("_", 1)
+        layers = [layer for layer in GIS.get_feature_styles(c, f)
+                  if not layer["aggregate"]]
+        if layer_id:
+            selected = [layer for layer in layers
+                        if str(layer["layer_id"]) == str(layer_id)]
+            if selected:
+                layers = selected
+
+        # Layer for all records not matching any layer filter
+        base = None
+        filtered = []
+        for layer in layers:
+            if layer["filter"] and len(layers) > 1:
+                filtered.append(layer)
+            elif base is None or \
+                 layer["style_default"] and not base["style_default"]:
+                base = layer
+
+        if not filtered:
+            if base is None:
+                return default
+            if not base["rules"]:
+                # Same marker for all features
+                return base["marker"] or default
+            layers = [base]
+        elif base is not None:
+            layers = filtered + [base]
+        else:
+            layers = filtered
+
+        # Extract the rule attributes of all records
+        table = resource.table
+        pkey = str(table._id)
+        fields = [table._id.name]
+        colnames = {}
+        for layer in layers:
+            for rule in layer["rules"]:
+                prop = rule[1]
+                if prop in colnames:
+                    continue
+                try:
+                    rfield = resource.resolve_selector(prop)
+                except (AttributeError, KeyError, SyntaxError):
+                    rfield = None
+                if rfield is None or rfield.field is None:
+                    # Not a field (e.g. Stats/Theme value) => skip rule
+                    colnames[prop] = None
+                else:
+                    colnames[prop] = rfield.colname
+                    fields.append(prop)
+        data = resource.select(fields,
+                               limit = None,
+                               raw_data = True,
+                               represent = len(fields) > 1,
+                               show_links = False,
+                               )
+        rows = data.rows
+        record_ids = [row["_row"][pkey] for row in rows]
+
+        # Assign the records to the filtered layers
+        assigned = {}
+        if filtered and record_ids:
+            from s3compat import urlparse
+            s3db = current.s3db
+            for index, layer in enumerate(filtered):
+                filter_vars = Storage()
+                for k, v in urlparse.parse_qsl(layer["filter"]):
+                    if k in filter_vars:
+                        value = filter_vars[k]
+                        if not isinstance(value, list):
+                            value = filter_vars[k] = [value]
+                        value.append(v)
+                    else:
+                        filter_vars[k] = v
+                fresource = s3db.resource(resource.tablename,
+                                          id = record_ids,
+                                          vars = filter_vars,
+                                          )
+                ids = fresource.select([table._id.name],
+                                       limit = None,
+                                       getids = True,
+                                       ).ids
+                for record_id in ids:
+                    if record_id not in assigned:
+                        assigned[record_id] = index
+
+        # Resolve the markers, once per layer and attribute values
+        cols = [colname for colname in set(colnames.values()) if colname]
+        base_index = len(filtered) if base is not None else None
+        resolved = {}
+        markers = {}
+        for row in rows:
+            raw = row["_row"]
+            record_id = raw[pkey]
+            index = assigned.get(record_id, base_index)
+            if index is None:
+                markers[record_id] = default
+                continue
+
+            values = []
+            for colname in cols:
+                value = raw[colname]
+                if isinstance(value, list):
+                    value = tuple(value)
+                values.append(value)
+            try:
+                key = (index, tuple(values))
+                marker = resolved.get(key)
+            except TypeError:
+                # Unhashable value
+                key = marker = None
+            if marker is None:
+                marker = GIS.match_marker_rules(layers[index], colnames, row) or default
+                if key is not None:
+                    resolved[key] = marker
+            markers[record_id] = marker
+
+        if len(set(id(marker) for marker in markers.values())) == 1:
+            marker = next(iter(markers.values()))
+            if marker:
+                # Same marker for all features
+                return marker
+
+        return markers
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def match_marker_rules(layer, colnames, row):
+        """
+            Find the marker for a record from the style rules of a layer,
+            analogous to the OpenLayers filters of the map client (see
+            styleRules in s3.gis.js)
+
+            @param layer: the layer dict (from get_feature_styles)
+            @param colnames: the column names of the rule attributes {prop: colname}
+            @param row: the record (from resource.select with raw_data)
+
+            @returns: the marker dict, or None if the layer has no marker
+        """
+
+        raw = row["_row"]
+        for kind, prop, low, high, marker in layer["rules"]:
+            colname = colnames.get(prop)
+            if not colname:
+                continue
+            value = raw[colname]
+            if value is None:
+                continue
+            if kind == "cat":
+                # low is the category
+                if s3_str(value) == low or s3_str(row[colname]) == low:
+                    return marker
+            else:
+                try:
+                    value = float(value)
+                except (TypeError, ValueError):
+                    continue
+                if (low is None or value >= low) and \
+                   (high is None or value <= high):
+                    return marker
+
+        return layer["fallback"] or layer["marker"]
 
     # -------------------------------------------------------------------------
     @staticmethod
@@ -3753,7 +5427,8 @@ page.render('%(filename)s', {format: 'jpeg', quality: '100'});''' % \
     def import_admin_areas(self,
                            source="gadmv1",
                            countries=[],
-                           levels=["L0", "L1", "L2"]
+                           levels=["L0", "L1", "L2"],
+                           progress=None,
                           ):
         """
            Import Admin Boundaries into the Locations table
@@ -3764,49 +5439,306 @@ page.render('%(filename)s', {format: 'jpeg', quality: '100'});''' % \
                               defaults to all countries
            @param levels - Which levels of the hierarchy to import.
                            defaults to all 3 supported levels
+           @param progress - callback function progress(level, count) to
+                             report the number of features imported so far
         """
 
-        if source == "gadmv1":
-            try:
-                from osgeo import ogr
-            except:
-                current.log.error("Unable to import ogr. Please install python-gdal bindings: GDAL-1.8.1+")
-                return
+        if source not in ("gadmv1", "gadmv2"):
+            current.log.warning("Only GADM is currently supported")
+            return
+
+        try:
+            from osgeo import ogr
+        except ImportError:
+            current.log.error("Unable to import ogr. Please install python-gdal bindings: GDAL-1.8.1+")
+            return
 
+        if source == "gadmv1":
             if "L0" in levels:
-                self.import_gadm1_L0(ogr, countries=countries)
-            if "L1" in levels:
-                self.import_gadm1(ogr, "L1", countries=countries)
-            if "L2" in levels:
-                self.import_gadm1(ogr, "L2", countries=countries)
+                self.import_gadm1_L0(ogr, countries=countries, progress=progress)
+            for level in ("L1", "L2"):
+                if level in levels:
+                    self.import_gadm1(ogr, level,
+                                      countries = countries,
+                                      update_tree = False,
+                                      progress = progress,
+                                      )
+        else:
+            for level in ("L0", "L1", "L2"):
+                if level in levels:
+                    self.import_gadm2(ogr, level, countries=countries, progress=progress)
 
-            current.log.debug("All done!")
+        # Single update of the Location Tree for all levels
+        current.log.debug("Updating Location Tree...")
+        self.update_location_tree_batch()
+        current.db.commit()
 
-        elif source == "gadmv1":
-            try:
-                from osgeo import ogr
-            except:
-                current.log.error("Unable to import ogr. Please install python-gdal bindings: GDAL-1.8.1+")
-                return
+        current.log.debug("All done!")
 
-            if "L0" in levels:
-                self.import_gadm2(ogr, "L0", countries=countries)
-            if "L1" in levels:
-                self.import_gadm2(ogr, "L1", countries=countries)
-            if "L2" in levels:
-                self.import_gadm2(ogr, "L2", countries=countries)
+        # Precompute simplified polygons (async if-possible)
+        current.s3task.run_async("gis_update_simplified")
+
+        return
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def gadm_shapefile(folder, url, zipname, layername):
+        """
+            Download and unzip a GADM Shapefile, unless already available
+            - web2py/temp/<folder> (or the system temp folder) is used as cache
+
+            @param folder: the name of the cache folder (e.g. "GADMv1")
+            @param url: the URL to download the zip file from
+            @param zipname: the file name of the zip file
+            @param layername: the name of the Shapefile (without extension)
+
+            @returns: the path of the .shp file, or None if not available
+        """
 
-            current.log.debug("All done!")
+        import shutil
+        import zipfile
+
+        TEMP = os.path.join(os.getcwd(), "temp")
+        if not os.path.exists(TEMP):
+            import tempfile
+            TEMP = tempfile.gettempdir()
+        path = os.path.join(TEMP, folder)
+        if not os.path.exists(path):
+            try:
+                os.mkdir(path)
+            except OSError:
+                current.log.error("Unable to create temp folder %s!" % path)
+                return None
 
+        shapefile = os.path.join(path, "%s.shp" % layername)
+        if os.path.isfile(shapefile):
+            current.log.debug("Using existing file %s" % shapefile)
+            return shapefile
+
+        # Check if file has already been downloaded
+        filename = os.path.join(path, zipname)
+        if not os.path.isfile(filename):
+            # Download the file (streamed, these can be large)
+            current.log.debug("Downloading %s" % url)
+            try:
+                source = urlopen(url)
+                with open(filename, "wb") as target:
+                    shutil.copyfileobj(source, target)
+                source.close()
+            except (URLError, IOError) as exception:
+                current.log.error(exception)
+                if os.path.exists(filename):
+                    os.remove(filename)
+                return None
         else:
-            current.log.warning("Only GADM is currently supported")
+            current.log.debug("Using existing file %s" % filename)
+
+        # Unzip it
+        current.log.debug("Unzipping %s" % layername)
+        myfile = zipfile.ZipFile(filename)
+        prefix = "%s." % layername
+        for name in myfile.namelist():
+            if name.startswith(prefix):
+                myfile.extract(name, path)
+        myfile.close()
+
+        if not os.path.isfile(shapefile):
+            current.log.error("Zipfile contents don't seem correct!")
+            return None
+        return shapefile
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def ogr_features(ogr, filename, fields, encoding=None):
+        """
+            Read the features of a Shapefile lazily (one at a time)
+
+            @param ogr: the OGR Python module
+            @param filename: the path of the Shapefile
+            @param fields: the names of the attributes to read
+            @param encoding: the character encoding of the attributes,
+                             if not declared in the Shapefile
+
+            @returns: generator of tuples (attributes, wkt, gis_feature_type),
+                      where wkt and gis_feature_type are None for features
+                      without geometry
+        """
+
+        if encoding:
+            from osgeo import gdal
+            gdal.SetConfigOption("SHAPE_ENCODING", encoding)
+
+        current.log.debug("Opening %s" % filename)
+        ds = ogr.Open(filename)
+        if ds is None:
+            current.log.error("Open failed: %s" % filename)
             return
 
-        return
+        try:
+            lyr = ds.GetLayer(0)
+            lyr.ResetReading()
+            feat = lyr.GetNextFeature()
+            while feat is not None:
+                attributes = dict((fn, feat.GetField(fn)) for fn in fields)
+                geom = feat.GetGeometryRef()
+                if geom is None:
+                    wkt = gis_feature_type = None
+                else:
+                    wkt = geom.ExportToWkt()
+                    geom_type = wkt.split("(", 1)[0].strip().lower()
+                    gis_feature_type = GEOM_TYPES.get(geom_type)
+                yield attributes, wkt, gis_feature_type
+                feat = lyr.GetNextFeature()
+        finally:
+            # Close the shapefile
+            ds = None
+            if encoding:
+                gdal.SetConfigOption("SHAPE_ENCODING", None)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def import_locations(records,
+                         chunk_size=1000,
+                         processes=None,
+                         progress=None,
+                         commit=True,
+                         ):
+        """
+            Bulk-import a stream of locations
+            - centroids and bounds of the geometries are computed in a
+              process pool, in parallel with the database writes of the
+              previous chunks
+            - new locations are inserted, existing ones updated, in chunks
+            - the location tree is not updated, use update_location_tree_batch
+              after the import
+
+            @param records: iterable of dicts with gis_location field values,
+                            including "id" to update an existing location, and
+                            optionally "tags" {tag: value} to add as
+                            gis_location_tag
+            @param chunk_size: the number of records per chunk
+            @param processes: the number of worker processes (default: number
+                              of CPUs, 1 to compute everything in-process)
+            @param progress: callback function progress(count) to report
+                             the number of records imported so far
+            @param commit: commit after every chunk
+
+            @returns: the number of records imported
+        """
+
+        import itertools
+        from collections import deque
+
+        db = current.db
+        s3db = current.s3db
+        table = s3db.gis_location
+        ttable = s3db.gis_location_tag
+
+        spatialdb = current.deployment_settings.get_gis_spatialdb()
+        update = GIS._update_by_id
+        bounds = ("lon", "lat", "lon_min", "lat_min", "lon_max", "lat_max")
+
+        pool = None
+        if processes != 1:
+            try:
+                import multiprocessing
+                if not processes:
+                    processes = multiprocessing.cpu_count()
+                pool = multiprocessing.Pool(processes)
+            except (ImportError, NotImplementedError, OSError):
+                pool = None
+        if not pool:
+            processes = 1
+
+        def chunks():
+            iterator = iter(records)
+            while True:
+                chunk = list(itertools.islice(iterator, chunk_size))
+                if not chunk:
+                    break
+                yield chunk
+
+        def needs_centroid(record):
+            return record.get("wkt") and record.get("lat") is None
+
+        def write(chunk, centroids):
+            if pool:
+                centroids = centroids.get()
+            centroids = iter(centroids)
+
+            inserts = []
+            inserted_tags = []
+            updates = {}
+            tags = []
+            for record in chunk:
+                wkt = record.get("wkt")
+                if needs_centroid(record):
+                    centroid = next(centroids)
+                    if centroid is None:
+                        current.log.error("S3GIS: Unable to set bounds & centroid for feature %s" % \
+                                          record.get("name", record.get("id")))
+                    else:
+                        record.update(zip(bounds, centroid))
+                if spatialdb and wkt:
+                    record["the_geom"] = wkt
+                location_tags = record.pop("tags", None)
+                location_id = record.pop("id", None)
+                if location_id:
+                    for fieldname, value in record.items():
+                        updates.setdefault(fieldname, {})[location_id] = value
+                    if location_tags:
+                        tags.extend((location_id, tag, value)
+                                    for tag, value in location_tags.items())
+                else:
+                    inserts.append(record)
+                    inserted_tags.append(location_tags)
+
+            if inserts:
+                ids = table.bulk_insert(inserts)
+                for location_id, location_tags in zip(ids, inserted_tags):
+                    if location_tags:
+                        tags.extend((location_id, tag, value)
+                                    for tag, value in location_tags.items())
+            for fieldname, values in updates.items():
+                update(table, fieldname, values)
+            if tags:
+                ttable.bulk_insert([{"location_id": location_id,
+                                     "tag": tag,
+                                     "value": value,
+                                     } for location_id, tag, value in tags])
+            if commit:
+                db.commit()
+            return len(chunk)
+
+        count = 0
+        pending = deque()
+        try:
+            for chunk in chunks():
+                wkts = [record["wkt"] for record in chunk if needs_centroid(record)]
+                if pool:
+                    centroids = pool.apply_async(_get_centroids, (wkts,))
+                else:
+                    centroids = GIS.get_centroids(wkts)
+                pending.append((chunk, centroids))
+                # Keep all workers busy, but no more chunks in memory
+                if len(pending) > processes:
+                    count += write(*pending.popleft())
+                    if progress:
+                        progress(count)
+            while pending:
+                count += write(*pending.popleft())
+                if progress:
+                    progress(count)
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+        return count
 
     # -------------------------------------------------------------------------
     @staticmethod
-    def import_gadm1_L0(ogr, countries=[]):
+    def import_gadm1_L0(ogr, countries=[], progress=None):
         """
            Import L0 Admin Boundaries into the Locations table from GADMv1
            - designed to be called from import_admin_areas()
@@ -3815,6 +5747,7 @@ page.render('%(filename)s', {format: 'jpeg', quality: '100'});''' % \
            @param ogr - The OGR Python module
            @param countries - List of ISO2 countrycodes to download data for
                               defaults to all countries
+           @param progress - callback function progress(level, count)
         """
 
         db = current.db
@@ -3830,131 +5763,59 @@ page.render('%(filename)s', {format: 'jpeg', quality: '100'});''' % \
             "code2field" : "ISO"  # This field is used to uniquely identify the L0 for parenting the L1s
         }
 
-        # Copy the current working directory to revert back to later
-        cwd = os.getcwd()
-
-        # Create the working directory
-        TEMP = os.path.join(cwd, "temp")
-        if not os.path.exists(TEMP): # use web2py/temp/GADMv1 as a cache
-            import tempfile
-            TEMP = tempfile.gettempdir()
-        tempPath = os.path.join(TEMP, "GADMv1")
-        if not os.path.exists(tempPath):
-            try:
-                os.mkdir(tempPath)
-            except OSError:
-                current.log.error("Unable to create temp folder %s!" % tempPath)
-                return
-
-        # Set the current working directory
-        os.chdir(tempPath)
-
-        layerName = layer["shapefile"]
-
-        # Check if file has already been downloaded
-        fileName = layer["zipfile"]
-        if not os.path.isfile(fileName):
-            # Download the file
-            from gluon.tools import fetch
-            url = layer["url"]
-            current.log.debug("Downloading %s" % url)
-            try:
-                file = fetch(url)
-            except URLError as exception:
-                current.log.error(exception)
-                return
-            fp = StringIO(file)
-        else:
-            current.log.debug("Using existing file %s" % fileName)
-            fp = open(fileName)
-
-        # Unzip it
-        current.log.debug("Unzipping %s" % layerName)
-        import zipfile
-        myfile = zipfile.ZipFile(fp)
-        for ext in ("dbf", "prj", "sbn", "sbx", "shp", "shx"):
-            fileName = "%s.%s" % (layerName, ext)
-            file = myfile.read(fileName)
-            f = open(fileName, "w")
-            f.write(file)
-            f.close()
-        myfile.close()
-
-        # Use OGR to read Shapefile
-        current.log.debug("Opening %s.shp" % layerName)
-        ds = ogr.Open("%s.shp" % layerName)
-        if ds is None:
-            current.log.error("Open failed.\n")
-            return
-
-        lyr = ds.GetLayerByName(layerName)
+        shapefile = GIS.gadm_shapefile("GADMv1",
+                                       layer["url"],
+                                       layer["zipfile"],
+                                       layer["shapefile"],
+                                       )
+        if not shapefile:
+            return
 
-        lyr.ResetReading()
+        # Look up all countries at once
+        query = (table.id == ttable.location_id) & \
+                (table.level == "L0") & \
+                (table.deleted == False) & \
+                (ttable.tag == "ISO2") & \
+                (ttable.deleted == False)
+        rows = db(query).select(table.id, ttable.value)
+        L0s = dict((row["gis_location_tag.value"], row["gis_location.id"]) for row in rows)
 
         codeField = layer["codefield"]
         code2Field = layer["code2field"]
-        for feat in lyr:
-            code = feat.GetField(codeField)
-            if not code:
-                # Skip the entries which aren't countries
-                continue
-            if countries and code not in countries:
-                # Skip the countries which we're not interested in
-                continue
-
-            geom = feat.GetGeometryRef()
-            if geom is not None:
-                if geom.GetGeometryType() == ogr.wkbPoint:
-                    pass
-                else:
-                    query = (table.id == ttable.location_id) & \
-                            (ttable.tag == "ISO2") & \
-                            (ttable.value == code)
-                    wkt = geom.ExportToWkt()
-                    if wkt.startswith("LINESTRING"):
-                        gis_feature_type = 2
-                    elif wkt.startswith("POLYGON"):
-                        gis_feature_type = 3
-                    elif wkt.startswith("MULTIPOINT"):
-                        gis_feature_type = 4
-                    elif wkt.startswith("MULTILINESTRING"):
-                        gis_feature_type = 5
-                    elif wkt.startswith("MULTIPOLYGON"):
-                        gis_feature_type = 6
-                    elif wkt.startswith("GEOMETRYCOLLECTION"):
-                        gis_feature_type = 7
-                    code2 = feat.GetField(code2Field)
-                    #area = feat.GetField("Shape_Area")
-                    try:
-                        id = db(query).select(table.id,
-                                              limitby = (0, 1)).first().id
-                        query = (table.id == id)
-                        db(query).update(gis_feature_type=gis_feature_type,
-                                         wkt=wkt)
-                        ttable.insert(location_id = id,
-                                      tag = "ISO3",
-                                      value = code2)
-                        #ttable.insert(location_id = location_id,
-                        #              tag = "area",
-                        #              value = area)
-                    except db._adapter.driver.OperationalError:
-                        current.log.error(sys.exc_info()[1])
-
-            else:
-                current.log.debug("No geometry\n")
-
-        # Close the shapefile
-        ds.Destroy()
-
-        db.commit()
-
-        # Revert back to the working directory as before.
-        os.chdir(cwd)
 
+        def records():
+            features = GIS.ogr_features(ogr, shapefile, (codeField, code2Field))
+            for attributes, wkt, gis_feature_type in features:
+                code = attributes[codeField]
+                if not code:
+                    # Skip the entries which aren't countries
+                    continue
+                if countries and code not in countries:
+                    # Skip the countries which we're not interested in
+                    continue
+                if wkt is None:
+                    current.log.debug("No geometry\n")
+                    continue
+                if gis_feature_type == 1:
+                    continue
+                location_id = L0s.get(code)
+                if not location_id:
+                    continue
+                yield {"id": location_id,
+                       "gis_feature_type": gis_feature_type,
+                       "wkt": wkt,
+                       "tags": {"ISO3": attributes[code2Field]},
+                       }
+
+        GIS.import_locations(records(),
+                             chunk_size = 50,
+                             progress = (lambda count: progress("L0", count)) \
+                                        if progress else None,
+                             )
         return
 
     # -------------------------------------------------------------------------
-    def import_gadm1(self, ogr, level="L1", countries=[]):
+    def import_gadm1(self, ogr, level="L1", countries=[], update_tree=True, progress=None):
         """
             Import L1 Admin Boundaries into the Locations table from GADMv1
             - designed to be called from import_admin_areas()
@@ -3964,6 +5825,9 @@ page.render('%(filename)s', {format: 'jpeg', quality: '100'});''' % \
             @param level - "L1" or "L2"
             @param countries - List of ISO2 countrycodes to download data for
                                defaults to all countries
+            @param update_tree - update the location tree after the import
+                                 (import_admin_areas does it once at the end)
+            @param progress - callback function progress(level, count)
         """
 
         if level == "L1":
@@ -3998,334 +5862,102 @@ page.render('%(filename)s', {format: 'jpeg', quality: '100'});''' % \
             current.log.warning("Level %s not supported!" % level)
             return
 
-        import csv
-        import shutil
-        import zipfile
-
         db = current.db
         s3db = current.s3db
-        cache = s3db.cache
         table = s3db.gis_location
         ttable = s3db.gis_location_tag
 
-        csv.field_size_limit(2**20 * 100)  # 100 megs
-
         # Not all the data is encoded like this
         # (unable to determine encoding - appears to be damaged in source):
         # Azerbaijan L1
         # Vietnam L1 & L2
         ENCODING = "cp1251"
 
-        # from http://docs.python.org/library/csv.html#csv-examples
-        # TODO rewrite for Py3
-        def latin_csv_reader(unicode_csv_data, dialect=csv.excel, **kwargs):
-            for row in csv.reader(unicode_csv_data):
-                yield [unicode(cell, ENCODING) for cell in row]
-
-        # TODO rewrite for Py3
-        def latin_dict_reader(data, dialect=csv.excel, **kwargs):
-            reader = latin_csv_reader(data, dialect=dialect, **kwargs)
-            headers = reader.next()
-            for r in reader:
-                yield dict(zip(headers, r))
-
-        # Copy the current working directory to revert back to later
-        cwd = os.getcwd()
-
-        # Create the working directory
-        TEMP = os.path.join(cwd, "temp")
-        if not os.path.exists(TEMP): # use web2py/temp/GADMv1 as a cache
-            import tempfile
-            TEMP = tempfile.gettempdir()
-        tempPath = os.path.join(TEMP, "GADMv1")
-        if not os.path.exists(tempPath):
-            try:
-                os.mkdir(tempPath)
-            except OSError:
-                current.log.error("Unable to create temp folder %s!" % tempPath)
-                return
-
-        # Set the current working directory
-        os.chdir(tempPath)
-
-        # Remove any existing CSV folder to allow the new one to be created
-        try:
-            shutil.rmtree("CSV")
-        except OSError:
-            # Folder doesn't exist, so should be creatable
-            pass
-
-        layerName = layer["shapefile"]
-
-        # Check if file has already been downloaded
-        fileName = layer["zipfile"]
-        if not os.path.isfile(fileName):
-            # Download the file
-            from gluon.tools import fetch
-            url = layer["url"]
-            current.log.debug("Downloading %s" % url)
-            try:
-                file = fetch(url)
-            except URLError as exception:
-                current.log.error(exception)
-                # Revert back to the working directory as before.
-                os.chdir(cwd)
-                return
-            fp = StringIO(file)
-        else:
-            current.log.debug("Using existing file %s" % fileName)
-            fp = open(fileName)
-
-        # Unzip it
-        current.log.debug("Unzipping %s" % layerName)
-        myfile = zipfile.ZipFile(fp)
-        for ext in ("dbf", "prj", "sbn", "sbx", "shp", "shx"):
-            fileName = "%s.%s" % (layerName, ext)
-            file = myfile.read(fileName)
-            f = open(fileName, "w")
-            f.write(file)
-            f.close()
-        myfile.close()
-
-        # Convert to CSV
-        current.log.debug("Converting %s.shp to CSV" % layerName)
-        # Simplified version of generic Shapefile Importer:
-        # http://svn.osgeo.org/gdal/trunk/gdal/swig/python/samples/ogr2ogr.py
-        bSkipFailures = False
-        nGroupTransactions = 200
-        nFIDToFetch = ogr.NullFID
-        inputFileName = "%s.shp" % layerName
-        inputDS = ogr.Open(inputFileName, False)
-        outputFileName = "CSV"
-        outputDriver = ogr.GetDriverByName("CSV")
-        outputDS = outputDriver.CreateDataSource(outputFileName, options=[])
-        # GADM only has 1 layer/source
-        inputLayer = inputDS.GetLayer(0)
-        inputFDefn = inputLayer.GetLayerDefn()
-        # Create the output Layer
-        outputLayer = outputDS.CreateLayer(layerName)
-        # Copy all Fields
-        #papszFieldTypesToString = []
-        inputFieldCount = inputFDefn.GetFieldCount()
-        panMap = [-1] * inputFieldCount
-        outputFDefn = outputLayer.GetLayerDefn()
-        nDstFieldCount = 0
-        if outputFDefn is not None:
-            nDstFieldCount = outputFDefn.GetFieldCount()
-        for iField in range(inputFieldCount):
-            inputFieldDefn = inputFDefn.GetFieldDefn(iField)
-            oFieldDefn = ogr.FieldDefn(inputFieldDefn.GetNameRef(),
-                                       inputFieldDefn.GetType())
-            oFieldDefn.SetWidth(inputFieldDefn.GetWidth())
-            oFieldDefn.SetPrecision(inputFieldDefn.GetPrecision())
-            # The field may have been already created at layer creation
-            iDstField = -1
-            if outputFDefn is not None:
-                iDstField = outputFDefn.GetFieldIndex(oFieldDefn.GetNameRef())
-            if iDstField >= 0:
-                panMap[iField] = iDstField
-            elif outputLayer.CreateField(oFieldDefn) == 0:
-                # now that we've created a field, GetLayerDefn() won't return NULL
-                if outputFDefn is None:
-                    outputFDefn = outputLayer.GetLayerDefn()
-                panMap[iField] = nDstFieldCount
-                nDstFieldCount = nDstFieldCount + 1
-        # Transfer features
-        nFeaturesInTransaction = 0
-        #iSrcZField = -1
-        inputLayer.ResetReading()
-        if nGroupTransactions > 0:
-            outputLayer.StartTransaction()
-        while True:
-            poDstFeature = None
-            if nFIDToFetch != ogr.NullFID:
-                # Only fetch feature on first pass.
-                if nFeaturesInTransaction == 0:
-                    poFeature = inputLayer.GetFeature(nFIDToFetch)
-                else:
-                    poFeature = None
-            else:
-                poFeature = inputLayer.GetNextFeature()
-            if poFeature is None:
-                break
-            nParts = 0
-            nIters = 1
-            for iPart in range(nIters):
-                nFeaturesInTransaction = nFeaturesInTransaction + 1
-                if nFeaturesInTransaction == nGroupTransactions:
-                    outputLayer.CommitTransaction()
-                    outputLayer.StartTransaction()
-                    nFeaturesInTransaction = 0
-                poDstFeature = ogr.Feature(outputLayer.GetLayerDefn())
-                if poDstFeature.SetFromWithMap(poFeature, 1, panMap) != 0:
-                    if nGroupTransactions > 0:
-                        outputLayer.CommitTransaction()
-                    current.log.error("Unable to translate feature %d from layer %s" % \
-                                (poFeature.GetFID(), inputFDefn.GetName()))
-                    # Revert back to the working directory as before.
-                    os.chdir(cwd)
-                    return
-                poDstGeometry = poDstFeature.GetGeometryRef()
-                if poDstGeometry is not None:
-                    if nParts > 0:
-                        # For -explodecollections, extract the iPart(th) of the geometry
-                        poPart = poDstGeometry.GetGeometryRef(iPart).Clone()
-                        poDstFeature.SetGeometryDirectly(poPart)
-                        poDstGeometry = poPart
-                if outputLayer.CreateFeature(poDstFeature) != 0 and \
-                   not bSkipFailures:
-                    if nGroupTransactions > 0:
-                        outputLayer.RollbackTransaction()
-                    # Revert back to the working directory as before.
-                    os.chdir(cwd)
-                    return
-        if nGroupTransactions > 0:
-            outputLayer.CommitTransaction()
-        # Cleanup
-        outputDS.Destroy()
-        inputDS.Destroy()
-
-        fileName = "%s.csv" % layerName
-        filePath = os.path.join("CSV", fileName)
-        os.rename(filePath, fileName)
-        os.removedirs("CSV")
-
-        # Use OGR to read SHP for geometry
-        current.log.debug("Opening %s.shp" % layerName)
-        ds = ogr.Open("%s.shp" % layerName)
-        if ds is None:
-            current.log.debug("Open failed.\n")
-            # Revert back to the working directory as before.
-            os.chdir(cwd)
+        shapefile = GIS.gadm_shapefile("GADMv1",
+                                       layer["url"],
+                                       layer["zipfile"],
+                                       layer["shapefile"],
+                                       )
+        if not shapefile:
             return
 
-        lyr = ds.GetLayerByName(layerName)
-
-        lyr.ResetReading()
-
-        # Use CSV for Name
-        current.log.debug("Opening %s.csv" % layerName)
-        rows = latin_dict_reader(open("%s.csv" % layerName))
-
         nameField = layer["namefield"]
         sourceCodeField = layer["sourceCodeField"]
         edenCodeField = layer["edenCodeField"]
         parentSourceCodeField = layer["parentSourceCodeField"]
         parentLevel = layer["parent"]
         parentEdenCodeField = layer["parentEdenCodeField"]
-        parentCodeQuery = (ttable.tag == parentEdenCodeField)
-        count = 0
-        for row in rows:
-            # Read Attributes
-            feat = lyr[count]
-
-            parentCode = feat.GetField(parentSourceCodeField)
-            query = (table.level == parentLevel) & \
-                    parentCodeQuery & \
-                    (ttable.value == parentCode)
-            parent = db(query).select(table.id,
-                                      ttable.value,
-                                      limitby = (0, 1),
-                                      cache=cache).first()
-            if not parent:
-                # Skip locations for which we don't have a valid parent
-                current.log.warning("Skipping - cannot find parent with key: %s, value: %s" % \
-                            (parentEdenCodeField, parentCode))
-                count += 1
-                continue
-
-            if countries:
-                # Skip the countries which we're not interested in
-                if level == "L1":
-                    if parent["gis_location_tag"].value not in countries:
-                        #current.log.warning("Skipping %s as not in countries list" % parent["gis_location_tag"].value)
-                        count += 1
-                        continue
-                else:
-                    # Check grandparent
-                    country = self.get_parent_country(parent.id,
-                                                      key_type="code")
-                    if country not in countries:
-                        count += 1
-                        continue
 
-            # This is got from CSV in order to be able to handle the encoding
-            name = row.pop(nameField)
-            name.encode("utf8")
-
-            code = feat.GetField(sourceCodeField)
-            #area = feat.GetField("Shape_Area")
-
-            geom = feat.GetGeometryRef()
-            if geom is not None:
-                if geom.GetGeometryType() == ogr.wkbPoint:
-                    lat = geom.GetX()
-                    lon = geom.GetY()
-                    id = table.insert(name=name,
-                                      level=level,
-                                      gis_feature_type=1,
-                                      lat=lat,
-                                      lon=lon,
-                                      parent=parent.id)
-                    ttable.insert(location_id = id,
-                                  tag = edenCodeField,
-                                  value = code)
-                    # ttable.insert(location_id = id,
-                                  # tag = "area",
-                                  # value = area)
-                else:
-                    wkt = geom.ExportToWkt()
-                    if wkt.startswith("LINESTRING"):
-                        gis_feature_type = 2
-                    elif wkt.startswith("POLYGON"):
-                        gis_feature_type = 3
-                    elif wkt.startswith("MULTIPOINT"):
-                        gis_feature_type = 4
-                    elif wkt.startswith("MULTILINESTRING"):
-                        gis_feature_type = 5
-                    elif wkt.startswith("MULTIPOLYGON"):
-                        gis_feature_type = 6
-                    elif wkt.startswith("GEOMETRYCOLLECTION"):
-                        gis_feature_type = 7
-                    id = table.insert(name=name,
-                                      level=level,
-                                      gis_feature_type=gis_feature_type,
-                                      wkt=wkt,
-                                      parent=parent.id)
-                    ttable.insert(location_id = id,
-                                  tag = edenCodeField,
-                                  value = code)
-                    # ttable.insert(location_id = id,
-                                  # tag = "area",
-                                  # value = area)
-            else:
-                current.log.debug("No geometry\n")
+        # Look up all parents at once: {code: (parent_id, L0 id)}
+        query = (table.id == ttable.location_id) & \
+                (table.level == parentLevel) & \
+                (table.deleted == False) & \
+                (ttable.tag == parentEdenCodeField) & \
+                (ttable.deleted == False)
+        rows = db(query).select(table.id, table.parent, ttable.value)
+        parents = {}
+        for row in rows:
+            location = row["gis_location"]
+            L0 = location.id if parentLevel == "L0" else location.parent
+            parents[row["gis_location_tag.value"]] = (location.id, L0)
 
-            count += 1
+        if countries:
+            # ISO2 codes of the countries
+            query = (table.id == ttable.location_id) & \
+                    (table.level == "L0") & \
+                    (ttable.tag == "ISO2") & \
+                    (ttable.deleted == False)
+            rows = db(query).select(table.id, ttable.value)
+            iso2 = dict((row["gis_location.id"], row["gis_location_tag.value"]) for row in rows)
+
+        def records():
+            features = GIS.ogr_features(ogr,
+                                        shapefile,
+                                        (nameField, sourceCodeField, parentSourceCodeField),
+                                        encoding = ENCODING,
+                                        )
+            for attributes, wkt, gis_feature_type in features:
+
+                parentCode = attributes[parentSourceCodeField]
+                parent = parents.get(s3_str(parentCode))
+                if not parent:
+                    # Skip locations for which we don't have a valid parent
+                    current.log.warning("Skipping - cannot find parent with key: %s, value: %s" % \
+                                        (parentEdenCodeField, parentCode))
+                    continue
+                parent_id, L0 = parent
 
-        # Close the shapefile
-        ds.Destroy()
+                if countries and iso2.get(L0) not in countries:
+                    # Skip the countries which we're not interested in
+                    continue
 
-        db.commit()
+                if wkt is None:
+                    current.log.debug("No geometry\n")
+                    continue
 
-        current.log.debug("Updating Location Tree...")
-        try:
-            self.update_location_tree()
-        except MemoryError:
-            # If doing all L2s, it can break memory limits
-            # @ToDo: Check now that we're doing by level
-            current.log.critical("Memory error when trying to update_location_tree()!")
+                yield {"name": attributes[nameField],
+                       "level": level,
+                       "gis_feature_type": gis_feature_type,
+                       "wkt": wkt,
+                       "parent": parent_id,
+                       "tags": {edenCodeField: attributes[sourceCodeField]},
+                       }
 
-        db.commit()
+        self.import_locations(records(),
+                              progress = (lambda count: progress(level, count)) \
+                                         if progress else None,
+                              )
 
-        # Revert back to the working directory as before.
-        os.chdir(cwd)
+        if update_tree:
+            current.log.debug("Updating Location Tree...")
+            self.update_location_tree_batch()
+            db.commit()
 
         return
 
     # -------------------------------------------------------------------------
     @staticmethod
-    def import_gadm2(ogr, level="L0", countries=[]):
+    def import_gadm2(ogr, level="L0", countries=[], progress=None):
         """
             Import Admin Boundaries into the Locations table from GADMv2
             - designed to be called from import_admin_areas()
@@ -4335,6 +5967,7 @@ page.render('%(filename)s', {format: 'jpeg', quality: '100'});''' % \
             @param level - The OGR Python module
             @param countries - List of ISO2 countrycodes to download data for
                                defaults to all countries
+            @param progress - callback function progress(level, count)
 
             @ToDo: Complete this
                 - not currently possible to get all data from the 1 file easily
@@ -4347,150 +5980,69 @@ page.render('%(filename)s', {format: 'jpeg', quality: '100'});''' % \
         if level == "L0":
             codeField = "ISO2"   # This field is used to uniquely identify the L0 for updates
             code2Field = "ISO"   # This field is used to uniquely identify the L0 for parenting the L1s
-        elif level == "L1":
-            #nameField = "NAME_1"
-            codeField = "ID_1"   # This field is used to uniquely identify the L1 for updates
-            code2Field = "ISO"   # This field is used to uniquely identify the L0 for parenting the L1s
-            #parent = "L0"
-            #parentCode = "code2"
-        elif level == "L2":
-            #nameField = "NAME_2"
-            codeField = "ID_2"   # This field is used to uniquely identify the L2 for updates
-            code2Field = "ID_1"  # This field is used to uniquely identify the L1 for parenting the L2s
-            #parent = "L1"
-            #parentCode = "code"
         else:
+            # L1/L2 need a way to match the GADMv2 IDs (see @ToDo)
             current.log.error("Level %s not supported!" % level)
             return
 
         db = current.db
         s3db = current.s3db
         table = s3db.gis_location
+        ttable = s3db.gis_location_tag
 
-        url = "http://gadm.org/data2/gadm_v2_shp.zip"
-        zipfile = "gadm_v2_shp.zip"
-        shapefile = "gadm2"
-
-        # Copy the current working directory to revert back to later
-        old_working_directory = os.getcwd()
-
-        # Create the working directory
-        if os.path.exists(os.path.join(os.getcwd(), "temp")): # use web2py/temp/GADMv2 as a cache
-            TEMP = os.path.join(os.getcwd(), "temp")
-        else:
-            import tempfile
-            TEMP = tempfile.gettempdir()
-        tempPath = os.path.join(TEMP, "GADMv2")
-        try:
-            os.mkdir(tempPath)
-        except OSError:
-            # Folder already exists - reuse
-            pass
-
-        # Set the current working directory
-        os.chdir(tempPath)
-
-        layerName = shapefile
-
-        # Check if file has already been downloaded
-        fileName = zipfile
-        if not os.path.isfile(fileName):
-            # Download the file
-            from gluon.tools import fetch
-            current.log.debug("Downloading %s" % url)
-            try:
-                file = fetch(url)
-            except URLError as exception:
-                current.log.error(exception)
-                return
-            fp = StringIO(file)
-        else:
-            current.log.debug("Using existing file %s" % fileName)
-            fp = open(fileName)
-
-        # Unzip it
-        current.log.debug("Unzipping %s" % layerName)
-        import zipfile
-        myfile = zipfile.ZipFile(fp)
-        for ext in ("dbf", "prj", "sbn", "sbx", "shp", "shx"):
-            fileName = "%s.%s" % (layerName, ext)
-            file = myfile.read(fileName)
-            f = open(fileName, "w")
-            f.write(file)
-            f.close()
-        myfile.close()
-
-        # Use OGR to read Shapefile
-        current.log.debug("Opening %s.shp" % layerName)
-        ds = ogr.Open("%s.shp" % layerName)
-        if ds is None:
-            current.log.debug("Open failed.\n")
+        shapefile = GIS.gadm_shapefile("GADMv2",
+                                       "http://gadm.org/data2/gadm_v2_shp.zip",
+                                       "gadm_v2_shp.zip",
+                                       "gadm2",
+                                       )
+        if not shapefile:
             return
 
-        lyr = ds.GetLayerByName(layerName)
-
-        lyr.ResetReading()
-
-        for feat in lyr:
-            code = feat.GetField(codeField)
-            if not code:
-                # Skip the entries which aren't countries
-                continue
-            if countries and code not in countries:
-                # Skip the countries which we're not interested in
-                continue
-
-            geom = feat.GetGeometryRef()
-            if geom is not None:
-                if geom.GetGeometryType() == ogr.wkbPoint:
-                    pass
-                else:
-                    ## FIXME
-                    ##query = (table.code == code)
-                    wkt = geom.ExportToWkt()
-                    if wkt.startswith("LINESTRING"):
-                        gis_feature_type = 2
-                    elif wkt.startswith("POLYGON"):
-                        gis_feature_type = 3
-                    elif wkt.startswith("MULTIPOINT"):
-                        gis_feature_type = 4
-                    elif wkt.startswith("MULTILINESTRING"):
-                        gis_feature_type = 5
-                    elif wkt.startswith("MULTIPOLYGON"):
-                        gis_feature_type = 6
-                    elif wkt.startswith("GEOMETRYCOLLECTION"):
-                        gis_feature_type = 7
-                    #code2 = feat.GetField(code2Field)
-                    #area = feat.GetField("Shape_Area")
-                    try:
-                        ## FIXME
-                        db(query).update(gis_feature_type=gis_feature_type,
-                                         wkt=wkt)
-                                         #code2=code2,
-                                         #area=area
-                    except db._adapter.driver.OperationalError as exception:
-                        current.log.error(exception)
-
-            else:
-                current.log.debug("No geometry\n")
-
-        # Close the shapefile
-        ds.Destroy()
-
-        db.commit()
-
-        # Revert back to the working directory as before.
-        os.chdir(old_working_directory)
-
+        # Look up all countries at once
+        query = (table.id == ttable.location_id) & \
+                (table.level == "L0") & \
+                (table.deleted == False) & \
+                (ttable.tag == "ISO2") & \
+                (ttable.deleted == False)
+        rows = db(query).select(table.id, ttable.value)
+        L0s = dict((row["gis_location_tag.value"], row["gis_location.id"]) for row in rows)
+
+        def records():
+            features = GIS.ogr_features(ogr, shapefile, (codeField, code2Field))
+            for attributes, wkt, gis_feature_type in features:
+                code = attributes[codeField]
+                if not code:
+                    # Skip the entries which aren't countries
+                    continue
+                if countries and code not in countries:
+                    # Skip the countries which we're not interested in
+                    continue
+                if wkt is None:
+                    current.log.debug("No geometry\n")
+                    continue
+                location_id = L0s.get(code)
+                if not location_id or gis_feature_type == 1:
+                    continue
+                yield {"id": location_id,
+                       "gis_feature_type": gis_feature_type,
+                       "wkt": wkt,
+                       }
+
+        GIS.import_locations(records(),
+                             chunk_size = 50,
+                             progress = (lambda count: progress(level, count)) \
+                                        if progress else None,
+                             )
         return
 
     # -------------------------------------------------------------------------
-    def import_geonames(self, country, level=None):
+    def import_geonames(self, country, level=None, progress=None):
         """
             Import Locations from the Geonames database
 
             @param country: the 2-letter country code
             @param level: the ADM level to import
+            @param progress: callback function progress(level, count)
 
             Designed to be run from the CLI
             Levels should be imported sequentially.
@@ -4515,11 +6067,8 @@ page.render('%(filename)s', {format: 'jpeg', quality: '100'});''' % \
 
         db = current.db
         s3db = current.s3db
-        #cache = s3db.cache
         request = current.request
-        #settings = current.deployment_settings
         table = s3db.gis_location
-        ttable = s3db.gis_location_tag
 
         url = "http://download.geonames.org/export/dump/" + country + ".zip"
 
@@ -4564,10 +6113,6 @@ page.render('%(filename)s', {format: 'jpeg', quality: '100'});''' % \
                     myfile.close()
                     return
 
-        f = codecs.open(filepath, encoding="utf-8")
-        # Downloaded file is worth keeping
-        #os.remove(filepath)
-
         if level == "L1":
             fc = "ADM1"
             parent_level = "L0"
@@ -4616,80 +6161,77 @@ page.render('%(filename)s', {format: 'jpeg', quality: '100'});''' % \
                                            table.lat_max,
                                            table.id)
 
-        # Parse File
-        current_row = 0
-        for line in f:
-            current_row += 1
-            # Format of file: http://download.geonames.org/export/dump/readme.txt
-            geonameid, \
-            name, \
-            asciiname, \
-            alternatenames, \
-            lat, \
-            lon, \
-            feature_class, \
-            feature_code, \
-            country_code, \
-            cc2, \
-            admin1_code, \
-            admin2_code, \
-            admin3_code, \
-            admin4_code, \
-            population, \
-            elevation, \
-            gtopo30, \
-            timezone, \
-            modification_date = line.split("\t")
-
-            if feature_code == fc:
+        # Parse the parent shapes only once, when first needed
+        parent_shapes = {}
+        def parent_shape(row):
+            shape = parent_shapes.get(row.id)
+            if shape is None and row.id not in parent_shapes:
+                try:
+                    shape = wkt_loads(row.wkt)
+                except ReadingError:
+                    current.log.error("Error reading wkt of location with id", row.id)
+                parent_shapes[row.id] = shape
+            return shape
+
+        def records():
+            # Parse File (line by line)
+            f = codecs.open(filepath, encoding="utf-8")
+            for line in f:
+                # Format of file: http://download.geonames.org/export/dump/readme.txt
+                fields = line.split("\t")
+                if fields[7] != fc:
+                    continue
+                geonameid, name = fields[0], fields[1]
+
                 # Add WKT
-                lat = float(lat)
-                lon = float(lon)
+                lat = float(fields[4])
+                lon = float(fields[5])
                 wkt = self.latlon_to_wkt(lat, lon)
 
                 shape = point.Point(lon, lat)
 
-                # Add Bounds
-                lon_min = lon_max = lon
-                lat_min = lat_max = lat
-
                 # Locate Parent
-                parent = ""
+                parent = None
                 # 1st check for Parents whose bounds include this location (faster)
-                def in_bbox(row):
-                    return (row.lon_min < lon_min) & \
-                           (row.lon_max > lon_max) & \
-                           (row.lat_min < lat_min) & \
-                           (row.lat_max > lat_max)
-                for row in all_parents.find(lambda row: in_bbox(row)):
+                for row in all_parents:
+                    if row.lon_min is None or row.lat_min is None or \
+                       not (row.lon_min < lon < row.lon_max and \
+                            row.lat_min < lat < row.lat_max):
+                        continue
                     # Search within this subset with a full geometry check
                     # Uses Shapely.
                     # @ToDo provide option to use PostGIS/Spatialite
-                    try:
-                        parent_shape = wkt_loads(row.wkt)
-                        if parent_shape.intersects(shape):
-                            parent = row.id
-                            # Should be just a single parent
-                            break
-                    except ReadingError:
-                        current.log.error("Error reading wkt of location with id", row.id)
-
-                # Add entry to database
-                new_id = table.insert(name=name,
-                                      level=level,
-                                      parent=parent,
-                                      lat=lat,
-                                      lon=lon,
-                                      wkt=wkt,
-                                      lon_min=lon_min,
-                                      lon_max=lon_max,
-                                      lat_min=lat_min,
-                                      lat_max=lat_max)
-                ttable.insert(location_id=new_id,
-                              tag="geonames",
-                              value=geonameid)
-            else:
-                continue
+                    pshape = parent_shape(row)
+                    if pshape is not None and pshape.intersects(shape):
+                        parent = row.id
+                        # Should be just a single parent
+                        break
+
+                yield {"name": name,
+                       "level": level,
+                       "parent": parent,
+                       "gis_feature_type": 1,
+                       "lat": lat,
+                       "lon": lon,
+                       "wkt": wkt,
+                       "lon_min": lon,
+                       "lon_max": lon,
+                       "lat_min": lat,
+                       "lat_max": lat,
+                       "tags": {"geonames": geonameid},
+                       }
+            f.close()
+
+        # Points need no centroid calculation => no process pool
+        self.import_locations(records(),
+                              processes = 1,
+                              progress = (lambda count: progress(level, count)) \
+                                         if progress else None,
+                              )
+
+        current.log.debug("Updating Location Tree...")
+        self.update_location_tree_batch()
+        db.commit()
 
         current.log.debug("All done!")
         return
@@ -4842,11 +6384,14 @@ page.render('%(filename)s', {format: 'jpeg', quality: '100'});''' % \
         # ---------------------------------------------------------------------
         def propagate(parent):
             """
-                Propagate Lat/Lon down to any Features which inherit from this one
+                Propagate Lat/Lon down to any Features which inherit from this one,
+                and discard cached hierarchy data which include this one
 
                 @param parent: gis_location id of parent
             """
 
+            GIS.clear_ldata(parent, ancestors=True)
+
             # No need to filter out deleted since the parent FK is None for these records
             query = (table.parent == parent) & \
                     (table.inherited == True)
@@ -4860,29 +6405,8 @@ page.render('%(filename)s', {format: 'jpeg', quality: '100'});''' % \
 
 
         if not feature:
-            # We are updating all locations.
-            all_locations = True
-            # Do in chunks to save memory and also do in correct order
-            all_fields = (table.id, table.name, table.gis_feature_type,
-                          table.L0, table.L1, table.L2, table.L3, table.L4,
-                          table.lat, table.lon, table.wkt, table.inherited,
-                          # Handle Countries which start with Bounds set, yet are Points
-                          table.lat_min, table.lon_min, table.lat_max, table.lon_max,
-                          table.path, table.parent)
-            for level in ("L0", "L1", "L2", "L3", "L4", "L5", None):
-                query = (table.level == level) & (table.deleted == False)
-                try:
-                    features = db(query).select(*all_fields)
-                except MemoryError:
-                    current.log.error("S3GIS: Unable to update Location Tree for level %s: MemoryError" % level)
-                else:
-                    for feature in features:
-                        feature["level"] = level
-                        wkt = feature["wkt"]
-                        if wkt and not wkt.startswith("POI"):
-                            # Polygons aren't inherited
-                            feature["inherited"] = False
-                        update_location_tree(feature)  # all_locations is False here
+            # We are updating all locations => use the batch mode
+            GIS.update_location_tree_batch()
             # All Done!
             return
 
@@ -5847,52 +7371,358 @@ page.render('%(filename)s', {format: 'jpeg', quality: '100'});''' % \
                 _path = "%s/%s" % (parent, id)
                 L0_name = Lx.name
             else:
-                current.log.error("Parent of L3 Location ID %s has invalid level: %s is %s" % \
-                            (id, parent, Lx.level))
-                #raise ValueError
-                return "%s/%s" % (parent, id)
-            Lx_lat = Lx.lat
-            Lx_lon = Lx.lon
-        else:
-            _path = id
-            Lx_lat = None
-            Lx_lon = None
+                current.log.error("Parent of L3 Location ID %s has invalid level: %s is %s" % \
+                            (id, parent, Lx.level))
+                #raise ValueError
+                return "%s/%s" % (parent, id)
+            Lx_lat = Lx.lat
+            Lx_lon = Lx.lon
+        else:
+            _path = id
+            Lx_lat = None
+            Lx_lon = None
+
+        if inherited or lat is None or lon is None:
+            fixup_required = True
+            inherited = True
+            lat = Lx_lat
+            lon = Lx_lon
+            wkt = None
+        elif path != _path or L0 != L0_name or L1 != L1_name or L2 != L2_name or L3 != L3_name or L4 != L4_name or L5 != L5_name or not wkt:
+            fixup_required = True
+
+        if fixup_required:
+            # Fix everything up
+            if lat is False:
+                lat = None
+            if lon is False:
+                lon = None
+            fix_vars = {"inherited": inherited,
+                        "path": _path,
+                        "lat": lat,
+                        "lon": lon,
+                        "wkt": wkt or None,
+                        "L0": L0_name,
+                        "L1": L1_name,
+                        "L2": L2_name,
+                        "L3": L3_name,
+                        "L4": L4_name,
+                        "L5": L5_name,
+                        }
+            feature.update(**fix_vars)
+            fixup(feature)
+
+        if not all_locations:
+            # Ensure that any locations which inherit their latlon from this one get updated
+            propagate(id)
+
+        return _path
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def update_location_tree_batch(chunk_size=5000):
+        """
+            Update Materialized paths, Lx names, inherited Lat/Lon, WKT and
+            Bounds/Centroids of all locations in batch mode:
+            - processes the tree level by level (L0 to L5, then specific
+              locations), so that parents are always complete before their
+              children, without recursion
+            - updates sibling locations with shared values in one go,
+              and per-location values (paths, centroids) with chunked
+              multi-row updates
+            - calculates centroids and bounds of polygons vectorised
+              (where Shapely 2 is available)
+
+            Used for updates of the whole tree (e.g. after prepop or bulk
+            imports of admin areas), the single-feature update onaccept
+            is still done by update_location_tree
+
+            @param chunk_size: the number of locations to process at a time
+
+            @returns: the number of locations processed
+        """
+
+        if GIS.disable_update_location_tree:
+            return 0
+
+        db = current.db
+        table = current.s3db.gis_location
+
+        update_chunk = GIS._update_location_tree_chunk
+
+        count = 0
+        for level in current.gis.hierarchy_level_keys + (None,):
+            query = (table.level == level) & \
+                    (table.deleted == False)
+            rows = db(query).select(table.id, orderby=table.id)
+            location_ids = [row.id for row in rows]
+            for i in range(0, len(location_ids), chunk_size):
+                chunk = location_ids[i:i + chunk_size]
+                try:
+                    update_chunk(chunk, level)
+                except MemoryError:
+                    current.log.error("S3GIS: Unable to update Location Tree for level %s: MemoryError" % level)
+                count += len(chunk)
+
+        # Discard all cached hierarchy data
+        GIS.clear_ldata()
+
+        return count
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _update_location_tree_chunk(location_ids, level):
+        """
+            Update the location tree for a chunk of locations of the same
+            level - all parents must have been updated before
+
+            @param location_ids: the gis_location record IDs
+            @param level: the level of the locations
+        """
+
+        db = current.db
+        table = current.s3db.gis_location
+        settings = current.deployment_settings
+
+        hierarchy = list(current.gis.hierarchy_level_keys)
+        position = hierarchy.index(level) if level else len(hierarchy)
+
+        query = table.id.belongs(location_ids)
+        rows = db(query).select(table.id,
+                                table.name,
+                                table.parent,
+                                table.path,
+                                table.inherited,
+                                table.gis_feature_type,
+                                table.lat,
+                                table.lon,
+                                table.lat_min,
+                                *[table[key] for key in hierarchy])
+
+        # Locations without WKT
+        no_wkt = db(query & ((table.wkt == None) | (table.wkt == ""))).select(table.id)
+        no_wkt = set(row.id for row in no_wkt)
+
+        # Look up the parents (already up-to-date)
+        parents = {}
+        if level != "L0":
+            parent_ids = list(set(row.parent for row in rows if row.parent))
+            if parent_ids:
+                prows = db(table.id.belongs(parent_ids)).select(table.id,
+                                                                table.name,
+                                                                table.level,
+                                                                table.path,
+                                                                table.lat,
+                                                                table.lon,
+                                                                *[table[key] for key in hierarchy])
+                parents = dict((row.id, row) for row in prows)
+
+        names = {}          # {(Lx names except own level): [location_id]}
+        paths = {}          # {location_id: path}
+        inherit = {}        # {(parent lat, parent lon): [location_id]}
+        points = {}         # {location_id: (lat, lon)}
+        polygons = []       # [location_id]
+        not_inherited = []  # [location_id]
+
+        for row in rows:
+
+            location_id = row.id
+            parent = parents.get(row.parent)
+
+            # Path & Lx names
+            if parent:
+                parent_level = parent.level
+                if parent_level not in hierarchy or \
+                   hierarchy.index(parent_level) >= position:
+                    current.log.error("Parent of %s Location ID %s has invalid level: %s is %s" % \
+                                      (level or "specific", location_id, parent.id, parent_level))
+                    continue
+                path = "%s/%s" % (parent.path or parent.id, location_id)
+                lx = [parent[key] for key in hierarchy]
+                lx[hierarchy.index(parent_level)] = parent.name
+                parent_lat, parent_lon = parent.lat, parent.lon
+            else:
+                path = str(location_id)
+                lx = [None] * len(hierarchy)
+                parent_lat = parent_lon = None
+            for i in range(position, len(hierarchy)):
+                lx[i] = None
+            if level:
+                lx[position] = row.name
+
+            if lx != [row[key] for key in hierarchy]:
+                # Own name gets set from the name field
+                shared = tuple(lx[:position] + lx[position + 1:])
+                names.setdefault(shared, []).append(location_id)
+            if row.path != path:
+                paths[location_id] = path
+
+            # Lat/Lon
+            if row.gis_feature_type != 1 and location_id not in no_wkt:
+                # Polygons aren't inherited
+                if row.inherited:
+                    not_inherited.append(location_id)
+                if row.lat is None or row.lon is None or row.lat_min is None:
+                    polygons.append(location_id)
+            elif level == "L0":
+                # Countries don't inherit
+                if row.inherited:
+                    not_inherited.append(location_id)
+                if location_id in no_wkt and \
+                   row.lat is not None and row.lon is not None:
+                    points[location_id] = (row.lat, row.lon)
+            elif row.inherited or row.lat is None or row.lon is None:
+                if not row.inherited or location_id in no_wkt or \
+                   row.lat != parent_lat or row.lon != parent_lon:
+                    inherit.setdefault((parent_lat, parent_lon), []).append(location_id)
+            elif location_id in no_wkt:
+                points[location_id] = (row.lat, row.lon)
+
+        # Lx names (shared by siblings)
+        for shared, ids in names.items():
+            lx = list(shared)
+            if level:
+                lx.insert(position, table.name)
+            db(table.id.belongs(ids)).update(**dict(zip(hierarchy, lx)))
+
+        if not_inherited:
+            db(table.id.belongs(not_inherited)).update(inherited = False)
+
+        # Inherited Lat/Lon (shared by siblings)
+        spatialdb = settings.get_gis_spatialdb()
+        for (lat, lon), ids in inherit.items():
+            if lat is None or lon is None:
+                values = {"inherited": True,
+                          "lat": None,
+                          "lon": None,
+                          "wkt": None,
+                          }
+            else:
+                wkt = "POINT (%s %s)" % (lon, lat)
+                values = {"inherited": True,
+                          "gis_feature_type": 1,
+                          "lat": lat,
+                          "lon": lon,
+                          "lat_min": lat,
+                          "lat_max": lat,
+                          "lon_min": lon,
+                          "lon_max": lon,
+                          "wkt": wkt,
+                          }
+                if spatialdb:
+                    values["the_geom"] = wkt
+            db(table.id.belongs(ids)).update(**values)
+
+        # Per-location values
+        update = GIS._update_by_id
+        if paths:
+            update(table, "path", paths)
+
+        if points:
+            wkts = dict((location_id, "POINT (%s %s)" % (lon, lat))
+                        for location_id, (lat, lon) in points.items())
+            update(table, "wkt", wkts)
+            if spatialdb:
+                update(table, "the_geom", wkts)
+
+        if polygons:
+            rows = db(table.id.belongs(polygons)).select(table.id, table.wkt)
+            centroids = GIS.get_centroids([row.wkt for row in rows])
+            values = {}
+            for row, centroid in zip(rows, centroids):
+                if centroid is None:
+                    current.log.error("S3GIS: Unable to set bounds & centroid for feature %s" % row.id)
+                    continue
+                for fieldname, value in zip(("lon", "lat", "lon_min", "lat_min", "lon_max", "lat_max"),
+                                            centroid):
+                    values.setdefault(fieldname, {})[row.id] = value
+            for fieldname, items in values.items():
+                update(table, fieldname, items)
 
-        if inherited or lat is None or lon is None:
-            fixup_required = True
-            inherited = True
-            lat = Lx_lat
-            lon = Lx_lon
-            wkt = None
-        elif path != _path or L0 != L0_name or L1 != L1_name or L2 != L2_name or L3 != L3_name or L4 != L4_name or L5 != L5_name or not wkt:
-            fixup_required = True
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def get_centroids(wkts):
+        """
+            Calculate centroids and bounds for a list of WKT geometries,
+            vectorised if Shapely 2 is available
 
-        if fixup_required:
-            # Fix everything up
-            if lat is False:
-                lat = None
-            if lon is False:
-                lon = None
-            fix_vars = {"inherited": inherited,
-                        "path": _path,
-                        "lat": lat,
-                        "lon": lon,
-                        "wkt": wkt or None,
-                        "L0": L0_name,
-                        "L1": L1_name,
-                        "L2": L2_name,
-                        "L3": L3_name,
-                        "L4": L4_name,
-                        "L5": L5_name,
-                        }
-            feature.update(**fix_vars)
-            fixup(feature)
+            @param wkts: list of WKT strings
 
-        if not all_locations:
-            # Ensure that any locations which inherit their latlon from this one get updated
-            propagate(id)
+            @returns: list of tuples (lon, lat, lon_min, lat_min, lon_max, lat_max),
+                      or None for invalid geometries
+        """
 
-        return _path
+        import math
+
+        try:
+            import shapely
+            from_wkt = shapely.from_wkt
+        except (ImportError, AttributeError):
+            # Shapely < 2.0
+            from shapely.wkt import loads as wkt_loads
+            output = []
+            for wkt in wkts:
+                try:
+                    shape = wkt_loads(wkt)
+                    centroid = shape.centroid
+                    output.append((centroid.x, centroid.y) + tuple(shape.bounds))
+                except Exception:
+                    output.append(None)
+            return output
+
+        geometries = from_wkt(wkts, on_invalid="ignore")
+        centroids = shapely.centroid(geometries)
+        xs = shapely.get_x(centroids)
+        ys = shapely.get_y(centroids)
+        bounds = shapely.bounds(geometries)
+
+        output = []
+        for i in range(len(wkts)):
+            values = (float(xs[i]), float(ys[i])) + tuple(float(v) for v in bounds[i])
+            if any(math.isnan(v) for v in values):
+                output.append(None)
+            else:
+                output.append(values)
+        return output
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _update_by_id(table, fieldname, values, chunk_size=500):
+        """
+            Set different values of a field for many records, with one
+            UPDATE (using CASE) per chunk of records
+
+            @param table: the Table
+            @param fieldname: the field name
+            @param values: dict {record_id: value}
+            @param chunk_size: the maximum number of records per UPDATE
+        """
+
+        db = current.db
+        represent = db._adapter.represent
+
+        field = table[fieldname]
+        record_ids = list(values.keys())
+
+        if "modified_on" in table.fields:
+            modified_on = ", modified_on=%s" % represent(current.request.utcnow, "datetime")
+        else:
+            modified_on = ""
+
+        for i in range(0, len(record_ids), chunk_size):
+            chunk = record_ids[i:i + chunk_size]
+            cases = " ".join("WHEN %s THEN %s" % (int(record_id),
+                                                  represent(values[record_id], field.type),
+                                                  )
+                             for record_id in chunk)
+            sql = "UPDATE %s SET %s=CASE id %s END%s WHERE id IN (%s);" % \
+                  (table._tablename,
+                   fieldname,
+                   cases,
+                   modified_on,
+                   ",".join(str(int(record_id)) for record_id in chunk),
+                   )
+            db.executesql(sql)
 
     # -------------------------------------------------------------------------
     @staticmethod
@@ -6066,6 +7896,57 @@ page.render('%(filename)s', {format: 'jpeg', quality: '100'});''' % \
                 (table.lon_max >= lon_min)
         return query
 
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def spatial_index():
+        """
+            Get the spatial index for location lookups
+
+            @returns: the S3SpatialIndex, or None if disabled
+        """
+
+        if current.deployment_settings.get_gis_spatial_index():
+            return S3SpatialIndex.instance()
+        else:
+            return None
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _select_in_bbox(lon_min, lat_min, lon_max, lat_max, query=None, fields=None):
+        """
+            Generator of Locations whose bounds intersect the given bbox,
+            pre-selected with the spatial index if available, otherwise
+            with a bounds query
+
+            @param lon_min: the minimum longitude of the bbox
+            @param lat_min: the minimum latitude of the bbox
+            @param lon_max: the maximum longitude of the bbox
+            @param lat_max: the maximum latitude of the bbox
+            @param query: additional query (e.g. a join with a resource table)
+            @param fields: the fields to select (default: all gis_location fields)
+        """
+
+        db = current.db
+        table = current.s3db.gis_location
+
+        if fields is None:
+            fields = [table.ALL]
+
+        index = GIS.spatial_index()
+        if index:
+            ids = index.search(lon_min, lat_min, lon_max, lat_max)
+            queries = [table.id.belongs(chunk) for chunk in index.chunks(ids)]
+        else:
+            queries = [current.gis.query_features_by_bbox(lon_min,
+                                                          lat_min,
+                                                          lon_max,
+                                                          lat_max)]
+        for subquery in queries:
+            if query is not None:
+                subquery &= query
+            for row in db(subquery).select(*fields):
+                yield row
+
     # -------------------------------------------------------------------------
     @staticmethod
     def get_features_by_bbox(lon_min, lat_min, lon_max, lat_max):
@@ -6073,11 +7954,24 @@ page.render('%(filename)s', {format: 'jpeg', quality: '100'});''' % \
             Returns Rows of Locations whose shape intersects the given bbox.
         """
 
-        query = current.gis.query_features_by_bbox(lon_min,
-                                                   lat_min,
-                                                   lon_max,
-                                                   lat_max)
-        return current.db(query).select()
+        db = current.db
+
+        index = current.gis.spatial_index()
+        if not index:
+            query = current.gis.query_features_by_bbox(lon_min,
+                                                       lat_min,
+                                                       lon_max,
+                                                       lat_max)
+            return db(query).select()
+
+        table = current.s3db.gis_location
+        ids = index.search(lon_min, lat_min, lon_max, lat_max)
+
+        rows = None
+        for chunk in list(index.chunks(ids)) or [[]]:
+            chunk_rows = db(table.id.belongs(chunk)).select()
+            rows = chunk_rows if rows is None else rows & chunk_rows
+        return rows
 
     # -------------------------------------------------------------------------
     @staticmethod
@@ -6101,10 +7995,10 @@ page.render('%(filename)s', {format: 'jpeg', quality: '100'});''' % \
                              "Upgrade Shapely for Performance enhancements")
 
         table = current.s3db.gis_location
-        in_bbox = current.gis.query_features_by_bbox(*shape.bounds)
         has_wkt = (table.wkt != None) & (table.wkt != "")
+        in_bbox = current.gis._select_in_bbox(*shape.bounds, query=has_wkt)
 
-        for loc in current.db(in_bbox & has_wkt).select():
+        for loc in in_bbox:
             try:
                 location_shape = wkt_loads(loc.wkt)
                 if location_shape.intersects(shape):
@@ -6205,7 +8099,8 @@ page.render('%(filename)s', {format: 'jpeg', quality: '100'});''' % \
             db(query).select(table.the_geom.st_simplify(tolerance).st_astext().with_alias('wkt')).first().wkt
             db(query).select(table.the_geom.st_simplify(tolerance).st_asgeojson().with_alias('geojson')).first().geojson
 
-            @param wkt: the WKT string to be simplified (usually coming from a gis_location record)
+            @param wkt: the WKT string to be simplified (usually coming from a gis_location record),
+                        or an already parsed Shapely geometry
             @param tolerance: how aggressive a simplification to perform
             @param preserve_topology: whether the simplified geometry should be maintained
             @param output: whether to output as WKT or GeoJSON format
@@ -6223,12 +8118,15 @@ page.render('%(filename)s', {format: 'jpeg', quality: '100'});''' % \
             current.log.info("S3GIS",
                              "Upgrade Shapely for Performance enhancements")
 
-        try:
-            shape = wkt_loads(wkt)
-        except:
-            wkt = wkt[10] if wkt else wkt
-            current.log.error("Invalid Shape: %s" % wkt)
-            return None
+        if isinstance(wkt, basestring):
+            try:
+                shape = wkt_loads(wkt)
+            except:
+                wkt = wkt[10] if wkt else wkt
+                current.log.error("Invalid Shape: %s" % wkt)
+                return None
+        else:
+            shape = wkt
 
         settings = current.deployment_settings
 
@@ -6290,6 +8188,154 @@ page.render('%(filename)s', {format: 'jpeg', quality: '100'});''' % \
 
         return output
 
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def update_simplified(location_ids=None):
+        """
+            Precompute the simplified geometries of polygon locations at
+            all tolerance levels (settings.gis.simplify_levels)
+            - called asynchronously from gis_location_onaccept and after
+              the import of admin areas
+
+            @param location_ids: list of gis_location record IDs, or None
+                                 to process all polygon locations which
+                                 do not have simplified geometries yet
+
+            @returns: the number of locations processed
+        """
+
+        from shapely.wkt import loads as wkt_loads
+
+        levels = current.deployment_settings.get_gis_simplify_levels()
+        if not levels:
+            return 0
+
+        db = current.db
+        s3db = current.s3db
+        table = s3db.gis_location
+        stable = s3db.gis_location_simplified
+
+        query = (table.gis_feature_type.belongs((3, 6))) & \
+                (table.deleted == False)
+        if location_ids is None:
+            left = stable.on(stable.location_id == table.id)
+            query &= (stable.id == None)
+            rows = db(query).select(table.id, left=left)
+        else:
+            if not isinstance(location_ids, (list, tuple)):
+                location_ids = [location_ids]
+            # Discard outdated simplified geometries
+            db(stable.location_id.belongs(location_ids)).delete()
+            rows = db(query & table.id.belongs(location_ids)).select(table.id)
+        location_ids = [row.id for row in rows]
+
+        simplify = GIS.simplify
+        insert = stable.insert
+
+        count = 0
+        for i in range(0, len(location_ids), 100):
+            chunk = location_ids[i:i + 100]
+            rows = db(table.id.belongs(chunk)).select(table.id, table.wkt)
+            for row in rows:
+                try:
+                    shape = wkt_loads(row.wkt)
+                except:
+                    current.log.error("Invalid Shape for location %s" % row.id)
+                    continue
+                for tolerance in levels:
+                    insert(location_id = row.id,
+                           tolerance = tolerance,
+                           wkt = simplify(shape,
+                                          tolerance = tolerance,
+                                          output = "wkt",
+                                          ),
+                           geojson = simplify(shape,
+                                              tolerance = tolerance,
+                                              output = "geojson",
+                                              ),
+                           )
+                count += 1
+
+        return count
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def get_simplify_level(zoom=None, bbox=None):
+        """
+            Select the precomputed simplification level appropriate for
+            an export, i.e. the coarsest level not exceeding the size of
+            a map pixel at the requested zoom (or bbox), or the default
+            simplify tolerance if neither is given
+
+            @param zoom: the zoom level of the map
+            @param bbox: the bbox of the map, as string
+                         "lon_min,lat_min,lon_max,lat_max"
+
+            @returns: the tolerance of the level, or None if no level
+                      is appropriate
+        """
+
+        settings = current.deployment_settings
+
+        levels = settings.get_gis_simplify_levels()
+        if not levels:
+            return None
+
+        tolerance = None
+        if zoom is not None:
+            try:
+                zoom = min(max(int(zoom), 0), 30)
+            except (ValueError, TypeError):
+                pass
+            else:
+                # Width of a 256px-tile in degrees / 256
+                tolerance = 360.0 / (256 << zoom)
+        if tolerance is None and bbox:
+            try:
+                lon_min, lat_min, lon_max, lat_max = [float(v) for v in bbox.split(",")]
+            except (ValueError, AttributeError):
+                pass
+            else:
+                # Assume a map width of 1024 pixels
+                tolerance = abs(lon_max - lon_min) / 1024
+        if tolerance is None:
+            tolerance = settings.get_gis_simplify_tolerance()
+            if not tolerance:
+                return None
+
+        candidates = [level for level in levels if level <= tolerance]
+        return max(candidates) if candidates else None
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def get_simplified(location_ids, tolerance, geojson=True):
+        """
+            Look up precomputed simplified geometries
+
+            @param location_ids: the gis_location record IDs
+            @param tolerance: the simplification level
+            @param geojson: return GeoJSON rather than WKT
+
+            @returns: dict {location_id: geometry}, only for locations
+                      which have a precomputed simplified geometry
+        """
+
+        db = current.db
+        table = current.s3db.gis_location_simplified
+
+        fieldname = "geojson" if geojson else "wkt"
+        field = table[fieldname]
+
+        location_ids = list(set(location_ids))
+        output = {}
+        for i in range(0, len(location_ids), 1000):
+            query = (table.location_id.belongs(location_ids[i:i + 1000])) & \
+                    (table.tolerance == tolerance)
+            rows = db(query).select(table.location_id, field)
+            for row in rows:
+                output[row.location_id] = row[fieldname]
+        return output
+
     # -------------------------------------------------------------------------
     def show_map(self,
                  id = "default_map",
@@ -6480,6 +8526,96 @@ page.render('%(filename)s', {format: 'jpeg', quality: '100'});''' % \
                    plugins = plugins,
                    )
 
+# =============================================================================
+def _get_centroids(wkts):
+    """
+        Calculate centroids and bounds for a list of WKT geometries,
+        in a worker process (see GIS.import_locations)
+
+        @param wkts: list of WKT strings
+    """
+
+    return GIS.get_centroids(wkts)
+
+# =============================================================================
+class S3OfflineGeocoder(object):
+    """
+        Geocoder matching addresses against the names (and street
+        addresses) of existing locations, with a geopy-compatible
+        interface - for tests and installations without internet
+        access (settings.gis.geocode_service = "offline")
+    """
+
+    def geocode(self, query, exactly_one=True, **kwargs):
+        """
+            Geocode an address
+
+            @param query: the address, comma-separated parts from specific
+                          to general (e.g. "street,postcode,L3,L2,L1,L0")
+            @param exactly_one: return only the best match
+
+            @returns: list of tuples (place, (lat, lon)) of the best matches
+                      (a single tuple if exactly_one), or None if there is
+                      no match
+        """
+
+        parts = [" ".join(part.split()).lower()
+                 for part in s3_str(query).split(",")]
+        parts = [part for part in parts if part]
+        if not parts:
+            return None
+
+        db = current.db
+        table = current.s3db.gis_location
+        hierarchy = current.gis.hierarchy_level_keys
+
+        base = (table.deleted == False) & \
+               (table.lat != None) & \
+               (table.lon != None)
+        fields = [table.id,
+                  table.name,
+                  table.addr_street,
+                  table.lat,
+                  table.lon,
+                  ] + [table[key] for key in hierarchy]
+
+        # The most specific part of the address which matches any location
+        candidates = None
+        for position, part in enumerate(parts):
+            query = base & ((table.name.lower() == part) | \
+                            (table.addr_street.lower() == part))
+            rows = db(query).select(*fields, limitby=(0, 100))
+            if not rows:
+                continue
+
+            # Prefer the locations within the other parts of the address
+            context = set(parts[position + 1:])
+            best = []
+            best_score = -1
+            for row in rows:
+                names = set(s3_str(row[key]).lower() for key in hierarchy if row[key])
+                score = len(context & names)
+                if score > best_score:
+                    best = [row]
+                    best_score = score
+                elif score == best_score:
+                    best.append(row)
+            candidates = best
+            break
+
+        if not candidates:
+            return None
+
+        results = []
+        for row in candidates:
+            name = row.addr_street or row.name
+            place = [s3_str(name)] + [s3_str(row[key])
+                                      for key in reversed(hierarchy)
+                                      if row[key] and row[key] != name]
+            results.append((", ".join(place), (row.lat, row.lon)))
+
+        return results[0] if exactly_one else results
+
 # =============================================================================
 class MAP(DIV):
     """
@@ -7186,12 +9322,20 @@ class MAP(DIV):
         layer_types = set(layer_types)
         scripts = []
         scripts_append = scripts.append
+        cache_key = GIS.layer_cache_key(config,
+                                        openlayers = 2,
+                                        catalogue_layers = opts_get("catalogue_layers", False),
+                                        )
         for LayerType in layer_types:
             try:
-                # Instantiate the Class
-                layer = LayerType(layers, openlayers=2)
-                layer.as_dict(options)
-                for script in layer.scripts:
+                # Instantiate the Class (or use the cached output)
+                layer_dicts, layer_scripts = LayerType.build(layers,
+                                                             openlayers = 2,
+                                                             cache_key = cache_key,
+                                                             )
+                if layer_dicts:
+                    options[LayerType.dictname] = layer_dicts
+                for script in layer_scripts:
                     scripts_append(script)
             except Exception as exception:
                 error = "%s not shown: %s" % (LayerType.__name__, exception)
@@ -7684,12 +9828,19 @@ class MAP2(DIV):
         layer_types = set(layer_types)
         scripts = []
         scripts_append = scripts.append
+        cache_key = GIS.layer_cache_key(config,
+                                        openlayers = 6,
+                                        catalogue_layers = opts_get("catalogue_layers", False),
+                                        )
         for LayerType in layer_types:
             try:
-                # Instantiate the Class
-                layer = LayerType(layers)
-                layer.as_dict(options)
-                for script in layer.scripts:
+                # Instantiate the Class (or use the cached output)
+                layer_dicts, layer_scripts = LayerType.build(layers,
+                                                             cache_key = cache_key,
+                                                             )
+                if layer_dicts:
+                    options[LayerType.dictname] = layer_dicts
+                for script in layer_scripts:
                     scripts_append(script)
             except Exception as exception:
                 error = "%s not shown: %s" % (LayerType.__name__, exception)
@@ -8170,6 +10321,10 @@ class Layer(object):
         Abstract base class for Layers from Catalogue
     """
 
+    # Whether the output can be cached across requests (False for
+    # layer types with side-effects, e.g. feed refreshs or scripts)
+    cacheable = True
+
     def __init__(self, all_layers, openlayers=6):
 
         self.openlayers = openlayers
@@ -8289,6 +10444,46 @@ class Layer(object):
         # - client will only sort within their type: s3.gis.layers.js
         self.sublayers = sorted(sublayers, key=lambda row: row.name)
 
+    # -------------------------------------------------------------------------
+    @classmethod
+    def build(cls, all_layers, openlayers=6, cache_key=None):
+        """
+            Instantiate this layer type and output its layers, using
+            the GIS config cache where possible
+
+            @param all_layers: the layer config Rows
+            @param openlayers: the OpenLayers version
+            @param cache_key: the layer cache key (see GIS.layer_cache_key),
+                              None to not use the cache
+
+            @returns: tuple (layer_dicts, scripts)
+        """
+
+        def build():
+            s3_gis = current.response.s3.gis
+            get_feature_info = s3_gis.get_feature_info
+            s3_gis.get_feature_info = None
+
+            layer = cls(all_layers, openlayers=openlayers)
+            output = (layer.as_dict(),
+                      list(layer.scripts),
+                      s3_gis.get_feature_info,
+                      )
+
+            if get_feature_info:
+                s3_gis.get_feature_info = get_feature_info
+            return output
+
+        if cache_key and cls.cacheable:
+            key = "%s_%s" % (cache_key, cls.__name__)
+            layer_dicts, scripts, get_feature_info = GIS.config_cache(key, build)
+            if get_feature_info:
+                current.response.s3.gis.get_feature_info = get_feature_info
+        else:
+            layer_dicts, scripts = build()[:2]
+
+        return layer_dicts, scripts
+
     # -------------------------------------------------------------------------
     def as_dict(self, options=None):
         """
@@ -8582,6 +10777,12 @@ class LayerFeature(Layer):
                      self.layer_id,
                      maxdepth)
                 url_format = "%s/{id}.plain" % _url
+                # Vector tiles (for layers too large for GeoJSON)
+                tiles = "%s?layer=%i&z={z}&x={x}&y={y}" % \
+                    (URL(self.controller, self.function, args="mvt.mvt"),
+                     self.layer_id)
+                if self.filter:
+                    tiles = "%s&%s" % (tiles, self.filter)
             if self.filter:
                 url = "%s&%s" % (url, self.filter)
             if self.trackable:
@@ -8595,6 +10796,8 @@ class LayerFeature(Layer):
                       "url_format": url_format,
                       "url": url,
                       }
+            if not self.aggregate:
+                output["tiles"] = tiles
 
             popup_format = self.popup_format
             if popup_format:
@@ -8695,75 +10898,17 @@ class LayerGeoRSS(Layer):
     dictname = "layers_georss"
     style = True
 
-    def __init__(self, all_layers, openlayers=6):
-        super(LayerGeoRSS, self).__init__(all_layers, openlayers)
-        LayerGeoRSS.SubLayer.cachetable = current.s3db.gis_cache
-
     # -------------------------------------------------------------------------
     class SubLayer(Layer.SubLayer):
         def as_dict(self):
-            db = current.db
-            request = current.request
-            response = current.response
-            cachetable = self.cachetable
-
-            url = self.url
-            # Check to see if we should Download layer to the cache
-            download = True
-            query = (cachetable.source == url)
-            existing_cached_copy = db(query).select(cachetable.modified_on,
-                                                    limitby = (0, 1)).first()
-            refresh = self.refresh or 900 # 15 minutes set if we have no data (legacy DB)
-            if existing_cached_copy:
-                modified_on = existing_cached_copy.modified_on
-                cutoff = modified_on + datetime.timedelta(seconds=refresh)
-                if request.utcnow < cutoff:
-                    download = False
-            if download:
-                # Download layer to the Cache
-                from gluon.tools import fetch
-                # @ToDo: Call directly without going via HTTP
-                # @ToDo: Make this async by using S3Task (also use this for the refresh time)
-                fields = ""
-                if self.data:
-                    fields = "&data_field=%s" % self.data
-                if self.image:
-                    fields = "%s&image_field=%s" % (fields, self.image)
-                _url = "%s%s/update.georss?fetchurl=%s%s" % (current.deployment_settings.get_base_public_url(),
-                                                             URL(c="gis", f="cache_feed"),
-                                                             url,
-                                                             fields)
-                # Keep Session for local URLs
-                cookie = Cookie.SimpleCookie()
-                cookie[response.session_id_name] = response.session_id
-                current.session._unlock(response)
-                try:
-                    # @ToDo: Need to commit to not have DB locked with SQLite?
-                    fetch(_url, cookie=cookie)
-                    if existing_cached_copy:
-                        # Clear old selfs which are no longer active
-                        query = (cachetable.source == url) & \
-                                (cachetable.modified_on < cutoff)
-                        db(query).delete()
-                except Exception as exception:
-                    current.log.error("GeoRSS %s download error" % url, exception)
-                    # Feed down
-                    if existing_cached_copy:
-                        # Use cached copy
-                        # Should we Update timestamp to prevent every
-                        # subsequent request attempting the download?
-                        #query = (cachetable.source == url)
-                        #db(query).update(modified_on=request.utcnow)
-                        pass
-                    else:
-                        response.warning += "%s down & no cached copy available" % url
 
             name_safe = self.safe_name
 
             # Pass the GeoJSON URL to the client
+            # - the feed is cached by the gis_refresh_feeds task
             # Filter to the source of this feed
             url = "%s.geojson?cache.source=%s" % (URL(c="gis", f="cache_feed"),
-                                                  url)
+                                                  urllib_quote(self.url, safe=""))
 
             # Mandatory attributes
             output = {"id": self.layer_id,
@@ -8790,6 +10935,7 @@ class LayerGoogle(Layer):
     tablename = "gis_layer_google"
     dictname = "Google"
     style = False
+    cacheable = False
 
     # -------------------------------------------------------------------------
     def as_dict(self, options=None):
@@ -8967,67 +11113,27 @@ class LayerKML(Layer):
                                  "gis_cache")
 
         if os.path.exists(cachepath):
-            cacheable = os.access(cachepath, os.W_OK)
+            file_cache = os.access(cachepath, os.W_OK)
         else:
             try:
                 os.mkdir(cachepath)
             except OSError as os_error:
                 current.log.error("GIS: KML layers cannot be cached: %s %s" % \
                                   (cachepath, os_error))
-                cacheable = False
+                file_cache = False
             else:
-                cacheable = True
-        # @ToDo: Migrate to gis_cache
-        LayerKML.cachetable = current.s3db.gis_cache2
-        LayerKML.cacheable = cacheable
+                file_cache = True
+        LayerKML.file_cache = file_cache
         LayerKML.cachepath = cachepath
 
     # -------------------------------------------------------------------------
     class SubLayer(Layer.SubLayer):
         def as_dict(self):
-            db = current.db
-            request = current.request
-
-            cachetable = LayerKML.cachetable
-            cacheable = LayerKML.cacheable
-            #cachepath = LayerKML.cachepath
-
-            name = self.name
-            if cacheable:
-                _name = urllib_quote(name)
-                _name = _name.replace("%", "_")
-                filename = "%s.file.%s.kml" % (cachetable._tablename,
-                                               _name)
-
-
-                # Should we download a fresh copy of the source file?
-                download = True
-                query = (cachetable.name == name)
-                cached = db(query).select(cachetable.modified_on,
-                                          limitby = (0, 1)).first()
-                refresh = self.refresh or 900 # 15 minutes set if we have no data (legacy DB)
-                if cached:
-                    modified_on = cached.modified_on
-                    cutoff = modified_on + datetime.timedelta(seconds=refresh)
-                    if request.utcnow < cutoff:
-                        download = False
-
-                if download:
-                    # Download file (async, if workers alive)
-                    response = current.response
-                    session_id_name = response.session_id_name
-                    session_id = response.session_id
-                    current.s3task.run_async("gis_download_kml",
-                                             args = [self.id,
-                                                     filename,
-                                                     session_id_name,
-                                                     session_id,
-                                                     ])
-                    if cached:
-                        db(query).update(modified_on=request.utcnow)
-                    else:
-                        cachetable.insert(name=name, file=filename)
 
+            if LayerKML.file_cache:
+                # The cached copy of the file is maintained by the
+                # gis_refresh_feeds task
+                filename = GIS.kml_cache_filename(self.name)
                 url = URL(c="default", f="download",
                           args=[filename])
             else:
@@ -9133,6 +11239,7 @@ class LayerOpenWeatherMap(Layer):
     tablename = "gis_layer_openweathermap"
     dictname = "layers_openweathermap"
     style = False
+    cacheable = False
 
     # -------------------------------------------------------------------------
     def as_dict(self, options=None):
@@ -9252,11 +11359,18 @@ class LayerTMS(Layer):
     # -------------------------------------------------------------------------
     class SubLayer(Layer.SubLayer):
         def as_dict(self):
+            if self.tile_cache is not None:
+                # Load the tiles through the Tile Cache
+                url = "%s/" % URL(c="gis", f="proxy", args=["tile", self.layer_id])
+                url2 = url3 = None
+            else:
+                url, url2, url3 = self.url, self.url2, self.url3
+
             # Mandatory attributes
             output = {"id": self.layer_id,
                       "type": "tms",
                       "name": self.safe_name,
-                      "url": self.url,
+                      "url": url,
                       "layername": self.layername
                       }
 
@@ -9264,8 +11378,8 @@ class LayerTMS(Layer):
             self.add_attributes_if_not_default(
                 output,
                 _base = (self._base, (False,)),
-                url2 = (self.url2, (None,)),
-                url3 = (self.url3, (None,)),
+                url2 = (url2, (None,)),
+                url3 = (url3, (None,)),
                 format = (self.img_format, ("png", None)),
                 zoomLevels = (self.zoom_levels, (19,)),
                 attribution = (self.attribution, (None,)),
@@ -9343,10 +11457,19 @@ class LayerWMS(Layer):
         def as_dict(self):
             if self.queryable:
                 current.response.s3.gis.get_feature_info = True
+            if self.tile_cache is not None:
+                # Load the tiles through the Tile Cache
+                # - credentials are added server-side
+                url = URL(c="gis", f="proxy", args=["tile", self.layer_id])
+                username = password = None
+            else:
+                url = self.url
+                username, password = self.username, self.password
+
             # Mandatory attributes
             output = {"id": self.layer_id,
                       "name": self.safe_name,
-                      "url": self.url,
+                      "url": url,
                       "layers": self.layers,
                       }
 
@@ -9361,8 +11484,8 @@ class LayerWMS(Layer):
                     "version": (self.version, ("1.1.1",)),
                     "format": (self.img_format, ("image/png",)),
                     "map": (self.map, (None, "")),
-                    "username": (self.username, (None, "")),
-                    "password": (self.password, (None, "")),
+                    "username": (username, (None, "")),
+                    "password": (password, (None, "")),
                     "buffer": (self.buffer, (0,)),
                     "base": (self.base, (False,)),
                     "_base": (self._base, (False,)),
@@ -9449,12 +11572,7 @@ class Marker(object):
             config = None
             if marker_id:
                 # Lookup the Marker details from it's ID
-                marker = db(mtable.id == marker_id).select(mtable.image,
-                                                           mtable.height,
-                                                           mtable.width,
-                                                           limitby = (0, 1),
-                                                           cache=s3db.cache
-                                                           ).first()
+                marker = GIS.get_marker_metadata()["id"].get(marker_id)
             elif layer_id:
                 # Check if we have a Marker defined for this Layer
                 config = GIS.get_config()
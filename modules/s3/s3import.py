@@ -3007,7 +3007,8 @@ class S3ImportJob():
                  update_policy=None,
                  conflict_policy=None,
                  last_sync=None,
-                 onconflict=None):
+                 onconflict=None,
+                 digests=None):
         """
             Constructor
 
@@ -3019,6 +3020,10 @@ class S3ImportJob():
             @param conflict_policy: the conflict resolution policy
             @param last_sync: the last synchronization time stamp (datetime)
             @param onconflict: custom conflict resolver function
+            @param digests: registry of the record digests exchanged with
+                            the source repository (S3SyncDigests), to skip
+                            records which have been exchanged before with
+                            identical contents (sync)
         """
 
         self.error = None # the last error
@@ -3076,6 +3081,11 @@ class S3ImportJob():
         self.last_sync = last_sync
         self.onconflict = onconflict
 
+        # Record digests
+        self.digests = digests
+        self.element_digests = {}
+        self.skipped = 0 # number of records skipped as unchanged
+
         if job_id:
             self.__define_tables()
             jobtable = self.job_table
@@ -3136,6 +3146,50 @@ class S3ImportJob():
 
         return uidmap
 
+    # -------------------------------------------------------------------------
+    def skip_known(self, elements):
+        """
+            Filter out elements for records that have been exchanged
+            with the source repository before with identical contents
+
+            @param elements: the resource elements to import
+
+            @returns: list of the elements to import
+        """
+
+        digests = self.digests
+        if digests is None:
+            return elements
+
+        xml = current.xml
+        UID = xml.UID
+        NAME = xml.ATTRIBUTE.name
+
+        # Compute the digests of all elements
+        element_digests = self.element_digests
+        for element in elements:
+            uid = element.get(UID)
+            if uid:
+                key = (element.get(NAME), xml.import_uid(uid))
+                element_digests[element] = (key, xml.digest(element))
+
+        # Look up the known digests
+        keys = [key for key, _ in element_digests.values()]
+        known = digests.lookup(keys)
+
+        # Skip all elements with known digests
+        selected = []
+        for element in elements:
+            if element in element_digests:
+                key, digest = element_digests[element]
+                if known.get(key) == digest:
+                    del element_digests[element]
+                    self.skipped += 1
+                    continue
+            selected.append(element)
+
+        return selected
+
     # -------------------------------------------------------------------------
     def add_item(self,
                  element = None,
@@ -3699,6 +3753,12 @@ class S3ImportJob():
         if failed:
             return False
 
+        # Register the digests of the imported records (unless there
+        # were errors, as the record contents might be incomplete)
+        element_digests = self.element_digests
+        if element_digests and not self.error and not current.auth.rollback:
+            self.digests.update(dict(element_digests.values()))
+
         self.count = count
         self.mtime = mtime
         self.created = created
@@ -424,6 +424,14 @@ class S3Model(object):
             table = getattr(db, tablename)
         else:
             table = db.define_table(tablename, *fields, **args)
+
+            # Track data versions of tables with locations for the
+            # vector tile cache
+            if current.deployment_settings.get_gis_mvt_cache():
+                from .s3tiles import S3VectorTiles
+                if S3VectorTiles.versioned(table):
+                    S3VectorTiles.version_hooks(table)
+
         return table
 
     # -------------------------------------------------------------------------
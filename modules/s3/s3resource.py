@@ -306,6 +306,7 @@ class S3Resource(object):
         # Export meta data
         self.muntil = None      # latest mtime of the exported records
         self.results = None     # number of exported records
+        self.digests = None     # digests of the exported records (sync)
 
         # Standard methods ----------------------------------------------------
 
@@ -1485,6 +1486,10 @@ class S3Resource(object):
                    location_data=None,
                    map_data=None,
                    target=None,
+                   stream=False,
+                   chunk_size=None,
+                   progress=None,
+                   digests=None,
                    **args):
         """
             Export this resource as S3XML
@@ -1521,6 +1526,15 @@ class S3Resource(object):
                                   looked-up in bulk ready for xml.gis_encode()
             @param map_data: dictionary of options which can be read by the map
             @param target: alias of component targetted (or None to target master resource)
+            @param stream: return a generator producing the S3XML document
+                           in chunks rather than the complete document
+                           (not possible with stylesheet, as_tree or as_json)
+            @param chunk_size: number of master records per chunk (stream)
+            @param progress: callback function progress(done, total) to
+                             report the progress of a streamed export
+            @param digests: registry of record digests exchanged with the
+                            target repository, to skip records the target
+                            already holds unchanged (sync, not streamed)
             @param args: dict of arguments to pass to the XSLT stylesheet
         """
 
@@ -1542,6 +1556,27 @@ class S3Resource(object):
                                map_data = map_data,
                                )
 
+        if stream and xmlformat is None and not as_tree and not as_json and \
+           digests is None:
+            # Incremental export
+            return rtree.stream(start = start,
+                                limit = limit,
+                                chunk_size = chunk_size,
+                                pretty_print = pretty_print,
+                                progress = progress,
+                                msince = msince,
+                                fields = fields,
+                                dereference = dereference,
+                                maxdepth = maxdepth,
+                                mcomponents = mcomponents,
+                                rcomponents = rcomponents,
+                                references = references,
+                                sync_filters = filters,
+                                mdata = mdata,
+                                maxbounds = maxbounds,
+                                target = target,
+                                )
+
         tree = rtree.build(start = start,
                            limit = limit,
                            msince = msince,
@@ -1556,6 +1591,7 @@ class S3Resource(object):
                            maxbounds = maxbounds,
                            xmlformat = xmlformat,
                            target = target,
+                           digests = digests,
                            )
 
         # XSLT transformation
@@ -1600,6 +1636,7 @@ class S3Resource(object):
                    conflict_policy = None,
                    last_sync = None,
                    onconflict = None,
+                   digests = None,
                    **args):
         """
             XML Importer
@@ -1621,6 +1658,8 @@ class S3Resource(object):
             @param conflict_policy: policy for conflict resolution (sync)
             @param last_sync: last synchronization datetime (sync)
             @param onconflict: callback hook for conflict resolution (sync)
+            @param digests: registry of record digests exchanged with the
+                            source repository, to skip unchanged records (sync)
             @param args: parameters to pass to the transformation stylesheet
         """
 
@@ -1712,7 +1751,9 @@ class S3Resource(object):
                                    update_policy = update_policy,
                                    conflict_policy = conflict_policy,
                                    last_sync = last_sync,
-                                   onconflict = onconflict)
+                                   onconflict = onconflict,
+                                   digests = digests,
+                                   )
         response.s3.bulk = False
 
         self.files = Storage()
@@ -1775,7 +1816,8 @@ class S3Resource(object):
                     update_policy = None,
                     conflict_policy = None,
                     last_sync = None,
-                    onconflict = None):
+                    onconflict = None,
+                    digests = None):
         """
             Import data from an S3XML element tree.
 
@@ -1787,6 +1829,9 @@ class S3Resource(object):
             @param delete_job: delete the import job from the job table
             @param commit_job: commit the job (default)
 
+            @param digests: registry of record digests exchanged with the
+                            source repository, to skip unchanged records
+
             @todo: update for link table support
         """
 
@@ -1927,7 +1972,12 @@ class S3Resource(object):
                                      update_policy = update_policy,
                                      conflict_policy = conflict_policy,
                                      last_sync = last_sync,
-                                     onconflict = onconflict)
+                                     onconflict = onconflict,
+                                     digests = digests,
+                                     )
+            if digests is not None:
+                # Skip records which have been exchanged before
+                elements = import_job.skip_known(elements)
             add_item = import_job.add_item
             exposed_aliases = self.components.exposed_aliases
             for element in elements:
@@ -958,6 +958,10 @@ class S3Request(object):
         headers["Content-Type"] = s3.content_type.get(representation,
                                                       default)
 
+        # Stream the output?
+        from .s3crud import S3CRUD
+        stream = S3CRUD._stream(get_vars)
+
         # Export the resource
         resource = r.resource
         target = r.target()[3]
@@ -978,6 +982,7 @@ class S3Request(object):
                                      as_json = as_json,
                                      maxbounds = maxbounds,
                                      target = target,
+                                     stream = stream,
                                      **args)
         # Transformation error?
         if not output:
@@ -99,6 +99,7 @@ class S3ResourceTree(object):
               rcomponents = None,
               mdata = False,
               maxbounds = False,
+              digests = None,
               ):
         """
             Build the resource tree
@@ -130,6 +131,9 @@ class S3ResourceTree(object):
                           (=>reduced field set, lookup-only option)
             @param maxbounds: include lat/lon boundaries in the top
                               level element (off by default)
+            @param digests: registry of record digests exchanged with the
+                            target repository (S3SyncDigests), to skip
+                            records the target already holds unchanged
 
             @returns: ElementTree
         """
@@ -238,6 +242,12 @@ class S3ResourceTree(object):
             for renderer, element, attr, f in lazy:
                 renderer.render_node(element, attr, f)
 
+        # Skip records the target repository already holds
+        if digests is not None:
+            results -= self.skip_known(root, digests, results)
+        else:
+            resource.digests = None
+
         # Complete the tree
         tree = xml.tree(None,
                         root = root,
@@ -254,6 +264,159 @@ class S3ResourceTree(object):
 
         return tree
 
+    # -------------------------------------------------------------------------
+    def skip_known(self, root, digests, results):
+        """
+            Remove the elements for records which the target repository
+            already holds with identical contents, and store the digests
+            of the remaining records in the resource (resource.digests)
+
+            @param root: the root element
+            @param digests: the registry of record digests (S3SyncDigests)
+            @param results: the number of master records, i.e. the number
+                            of leading elements for the master resource
+
+            @returns: the number of master records skipped
+        """
+
+        xml = current.xml
+        UID = xml.UID
+        NAME = xml.ATTRIBUTE.name
+
+        # Compute the digests of all records
+        exported = {}
+        elements = []
+        for index, element in enumerate(root.findall(xml.TAG.resource)):
+            uid = element.get(UID)
+            if not uid:
+                continue
+            key = (element.get(NAME), xml.import_uid(uid))
+            exported[key] = xml.digest(element)
+            elements.append((index, key, element))
+
+        # Remove all elements with known digests
+        known = digests.lookup(list(exported.keys()))
+        skipped = 0
+        for index, key, element in elements:
+            if known.get(key) == exported[key]:
+                root.remove(element)
+                del exported[key]
+                if index < results:
+                    skipped += 1
+
+        self.resource.digests = exported
+
+        return skipped
+
+    # -------------------------------------------------------------------------
+    def stream(self,
+               start = 0,
+               limit = None,
+               chunk_size = None,
+               pretty_print = False,
+               progress = None,
+               **args):
+        """
+            Generator to build and serialize the resource tree page by
+            page, writing the elements incrementally (lxml xmlfile) so
+            that the complete document never needs to be held in memory
+
+            @param start: index of the first record to export (slicing)
+            @param limit: maximum number of records to export (slicing)
+            @param chunk_size: number of master records per page
+            @param pretty_print: insert newlines/indentation in the output
+            @param progress: callback function progress(done, total)
+                             to report the export progress
+            @param args: further parameters for build()
+
+            @returns: generator yielding the S3XML document in chunks (bytes)
+
+            @note: records referenced from multiple pages are only
+                   exported once
+            @note: stops extracting data when the generator is closed,
+                   e.g. because the client has disconnected
+        """
+
+        from s3compat import BytesIO
+
+        if not chunk_size:
+            chunk_size = current.deployment_settings.get_base_export_chunk_size()
+
+        xml = current.xml
+        ATTRIBUTE = xml.ATTRIBUTE
+
+        resource = self.resource
+        total = resource.count()
+        if start:
+            total = max(total - start, 0)
+        if limit is not None:
+            total = min(total, limit)
+
+        # Root element attributes
+        tree = xml.tree(None,
+                        domain = xml.domain,
+                        url = self.base_url,
+                        results = total,
+                        start = start,
+                        limit = limit,
+                        maxbounds = args.get("maxbounds", False),
+                        )
+        root = tree.getroot()
+        root.set(ATTRIBUTE.success, "true")
+
+        # Records written so far {(tablename, uuid)}
+        written = set()
+        done = 0
+
+        output = BytesIO()
+        def flush():
+            chunk = output.getvalue()
+            output.seek(0)
+            output.truncate()
+            return chunk
+
+        try:
+            with etree.xmlfile(output, encoding="utf-8") as xf:
+                xf.write_declaration()
+                with xf.element(root.tag, root.attrib):
+                    offset = start or 0
+                    while limit is None or done < limit:
+                        size = chunk_size
+                        if limit is not None:
+                            size = min(size, limit - done)
+
+                        page = self.build(start = offset,
+                                          limit = size,
+                                          **args)
+                        results = resource.results
+                        for element in page.getroot():
+                            key = (element.get(ATTRIBUTE.name),
+                                   element.get(xml.UID),
+                                   )
+                            if key[1]:
+                                if key in written:
+                                    continue
+                                written.add(key)
+                            xf.write(element, pretty_print=pretty_print)
+
+                        done += results
+                        offset += size
+                        if progress:
+                            progress(done, total)
+
+                        xf.flush()
+                        yield flush()
+
+                        if results < size:
+                            break
+
+            yield flush()
+
+        except GeneratorExit:
+            current.log.debug("XML export of %s cancelled after %s records" %
+                              (resource.tablename, done))
+            raise
+
     # -------------------------------------------------------------------------
     def export_resource(self,
                         resource,
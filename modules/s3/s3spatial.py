@@ -0,0 +1,472 @@
+# -*- coding: utf-8 -*-
+
+""" Spatial Index for Locations
+
+    @copyright: 2021 (c) Sahana Software Foundation
+    @license: MIT
+
+    @requires: U{B{I{gluon}} <http://web2py.com>}
+
+    Permission is hereby granted, free of charge, to any person
+    obtaining a copy of this software and associated documentation
+    files (the "Software"), to deal in the Software without
+    restriction, including without limitation the rights to use,
+    copy, modify, merge, publish, distribute, sublicense, and/or sell
+    copies of the Software, and to permit persons to whom the
+    Software is furnished to do so, subject to the following
+    conditions:
+
+    The above copyright notice and this permission notice shall be
+    included in all copies or substantial portions of the Software.
+
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+    EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+    OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+    NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+    HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+    WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+    OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+__all__ = ("S3SpatialIndex",
+           )
+
+import math
+import os
+import tempfile
+import threading
+import time
+
+from gluon import current
+
+from s3compat import pickle
+
+# =============================================================================
+class S3SpatialIndex(object):
+    """
+        In-process R-tree over the bounds of all gis_location records,
+        to pre-select candidates for spatial lookups where no spatial
+        database is available
+
+        - the tree is packed with the Sort-Tile-Recursive algorithm,
+          built lazily once per process and persisted to disk so that
+          other processes can load it instead of rebuilding it
+        - location writes are applied to an overlay (and re-checked
+          against modified_on), the tree is re-packed when the overlay
+          grows too large
+    """
+
+    # Format version of the persisted index
+    FORMAT = 1
+
+    # Maximum number of children per tree node
+    CAPACITY = 16
+
+    # Minimum time between two data version checks (seconds)
+    CHECK_INTERVAL = 10
+
+    # Minimum overlay size to trigger re-packing of the tree
+    REBUILD_MIN = 1000
+
+    # Maximum number of IDs per belongs-query
+    CHUNK_SIZE = 1000
+
+    # Index instances, by application
+    _instances = {}
+    _lock = threading.Lock()
+
+    # -------------------------------------------------------------------------
+    def __init__(self, path=None):
+        """
+            Constructor
+
+            @param path: the file path to persist the index at
+                         (None to keep it in memory only)
+        """
+
+        self.path = path
+
+        self.lock = threading.RLock()
+
+        # All indexed locations {location_id: (xmin, ymin, xmax, ymax)}
+        self.entries = {}
+
+        # The packed tree
+        self.tree = None
+
+        # Overlay: locations changed since the tree was packed
+        self.added = {}
+        self.removed = set()
+
+        # Data version (count, max modified_on, max id)
+        self.version = None
+        self.checked = 0
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def instance(cls):
+        """
+            Get the spatial index of the current application, load or
+            build it if necessary, and bring it up to date
+
+            @returns: the S3SpatialIndex instance
+        """
+
+        application = current.request.application
+
+        with cls._lock:
+            index = cls._instances.get(application)
+            if index is None:
+                path = os.path.join(current.request.folder,
+                                    "uploads",
+                                    "gis_cache",
+                                    "spatial_index.pickle",
+                                    )
+                index = cls._instances[application] = cls(path)
+
+        index.refresh()
+        return index
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def update(cls, location_id):
+        """
+            Update the index for a location after it has been written,
+            onaccept-hook for gis_location; does nothing unless the index
+            has already been loaded in this process
+
+            @param location_id: the gis_location record ID
+        """
+
+        index = cls._instances.get(current.request.application)
+        if index is None or index.version is None:
+            return
+
+        table = current.s3db.gis_location
+        row = current.db(table.id == location_id).select(table.id,
+                                                         table.deleted,
+                                                         table.lat,
+                                                         table.lon,
+                                                         table.lat_min,
+                                                         table.lat_max,
+                                                         table.lon_min,
+                                                         table.lon_max,
+                                                         limitby = (0, 1),
+                                                         ).first()
+        with index.lock:
+            if row and not row.deleted:
+                index.apply(location_id, cls.bounds(row))
+            else:
+                index.apply(location_id, None)
+
+    # -------------------------------------------------------------------------
+    def refresh(self, force=False):
+        """
+            Bring the index up to date with the gis_location table
+
+            @param force: check the data version even if it has been
+                          checked less than CHECK_INTERVAL seconds ago
+        """
+
+        now = time.time()
+        if not force and self.version is not None and \
+           now - self.checked < self.CHECK_INTERVAL:
+            return
+
+        db = current.db
+        table = current.s3db.gis_location
+
+        count = table.id.count()
+        mtime = table.modified_on.max()
+        maxid = table.id.max()
+
+        with self.lock:
+            row = db(table.id > 0).select(count, mtime, maxid).first()
+            version = (row[count], row[mtime], row[maxid] or 0)
+
+            if self.version is None:
+                self.load()
+            self.checked = now
+
+            current_version = self.version
+            if current_version == version:
+                return
+            if current_version is None or \
+               version[1] is None or current_version[1] is None:
+                self.rebuild(version)
+                return
+
+            # Apply all changes since the last known version
+            fields = (table.id,
+                      table.deleted,
+                      table.lat,
+                      table.lon,
+                      table.lat_min,
+                      table.lat_max,
+                      table.lon_min,
+                      table.lon_max,
+                      )
+            query = (table.modified_on >= current_version[1])
+            rows = db(query).select(*fields)
+            new = 0
+            for row in rows:
+                if row.id > current_version[2]:
+                    new += 1
+                self.apply(row.id, None if row.deleted else self.bounds(row))
+
+            if current_version[0] + new != version[0]:
+                # Records have been removed (bypassing soft-delete)
+                self.rebuild(version)
+            else:
+                self.version = version
+
+    # -------------------------------------------------------------------------
+    def rebuild(self, version):
+        """
+            Re-build the index from the gis_location table, and persist it
+
+            @param version: the current data version
+        """
+
+        db = current.db
+        table = current.s3db.gis_location
+
+        query = (table.deleted == False)
+        rows = db(query).select(table.id,
+                                table.lat,
+                                table.lon,
+                                table.lat_min,
+                                table.lat_max,
+                                table.lon_min,
+                                table.lon_max,
+                                )
+        bounds = self.bounds
+        entries = {}
+        for row in rows:
+            bbox = bounds(row)
+            if bbox:
+                entries[row.id] = bbox
+
+        self.entries = entries
+        self.version = version
+        self.pack()
+
+    # -------------------------------------------------------------------------
+    def apply(self, location_id, bbox):
+        """
+            Apply a change of a location to the index
+
+            @param location_id: the location record ID
+            @param bbox: the new bounds of the location, a tuple
+                         (xmin, ymin, xmax, ymax), or None to remove
+                         the location from the index
+        """
+
+        entries = self.entries
+        if bbox is None:
+            if location_id not in entries:
+                return
+            del entries[location_id]
+            self.added.pop(location_id, None)
+        else:
+            if entries.get(location_id) == bbox:
+                return
+            entries[location_id] = bbox
+            self.added[location_id] = bbox
+
+        # Mask the entry in the packed tree
+        self.removed.add(location_id)
+
+        if len(self.removed) > max(self.REBUILD_MIN, len(entries) // 10):
+            self.pack()
+
+    # -------------------------------------------------------------------------
+    def pack(self):
+        """
+            Pack the tree from all current entries, and persist the index
+        """
+
+        items = [(bbox[0], bbox[1], bbox[2], bbox[3], location_id)
+                 for location_id, bbox in self.entries.items()]
+
+        self.tree = self.str_pack(items, self.CAPACITY)
+        self.added = {}
+        self.removed = set()
+
+        self.save()
+
+    # -------------------------------------------------------------------------
+    def search(self, xmin, ymin, xmax, ymax):
+        """
+            Find all locations whose bounds intersect a bounding box
+
+            @param xmin: the minimum longitude
+            @param ymin: the minimum latitude
+            @param xmax: the maximum longitude
+            @param ymax: the maximum latitude
+
+            @returns: list of location record IDs
+        """
+
+        result = []
+        append = result.append
+
+        with self.lock:
+            removed = self.removed
+            stack = [self.tree] if self.tree else []
+            pop = stack.pop
+            extend = stack.extend
+            while stack:
+                node = pop()
+                if node[0] > xmax or node[2] < xmin or \
+                   node[1] > ymax or node[3] < ymin:
+                    continue
+                payload = node[4]
+                if type(payload) is tuple:
+                    extend(payload)
+                elif payload not in removed:
+                    append(payload)
+
+            for location_id, bbox in self.added.items():
+                if bbox[0] > xmax or bbox[2] < xmin or \
+                   bbox[1] > ymax or bbox[3] < ymin:
+                    continue
+                append(location_id)
+
+        return result
+
+    # -------------------------------------------------------------------------
+    def load(self):
+        """
+            Load the persisted index, if available
+        """
+
+        path = self.path
+        if not path or not os.path.exists(path):
+            return
+
+        try:
+            with open(path, "rb") as source:
+                data = pickle.load(source)
+        except Exception:
+            current.log.warning("S3SpatialIndex: could not load %s" % path)
+            return
+
+        if not isinstance(data, dict) or data.get("format") != self.FORMAT:
+            return
+
+        self.entries = data["entries"]
+        self.tree = data["tree"]
+        self.added = {}
+        self.removed = set()
+        self.version = data["version"]
+
+    # -------------------------------------------------------------------------
+    def save(self):
+        """
+            Persist the index (write to a temporary file first, so that
+            concurrent processes never load a partial index)
+        """
+
+        path = self.path
+        if not path or self.version is None:
+            return
+
+        data = {"format": self.FORMAT,
+                "version": self.version,
+                "entries": self.entries,
+                "tree": self.tree,
+                }
+
+        folder = os.path.dirname(path)
+        try:
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            handle, tmp = tempfile.mkstemp(dir=folder)
+            with os.fdopen(handle, "wb") as target:
+                pickle.dump(data, target, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, path)
+        except (IOError, OSError):
+            current.log.warning("S3SpatialIndex: could not persist %s" % path)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def bounds(row):
+        """
+            Get the bounding box of a gis_location record
+
+            @param row: the gis_location Row
+            @returns: tuple (xmin, ymin, xmax, ymax), or None if the
+                      location has no geometry
+        """
+
+        lat, lon = row.lat, row.lon
+        lat_min, lat_max = row.lat_min, row.lat_max
+        lon_min, lon_max = row.lon_min, row.lon_max
+
+        if None in (lat_min, lat_max, lon_min, lon_max):
+            if lat is None or lon is None:
+                return None
+            lat_min = lat_max = lat
+            lon_min = lon_max = lon
+
+        return (float(lon_min), float(lat_min), float(lon_max), float(lat_max))
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def str_pack(items, capacity):
+        """
+            Pack an R-tree using the Sort-Tile-Recursive algorithm
+
+            @param items: list of tuples (xmin, ymin, xmax, ymax, ID)
+            @param capacity: the maximum number of children per node
+
+            @returns: the root node, a tuple (xmin, ymin, xmax, ymax, payload),
+                      where payload is either a tuple of child nodes or an ID
+        """
+
+        nodes = list(items)
+        if not nodes:
+            return None
+
+        x_center = lambda node: node[0] + node[2]
+        y_center = lambda node: node[1] + node[3]
+
+        while len(nodes) > 1:
+            count = len(nodes)
+            groups = int(math.ceil(float(count) / capacity))
+            slices = int(math.ceil(math.sqrt(groups)))
+            slice_size = slices * capacity
+
+            nodes.sort(key=x_center)
+
+            parents = []
+            for i in range(0, count, slice_size):
+                tile = sorted(nodes[i:i + slice_size], key=y_center)
+                for j in range(0, len(tile), capacity):
+                    children = tuple(tile[j:j + capacity])
+                    parents.append((min(c[0] for c in children),
+                                    min(c[1] for c in children),
+                                    max(c[2] for c in children),
+                                    max(c[3] for c in children),
+                                    children,
+                                    ))
+            nodes = parents
+
+        return nodes[0]
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def chunks(cls, ids):
+        """
+            Split a list of IDs into chunks for belongs-queries
+
+            @param ids: the list of IDs
+        """
+
+        size = cls.CHUNK_SIZE
+        for i in range(0, len(ids), size):
+            yield ids[i:i + size]
+
+# END =========================================================================
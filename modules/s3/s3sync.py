@@ -27,15 +27,20 @@
     OTHER DEALINGS IN THE SOFTWARE.
 """
 
+import contextlib
+import datetime
 import json
+import os
+import shutil
 import sys
-import datetime
+import tempfile
 
 from gluon import current, URL, DIV
 from gluon.storage import Storage
 
-from s3compat import BytesIO, unicodeT
+from s3compat import PY2, unicodeT
 from .s3datetime import s3_parse_datetime, s3_utc
+from .s3fields import s3_all_meta_field_names
 from .s3rest import S3Method
 from .s3import import S3ImportItem
 from .s3query import S3URLQuery
@@ -256,6 +261,19 @@ class S3Sync(S3Method):
         if msince is not None:
             msince = s3_parse_datetime(msince)
 
+        # Paged transfer
+        paging = {}
+        page_size = vars_get("page_size", None)
+        if page_size is not None:
+            try:
+                page_size = int(page_size)
+            except ValueError:
+                page_size = None
+            if page_size and page_size > 0:
+                paging = {"page_size": page_size,
+                          "token": vars_get("token", None),
+                          }
+
         # Sync filters from peer
         filters = {}
         for k, v in get_vars.items():
@@ -288,7 +306,7 @@ class S3Sync(S3Method):
                                     msince = msince,
                                     filters = filters,
                                     mixed = mixed,
-                                    )
+                                    **paging)
         except NotImplementedError:
             r.error(405, "Synchronization method not supported for repository")
 
@@ -442,41 +460,50 @@ class S3Sync(S3Method):
 
         current.log.debug("S3Sync: synchronize %s" % repository.url)
 
-        log = self.log
-        repository_id = repository.id
-
-        error = None
-        if repository.apitype == "filesync":
-            if not repository.path:
-                error = "No path set for repository"
-        else:
-            if not repository.url:
-                error = "No URL set for repository"
-        if error:
-            log.write(repository_id = repository_id,
-                      resource_name = None,
-                      transmission = None,
-                      mode = log.NONE,
-                      action = "connect",
-                      remote = False,
-                      result = log.FATAL,
-                      message = error,
-                      )
+        connector = self.connect(repository)
+        if not connector:
             return False
 
-        # Should we update sync tasks from peer?
-        connector = S3SyncRepository(repository)
-        if hasattr(connector, "refresh"):
-            success = connector.refresh()
-
         # Look up current sync tasks
         db = current.db
-        s3db = current.s3db
-        ttable = s3db.sync_task
-        query = (ttable.repository_id == repository_id) & \
+        ttable = current.s3db.sync_task
+        query = (ttable.repository_id == repository.id) & \
                 (ttable.deleted == False)
         tasks = db(query).select()
 
+        success = True
+        for task in tasks:
+            error = self.synchronize_task(connector, task)
+            if error:
+                success = False
+
+        self.disconnect(connector)
+
+        return success
+
+    # -------------------------------------------------------------------------
+    def connect(self, repository, refresh=True):
+        """
+            Connect to a repository (log in, activate UUID synchronization)
+
+            @param repository: the repository Row
+            @param refresh: update the sync tasks from the peer if the
+                            adapter supports it
+
+            @return: the S3SyncRepository, or None if the connection failed
+        """
+
+        if not self.check_repository(repository):
+            return None
+
+        log = self.log
+        repository_id = repository.id
+
+        # Should we update sync tasks from peer?
+        connector = S3SyncRepository(repository)
+        if refresh and hasattr(connector, "refresh"):
+            connector.refresh()
+
         # Login at repository
         error = connector.login()
         if error:
@@ -489,57 +516,107 @@ class S3Sync(S3Method):
                       result = log.FATAL,
                       message = error,
                       )
-            return False
+            return None
 
         # Activate UUID synchronisation if required
-        s3 = current.response.s3
-        s3.synchronise_uuids = connector.synchronise_uuids
+        current.response.s3.synchronise_uuids = connector.synchronise_uuids
 
-        # Delta for msince progress = 1 second after the mtime of
-        # the youngest item transmitted (without this, the youngest
-        # items would be re-transmitted until there is another update,
-        # because msince means greater-or-equal)
-        delta = datetime.timedelta(seconds=1)
+        return connector
 
-        success = True
-        for task in tasks:
+    # -------------------------------------------------------------------------
+    def check_repository(self, repository):
+        """
+            Check whether a repository is configured for synchronization,
+            log an error if not
 
-            # Pull
-            mtime = None
-            if task.mode in (1, 3):
-                error, mtime = connector.pull(task,
-                                              onconflict=self.onconflict,
-                                              )
-            if error:
-                success = False
-                current.log.debug("S3Sync: %s PULL error: %s" %
-                                  (task.resource_name, error))
-                continue
-            if mtime is not None:
-                task.update_record(last_pull=mtime+delta)
+            @param repository: the repository Row
 
-            # Push
-            mtime = None
-            if task.mode in (2, 3):
-                error, mtime = connector.push(task)
-            if error:
-                success = False
-                current.log.debug("S3Sync: %s PUSH error: %s" %
-                                  (task.resource_name, error))
-                continue
-            if mtime is not None:
-                task.update_record(last_push=mtime+delta)
+            @return: True|False
+        """
 
-            current.log.debug("S3Sync.synchronize: %s done" % task.resource_name)
+        error = None
+        if repository.apitype == "filesync":
+            if not repository.path:
+                error = "No path set for repository"
+        else:
+            if not repository.url:
+                error = "No URL set for repository"
+        if error:
+            log = self.log
+            log.write(repository_id = repository.id,
+                      resource_name = None,
+                      transmission = None,
+                      mode = log.NONE,
+                      action = "connect",
+                      remote = False,
+                      result = log.FATAL,
+                      message = error,
+                      )
+            return False
+
+        return True
 
-        s3.synchronise_uuids = False
-        db(s3db.sync_repository.id == repository_id).update(
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def disconnect(connector):
+        """
+            Finish synchronization with a repository
+
+            @param connector: the S3SyncRepository
+        """
+
+        current.response.s3.synchronise_uuids = False
+
+        table = current.s3db.sync_repository
+        current.db(table.id == connector.id).update(
                             last_connected = datetime.datetime.utcnow(),
                             )
 
         connector.close_archives()
 
-        return success
+    # -------------------------------------------------------------------------
+    def synchronize_task(self, connector, task):
+        """
+            Run a single sync task (pull and/or push)
+
+            @param connector: the S3SyncRepository (connected)
+            @param task: the sync_task Row
+
+            @return: error message, or None if successful
+        """
+
+        # Delta for msince progress = 1 second after the mtime of
+        # the youngest item transmitted (without this, the youngest
+        # items would be re-transmitted until there is another update,
+        # because msince means greater-or-equal)
+        delta = datetime.timedelta(seconds=1)
+
+        # Pull
+        error = mtime = None
+        if task.mode in (1, 3):
+            error, mtime = connector.pull(task,
+                                          onconflict=self.onconflict,
+                                          )
+        if error:
+            current.log.debug("S3Sync: %s PULL error: %s" %
+                              (task.resource_name, error))
+            return error
+        if mtime is not None:
+            task.update_record(last_pull=mtime+delta)
+
+        # Push
+        mtime = None
+        if task.mode in (2, 3):
+            error, mtime = connector.push(task)
+        if error:
+            current.log.debug("S3Sync: %s PUSH error: %s" %
+                              (task.resource_name, error))
+            return error
+        if mtime is not None:
+            task.update_record(last_push=mtime+delta)
+
+        current.log.debug("S3Sync.synchronize: %s done" % task.resource_name)
+        return None
 
     # -------------------------------------------------------------------------
     @classmethod
@@ -698,9 +775,11 @@ class S3Sync(S3Method):
             # Get the sync filters for this task
             filters = current.sync.get_filters(task.id)
 
-            # Export the resource as S3XML
+            # Export the resource as S3XML, streaming the document
+            # directly into the archive
             data = resource.export_xml(filters = filters,
                                        #pretty_print = True,
+                                       stream = True,
                                        )
 
             # Add to archive, using the UUID of the task as object name
@@ -995,6 +1074,8 @@ class S3SyncRepository(object):
         self.adapter = adapter
         self.archives = {}
 
+        self._digests = None
+
     # -------------------------------------------------------------------------
     @property
     def config(self):
@@ -1008,6 +1089,16 @@ class S3SyncRepository(object):
 
         return self._config
 
+    # -------------------------------------------------------------------------
+    @property
+    def digests(self):
+        """ Lazy access to the record digests exchanged with this repository """
+
+        if self._digests is None and self.id:
+            self._digests = S3SyncDigests(self.id)
+
+        return self._digests
+
     # -------------------------------------------------------------------------
     def __getattr__(self, name):
         """
@@ -1029,6 +1120,495 @@ class S3SyncRepository(object):
                 archive.close()
         self.archives = {}
 
+# =============================================================================
+class S3SyncDigests(object):
+    """
+        Registry of the content digests (S3XML.digest) of the records
+        last exchanged with a peer repository, used by exporter and
+        importer to skip records the peer already holds unchanged
+        (e.g. echoes of bidirectional synchronization)
+    """
+
+    # Maximum number of UUIDs per lookup query
+    BATCH_SIZE = 500
+
+    def __init__(self, repository_id):
+        """
+            Constructor
+
+            @param repository_id: the sync_repository record ID
+        """
+
+        self.repository_id = repository_id
+
+    # -------------------------------------------------------------------------
+    def lookup(self, keys):
+        """
+            Look up the digests for records
+
+            @param keys: the record keys, list of tuples (tablename, uuid)
+
+            @returns: dict {(tablename, uuid): digest}
+        """
+
+        digests = {}
+        if not keys:
+            return digests
+
+        table = current.s3db.sync_digest
+        db = current.db
+
+        uuids = list(set(uuid for _, uuid in keys))
+        base = (table.repository_id == self.repository_id)
+        size = self.BATCH_SIZE
+        for index in range(0, len(uuids), size):
+            query = base & (table.uuid.belongs(uuids[index:index + size]))
+            rows = db(query).select(table.tablename,
+                                    table.uuid,
+                                    table.digest,
+                                    )
+            for row in rows:
+                digests[(row.tablename, row.uuid)] = row.digest
+
+        return digests
+
+    # -------------------------------------------------------------------------
+    def update(self, digests):
+        """
+            Store the digests of records exchanged with the peer
+
+            @param digests: dict {(tablename, uuid): digest}
+        """
+
+        if not digests:
+            return
+
+        table = current.s3db.sync_digest
+        db = current.db
+
+        repository_id = self.repository_id
+        known = self.lookup(list(digests.keys()))
+
+        for key, digest in digests.items():
+            if key in known:
+                if known[key] != digest:
+                    tablename, uuid = key
+                    query = (table.repository_id == repository_id) & \
+                            (table.tablename == tablename) & \
+                            (table.uuid == uuid)
+                    db(query).update(digest=digest)
+            else:
+                tablename, uuid = key
+                table.insert(repository_id = repository_id,
+                             tablename = tablename,
+                             uuid = uuid,
+                             digest = digest,
+                             )
+
+# =============================================================================
+class S3SyncScheduler(object):
+    """
+        Orchestrator for concurrent synchronization: runs each sync task
+        as a separate scheduler job (sync_run), up to a configurable number
+        in parallel across all repositories, while runs writing to the same
+        tables are serialized by table locks (sync_lock)
+    """
+
+    # Runs holding their locks for longer than this (seconds) are
+    # considered dead, and their locks released
+    TIMEOUT = 7200
+
+    ACTIVE = ("QUEUED", "STARTING", "RUNNING")
+
+    def __init__(self):
+        """ Constructor """
+
+        self.sync = S3Sync()
+
+        limit = current.deployment_settings.get_sync_concurrency()
+        self.limit = max(1, limit or 1)
+
+    # -------------------------------------------------------------------------
+    def schedule(self, repository, manual=False):
+        """
+            Queue runs for all active tasks of a repository, and start them
+
+            @param repository: the repository Row
+            @param manual: manual synchronization
+
+            @return: list of sync_run IDs, or None if the repository
+                     is already being synchronized
+        """
+
+        db = current.db
+        s3db = current.s3db
+
+        # Release the locks of dead runs first, otherwise they would
+        # block the repository forever
+        self.expire()
+
+        if self.active(repository.id):
+            return None
+
+        sync = self.sync
+        if not sync.check_repository(repository):
+            return []
+
+        # Update sync tasks from peer (once per repository, not per run)
+        connector = S3SyncRepository(repository)
+        if hasattr(connector, "refresh"):
+            connector.refresh()
+
+        ttable = s3db.sync_task
+        query = (ttable.repository_id == repository.id) & \
+                (ttable.mode != 4) & \
+                (ttable.deleted == False)
+        tasks = db(query).select(ttable.id,
+                                 ttable.resource_name,
+                                 ttable.components,
+                                 )
+
+        rtable = s3db.sync_run
+        now = datetime.datetime.utcnow()
+
+        run_ids = []
+        for task in tasks:
+            run_id = rtable.insert(repository_id = repository.id,
+                                   task_id = task.id,
+                                   resource_name = task.resource_name,
+                                   tablenames = self.tablenames(task),
+                                   status = "QUEUED",
+                                   queued_on = now,
+                                   )
+            run_ids.append(run_id)
+
+        if run_ids:
+            sync.set_status(running=True, manual=manual)
+        db.commit()
+
+        self.dispatch()
+
+        return run_ids
+
+    # -------------------------------------------------------------------------
+    def dispatch(self):
+        """
+            Start queued runs, up to the concurrency limit
+        """
+
+        s3task = current.s3task
+
+        self.expire()
+
+        if not s3task._is_alive():
+            # No scheduler workers => run queued runs one after another
+            while True:
+                claimed = self.claim(1)
+                if not claimed:
+                    break
+                self.run(claimed[0], dispatch=False)
+            return
+
+        db = current.db
+        rtable = current.s3db.sync_run
+
+        query = (rtable.status.belongs(("STARTING", "RUNNING"))) & \
+                (rtable.deleted == False)
+        running = db(query).count()
+
+        for run_id in self.claim(self.limit - running):
+            task_id = s3task.run_async("sync_run",
+                                       args = [run_id],
+                                       timeout = self.TIMEOUT,
+                                       )
+            if task_id is False:
+                self.finish(run_id, None, "Could not start sync_run task")
+
+    # -------------------------------------------------------------------------
+    def claim(self, limit):
+        """
+            Claim queued runs for execution, by acquiring their table locks
+
+            @param limit: the maximum number of runs to claim
+
+            @return: list of sync_run IDs
+        """
+
+        if limit < 1:
+            return []
+
+        db = current.db
+        s3db = current.s3db
+
+        rtable = s3db.sync_run
+        ltable = s3db.sync_lock
+
+        # Locks must be acquired in separate transactions
+        db.commit()
+
+        rows = db(ltable.id > 0).select(ltable.tablename)
+        locked = set(row.tablename for row in rows)
+
+        query = (rtable.status == "QUEUED") & \
+                (rtable.deleted == False)
+        queued = db(query).select(rtable.id,
+                                  rtable.tablenames,
+                                  orderby = rtable.id,
+                                  )
+
+        now = datetime.datetime.utcnow()
+
+        claimed = []
+        for run in queued:
+
+            if len(claimed) >= limit:
+                break
+
+            tablenames = set(run.tablenames or [])
+            if tablenames & locked:
+                continue
+
+            try:
+                for tablename in tablenames:
+                    ltable.insert(tablename = tablename,
+                                  run_id = run.id,
+                                  timestmp = now,
+                                  )
+                query = (rtable.id == run.id) & \
+                        (rtable.status == "QUEUED")
+                updated = db(query).update(status = "STARTING")
+            except Exception:
+                # Lock acquired by a concurrent dispatcher
+                db.rollback()
+                continue
+            if not updated:
+                # Run claimed by a concurrent dispatcher
+                db.rollback()
+                continue
+            db.commit()
+
+            locked |= tablenames
+            claimed.append(run.id)
+
+        return claimed
+
+    # -------------------------------------------------------------------------
+    def run(self, run_id, dispatch=True):
+        """
+            Execute a claimed run, called from scheduler task
+
+            @param run_id: the sync_run record ID
+            @param dispatch: start further queued runs when done
+
+            @return: True if successful, False if there was an error
+        """
+
+        db = current.db
+        rtable = current.s3db.sync_run
+
+        query = (rtable.id == run_id) & \
+                (rtable.status == "STARTING")
+        run = db(query).select(rtable.id,
+                               rtable.repository_id,
+                               rtable.task_id,
+                               limitby = (0, 1),
+                               ).first()
+        if not run:
+            return False
+
+        started = datetime.datetime.utcnow()
+        run.update_record(status = "RUNNING",
+                          started_on = started,
+                          )
+        db.commit()
+
+        try:
+            error = self.execute(run)
+        except Exception:
+            db.rollback()
+            error = s3_str(sys.exc_info()[1])
+
+        self.finish(run_id, started, error)
+
+        if dispatch:
+            self.dispatch()
+
+        return not error
+
+    # -------------------------------------------------------------------------
+    def execute(self, run):
+        """
+            Run the sync task of a run
+
+            @param run: the sync_run Row
+
+            @return: error message, or None if successful
+        """
+
+        db = current.db
+        s3db = current.s3db
+
+        table = s3db.sync_repository
+        query = (table.id == run.repository_id) & \
+                (table.deleted == False)
+        repository = db(query).select(limitby=(0, 1)).first()
+
+        table = s3db.sync_task
+        query = (table.id == run.task_id) & \
+                (table.deleted == False)
+        task = db(query).select(limitby=(0, 1)).first()
+
+        if not repository or not task:
+            return "Repository or task not found"
+
+        sync = self.sync
+        connector = sync.connect(repository, refresh=False)
+        if not connector:
+            return "Could not connect to repository"
+        try:
+            error = sync.synchronize_task(connector, task)
+        finally:
+            sync.disconnect(connector)
+
+        return s3_str(error) if error else None
+
+    # -------------------------------------------------------------------------
+    def finish(self, run_id, started, error):
+        """
+            Record the outcome of a run, and release its table locks
+
+            @param run_id: the sync_run record ID
+            @param started: the start date/time of the run
+            @param error: the error message, or None if successful
+        """
+
+        db = current.db
+        s3db = current.s3db
+
+        finished = datetime.datetime.utcnow()
+        if started:
+            duration = (finished - started).total_seconds()
+        else:
+            duration = None
+
+        table = s3db.sync_run
+        db(table.id == run_id).update(status = "FAILED" if error else "SUCCESS",
+                                      finished_on = finished,
+                                      duration = duration,
+                                      message = error,
+                                      )
+
+        table = s3db.sync_lock
+        db(table.run_id == run_id).delete()
+
+        if not self.active():
+            self.sync.set_status(running=False, manual=False)
+
+        db.commit()
+
+    # -------------------------------------------------------------------------
+    def expire(self):
+        """
+            Fail runs which have been holding their locks for longer
+            than the timeout (e.g. due to a worker crash)
+        """
+
+        db = current.db
+        table = current.s3db.sync_lock
+
+        cutoff = datetime.datetime.utcnow() - \
+                 datetime.timedelta(seconds=self.TIMEOUT)
+        rows = db(table.timestmp < cutoff).select(table.run_id,
+                                                  distinct = True,
+                                                  )
+        for row in rows:
+            self.finish(row.run_id, None, "Timed out")
+
+    # -------------------------------------------------------------------------
+    def active(self, repository_id=None):
+        """
+            Check whether there are any queued or running runs
+
+            @param repository_id: limit the check to this repository
+
+            @return: True|False
+        """
+
+        table = current.s3db.sync_run
+
+        query = (table.status.belongs(self.ACTIVE)) & \
+                (table.deleted == False)
+        if repository_id:
+            query &= (table.repository_id == repository_id)
+
+        return current.db(query).select(table.id,
+                                        limitby = (0, 1),
+                                        ).first() is not None
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def tablenames(task):
+        """
+            Determine the tables a sync task writes to, i.e. the master
+            table and (if included) its component and link tables, and
+            all tables they reference (directly or indirectly), because
+            the import also creates or updates referenced records if the
+            peer includes them in the data (e.g. gis_location, pr_person,
+            org_organisation_type)
+
+            - references in meta-fields are not followed, as they are not
+              imported
+            - references to super-entities are not followed, as those are
+              only written per instance record, and never matched with
+              incoming data
+
+            @param task: the sync_task Row
+
+            @return: list of table names
+        """
+
+        s3db = current.s3db
+
+        tablename = task.resource_name
+        tablenames = {tablename}
+
+        if task.components is not False:
+            hooks = s3db.get_hooks(tablename)[1]
+            if hooks:
+                for hook in hooks.values():
+                    tablenames.add(hook.tablename)
+                    if hook.linktable:
+                        tablenames.add(hook.linktable)
+
+        # Add referenced tables
+        meta_fields = set(s3_all_meta_field_names())
+        pending = list(tablenames)
+        while pending:
+            table = s3db.table(pending.pop())
+            if table is None:
+                continue
+            for field in table:
+                if field.name in meta_fields:
+                    continue
+                ftype = str(field.type)
+                if ftype[:10] == "reference ":
+                    referenced = ftype[10:]
+                elif ftype[:15] == "list:reference ":
+                    referenced = ftype[15:]
+                else:
+                    continue
+                referenced = referenced.split(".", 1)[0]
+                if referenced in tablenames:
+                    continue
+                rtable = s3db.table(referenced)
+                if rtable is None or "instance_type" in rtable.fields:
+                    # Unknown table or super-entity
+                    continue
+                tablenames.add(referenced)
+                pending.append(referenced)
+
+        return sorted(tablenames)
+
 # =============================================================================
 class S3SyncBaseAdapter(object):
     """
@@ -1114,6 +1694,8 @@ class S3SyncBaseAdapter(object):
              filters=None,
              mixed=False,
              pretty_print=False,
+             page_size=None,
+             token=None,
              ):
         """
             Respond to an incoming pull from the peer repository
@@ -1125,6 +1707,9 @@ class S3SyncBaseAdapter(object):
             @param filters: URL filters for record extraction
             @param mixed: negotiate resource with peer (disregard resource)
             @param pretty_print: make the output human-readable
+            @param page_size: maximum number of records per page (paged
+                              transfer, overrides start/limit)
+            @param token: continuation token of the page to send
 
             @return: a dict {status, remote, message, response}, with:
                         - status....the outcome of the operation
@@ -1172,8 +1757,15 @@ class S3SyncDataArchive(object):
         Simple abstraction layer for (compressed) data archives, currently
         based on zipfile (Python standard library). Compression additionally
         requires zlib to be installed (both for write and read).
+
+        Archives are kept in temporary files, and objects are streamed
+        into and out of the archive, so that large archives need not be
+        held in memory.
     """
 
+    # Buffer size for copying between files
+    CHUNK_SIZE = 65536
+
     def __init__(self, fileobj=None, compressed=True):
         """
             Create or open an archive
@@ -1194,15 +1786,18 @@ class S3SyncDataArchive(object):
         if fileobj is not None:
             if not hasattr(fileobj, "seek"):
                 # Possibly a addinfourl instance from urlopen,
-                # => must copy to BytesIO buffer for random access
-                fileobj = BytesIO(fileobj.read())
+                # => must copy to a temporary file for random access
+                tmp = tempfile.TemporaryFile()
+                shutil.copyfileobj(fileobj, tmp, self.CHUNK_SIZE)
+                tmp.seek(0)
+                fileobj = tmp
             try:
                 archive = zipfile.ZipFile(fileobj, "r")
-            except RuntimeError:
+            except (RuntimeError, zipfile.BadZipfile):
                 current.log.warn("invalid ZIP archive: %s" % sys.exc_info()[1])
                 archive = None
         else:
-            fileobj = BytesIO()
+            fileobj = tempfile.TemporaryFile()
             try:
                 archive = zipfile.ZipFile(fileobj, "w", compression, True)
             except RuntimeError:
@@ -1220,14 +1815,15 @@ class S3SyncDataArchive(object):
             Add an object to the archive
 
             @param name: the file name for the object inside the archive
-            @param obj: the object to add (string or file-like object)
+            @param obj: the object to add (string, file-like object, or
+                        an iterable of strings, e.g. a streamed export)
 
             @raises UserWarning: when adding a duplicate name (overwrites
                                  the existing object in the archive)
             @raises RuntimeError: if the archive is not writable, or
                                   no valid object name has been provided
-            @raises TypeError: if the object is not a unicode, str or
-                               file-like object
+            @raises TypeError: if the object is not a unicode, str,
+                               file-like object or iterable
         """
 
         # Make sure the object name is an utf-8 encoded str
@@ -1244,7 +1840,8 @@ class S3SyncDataArchive(object):
         if hasattr(obj, "read"):
             if hasattr(obj, "seek"):
                 obj.seek(0)
-            archive.writestr(name, obj.read())
+            with self._open(name) as target:
+                shutil.copyfileobj(obj, target, self.CHUNK_SIZE)
 
         elif isinstance(obj, (str, bytes)):
             archive.writestr(name, obj)
@@ -1253,9 +1850,45 @@ class S3SyncDataArchive(object):
             # Convert unicode objects to str (Py2 backwards-compatibility)
             archive.writestr(name, s3_str(obj))
 
+        elif hasattr(obj, "__iter__"):
+            with self._open(name) as target:
+                for chunk in obj:
+                    if isinstance(chunk, unicodeT):
+                        chunk = chunk.encode("utf-8")
+                    target.write(chunk)
+
         else:
             raise TypeError("invalid object type")
 
+    # -------------------------------------------------------------------------
+    @contextlib.contextmanager
+    def _open(self, name):
+        """
+            Context manager to write an object into the archive
+
+            @param name: the object name
+
+            @returns: writable file-like object
+        """
+
+        archive = self.archive
+
+        if not PY2:
+            # Stream directly into the archive
+            with archive.open(name, "w", force_zip64=True) as target:
+                yield target
+        else:
+            # Python-2 zipfile can only add complete files
+            # => buffer in a temporary file
+            tmp = tempfile.NamedTemporaryFile(delete=False)
+            try:
+                yield tmp
+                tmp.close()
+                archive.write(tmp.name, name)
+            finally:
+                tmp.close()
+                os.unlink(tmp.name)
+
     # -------------------------------------------------------------------------
     def extract(self, name):
         """
@@ -59,6 +59,46 @@ class S3Task(object):
 
     TASK_TABLENAME = "scheduler_task"
 
+    # Task queues {name: {"group": worker group, "priority": priority}}
+    # - extended/overridden by the scheduler.queues setting
+    # - all default queues use the default worker group, so that a
+    #   single worker (python web2py.py -K eden) runs all tasks
+    QUEUES = {"high": {"group": "main", "priority": 2},
+              "default": {"group": "main", "priority": 1},
+              "low": {"group": "main", "priority": 0},
+              }
+
+    # Queues for tasks {taskname: queuename}, tasks not listed here
+    # are queued in "default"
+    # - extended/overridden by the scheduler.task_queues setting
+    TASK_QUEUES = {# Latency-sensitive
+                   "gis_update_location_tree": "high",
+                   "msg_gcm": "high",
+                   "msg_process_outbox": "high",
+                   # Long-running
+                   "disease_stats_update_aggregates": "low",
+                   "disease_stats_update_location_aggregates": "low",
+                   "document_create_index": "low",
+                   "document_delete_index": "low",
+                   "gis_import_admin_areas": "low",
+                   "s3_export_job": "low",
+                   "stats_demographic_update_aggregate_location": "low",
+                   "stats_demographic_update_aggregates": "low",
+                   "sync_run": "low",
+                   "sync_synchronize": "low",
+                   "vulnerability_update_aggregates": "low",
+                   "vulnerability_update_location_aggregate": "low",
+                   }
+
+    # Priority step (seconds): the web2py scheduler assigns tasks in
+    # order of next_run_time, so tasks are queued with their next_run_time
+    # brought forward by this interval per priority level
+    # - applies to run_async/run_async_batch only: tasks scheduled with
+    #   schedule_task keep their next_run_time (e.g. for periodic tasks),
+    #   and thus, once due, rank like priority 0, i.e. behind "default"
+    #   tasks queued up to one PRIORITY_STEP after they became due
+    PRIORITY_STEP = 3600
+
     # -------------------------------------------------------------------------
     def __init__(self):
 
@@ -238,7 +278,7 @@ class S3Task(object):
     # -------------------------------------------------------------------------
     # API Function run within the main flow of the application
     # -------------------------------------------------------------------------
-    def run_async(self, task, args=None, vars=None, timeout=300):
+    def run_async(self, task, args=None, vars=None, timeout=300, queue=None):
         """
             Wrapper to call an asynchronous task.
             - run from the main request
@@ -249,6 +289,8 @@ class S3Task(object):
             @param vars: The list of named vars to send to the function
             @param timeout: The length of time available for the task to complete
                             - default 300s (5 mins)
+            @param queue: the name of the queue to use (default: the queue
+                          configured for the task)
         """
 
         if args is None:
@@ -262,21 +304,12 @@ class S3Task(object):
             return False
 
         # Check that args/vars are JSON-serializable
-        try:
-            json.dumps(args)
-        except (ValueError, TypeError):
-            msg = "S3Task.run_async args not JSON-serializable: %s" % args
-            current.log.error(msg)
-            raise
-        try:
-            json.dumps(vars)
-        except (ValueError, TypeError):
-            msg = "S3Task.run_async vars not JSON-serializable: %s" % vars
-            current.log.error(msg)
-            raise
+        self._check_serializable(args, vars)
+
+        queue, group_name, priority = self.get_queue(task, queue=queue)
 
         # Run synchronously if scheduler not running
-        if not self._is_alive():
+        if not self._is_alive(group_name):
             tasks[task](*args, **vars)
             return None # No task ID in this case
 
@@ -286,6 +319,7 @@ class S3Task(object):
             vars["user_id"] = current.auth.user.id
         except AttributeError:
             pass
+        now = datetime.datetime.now()
         queued = self.scheduler.queue_task(task,
                                            pargs = args,
                                            pvars = vars,
@@ -293,11 +327,306 @@ class S3Task(object):
                                                               current.request.application,
                                            function_name = task,
                                            timeout = timeout,
+                                           group_name = group_name,
+                                           start_time = now,
+                                           next_run_time = self._next_run_time(now, priority),
                                            )
 
         # Return task ID so that status can be polled
         return queued.id
 
+    # -------------------------------------------------------------------------
+    def run_async_batch(self, task, calls, timeout=300, queue=None):
+        """
+            Queue many calls of the same task at once (fan-out), with
+            a single check for alive workers and a bulk insert
+
+            @param task: The function which should be run
+                         - async if a worker is alive
+            @param calls: list of tuples (args, vars) for the calls
+            @param timeout: The length of time available for each call to complete
+                            - default 300s (5 mins)
+            @param queue: the name of the queue to use (default: the queue
+                          configured for the task)
+
+            @returns: list of task IDs, or None if the calls were run
+                      synchronously
+        """
+
+        # Check that task is defined (and callable)
+        tasks = current.response.s3.tasks
+        if not tasks or not callable(tasks.get(task)):
+            return False
+
+        items = []
+        for args, vars in calls:
+            args = list(args) if args else []
+            vars = dict(vars) if vars else {}
+            self._check_serializable(args, vars)
+            items.append((args, vars))
+        if not items:
+            return []
+
+        queue, group_name, priority = self.get_queue(task, queue=queue)
+
+        # Run synchronously if scheduler not running
+        if not self._is_alive(group_name):
+            function = tasks[task]
+            for args, vars in items:
+                function(*args, **vars)
+            return None # No task IDs in this case
+
+        try:
+            user_id = current.auth.user.id
+        except AttributeError:
+            user_id = None
+
+        now = datetime.datetime.now()
+        next_run_time = self._next_run_time(now, priority)
+        application_name = "%s/default" % current.request.application
+
+        rows = []
+        for args, vars in items:
+            if user_id:
+                # Add the current user to the vars
+                vars["user_id"] = user_id
+            rows.append({"application_name": application_name,
+                         "task_name": task,
+                         "function_name": task,
+                         "args": json.dumps(args),
+                         "vars": json.dumps(vars),
+                         "group_name": group_name,
+                         "timeout": timeout,
+                         "start_time": now,
+                         "next_run_time": next_run_time,
+                         })
+
+        # Return task IDs so that status can be polled
+        return current.db[self.TASK_TABLENAME].bulk_insert(rows)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _check_serializable(args, vars):
+        """
+            Check that args/vars of a task are JSON-serializable
+
+            @param args: the list of unnamed args
+            @param vars: the dict of named vars
+
+            @raises: ValueError/TypeError if not serializable
+        """
+
+        try:
+            json.dumps(args)
+        except (ValueError, TypeError):
+            msg = "S3Task.run_async args not JSON-serializable: %s" % args
+            current.log.error(msg)
+            raise
+        try:
+            json.dumps(vars)
+        except (ValueError, TypeError):
+            msg = "S3Task.run_async vars not JSON-serializable: %s" % vars
+            current.log.error(msg)
+            raise
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def get_queues(cls):
+        """
+            Get the configured task queues
+
+            @returns: dict {queue_name: {"group": group_name,
+                                         "priority": priority,
+                                         }}
+        """
+
+        queues = dict((name, dict(config))
+                      for name, config in cls.QUEUES.items())
+
+        configured = current.deployment_settings.get_scheduler_queues()
+        for name, config in configured.items():
+            if name in queues:
+                queues[name].update(config)
+            else:
+                queues[name] = dict(config)
+
+        for config in queues.values():
+            config["group"] = config.get("group") or "main"
+            config["priority"] = config.get("priority") or 0
+
+        return queues
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def get_queue(cls, task, queue=None):
+        """
+            Get the queue for a task
+
+            @param task: the task name
+            @param queue: the queue name (overrides the configured queue)
+
+            @returns: tuple (queue_name, group_name, priority)
+        """
+
+        if queue is None:
+            task_queues = dict(cls.TASK_QUEUES)
+            task_queues.update(current.deployment_settings.get_scheduler_task_queues())
+            queue = task_queues.get(task, "default")
+
+        queues = cls.get_queues()
+        config = queues.get(queue)
+        if config is None:
+            current.log.warning("S3Task: unknown queue", value=queue)
+            queue = "default"
+            config = queues[queue]
+
+        return queue, config["group"], config["priority"]
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def _next_run_time(cls, now, priority):
+        """
+            Get the next_run_time for a task to be queued with a priority
+
+            @param now: the current date/time
+            @param priority: the priority
+        """
+
+        if not priority:
+            return now
+        return now - datetime.timedelta(seconds = priority * cls.PRIORITY_STEP)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def queue_status(cls, window=3600):
+        """
+            Get the status of all task queues
+
+            @param window: the time window (seconds) for the latency statistics
+
+            @returns: dict {queue_name: {"group": the worker group,
+                                         "priority": the priority,
+                                         "workers": number of alive workers in the group,
+                                         "queued": number of due tasks waiting,
+                                         "running": number of running tasks,
+                                         "wait": waiting time of the oldest task (seconds),
+                                         "runs": number of tasks started within the window,
+                                         "latency": average time from queuing to start (seconds),
+                                         "max_latency": maximum time from queuing to start (seconds),
+                                         }}
+
+            @note: queued tasks are attributed to queues by their group and
+                   priority, so queues with the same group and priority are
+                   reported together (under the first queue name)
+        """
+
+        db = current.db
+        now = datetime.datetime.now()
+
+        queues = cls.get_queues()
+
+        # Index of queues by (group, priority)
+        index = {}
+        for name in sorted(queues):
+            config = queues[name]
+            index.setdefault((config["group"], config["priority"]), name)
+
+        status = {}
+        for name, config in queues.items():
+            status[name] = {"group": config["group"],
+                            "priority": config["priority"],
+                            "workers": 0,
+                            "queued": 0,
+                            "running": 0,
+                            "wait": 0,
+                            "runs": 0,
+                            "latency": None,
+                            "max_latency": None,
+                            }
+
+        step = float(cls.PRIORITY_STEP)
+
+        def lookup(group_name, start_time, next_run_time):
+            # Find the queue of a task
+            priority = 0
+            if start_time and next_run_time and next_run_time < start_time:
+                delta = start_time - next_run_time
+                priority = int(round((delta.days * 86400 + delta.seconds) / step))
+            name = index.get((group_name, priority))
+            if name is None:
+                candidates = [(abs(p - priority), n)
+                              for (g, p), n in index.items() if g == group_name]
+                if candidates:
+                    name = min(candidates)[1]
+            return name
+
+        # Alive workers
+        wtable = db.scheduler_worker
+        query = (wtable.last_heartbeat > (now - datetime.timedelta(minutes = 1)))
+        workers = db(query).select(wtable.group_names)
+        for worker in workers:
+            groups = set(worker.group_names or [])
+            for item in status.values():
+                if item["group"] in groups:
+                    item["workers"] += 1
+
+        # Queued and running tasks
+        ttable = db[cls.TASK_TABLENAME]
+        query = (ttable.status.belongs(("QUEUED", "ASSIGNED", "RUNNING"))) & \
+                (ttable.enabled == True)
+        rows = db(query).select(ttable.status,
+                                ttable.group_name,
+                                ttable.start_time,
+                                ttable.next_run_time,
+                                )
+        for row in rows:
+            name = lookup(row.group_name, row.start_time, row.next_run_time)
+            if name is None:
+                continue
+            item = status[name]
+            if row.status == "RUNNING":
+                item["running"] += 1
+            elif not row.next_run_time or row.next_run_time <= now:
+                # Due
+                item["queued"] += 1
+                start_time = row.start_time
+                if start_time and start_time < now:
+                    wait = now - start_time
+                    wait = wait.days * 86400 + wait.seconds
+                    if wait > item["wait"]:
+                        item["wait"] = wait
+
+        # Latency of one-off tasks started within the window
+        rtable = db.scheduler_run
+        query = (rtable.start_time > (now - datetime.timedelta(seconds = window))) & \
+                (ttable.id == rtable.task_id) & \
+                (ttable.repeats == 1)
+        rows = db(query).select(ttable.group_name,
+                                ttable.start_time,
+                                ttable.next_run_time,
+                                rtable.start_time,
+                                )
+        latencies = {}
+        for row in rows:
+            task = row[ttable]
+            name = lookup(task.group_name, task.start_time, task.next_run_time)
+            started = row[rtable.start_time]
+            if name is None or not task.start_time or not started:
+                continue
+            delta = started - task.start_time
+            latency = max(0, delta.days * 86400 + delta.seconds)
+            if name in latencies:
+                latencies[name].append(latency)
+            else:
+                latencies[name] = [latency]
+        for name, values in latencies.items():
+            item = status[name]
+            item["runs"] = len(values)
+            item["latency"] = sum(values) / float(len(values))
+            item["max_latency"] = max(values)
+
+        return status
+
     # -------------------------------------------------------------------------
     def schedule_task(self,
                       task,
@@ -439,11 +768,13 @@ class S3Task(object):
 
     # -------------------------------------------------------------------------
     @staticmethod
-    def _is_alive():
+    def _is_alive(group_name=None):
         """
             Returns True if there is at least 1 active worker to run scheduled tasks
             - run from the main request
 
+            @param group_name: the worker group (None for any group)
+
             NB Can't run this 1/request at the beginning since the tables
                only get defined in zz_last
         """
@@ -460,6 +791,8 @@ class S3Task(object):
         offset = datetime.timedelta(minutes = 1)
 
         query = (table.last_heartbeat > (now - offset))
+        if group_name:
+            query &= (table.group_names.contains(group_name))
         cache = current.response.s3.cache
         worker_alive = db(query).select(table.id,
                                         limitby = (0, 1),
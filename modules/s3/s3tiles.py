@@ -0,0 +1,1639 @@
+# -*- coding: utf-8 -*-
+
+""" Vector Tiles for Feature Layers, Tile Cache for WMS/TMS Layers
+
+    @copyright: 2021 (c) Sahana Software Foundation
+    @license: MIT
+
+    @requires: U{B{I{gluon}} <http://web2py.com>}
+    @requires: U{B{I{shapely}} <http://trac.gispython.org/lab/wiki/Shapely>}
+               (optional, to render lines and polygons without PostGIS)
+
+    Permission is hereby granted, free of charge, to any person
+    obtaining a copy of this software and associated documentation
+    files (the "Software"), to deal in the Software without
+    restriction, including without limitation the rights to use,
+    copy, modify, merge, publish, distribute, sublicense, and/or sell
+    copies of the Software, and to permit persons to whom the
+    Software is furnished to do so, subject to the following
+    conditions:
+
+    The above copyright notice and this permission notice shall be
+    included in all copies or substantial portions of the Software.
+
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+    EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+    OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+    NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+    HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+    WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+    OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+__all__ = ("S3VectorTiles",
+           "S3MVTEncoder",
+           "S3TileCache",
+           )
+
+import base64
+import hashlib
+import math
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+
+from gluon import current
+
+from s3compat import HTTPError, INTEGER_TYPES, URLError, urlencode, urllib2, urlopen
+from s3dal import original_tablename
+from .s3query import FS
+from .s3rest import S3Method
+from .s3utils import s3_on_commit, s3_str
+
+# Half the width of the Spherical Mercator (EPSG:3857) world, in metres
+MERCATOR_EXTENT = 20037508.342789244
+
+# Latitude limit of Spherical Mercator
+MERCATOR_MAX_LAT = 85.0511287798066
+
+# =============================================================================
+class S3VectorTiles(S3Method):
+    """
+        Mapbox Vector Tiles (MVT) for Feature Layers, e.g.:
+
+            /org/facility/mvt.mvt?layer=3&z=12&x=2345&y=1678
+
+        Tiles contain the locations of all records in the resource (=as
+        filtered by the controller, the layer's URL filter and permissions)
+        which intersect the tile, with the record ID as attribute "id"
+        - popups are loaded from the layer's url_format as usual.
+
+        Tiles are encoded by PostGIS (ST_AsMVT) if available, otherwise
+        by S3MVTEncoder, and cached on disk until any record of the
+        resource or any location changes (see version_hooks).
+    """
+
+    CONTENT_TYPE = "application/vnd.mapbox-vector-tile"
+
+    # Tile resolution and buffer (in tile coordinates)
+    EXTENT = 4096
+    BUFFER = 64
+
+    # Maximum zoom level
+    MAX_ZOOM = 24
+
+    # -------------------------------------------------------------------------
+    def apply_method(self, r, **attr):
+        """
+            Entry point for REST interface
+
+            @param r: the S3Request
+            @param attr: controller attributes
+        """
+
+        if r.http != "GET":
+            r.error(405, current.ERROR.BAD_METHOD)
+        if r.representation not in ("mvt", "pbf"):
+            r.error(415, current.ERROR.BAD_FORMAT)
+
+        get_vars = r.get_vars
+        try:
+            z = int(get_vars["z"])
+            x = int(get_vars["x"])
+            y = int(get_vars["y"])
+        except (KeyError, TypeError, ValueError):
+            r.error(400, current.ERROR.BAD_REQUEST)
+        if not 0 <= z <= self.MAX_ZOOM or \
+           not 0 <= x < (1 << z) or not 0 <= y < (1 << z):
+            r.error(400, current.ERROR.BAD_REQUEST)
+
+        resource = self.resource
+
+        selector = self.location_selector(resource)
+        if selector is None:
+            # Resource can not be displayed on a map
+            r.error(400, current.ERROR.BAD_RESOURCE)
+
+        points = self.points_only(get_vars.get("layer"))
+
+        tile = None
+        if current.deployment_settings.get_gis_mvt_cache():
+            path = self.cache_path(r, z, x, y, points)
+            try:
+                with open(path, "rb") as cached:
+                    tile = cached.read()
+            except IOError:
+                pass
+        else:
+            path = None
+
+        if tile is None:
+            tile = self.tile(resource, selector, z, x, y, points=points)
+            if path:
+                self.store(path, tile)
+
+        current.response.headers["Content-Type"] = self.CONTENT_TYPE
+        return tile
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def location_selector(resource):
+        """
+            Get the selector prefix for the location of records
+
+            @param resource: the S3Resource
+
+            @returns: the selector prefix (e.g. "location_id$"), or
+                      None if the resource has no location reference
+        """
+
+        if resource.tablename == "gis_location":
+            return ""
+
+        fields = resource.table.fields
+        if "location_id" in fields:
+            return "location_id$"
+        elif "site_id" in fields:
+            return "site_id$location_id$"
+
+        context = resource.get_config("context")
+        if context and context.get("location"):
+            return "(location)$"
+
+        return None
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def points_only(layer_id):
+        """
+            Check whether a Feature Layer shall be rendered as points
+
+            @param layer_id: the layer_id of the gis_layer_feature
+        """
+
+        if not layer_id:
+            return False
+
+        table = current.s3db.gis_layer_feature
+        query = (table.layer_id == layer_id) & \
+                (table.deleted == False)
+        layer = current.db(query).select(table.points,
+                                         limitby = (0, 1),
+                                         ).first()
+
+        return bool(layer and layer.points)
+
+    # -------------------------------------------------------------------------
+    def tile(self, resource, selector, z, x, y, points=False):
+        """
+            Render a tile
+
+            @param resource: the S3Resource
+            @param selector: the selector prefix for the location
+            @param z: the zoom level
+            @param x: the tile column
+            @param y: the tile row
+            @param points: render all features as points
+
+            @returns: the MVT tile (bytes)
+        """
+
+        sel = lambda fn: "%s%s" % (selector, fn)
+
+        # Filter by location bounds (with tile buffer)
+        margin = float(self.BUFFER) / self.EXTENT
+        lon_min, lat_min, lon_max, lat_max = S3MVTEncoder.bounds(z, x, y, margin)
+        intersects = (FS(sel("lon_min")) <= lon_max) & \
+                     (FS(sel("lon_max")) >= lon_min) & \
+                     (FS(sel("lat_min")) <= lat_max) & \
+                     (FS(sel("lat_max")) >= lat_min)
+        inside = (FS(sel("lon_min")) == None) & \
+                 (FS(sel("lon")) >= lon_min) & \
+                 (FS(sel("lon")) <= lon_max) & \
+                 (FS(sel("lat")) >= lat_min) & \
+                 (FS(sel("lat")) <= lat_max)
+        resource.add_filter(intersects | inside)
+
+        # Extract record IDs and locations
+        fields = ["id", sel("id"), sel("lat"), sel("lon")]
+        data = resource.select(fields,
+                               limit = None,
+                               raw_data = True,
+                               represent = False,
+                               )
+        colnames = [resource.resolve_selector(s).colname for s in fields]
+        id_col, location_col, lat_col, lon_col = colnames
+
+        features = []
+        seen = set()
+        for row in data.rows:
+            raw = row["_row"]
+            record_id = raw[id_col]
+            location_id = raw[location_col]
+            if location_id is None or (record_id, location_id) in seen:
+                continue
+            seen.add((record_id, location_id))
+            features.append((record_id, location_id, raw[lat_col], raw[lon_col]))
+        if not features:
+            return b""
+
+        name = resource.tablename
+
+        if current.deployment_settings.get_gis_spatialdb():
+            tile = self.tile_postgis(name, features, z, x, y, points=points)
+            if tile is not None:
+                return tile
+
+        encoder = S3MVTEncoder(z, x, y, extent=self.EXTENT, buffer=self.BUFFER)
+
+        shapes = {}
+        if not points:
+            try:
+                from shapely.wkt import loads as wkt_loads
+            except ImportError:
+                current.log.warning("S3VectorTiles: Shapely not available, rendering points only")
+            else:
+                shapes = self.lookup_shapes(set(f[1] for f in features),
+                                            wkt_loads,
+                                            zoom = z,
+                                            )
+
+        for record_id, location_id, lat, lon in features:
+            properties = {"id": record_id}
+            shape = shapes.get(location_id)
+            if shape is not None:
+                encoder.add_shape(shape, properties, feature_id=record_id)
+            elif lat is not None and lon is not None:
+                encoder.add_point(lon, lat, properties, feature_id=record_id)
+
+        return encoder.encode(name)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def lookup_shapes(location_ids, wkt_loads, zoom=None):
+        """
+            Look up the geometries of non-point locations
+
+            @param location_ids: the gis_location record IDs
+            @param wkt_loads: the WKT parser
+            @param zoom: the zoom level (to use precomputed simplified
+                         polygons where available)
+
+            @returns: dict {location_id: shape}
+        """
+
+        table = current.s3db.gis_location
+        query = (table.id.belongs(location_ids)) & \
+                (table.gis_feature_type != 1) & \
+                (table.wkt != None)
+        rows = current.db(query).select(table.id, table.wkt)
+
+        simplified = {}
+        if zoom is not None and \
+           current.deployment_settings.get_gis_simplify_tolerance():
+            gis = current.gis
+            level = gis.get_simplify_level(zoom=zoom)
+            if level is not None:
+                simplified = gis.get_simplified([row.id for row in rows],
+                                                level,
+                                                geojson = False,
+                                                )
+
+        shapes = {}
+        for row in rows:
+            try:
+                shapes[row.id] = wkt_loads(simplified.get(row.id) or row.wkt)
+            except Exception:
+                # Invalid WKT => render as point
+                continue
+
+        return shapes
+
+    # -------------------------------------------------------------------------
+    def tile_postgis(self, name, features, z, x, y, points=False):
+        """
+            Render a tile with PostGIS (requires PostGIS 2.4 or later)
+
+            @param name: the layer name
+            @param features: list of tuples (record_id, location_id, lat, lon)
+            @param z: the zoom level
+            @param x: the tile column
+            @param y: the tile row
+            @param points: render all features as points
+
+            @returns: the MVT tile (bytes), or None if PostGIS failed
+        """
+
+        db = current.db
+
+        size = 2 * MERCATOR_EXTENT / (1 << z)
+        xmin = -MERCATOR_EXTENT + x * size
+        ymax = MERCATOR_EXTENT - y * size
+
+        point = "ST_SetSRID(ST_MakePoint(g.lon, g.lat), 4326)"
+        if points:
+            geometry = point
+        else:
+            geometry = "COALESCE(g.the_geom, %s)" % point
+
+        values = ",".join("(%d,%d)" % (f[0], f[1]) for f in features)
+
+        sql = "SELECT ST_AsMVT(t.*, %%s, %(extent)s, 'geom') FROM (" \
+              "SELECT f.id, ST_AsMVTGeom(ST_Transform(%(geometry)s, 3857), " \
+              "ST_MakeEnvelope(%(xmin)r, %(ymin)r, %(xmax)r, %(ymax)r, 3857), " \
+              "%(extent)s, %(buffer)s, true) AS geom " \
+              "FROM gis_location AS g " \
+              "JOIN (VALUES %(values)s) AS f(id, location_id) " \
+              "ON g.id = f.location_id) AS t " \
+              "WHERE t.geom IS NOT NULL" % {"extent": self.EXTENT,
+                                             "buffer": self.BUFFER,
+                                             "geometry": geometry,
+                                             "xmin": xmin,
+                                             "ymin": ymax - size,
+                                             "xmax": xmin + size,
+                                             "ymax": ymax,
+                                             "values": values,
+                                             }
+        try:
+            rows = db.executesql(sql, placeholders=(name,))
+        except Exception:
+            db.rollback()
+            current.log.error("S3VectorTiles: ST_AsMVT failed, falling back to Python encoder")
+            return None
+
+        tile = rows[0][0] if rows else None
+        return bytes(tile) if tile is not None else b""
+
+    # -------------------------------------------------------------------------
+    def cache_path(self, r, z, x, y, points):
+        """
+            Get the cache file path for a tile; the path contains a hash
+            of the request context (filters, permissions) and a version
+            key that changes whenever any record of the resource or any
+            location gets updated
+
+            @param r: the S3Request
+            @param z: the zoom level
+            @param x: the tile column
+            @param y: the tile row
+            @param points: render all features as points
+
+            @returns: the file path
+        """
+
+        resource = self.resource
+        table = resource.table
+
+        # Data version
+        version = []
+        for t in (table, current.s3db.gis_location):
+            if self.versioned(t):
+                # Version stamp, renewed on writes
+                version.append(self.data_version(t._tablename))
+            elif "modified_on" in t.fields:
+                # Not hooked (e.g. location via context), fall back
+                # to counting the records
+                count = t._id.count()
+                mtime = t.modified_on.max()
+                row = current.db(t._id > 0).select(count, mtime).first()
+                version.append("%s/%s" % (row[count], row[mtime]))
+
+        # Request context (URL filters, controller filters and permissions)
+        get_vars = r.get_vars
+        url_vars = [(k, get_vars[k]) for k in sorted(get_vars)
+                                     if k not in ("x", "y", "z", "_")]
+        context = [url_vars, repr(resource.rfilter), points]
+
+        return os.path.join(current.request.folder,
+                            "uploads",
+                            "gis_cache",
+                            "mvt",
+                            resource.tablename,
+                            self.hash(context),
+                            self.hash(version),
+                            str(z),
+                            str(x),
+                            "%s.mvt" % y,
+                            )
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def versioned(table):
+        """
+            Check whether the data version of a table is tracked with
+            a version stamp (see version_hooks)
+
+            @param table: the Table
+
+            @returns: True|False
+        """
+
+        fields = table.fields
+        return original_tablename(table) == "gis_location" or \
+               "location_id" in fields or "site_id" in fields
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def version_hooks(cls, table):
+        """
+            Renew the data version stamp of a table on any writes to it
+            (as DAL callbacks, so that direct DB updates are covered too);
+            called by S3Model.define_table for all tables with locations
+
+            @param table: the Table
+        """
+
+        tablename = table._tablename
+
+        def renew(*args):
+            cls.renew_data_version(tablename)
+
+        for callbacks in (table._after_insert,
+                          table._after_update,
+                          table._after_delete,
+                          ):
+            callbacks.append(renew)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def data_version(cls, tablename):
+        """
+            Get the current data version stamp of a table
+
+            @param tablename: the table name
+
+            @returns: the version stamp (string)
+        """
+
+        try:
+            with open(cls.data_version_path(tablename), "r") as stamp:
+                version = stamp.read().strip()
+        except (IOError, OSError):
+            version = None
+        if not version:
+            version = cls.write_data_version(tablename)
+
+        return version
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def renew_data_version(cls, tablename):
+        """
+            Renew the data version stamp of a table, once when the table
+            is first written to in a request, and again after commit (DAL
+            callbacks run before commit, so another process could otherwise
+            cache tiles from the previous data under the new stamp)
+
+            @param tablename: the table name
+        """
+
+        s3 = current.response.s3
+
+        renewed = s3.mvt_renewed
+        if renewed is None:
+            renewed = s3.mvt_renewed = set()
+
+            def renew():
+                for tn in renewed:
+                    cls.write_data_version(tn)
+            s3_on_commit(renew)
+
+        if tablename not in renewed:
+            renewed.add(tablename)
+            cls.write_data_version(tablename)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def write_data_version(cls, tablename):
+        """
+            Write a new data version stamp for a table
+
+            @param tablename: the table name
+
+            @returns: the new version stamp
+        """
+
+        from uuid import uuid4
+
+        version = uuid4().hex
+
+        path = cls.data_version_path(tablename)
+        folder = os.path.dirname(path)
+        try:
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            with open(path, "w") as stamp:
+                stamp.write(version)
+        except (IOError, OSError):
+            current.log.warning("S3VectorTiles: could not write %s" % path)
+
+        return version
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def data_version_path(tablename):
+        """
+            Get the path of the data version stamp file for a table
+
+            @param tablename: the table name
+        """
+
+        return os.path.join(current.request.folder,
+                            "uploads",
+                            "gis_cache",
+                            "mvt",
+                            "%s.version" % tablename,
+                            )
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def hash(value):
+        """
+            Helper to hash a cache key component
+
+            @param value: the value (any type with a stable repr)
+        """
+
+        text = s3_str(repr(value))
+        if not isinstance(text, bytes):
+            text = text.encode("utf-8")
+        return hashlib.md5(text).hexdigest()
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def store(path, tile):
+        """
+            Store a tile in the cache, and remove tiles of previous
+            data versions for the same request context
+
+            @param path: the cache file path
+            @param tile: the tile (bytes)
+        """
+
+        folder = os.path.dirname(path)
+        try:
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+
+            # Write to a temporary file first, so that concurrent
+            # requests never read a partial tile
+            handle, tmp = tempfile.mkstemp(dir=folder)
+            with os.fdopen(handle, "wb") as target:
+                target.write(tile)
+            os.rename(tmp, path)
+        except (IOError, OSError):
+            current.log.warning("S3VectorTiles: could not cache tile %s" % path)
+            return
+
+        # Remove outdated versions
+        version_folder = os.path.dirname(os.path.dirname(folder))
+        context_folder, version = os.path.split(version_folder)
+        try:
+            outdated = [v for v in os.listdir(context_folder) if v != version]
+        except OSError:
+            outdated = []
+        for v in outdated:
+            shutil.rmtree(os.path.join(context_folder, v), ignore_errors=True)
+
+# =============================================================================
+class S3MVTEncoder(object):
+    """
+        Encoder for Mapbox Vector Tiles (specification version 2), a
+        pure-Python alternative for ST_AsMVT
+    """
+
+    # Geometry types
+    POINT = 1
+    LINESTRING = 2
+    POLYGON = 3
+
+    # Geometry commands
+    MOVE_TO = 1
+    LINE_TO = 2
+    CLOSE_PATH = 7
+
+    def __init__(self, z, x, y, extent=4096, buffer=64):
+        """
+            Constructor
+
+            @param z: the zoom level
+            @param x: the tile column
+            @param y: the tile row
+            @param extent: the tile resolution
+            @param buffer: the tile buffer (in tile coordinates)
+        """
+
+        self.z = z
+        self.x = x
+        self.y = y
+
+        self.extent = extent
+        self.buffer = buffer
+
+        self.features = []
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def bounds(z, x, y, margin=0.0):
+        """
+            Get the bounds of a tile in WGS84 coordinates
+
+            @param z: the zoom level
+            @param x: the tile column
+            @param y: the tile row
+            @param margin: extend the bounds by this fraction of the tile size
+
+            @returns: tuple (lon_min, lat_min, lon_max, lat_max)
+        """
+
+        n = float(1 << z)
+
+        lon = lambda tx: tx / n * 360.0 - 180.0
+        lat = lambda ty: math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * ty / n))))
+
+        return (lon(x - margin),
+                lat(y + 1 + margin),
+                lon(x + 1 + margin),
+                lat(y - margin),
+                )
+
+    # -------------------------------------------------------------------------
+    def project(self, lon, lat):
+        """
+            Project WGS84 coordinates into tile coordinates
+
+            @param lon: the longitude
+            @param lat: the latitude
+
+            @returns: tuple (x, y)
+        """
+
+        n = float(1 << self.z)
+        extent = self.extent
+
+        lat = math.radians(max(min(lat, MERCATOR_MAX_LAT), -MERCATOR_MAX_LAT))
+
+        tx = (lon + 180.0) / 360.0 * n
+        ty = (1.0 - math.log(math.tan(lat) + 1.0 / math.cos(lat)) / math.pi) / 2.0 * n
+
+        return (int(round((tx - self.x) * extent)),
+                int(round((ty - self.y) * extent)),
+                )
+
+    # -------------------------------------------------------------------------
+    def add_point(self, lon, lat, properties=None, feature_id=None):
+        """
+            Add a point feature
+
+            @param lon: the longitude
+            @param lat: the latitude
+            @param properties: the feature attributes, a dict
+            @param feature_id: the feature ID
+
+            @returns: True if the point was added, False if it is
+                      outside of the tile
+        """
+
+        point = self.project(lon, lat)
+
+        low = -self.buffer
+        high = self.extent + self.buffer
+        if not (low <= point[0] <= high and low <= point[1] <= high):
+            return False
+
+        geometry = self.encode_path([], [0, 0], [point], self.MOVE_TO)
+        self.features.append((feature_id, self.POINT, geometry, properties))
+        return True
+
+    # -------------------------------------------------------------------------
+    def add_shape(self, shape, properties=None, feature_id=None):
+        """
+            Add a feature from a Shapely geometry (clipped to the tile)
+
+            @param shape: the geometry
+            @param properties: the feature attributes, a dict
+            @param feature_id: the feature ID
+        """
+
+        from shapely.geometry import box
+
+        margin = float(self.buffer) / self.extent
+        clip = box(*self.bounds(self.z, self.x, self.y, margin))
+        if not clip.contains(shape):
+            try:
+                shape = shape.intersection(clip)
+            except Exception:
+                # Invalid geometry => try to repair it
+                shape = shape.buffer(0).intersection(clip)
+        if shape.is_empty:
+            return
+
+        # Collect the parts by geometry type
+        points, lines, polygons = [], [], []
+        self.collect(shape, points, lines, polygons)
+
+        cursor = [0, 0]
+        project = self.project
+        append = self.features.append
+
+        if points:
+            geometry = self.encode_path([],
+                                        cursor,
+                                        [project(p.x, p.y) for p in points],
+                                        self.MOVE_TO,
+                                        )
+            append((feature_id, self.POINT, geometry, properties))
+
+        if lines:
+            cursor = [0, 0]
+            geometry = []
+            for line in lines:
+                path = self.dedupe([project(*c[:2]) for c in line.coords])
+                if len(path) > 1:
+                    self.encode_path(geometry, cursor, path, self.LINE_TO)
+            if geometry:
+                append((feature_id, self.LINESTRING, geometry, properties))
+
+        if polygons:
+            cursor = [0, 0]
+            geometry = []
+            for polygon in polygons:
+                exterior = self.ring(polygon.exterior, clockwise=True)
+                if not exterior:
+                    continue
+                self.encode_path(geometry, cursor, exterior, self.CLOSE_PATH)
+                for interior in polygon.interiors:
+                    interior = self.ring(interior, clockwise=False)
+                    if interior:
+                        self.encode_path(geometry, cursor, interior, self.CLOSE_PATH)
+            if geometry:
+                append((feature_id, self.POLYGON, geometry, properties))
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def collect(cls, shape, points, lines, polygons):
+        """
+            Break down a (multi-part) geometry into simple parts
+
+            @param shape: the geometry
+            @param points: list to collect points
+            @param lines: list to collect line strings
+            @param polygons: list to collect polygons
+        """
+
+        geom_type = shape.geom_type
+        if geom_type == "Point":
+            points.append(shape)
+        elif geom_type in ("LineString", "LinearRing"):
+            lines.append(shape)
+        elif geom_type == "Polygon":
+            polygons.append(shape)
+        elif hasattr(shape, "geoms"):
+            # Multi-part geometry or collection
+            for part in shape.geoms:
+                cls.collect(part, points, lines, polygons)
+
+    # -------------------------------------------------------------------------
+    def ring(self, ring, clockwise=True):
+        """
+            Project a polygon ring into tile coordinates
+
+            @param ring: the LinearRing
+            @param clockwise: the required winding order (clockwise for
+                              exterior rings, counter-clockwise for
+                              interior rings)
+
+            @returns: list of points (without closing point), or None if
+                      the ring degenerates at this resolution
+        """
+
+        project = self.project
+        path = self.dedupe([project(*c[:2]) for c in ring.coords])
+        if len(path) > 1 and path[0] == path[-1]:
+            path = path[:-1]
+        if len(path) < 3:
+            return None
+
+        # Surveyor's formula (positive area = clockwise in tile coordinates)
+        area = 0
+        for i, (x0, y0) in enumerate(path):
+            x1, y1 = path[i - 1]
+            area += x1 * y0 - x0 * y1
+        if area == 0:
+            return None
+        if (area > 0) != clockwise:
+            path.reverse()
+
+        return path
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def dedupe(path):
+        """
+            Remove consecutive duplicate points from a path
+
+            @param path: list of points
+        """
+
+        result = []
+        append = result.append
+        last = None
+        for point in path:
+            if point != last:
+                append(point)
+                last = point
+        return result
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def encode_path(cls, geometry, cursor, path, command):
+        """
+            Encode a path as geometry commands
+
+            @param geometry: the list of geometry integers to extend
+            @param cursor: the current cursor position [x, y] (will be
+                           updated)
+            @param path: list of points (tile coordinates)
+            @param command: MOVE_TO for (multi-)points, LINE_TO for line
+                            strings, CLOSE_PATH for polygon rings
+
+            @returns: the geometry list
+        """
+
+        zigzag = cls.zigzag
+        cx, cy = cursor
+
+        if command == cls.MOVE_TO:
+            # All points in a single MoveTo command
+            geometry.append(cls.command(cls.MOVE_TO, len(path)))
+            for px, py in path:
+                geometry.extend((zigzag(px - cx), zigzag(py - cy)))
+                cx, cy = px, py
+        else:
+            px, py = path[0]
+            geometry.append(cls.command(cls.MOVE_TO, 1))
+            geometry.extend((zigzag(px - cx), zigzag(py - cy)))
+            cx, cy = px, py
+            geometry.append(cls.command(cls.LINE_TO, len(path) - 1))
+            for px, py in path[1:]:
+                geometry.extend((zigzag(px - cx), zigzag(py - cy)))
+                cx, cy = px, py
+            if command == cls.CLOSE_PATH:
+                geometry.append(cls.command(cls.CLOSE_PATH, 1))
+
+        cursor[0], cursor[1] = cx, cy
+        return geometry
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def command(cid, count):
+        """ Encode a geometry command integer """
+
+        return (cid & 0x7) | (count << 3)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def zigzag(n):
+        """ ZigZag-encode a signed integer """
+
+        return (n << 1) ^ (n >> 63)
+
+    # -------------------------------------------------------------------------
+    def encode(self, name):
+        """
+            Encode all features as a single-layer tile
+
+            @param name: the layer name
+
+            @returns: the tile (bytes), empty if there are no features
+        """
+
+        if not self.features:
+            return b""
+
+        _bytes = self._bytes
+        _key = self._key
+        _packed = self._packed
+        _varint = self._varint
+
+        keys, key_index = [], {}
+        values, value_index = [], {}
+
+        layer = [_key(15, 0) + _varint(2), # version
+                 _bytes(1, self._string(name)),
+                 ]
+
+        for feature_id, geom_type, geometry, properties in self.features:
+
+            tags = []
+            if properties:
+                for k, v in properties.items():
+                    if v is None:
+                        continue
+                    if k not in key_index:
+                        key_index[k] = len(keys)
+                        keys.append(k)
+                    value = self._value(v)
+                    if value not in value_index:
+                        value_index[value] = len(values)
+                        values.append(value)
+                    tags.extend((key_index[k], value_index[value]))
+
+            feature = []
+            if feature_id is not None:
+                feature.append(_key(1, 0) + _varint(feature_id))
+            if tags:
+                feature.append(_packed(2, tags))
+            feature.append(_key(3, 0) + _varint(geom_type))
+            feature.append(_packed(4, geometry))
+
+            layer.append(_bytes(2, b"".join(feature)))
+
+        for k in keys:
+            layer.append(_bytes(3, self._string(k)))
+        for value in values:
+            layer.append(_bytes(4, value))
+        layer.append(_key(5, 0) + _varint(self.extent))
+
+        return _bytes(3, b"".join(layer))
+
+    # -------------------------------------------------------------------------
+    # Protocol Buffers encoding
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _varint(n):
+        """ Encode an unsigned integer as varint """
+
+        output = bytearray()
+        while True:
+            towrite = n & 0x7f
+            n >>= 7
+            if n:
+                output.append(towrite | 0x80)
+            else:
+                output.append(towrite)
+                break
+        return bytes(output)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def _key(cls, field, wiretype):
+        """ Encode a field key """
+
+        return cls._varint((field << 3) | wiretype)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def _bytes(cls, field, data):
+        """ Encode a length-delimited field """
+
+        return cls._key(field, 2) + cls._varint(len(data)) + data
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def _packed(cls, field, values):
+        """ Encode a packed repeated field of unsigned integers """
+
+        varint = cls._varint
+        return cls._bytes(field, b"".join(varint(v) for v in values))
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _string(value):
+        """ Encode a string as UTF-8 """
+
+        value = s3_str(value)
+        if not isinstance(value, bytes):
+            value = value.encode("utf-8")
+        return value
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def _value(cls, value):
+        """ Encode an attribute value as Value message """
+
+        if isinstance(value, bool):
+            return cls._key(7, 0) + cls._varint(int(value))
+        elif isinstance(value, INTEGER_TYPES):
+            if value >= 0:
+                return cls._key(5, 0) + cls._varint(value)
+            else:
+                return cls._key(6, 0) + cls._varint(cls.zigzag(value))
+        elif isinstance(value, float):
+            return cls._key(3, 1) + struct.pack("<d", value)
+        else:
+            return cls._bytes(1, cls._string(value))
+
+# =============================================================================
+class S3TileCache(object):
+    """
+        Disk cache for the tiles of WMS/TMS layers, used by the gis/proxy
+        controller for layers with a tile_cache TTL
+
+        - tiles are keyed by the normalised request parameters
+        - the access time of a tile file is its last use, the modification
+          time is when it has been fetched
+        - least recently used tiles are evicted when the cache grows beyond
+          the configured size (settings.gis.tile_cache_size)
+        - expired tiles are still served if the service is unreachable
+    """
+
+    # Significant GetMap parameters
+    WMS_PARAMS = ("LAYERS", "STYLES", "FORMAT", "TRANSPARENT", "VERSION",
+                  "SRS", "CRS", "BBOX", "WIDTH", "HEIGHT", "BGCOLOR",
+                  "MAP", "TILED", "TILESORIGIN", "TIME", "ELEVATION",
+                  )
+
+    # Tile file extensions by MIME type
+    EXTENSIONS = {"image/png": "png",
+                  "image/jpeg": "jpg",
+                  "image/gif": "gif",
+                  "image/bmp": "bmp",
+                  "image/tiff": "tif",
+                  "image/svg+xml": "svg",
+                  }
+
+    # Fraction of the maximum size to prune the cache down to
+    LOW_WATER = 0.9
+
+    # Tile size (pixels) for seeding
+    TILE_SIZE = 256
+
+    # Per-process statistics
+    _stats = {"hits": 0,
+              "misses": 0,
+              "stale": 0,
+              "errors": 0,
+              "evicted": 0,
+              }
+
+    # Approximate size of the cache (bytes), scanned once per process
+    _size = None
+    _lock = threading.Lock()
+
+    # -------------------------------------------------------------------------
+    def __init__(self, tablename, layer):
+        """
+            Constructor
+
+            @param tablename: the layer table name (gis_layer_wms|gis_layer_tms)
+            @param layer: the layer Row
+        """
+
+        self.tablename = tablename
+        self.layer = layer
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def get_layer(cls, layer_id):
+        """
+            Get the tile cache for a layer
+
+            @param layer_id: the layer_id
+
+            @returns: S3TileCache instance, or None if the layer does
+                      not exist, does not use the tile cache, or is not
+                      accessible for the current user
+        """
+
+        db = current.db
+        s3db = current.s3db
+
+        etable = s3db.gis_layer_entity
+        entity = db(etable.layer_id == layer_id).select(etable.instance_type,
+                                                        limitby = (0, 1),
+                                                        ).first()
+        if not entity:
+            return None
+        tablename = entity.instance_type
+        if tablename not in ("gis_layer_wms", "gis_layer_tms"):
+            return None
+
+        table = s3db[tablename]
+        query = (table.layer_id == layer_id) & \
+                (table.tile_cache != None) & \
+                (table.deleted == False)
+        layer = db(query).select(limitby = (0, 1)).first()
+        if not layer:
+            return None
+
+        role_required = layer.role_required
+        if role_required and not current.auth.s3_has_role(role_required):
+            return None
+
+        return cls(tablename, layer)
+
+    # -------------------------------------------------------------------------
+    def request(self, args, get_vars):
+        """
+            Normalise a tile request
+
+            @param args: the URL arguments after the layer_id (TMS:
+                         version, layername, z, x, y.format)
+            @param get_vars: the GET vars (WMS GetMap parameters)
+
+            @returns: tuple (url, key, extension), the URL to fetch the
+                      tile from, the cache key and the file extension
+
+            @raises ValueError: for invalid or non-tile requests
+        """
+
+        layer = self.layer
+
+        if self.tablename == "gis_layer_tms":
+            if len(args) != 5:
+                raise ValueError("Invalid TMS request")
+            version, layername, z, x, y = args
+            try:
+                y, extension = y.rsplit(".", 1)
+                z, x, y = int(z), int(x), int(y)
+            except ValueError:
+                raise ValueError("Invalid TMS request")
+            if layername != layer.layername or \
+               not all(n.isdigit() for n in version.split(".")) or \
+               extension != (layer.img_format or "png") or \
+               not 0 <= z < 30 or not 0 <= x < 2**z or not 0 <= y < 2**z:
+                raise ValueError("Invalid TMS request")
+            path = "%s/%s/%s/%s/%s.%s" % (version, layername, z, x, y, extension)
+            url = layer.url
+            if url[-1] != "/":
+                url = "%s/" % url
+            return "%s%s" % (url, path), path, extension
+
+        params = dict((k.upper(), v) for k, v in get_vars.items())
+        if params.get("REQUEST", "").lower() != "getmap":
+            raise ValueError("Not a GetMap request")
+
+        params = dict((k, params[k]) for k in self.WMS_PARAMS if k in params)
+        try:
+            bbox = [float(c) for c in params["BBOX"].split(",")]
+            width = int(params["WIDTH"])
+            height = int(params["HEIGHT"])
+        except (KeyError, ValueError):
+            raise ValueError("Invalid GetMap request")
+        if len(bbox) != 4 or not 0 < width <= 2048 or not 0 < height <= 2048:
+            raise ValueError("Invalid GetMap request")
+
+        # Layers must not deviate from the layer configuration
+        params["LAYERS"] = layer.layers
+        if "TRANSPARENT" in params:
+            params["TRANSPARENT"] = params["TRANSPARENT"].upper()
+        if layer.map:
+            params["MAP"] = layer.map
+        extension = self.EXTENSIONS.get(params.get("FORMAT", "").split(";")[0], "png")
+
+        # Key: quantise the BBOX to the pixel size, so that rounding
+        # differences between clients (and seeding) do not matter
+        xres = (bbox[2] - bbox[0]) / width
+        yres = (bbox[3] - bbox[1]) / height
+        if xres <= 0 or yres <= 0:
+            raise ValueError("Invalid GetMap request")
+        key = dict(params)
+        key["BBOX"] = "%d,%d,%d,%d" % (round(bbox[0] / xres), round(bbox[1] / yres),
+                                       round(bbox[2] / xres), round(bbox[3] / yres),
+                                       )
+        key.pop("TILESORIGIN", None)
+        key = "&".join("%s=%s" % (k, key[k]) for k in sorted(key))
+
+        params["SERVICE"] = "WMS"
+        params["REQUEST"] = "GetMap"
+        url = self.service_url(layer.url, params)
+
+        return url, key, extension
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def service_url(url, params):
+        """
+            Add query parameters to a service URL
+
+            @param url: the service URL (may contain a query already)
+            @param params: dict of query parameters
+        """
+
+        query = urlencode(sorted(params.items()), doseq=True)
+        if "?" not in url:
+            url = "%s?%s" % (url, query)
+        elif url[-1] in ("?", "&"):
+            url = "%s%s" % (url, query)
+        else:
+            url = "%s&%s" % (url, query)
+        return url
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def cache_root():
+        """
+            The root folder of the tile cache
+        """
+
+        return os.path.join(current.request.folder,
+                            "uploads",
+                            "gis_cache",
+                            "tiles",
+                            )
+
+    # -------------------------------------------------------------------------
+    def path(self, key, extension):
+        """
+            Get the file path for a tile
+
+            @param key: the cache key
+            @param extension: the file extension
+        """
+
+        name = S3VectorTiles.hash(key)
+        return os.path.join(self.cache_root(),
+                            str(self.layer.layer_id),
+                            name[:2],
+                            "%s.%s" % (name, extension),
+                            )
+
+    # -------------------------------------------------------------------------
+    def get(self, url, key, extension, refresh=False):
+        """
+            Get a tile, from the cache if available and not expired,
+            otherwise from the service
+
+            @param url: the URL to fetch the tile from
+            @param key: the cache key
+            @param extension: the file extension
+            @param refresh: fetch the tile even if it is cached
+
+            @returns: the tile (bytes)
+
+            @raises HTTPError, URLError, IOError: if the tile could
+                    neither be fetched nor served from the cache
+        """
+
+        path = self.path(key, extension)
+        stats = self._stats
+
+        now = time.time()
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            mtime = None
+
+        ttl = self.layer.tile_cache
+        if mtime is not None and not refresh and \
+           (not ttl or now - mtime < ttl):
+            tile = self.read(path, now, mtime)
+            if tile is not None:
+                stats["hits"] += 1
+                return tile
+
+        stats["misses"] += 1
+        try:
+            tile = self.fetch(url)
+        except (HTTPError, URLError, IOError, ValueError):
+            stats["errors"] += 1
+            if mtime is not None:
+                # Service unreachable => serve the expired tile
+                tile = self.read(path, now, mtime)
+                if tile is not None:
+                    stats["stale"] += 1
+                    return tile
+            raise
+
+        self.store(path, tile)
+        return tile
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def read(path, now, mtime):
+        """
+            Read a tile from the cache, and record the access
+
+            @param path: the file path
+            @param now: the current time
+            @param mtime: the time when the tile has been fetched
+
+            @returns: the tile (bytes), or None if it could not be read
+        """
+
+        try:
+            with open(path, "rb") as source:
+                tile = source.read()
+            # Access time = last use (LRU), set explicitly as file
+            # systems are often mounted with noatime/relatime
+            os.utime(path, (now, mtime))
+        except (IOError, OSError):
+            return None
+        return tile
+
+    # -------------------------------------------------------------------------
+    def fetch(self, url):
+        """
+            Fetch a tile from the service
+
+            @param url: the URL
+
+            @returns: the tile (bytes)
+
+            @raises ValueError: if the service returns no image (e.g.
+                                an OGC service exception)
+        """
+
+        tile, content_type = self.download(url)
+        if not content_type or not content_type.startswith("image/"):
+            raise ValueError("Not an image: %s" % content_type)
+
+        return tile
+
+    # -------------------------------------------------------------------------
+    def forward(self, get_vars):
+        """
+            Forward a non-tile WMS request (e.g. GetFeatureInfo or
+            GetLegendGraphic) to the service, without caching
+
+            @param get_vars: the GET vars
+
+            @returns: tuple (content, content type)
+        """
+
+        return self.download(self.service_url(self.layer.url, get_vars))
+
+    # -------------------------------------------------------------------------
+    def download(self, url):
+        """
+            Download from the service, with the credentials of the layer
+
+            @param url: the URL
+
+            @returns: tuple (content, content type)
+        """
+
+        layer = self.layer
+
+        headers = {}
+        username = layer.get("username")
+        password = layer.get("password")
+        if username and password:
+            credentials = "%s:%s" % (username, password)
+            credentials = base64.b64encode(credentials.encode("utf-8"))
+            headers["Authorization"] = "Basic %s" % credentials.decode("ascii")
+
+        request = urllib2.Request(url, headers=headers)
+        f = urlopen(request, timeout=30)
+        try:
+            content_type = f.info().get("Content-Type")
+            content = f.read()
+        finally:
+            f.close()
+
+        return content, content_type
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def store(cls, path, tile):
+        """
+            Store a tile in the cache, and evict the least recently used
+            tiles if the cache grows beyond its maximum size
+
+            @param path: the file path
+            @param tile: the tile (bytes)
+        """
+
+        folder = os.path.dirname(path)
+        try:
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            handle, tmp = tempfile.mkstemp(dir=folder)
+            with os.fdopen(handle, "wb") as target:
+                target.write(tile)
+            os.rename(tmp, path)
+        except (IOError, OSError):
+            current.log.warning("S3TileCache: could not cache tile %s" % path)
+            return
+
+        limit = current.deployment_settings.get_gis_tile_cache_size() * 1048576
+        with cls._lock:
+            if cls._size is None:
+                cls._size = sum(item[1] for item in cls.scan())
+            else:
+                cls._size += len(tile)
+            size = cls._size
+        if size > limit:
+            cls.prune(limit)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def scan(cls, layer_id=None):
+        """
+            Scan the cache
+
+            @param layer_id: scan only the tiles of this layer
+
+            @returns: list of tuples (atime, size, path, layer_id)
+        """
+
+        root = cls.cache_root()
+        if layer_id is not None:
+            folders = [str(layer_id)]
+        else:
+            try:
+                folders = os.listdir(root)
+            except OSError:
+                folders = []
+
+        items = []
+        append = items.append
+        for folder in folders:
+            for dirpath, dirnames, filenames in os.walk(os.path.join(root, folder)):
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    append((stat.st_atime, stat.st_size, path, folder))
+        return items
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def prune(cls, limit=None):
+        """
+            Evict the least recently used tiles until the cache size is
+            below LOW_WATER of the maximum size
+
+            @param limit: the maximum size (bytes), defaults to
+                          settings.gis.tile_cache_size
+
+            @returns: the number of evicted tiles
+        """
+
+        if limit is None:
+            limit = current.deployment_settings.get_gis_tile_cache_size() * 1048576
+
+        with cls._lock:
+            items = cls.scan()
+            size = sum(item[1] for item in items)
+            evicted = 0
+            if size > limit:
+                target = limit * cls.LOW_WATER
+                items.sort()
+                for atime, length, path, folder in items:
+                    if size <= target:
+                        break
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        continue
+                    size -= length
+                    evicted += 1
+            cls._size = size
+            cls._stats["evicted"] += evicted
+
+        return evicted
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def clear(cls, layer_id):
+        """
+            Remove all cached tiles of a layer
+
+            @param layer_id: the layer_id
+        """
+
+        shutil.rmtree(os.path.join(cls.cache_root(), str(layer_id)),
+                      ignore_errors = True,
+                      )
+        with cls._lock:
+            cls._size = None
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def statistics(cls):
+        """
+            Get statistics of the tile cache
+
+            @returns: dict with the number of tiles and their size per
+                      layer and in total, the maximum size, and the hit/
+                      miss counters of this process
+        """
+
+        layers = {}
+        for atime, length, path, folder in cls.scan():
+            layer = layers.get(folder)
+            if layer is None:
+                layer = layers[folder] = {"tiles": 0, "size": 0}
+            layer["tiles"] += 1
+            layer["size"] += length
+
+        stats = dict(cls._stats)
+        stats.update(layers = layers,
+                     tiles = sum(l["tiles"] for l in layers.values()),
+                     size = sum(l["size"] for l in layers.values()),
+                     limit = current.deployment_settings.get_gis_tile_cache_size() * 1048576,
+                     )
+        return stats
+
+    # -------------------------------------------------------------------------
+    def seed(self, bbox, zoom_min, zoom_max, epsg=900913, limit=10000):
+        """
+            Fetch all tiles of a bounding box and zoom range into the
+            cache (tiles which are cached and not expired are skipped)
+
+            - for WMS, requests are generated like the map client does
+              for a Spherical Mercator map with 256px tiles
+
+            @param bbox: the bounding box (lon_min, lat_min, lon_max, lat_max)
+            @param zoom_min: the minimum zoom level
+            @param zoom_max: the maximum zoom level
+            @param epsg: the map projection (WMS)
+            @param limit: the maximum number of tiles
+
+            @returns: tuple (number of tiles, number of failures)
+        """
+
+        layer = self.layer
+
+        lon_min, lat_min, lon_max, lat_max = bbox
+        tms = self.tablename == "gis_layer_tms"
+        if not tms:
+            if epsg not in (900913, 3857):
+                raise ValueError("Seeding requires Spherical Mercator")
+            version = layer.version or "1.1.1"
+            params = {"REQUEST": "GetMap",
+                      "LAYERS": layer.layers,
+                      "TRANSPARENT": "TRUE" if layer.transparent else "FALSE",
+                      "FORMAT": layer.img_format or "image/png",
+                      "VERSION": version,
+                      "STYLES": layer.style or "",
+                      "WIDTH": str(self.TILE_SIZE),
+                      "HEIGHT": str(self.TILE_SIZE),
+                      "CRS" if version == "1.3.0" else "SRS": "EPSG:%s" % epsg,
+                      }
+            if layer.bgcolor:
+                params["BGCOLOR"] = "0x%s" % layer.bgcolor
+            if layer.tiled:
+                params["TILESORIGIN"] = "%s,%s" % (-MERCATOR_EXTENT, -MERCATOR_EXTENT)
+
+        count = failed = 0
+        for z in range(zoom_min, zoom_max + 1):
+            n = 2 ** z
+            x0, y1 = self.tile_xy(lon_min, lat_min, z)
+            x1, y0 = self.tile_xy(lon_max, lat_max, z)
+            for x in range(x0, x1 + 1):
+                for y in range(y0, y1 + 1):
+                    if count >= limit:
+                        return count, failed
+                    count += 1
+                    # TMS rows count from the bottom
+                    row = n - 1 - y
+                    if tms:
+                        args = ["1.0.0",
+                                layer.layername,
+                                str(z),
+                                str(x),
+                                "%s.%s" % (row, layer.img_format or "png"),
+                                ]
+                        get_vars = {}
+                    else:
+                        size = 2 * MERCATOR_EXTENT / n
+                        left = -MERCATOR_EXTENT + x * size
+                        bottom = -MERCATOR_EXTENT + row * size
+                        args = []
+                        get_vars = dict(params)
+                        get_vars["BBOX"] = "%s,%s,%s,%s" % (left,
+                                                            bottom,
+                                                            left + size,
+                                                            bottom + size,
+                                                            )
+                    url, key, extension = self.request(args, get_vars)
+                    try:
+                        self.get(url, key, extension)
+                    except (HTTPError, URLError, IOError, ValueError):
+                        failed += 1
+
+        return count, failed
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def tile_xy(lon, lat, z):
+        """
+            Get the column and row (from the top) of the Spherical
+            Mercator tile containing a point
+
+            @param lon: the longitude
+            @param lat: the latitude
+            @param z: the zoom level
+
+            @returns: tuple (x, y)
+        """
+
+        n = 2 ** z
+        lat = max(-MERCATOR_MAX_LAT, min(MERCATOR_MAX_LAT, lat))
+        lat_rad = math.radians(lat)
+
+        x = int((lon + 180.0) / 360.0 * n)
+        y = int((1.0 - math.log(math.tan(lat_rad) + 1.0 / math.cos(lat_rad)) / math.pi) / 2.0 * n)
+
+        return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+# END =========================================================================
@@ -1021,6 +1021,70 @@ def s3_keep_messages():
     session.information = response.information
     session.warning = response.warning
 
+# =============================================================================
+def s3_on_commit(callback, before=False):
+    """
+        Register a callback for the commits of the current request, i.e.
+        the commit at the end of the request (response.custom_commit) as
+        well as any explicit db.commit() during the request
+
+        @param callback: the callback function (without arguments)
+        @param before: call before rather than after the commit, e.g. to
+                       write buffered data within the committed transaction
+
+        @note: callbacks are called once per commit (and DB adapter), so
+               must be safe to call repeatedly
+        @note: callbacks are not called if the request is rolled back
+    """
+
+    response = current.response
+
+    callbacks = response.s3.on_commit
+    if callbacks is None:
+        callbacks = response.s3.on_commit = {"before": [], "after": []}
+
+        # Commit at the end of the request
+        commit = response.custom_commit
+        def custom_commit(*args):
+            # Called once per DB adapter (with the adapter as argument)
+            if not commit and not args:
+                # db.commit runs the callbacks itself
+                current.db.commit()
+                return
+            s3_run_on_commit("before")
+            if commit:
+                commit(*args)
+            else:
+                args[0].commit()
+            s3_run_on_commit("after")
+        response.custom_commit = custom_commit
+
+    # Explicit commits during the request
+    db = current.db
+    if not getattr(db.commit, "on_commit", False):
+        db_commit = db.commit
+        def explicit_commit():
+            s3_run_on_commit("before")
+            db_commit()
+            s3_run_on_commit("after")
+        explicit_commit.on_commit = True
+        db.commit = explicit_commit
+
+    callbacks["before" if before else "after"].append(callback)
+
+# -----------------------------------------------------------------------------
+def s3_run_on_commit(when):
+    """
+        Run the callbacks registered with s3_on_commit
+
+        @param when: "before" or "after" (the commit)
+    """
+
+    callbacks = current.response.s3.on_commit
+    if callbacks:
+        for callback in callbacks[when]:
+            callback()
+
 # =============================================================================
 def s3_redirect_default(location="", how=303, client_side=False, headers=None):
     """
@@ -5766,7 +5766,7 @@ class S3LocationSelector(S3Selector):
         else:
             filter_lx = top_level = None
 
-        # @todo: DRY this:
+        query = None
         if "L0" in levels:
             query = (gtable.level == "L0")
             countries = settings.get_gis_countries()
@@ -5777,78 +5777,25 @@ class S3LocationSelector(S3Selector):
                           (ttable.location_id == gtable.id))
             if filter_lx and top_level == "L0":
                 query &= gtable.name.belongs(filter_lx)
-            if L0 and "L1" in levels:
-                query |= (gtable.level != None) & \
-                         (gtable.parent == L0)
-            if L1 and "L2" in levels:
-                query |= (gtable.level != None) & \
-                         (gtable.parent == L1)
-            if L2 and "L3" in levels:
-                query |= (gtable.level != None) & \
-                         (gtable.parent == L2)
-            if L3 and "L4" in levels:
-                query |= (gtable.level != None) & \
-                         (gtable.parent == L3)
-            if L4 and "L5" in levels:
-                query |= (gtable.level != None) & \
-                         (gtable.parent == L4)
-        elif L0 and "L1" in levels:
-            query = (gtable.level != None) & \
-                    (gtable.parent == L0)
-            if filter_lx and top_level == "L1":
-                query &= gtable.name.belongs(filter_lx)
-            if L1 and "L2" in levels:
-                query |= (gtable.level != None) & \
-                         (gtable.parent == L1)
-            if L2 and "L3" in levels:
-                query |= (gtable.level != None) & \
-                         (gtable.parent == L2)
-            if L3 and "L4" in levels:
-                query |= (gtable.level != None) & \
-                         (gtable.parent == L3)
-            if L4 and "L5" in levels:
-                query |= (gtable.level != None) & \
-                         (gtable.parent == L4)
-        elif L1 and "L2" in levels:
-            query = (gtable.level != None) & \
-                    (gtable.parent == L1)
-            if filter_lx and top_level == "L2":
-                query &= gtable.name.belongs(filter_lx)
-            if L2 and "L3" in levels:
-                query |= (gtable.level != None) & \
-                         (gtable.parent == L2)
-            if L3 and "L4" in levels:
-                query |= (gtable.level != None) & \
-                         (gtable.parent == L3)
-            if L4 and "L5" in levels:
-                query |= (gtable.level != None) & \
-                         (gtable.parent == L4)
-        elif L2 and "L3" in levels:
-            query = (gtable.level != None) & \
-                    (gtable.parent == L2)
-            if filter_lx and top_level == "L3":
-                query &= gtable.name.belongs(filter_lx)
-            if L3 and "L4" in levels:
-                query |= (gtable.level != None) & \
-                         (gtable.parent == L3)
-            if L4 and "L5" in levels:
-                query |= (gtable.level != None) & \
-                         (gtable.parent == L4)
-        elif L3 and "L4" in levels:
-            query = (gtable.level != None) & \
-                    (gtable.parent == L3)
-            if filter_lx and top_level == "L4":
-                query &= gtable.name.belongs(filter_lx)
-            if L4 and "L5" in levels:
-                query |= (gtable.level != None) & \
-                         (gtable.parent == L4)
-        elif L4 and "L5" in levels:
-            query = (gtable.level != None) & \
-                    (gtable.parent == L4)
-            if filter_lx and top_level == "L5":
-                query &= gtable.name.belongs(filter_lx)
-        else:
-            query = None
+
+        # Children of the selected Lx (from the hierarchy cache,
+        # unless the top-level options are filtered by name)
+        parents = []
+        for parent, level in ((L0, "L1"),
+                              (L1, "L2"),
+                              (L2, "L3"),
+                              (L3, "L4"),
+                              (L4, "L5"),
+                              ):
+            if not parent or level not in levels:
+                continue
+            if filter_lx and top_level == level:
+                subquery = (gtable.level != None) & \
+                           (gtable.parent == parent) & \
+                           gtable.name.belongs(filter_lx)
+                query = subquery if query is None else query | subquery
+            else:
+                parents.append(parent)
 
         # Translate options using gis_location_name?
         language = current.session.s3.language
@@ -5860,7 +5807,7 @@ class S3LocationSelector(S3Selector):
 
         if query is None:
             locations = []
-            if levels != []:
+            if levels != [] and not parents:
                 # Misconfigured (e.g. no default for a hidden Lx level)
                 current.log.warning("S3LocationSelector: no default for hidden Lx level?")
         else:
@@ -5992,6 +5939,12 @@ class S3LocationSelector(S3Selector):
                                  ]
                 location_dict[int(l.id)] = data
 
+        get_ldata = current.gis.get_ldata
+        for parent in parents:
+            children = json.loads(get_ldata(parent, children=True)[0])
+            for location_id, data in children.items():
+                location_dict[int(location_id)] = data
+
         return location_dict
 
     # -------------------------------------------------------------------------
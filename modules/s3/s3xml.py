@@ -32,10 +32,12 @@
     OTHER DEALINGS IN THE SOFTWARE.
 """
 
+import hashlib
 import json
 import os
 import re
 import sys
+import threading
 
 try:
     from lxml import etree
@@ -248,7 +250,9 @@ class S3XML(S3Codec):
             Transform an element tree with XSLT
 
             @param tree: the element tree
-            @param stylesheet_path: pathname of the XSLT stylesheet
+            @param stylesheet_path: pathname of the XSLT stylesheet, or
+                                    a pre-parsed stylesheet (ElementTree),
+                                    or a compiled stylesheet (XSLT)
             @param args: dict of arguments to pass to the stylesheet
         """
 
@@ -259,16 +263,25 @@ class S3XML(S3Codec):
         else:
             _args = None
 
-        if isinstance(stylesheet_path, (etree._ElementTree, etree._Element)):
+        transformer = None
+        if isinstance(stylesheet_path, etree.XSLT):
+            # Pre-compiled stylesheet
+            stylesheet = transformer = stylesheet_path
+        elif isinstance(stylesheet_path, (etree._ElementTree, etree._Element)):
             # Pre-parsed stylesheet
             stylesheet = stylesheet_path
         else:
-            stylesheet = self.parse(stylesheet_path)
+            entry = S3XSLTCache.get(stylesheet_path)
+            if entry:
+                stylesheet = transformer = entry.transformer
+            else:
+                stylesheet = self.parse(stylesheet_path)
 
         if stylesheet is not None:
             try:
-                ac = etree.XSLTAccessControl(read_file=True, read_network=True)
-                transformer = etree.XSLT(stylesheet, access_control=ac)
+                if transformer is None:
+                    ac = etree.XSLTAccessControl(read_file=True, read_network=True)
+                    transformer = etree.XSLT(stylesheet, access_control=ac)
                 if _args:
                     result = transformer(tree, **_args)
                 else:
@@ -1182,6 +1195,57 @@ class S3XML(S3Codec):
                     yield child
         return
 
+    # -------------------------------------------------------------------------
+    @classmethod
+    def digest(cls, element):
+        """
+            Compute a digest of the contents of a resource element
+            (including its components), disregarding meta-data which
+            differ between repositories or exports (record IDs, URLs,
+            creation/modification details, map attributes) as well as
+            representations - to detect records which a peer repository
+            already holds with identical contents
+
+            @param element: the resource element
+
+            @returns: the digest (hex string)
+        """
+
+        ATTRIBUTE = cls.ATTRIBUTE
+        TAG = cls.TAG
+
+        ignore = {ATTRIBUTE.id,
+                  ATTRIBUTE.url,
+                  ATTRIBUTE.error,
+                  ATTRIBUTE.lat,
+                  ATTRIBUTE.lon,
+                  ATTRIBUTE.marker,
+                  ATTRIBUTE.marker_url,
+                  ATTRIBUTE.marker_height,
+                  ATTRIBUTE.marker_width,
+                  ATTRIBUTE.sym,
+                  cls.CTIME,
+                  cls.CUSER,
+                  cls.MTIME,
+                  cls.MUSER,
+                  cls.MCI,
+                  }
+
+        def canonical(node):
+            # Canonical string representation of an element
+            attributes = sorted((k, v) for k, v in node.attrib.items()
+                                       if k not in ignore)
+            if node.tag == TAG.data and ATTRIBUTE.value not in node.attrib:
+                text = (node.text or "").strip()
+            else:
+                # Representation => ignore
+                text = ""
+            children = sorted(canonical(child) for child in node.iterchildren()
+                                               if isinstance(child.tag, basestring))
+            return json.dumps([node.tag, attributes, text, children])
+
+        return hashlib.sha1(s3_str(canonical(element)).encode("utf-8")).hexdigest()
+
     # -------------------------------------------------------------------------
     @staticmethod
     def _dtparse(dtstr, field_type="datetime"):
@@ -2904,6 +2968,147 @@ class S3EntityResolver(etree.Resolver):
         # Allow everything else (fall back to default resolver)
         return None
 
+# =============================================================================
+class S3XSLTCache(object):
+    """
+        Process-wide cache for parsed and compiled XSLT stylesheets,
+        keyed by the stylesheet path and validated against the mtimes
+        of the stylesheet and all its (local) includes/imports
+    """
+
+    XSL = "http://www.w3.org/1999/XSL/Transform"
+
+    _cache = {}
+    _lock = threading.Lock()
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def get(cls, path):
+        """
+            Get the cache entry for a stylesheet, parse and compile the
+            stylesheet if it is not cached yet or has changed on disk
+
+            @param path: the path name of the stylesheet
+
+            @returns: Storage(tree, transformer, select, skip, files),
+                      or None if the stylesheet is not cacheable (e.g.
+                      stream or URL) or cannot be parsed/compiled
+        """
+
+        if not isinstance(path, basestring) or not os.path.isfile(path):
+            return None
+        path = os.path.realpath(path)
+
+        cache = cls._cache
+
+        entry = cache.get(path)
+        if entry is not None and cls.valid(entry):
+            return entry
+
+        with cls._lock:
+            entry = cache.get(path)
+            if entry is None or not cls.valid(entry):
+                entry = cls.compile(path)
+                if entry is None:
+                    cache.pop(path, None)
+                else:
+                    cache[path] = entry
+        return entry
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def compile(cls, path):
+        """
+            Parse and compile a stylesheet
+
+            @param path: the path name of the stylesheet
+
+            @returns: the cache entry (Storage), or None on error
+        """
+
+        xml = current.xml
+
+        tree = xml.parse(path)
+        if not tree:
+            return None
+
+        try:
+            ac = etree.XSLTAccessControl(read_file=True, read_network=True)
+            transformer = etree.XSLT(tree, access_control=ac)
+        except etree.XSLTParseError:
+            e = sys.exc_info()[1]
+            xml.error = e
+            current.log.error(e)
+            return None
+
+        files = {}
+        cls.dependencies(path, files)
+
+        return Storage(tree = tree,
+                       transformer = transformer,
+                       files = files,
+                       # S3XMLFormat field inspection results
+                       select = None,
+                       skip = None,
+                       )
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def dependencies(cls, path, files):
+        """
+            Collect the mtimes of a stylesheet and all its local
+            includes and imports
+
+            @param path: the path name of the stylesheet
+            @param files: dict {path: mtime} to update
+        """
+
+        if path in files:
+            return
+        try:
+            files[path] = os.path.getmtime(path)
+            tree = etree.parse(path)
+        except (OSError, IOError, etree.XMLSyntaxError):
+            return
+
+        folder = os.path.dirname(path)
+        for element in tree.xpath("//xsl:include|//xsl:import",
+                                  namespaces = {"xsl": cls.XSL},
+                                  ):
+            href = element.get("href")
+            if not href or "://" in href:
+                continue
+            cls.dependencies(os.path.realpath(os.path.join(folder, href)), files)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def valid(entry):
+        """
+            Check whether a cache entry is still valid, i.e. none of
+            the files it depends on has been modified
+
+            @param entry: the cache entry
+
+            @returns: boolean
+        """
+
+        getmtime = os.path.getmtime
+        try:
+            for path, mtime in entry.files.items():
+                if getmtime(path) != mtime:
+                    return False
+        except OSError:
+            return False
+        return True
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def clear(cls):
+        """ Remove all entries from the cache """
+
+        with cls._lock:
+            cls._cache.clear()
+
 # =============================================================================
 class S3XMLFormat(object):
     """ Helper class to store a pre-parsed stylesheet """
@@ -2915,13 +3120,25 @@ class S3XMLFormat(object):
             @param stylesheet: the stylesheet (pathname or stream)
         """
 
-        self.tree = current.xml.parse(stylesheet)
+        # Use the process-wide cache if the stylesheet is a file
+        entry = S3XSLTCache.get(stylesheet)
+        if entry:
+            self.tree = entry.tree
+            self.transformer = entry.transformer
+        else:
+            self.tree = current.xml.parse(stylesheet)
+            self.transformer = None
         if not self.tree:
             current.log.error("%s parse error: %s" %
                               (stylesheet, current.xml.error))
 
-        self.select = None
-        self.skip = None
+        self.entry = entry
+        if entry:
+            self.select = entry.select
+            self.skip = entry.skip
+        else:
+            self.select = None
+            self.skip = None
 
     # -------------------------------------------------------------------------
     def get_fields(self, tablename):
@@ -3012,6 +3229,12 @@ class S3XMLFormat(object):
 
         self.select = select
         self.skip = skip
+
+        # Store the results in the cache entry
+        entry = self.entry
+        if entry:
+            entry.select = select
+            entry.skip = skip
         return
 
     # -------------------------------------------------------------------------
@@ -3027,6 +3250,10 @@ class S3XMLFormat(object):
             current.log.error("XMLFormat: no stylesheet available")
             return tree
 
-        return current.xml.transform(tree, self.tree, **args)
+        stylesheet = self.transformer
+        if stylesheet is None:
+            stylesheet = self.tree
+
+        return current.xml.transform(tree, stylesheet, **args)
 
 # End =========================================================================
@@ -27,9 +27,12 @@
     OTHER DEALINGS IN THE SOFTWARE.
 """
 
+import base64
 import datetime
 import json
+import shutil
 import sys
+import tempfile
 import traceback
 
 try:
@@ -42,7 +45,9 @@ from gluon import current
 
 from s3compat import HTTPError, URLError, urllib2, urllib_quote
 from ..s3datetime import s3_encode_iso_datetime
+from ..s3query import FS, S3URLQuery
 from ..s3sync import S3SyncBaseAdapter, S3SyncDataArchive
+from ..s3utils import s3_str
 from ..s3validators import JSONERRORS
 
 # =============================================================================
@@ -51,6 +56,12 @@ class S3SyncAdapter(S3SyncBaseAdapter):
         Sahana Eden Synchronization Adapter (default sync adapter)
     """
 
+    # HTTP header for the continuation token of paged transfers
+    CONTINUATION = "X-Sync-Continuation"
+
+    # Maximum number of attempts to resume an interrupted download
+    DOWNLOAD_ATTEMPTS = 5
+
     # -------------------------------------------------------------------------
     def register(self):
         """
@@ -167,6 +178,12 @@ class S3SyncAdapter(S3SyncBaseAdapter):
             @return: tuple (error, mtime), with error=None if successful,
                      else error=message, and mtime=modification timestamp
                      of the youngest record sent
+
+            @note: if paged transfers are enabled (sync.page_size setting),
+                   the data are fetched and imported page by page, and
+                   the continuation token of the next page is stored in
+                   the task after each imported page, so that an interrupted
+                   transfer is resumed from there
         """
 
         xml = current.xml
@@ -210,6 +227,8 @@ class S3SyncAdapter(S3SyncBaseAdapter):
                 else:
                     use_archived = True
 
+        url = None
+        page_size = token = None
         if response is None:
 
             debug("S3Sync: pull %s from %s" % (resource_name, repository.url))
@@ -234,83 +253,59 @@ class S3SyncAdapter(S3SyncBaseAdapter):
                         urlfilter = "[%s]%s=%s" % (prefix, k, urllib_quote(value))
                         url += "&%s" % urlfilter
 
-            debug("...pull from URL %s" % url)
-
-            # Execute the request
-            remote = False
-            action = "fetch"
-            response = None
-            output = None
-
-            opener = self._http_opener(url)
-            try:
-                f = opener.open(url)
-
-            except HTTPError as e:
-                result = log.ERROR
-                remote = True # Peer error
-                code = e.code
-                message = e.read()
-                try:
-                    # Sahana-Eden would send a JSON message,
-                    # try to extract the actual error message:
-                    message_json = json.loads(message)
-                except JSONERRORS:
-                    pass
-                else:
-                    message = message_json.get("message", message)
-                # Prefix as peer error and strip XML markup from the message
-                # @todo: better method to do this?
-                message = "<message>%s</message>" % message
-                try:
-                    markup = etree.XML(message)
-                    message = markup.xpath(".//text()")
-                    if message:
-                        message = " ".join(message)
-                    else:
-                        message = ""
-                except etree.XMLSyntaxError:
-                    pass
-                output = xml.json_message(False, code, message, tree=None)
+            # Paged transfer, resume with the stored continuation token
+            page_size = current.deployment_settings.get_sync_page_size()
+            if page_size:
+                url += "&page_size=%s" % page_size
+                token = task.pull_token
 
-            except URLError as e:
-                # URL Error (network error)
-                result = log.ERROR
-                remote = True
-                message = "Peer repository unavailable (%s)" % e.reason
-                output = xml.json_message(False, 400, message)
+        # Get import strategy and update policy
+        strategy = task.strategy
+        update_policy = task.update_policy
+        conflict_policy = task.conflict_policy
 
-            except:
-                result = log.FATAL
-                message = sys.exc_info()[1]
-                output = xml.json_message(False, 400, message)
+        if onconflict:
+            onconflict_callback = lambda item: onconflict(item,
+                                                          repository,
+                                                          resource,
+                                                          )
+        else:
+            onconflict_callback = None
 
-            else:
-                result = log.SUCCESS
-                response = f
+        # Skip records which have been exchanged before unchanged
+        digests = self._digests()
 
-        # Process the response
         mtime = None
-        if response:
-
-            # Get import strategy and update policy
-            strategy = task.strategy
-            update_policy = task.update_policy
-            conflict_policy = task.conflict_policy
-
+        count = 0
+        pages = 0
+        message = ""
+        while True:
+
+            next_token = None
+            if response is None:
+
+                # Fetch the next page
+                page_url = url
+                if token:
+                    page_url += "&token=%s" % urllib_quote(token)
+
+                debug("...pull from URL %s" % page_url)
+
+                action = "fetch"
+                response, output, status, remote, error = self._fetch(page_url)
+                if response is None:
+                    result = status
+                    message = error
+                    break
+                if page_size:
+                    next_token = response.info().get(self.CONTINUATION)
+
+            # Process the response
             success = True
-            message = ""
             action = "import"
 
             # Import the data
-            if onconflict:
-                onconflict_callback = lambda item: onconflict(item,
-                                                              repository,
-                                                              resource,
-                                                              )
-            else:
-                onconflict_callback = None
-            count = 0
+            resource = current.s3db.resource(resource_name)
             try:
                 success = resource.import_xml(response,
                                               ignore_errors = True,
@@ -319,8 +314,9 @@ class S3SyncAdapter(S3SyncBaseAdapter):
                                               conflict_policy = conflict_policy,
                                               last_sync = last_pull,
                                               onconflict = onconflict_callback,
+                                              digests = digests,
                                               )
-                count = resource.import_count
+                count += resource.import_count
 
             except IOError as e:
                 result = log.FATAL
@@ -338,12 +334,15 @@ class S3SyncAdapter(S3SyncBaseAdapter):
                           traceback.format_exc()
                 output = xml.json_message(False, 500, sys.exc_info()[1])
 
-            mtime = resource.mtime
+            page_mtime = resource.mtime
+            if page_mtime and (mtime is None or page_mtime > mtime):
+                mtime = page_mtime
+            pages += 1
 
             # Log all validation errors
             if resource.error_tree is not None:
                 result = log.WARNING
-                message = "%s" % resource.error
+                message = "%s%s" % (message, resource.error)
                 for element in resource.error_tree.findall("resource"):
                     for field in element.findall("data[@error]"):
                         error_msg = field.get("error", None)
@@ -364,23 +363,42 @@ class S3SyncAdapter(S3SyncBaseAdapter):
                 output = xml.json_message(False, 400, message)
                 mtime = None
 
-            # ...or report success
+            if output is not None:
+                # Stop here, resume from the last committed page
+                break
+
+            if next_token:
+                # Commit this page and remember where to continue
+                task.update_record(pull_token=next_token)
+                current.db.commit()
+                token = next_token
+                response = None
+            else:
+                # Transfer complete
+                if task.pull_token:
+                    task.update_record(pull_token=None)
+                break
+
+        if output is None:
+            if not pages:
+                # No data received from peer
+                result = log.ERROR
+                remote = True
+                message = "No data received from peer"
+
             elif not message:
+                # Report success
                 if not count:
                     message = "No data to import (already up-to-date)"
                 else:
                     message = "Data imported successfully (%s records%%s)" % count
                     if use_archived:
                         message = message % ", from archive"
+                    elif pages > 1:
+                        message = message % (", %s pages" % pages)
                     else:
                         message = message % ""
 
-        elif result == log.SUCCESS:
-            # No data received from peer
-            result = log.ERROR
-            remote = True
-            message = "No data received from peer"
-
         # Log the operation
         log.write(repository_id = repository.id,
                   resource_name = task.resource_name,
@@ -406,6 +424,12 @@ class S3SyncAdapter(S3SyncBaseAdapter):
             @return: tuple (error, mtime), with error=None if successful,
                      else error=message, and mtime=modification timestamp
                      of the youngest record sent
+
+            @note: if paged transfers are enabled (sync.page_size setting),
+                   the data are sent page by page, and the continuation
+                   token of the next page is stored in the task after each
+                   page accepted by the peer, so that an interrupted transfer
+                   is resumed from there
         """
 
         xml = current.xml
@@ -444,66 +468,117 @@ class S3SyncAdapter(S3SyncBaseAdapter):
             # Default
             components = None
 
-        # Define the resource
-        resource = current.s3db.resource(resource_name,
-                                         components = components,
-                                         include_deleted = True,
-                                         )
-
-        # Apply sync filters for this task
+        # Sync filters for this task
         filters = current.sync.get_filters(task.id)
 
-        # Export the resource as S3XML
-        data = resource.export_xml(filters = filters,
-                                   msince = last_push,
-                                   )
-        count = resource.results or 0
-        mtime = resource.muntil
+        # Paged transfer, resume with the stored continuation token
+        page_size = current.deployment_settings.get_sync_page_size()
+        token = task.push_token if page_size else None
+
+        # Skip records the peer already holds unchanged
+        digests = self._digests()
 
-        # Transmit the data via HTTP
         remote = False
         output = None
         log = repository.log
-        if data and count:
-            # Execute the request
-            opener = self._http_opener(url,
-                                       headers = [("Content-Type", "text/xml"),
-                                                  ],
+
+        mtime = None
+        total = 0
+        pages = 0
+        while True:
+
+            # Define the resource
+            resource = current.s3db.resource(resource_name,
+                                             components = components,
+                                             include_deleted = True,
+                                             )
+
+            # Select the next page
+            if page_size:
+                next_token = self.select_page(resource,
+                                              page_size,
+                                              token = token,
+                                              msince = last_push,
+                                              filters = filters,
+                                              )
+            else:
+                next_token = None
+
+            # Export the resource as S3XML
+            data = resource.export_xml(filters = filters,
+                                       msince = last_push,
+                                       digests = digests,
                                        )
-            try:
-                opener.open(url, data)
-            except HTTPError as e:
-                result = log.FATAL
-                remote = True # Peer error
-                code = e.code
-                message = e.read()
+            count = resource.results or 0
+
+            # Transmit the data via HTTP
+            if data and count:
+                # Execute the request
+                opener = self._http_opener(url,
+                                           headers = [("Content-Type", "text/xml"),
+                                                      ],
+                                           )
                 try:
-                    # Sahana-Eden sends a JSON message,
-                    # try to extract the actual error message:
-                    message_json = json.loads(message)
-                except JSONERRORS:
-                    pass
+                    opener.open(url, data)
+                except HTTPError as e:
+                    result = log.FATAL
+                    remote = True # Peer error
+                    code = e.code
+                    message = e.read()
+                    try:
+                        # Sahana-Eden sends a JSON message,
+                        # try to extract the actual error message:
+                        message_json = json.loads(message)
+                    except JSONERRORS:
+                        pass
+                    else:
+                        message = message_json.get("message", message)
+                    output = xml.json_message(False, code, message)
+                except URLError as e:
+                    # URL Error (network error)
+                    result = log.ERROR
+                    remote = True
+                    message = "Peer repository unavailable (%s)" % e.reason
+                    output = xml.json_message(False, 400, message)
+                except:
+                    result = log.FATAL
+                    code = 400
+                    message = sys.exc_info()[1]
+                    output = xml.json_message(False, code, message)
                 else:
-                    message = message_json.get("message", message)
-                output = xml.json_message(False, code, message)
-            except URLError as e:
-                # URL Error (network error)
-                result = log.ERROR
-                remote = True
-                message = "Peer repository unavailable (%s)" % e.reason
-                output = xml.json_message(False, 400, message)
-            except:
-                result = log.FATAL
-                code = 400
-                message = sys.exc_info()[1]
-                output = xml.json_message(False, code, message)
+                    if digests is not None:
+                        # Peer has accepted the data
+                        digests.update(resource.digests)
+                    total += count
+                    pages += 1
+                    page_mtime = resource.muntil
+                    if page_mtime and (mtime is None or page_mtime > mtime):
+                        mtime = page_mtime
+
+            if output is not None:
+                # Stop here, resume from the last accepted page
+                break
+
+            if next_token:
+                # Remember where to continue
+                task.update_record(push_token=next_token)
+                current.db.commit()
+                token = next_token
             else:
+                # Transfer complete
+                if task.push_token:
+                    task.update_record(push_token=None)
+                break
+
+        if output is None:
+            if total:
                 result = log.SUCCESS
-                message = "data sent successfully (%s records)" % count
-        else:
-            # No data to send
-            result = log.WARNING
-            message = "No data to send"
+                message = "data sent successfully (%s records%s)" % \
+                          (total, ", %s pages" % pages if pages > 1 else "")
+            else:
+                # No data to send
+                result = log.WARNING
+                message = "No data to send"
 
         # Log the operation
         log.write(repository_id = repository.id,
@@ -529,7 +604,9 @@ class S3SyncAdapter(S3SyncBaseAdapter):
              msince=None,
              filters=None,
              mixed=False,
-             pretty_print=False):
+             pretty_print=False,
+             page_size=None,
+             token=None):
         """
             Respond to an incoming pull from the peer repository
 
@@ -540,12 +617,19 @@ class S3SyncAdapter(S3SyncBaseAdapter):
             @param filters: URL filters for record extraction
             @param mixed: negotiate resource with peer (disregard resource)
             @param pretty_print: make the output human-readable
+            @param page_size: maximum number of records per page (paged
+                              transfer, overrides start/limit)
+            @param token: continuation token of the page to send
 
             @return: a dict {status, remote, message, response}, with:
                         - status....the outcome of the operation
                         - remote....whether the error was remote (or local)
                         - message...the log message
                         - response..the response to send to the peer
+
+            @note: for paged transfers, the continuation token for the
+                   next page is sent in the X-Sync-Continuation header
+                   (omitted for the last page)
         """
 
         if not resource or mixed:
@@ -555,12 +639,24 @@ class S3SyncAdapter(S3SyncBaseAdapter):
                     "response": current.xml.json_message(False, 400, msg),
                     }
 
+        # Select the requested page
+        next_token = None
+        if page_size:
+            start = limit = None
+            next_token = self.select_page(resource,
+                                          page_size,
+                                          token = token,
+                                          msince = msince,
+                                          filters = filters,
+                                          )
+
         # Export the data as S3XML
         output = resource.export_xml(start = start,
                                      limit = limit,
                                      filters = filters,
                                      msince = msince,
                                      pretty_print = pretty_print,
+                                     digests = self._digests(),
                                      )
         count = resource.results
         msg = "Data sent to peer (%s records)" % count
@@ -573,6 +669,8 @@ class S3SyncAdapter(S3SyncBaseAdapter):
         # Set content type header
         headers = current.response.headers
         headers["Content-Type"] = "text/xml"
+        if next_token:
+            headers[self.CONTINUATION] = next_token
 
         return {"status": self.log.SUCCESS,
                 "message": msg,
@@ -638,6 +736,7 @@ class S3SyncAdapter(S3SyncBaseAdapter):
                                      conflict_policy = conflict_policy,
                                      last_sync = last_sync,
                                      onconflict = onconflict_callback,
+                                     digests = self._digests(),
                                      )
 
         log = self.log
@@ -689,6 +788,197 @@ class S3SyncAdapter(S3SyncBaseAdapter):
                 "response": output,
                 }
 
+    # -------------------------------------------------------------------------
+    @classmethod
+    def select_page(cls,
+                    resource,
+                    page_size,
+                    token=None,
+                    msince=None,
+                    filters=None):
+        """
+            Restrict a resource to the next page of master records for a
+            paged transfer; records are paged in order of modification
+            date and record ID, so that records modified during the
+            transfer move to the end rather than shifting the pages
+
+            @param resource: the S3Resource
+            @param page_size: the maximum number of records per page
+            @param token: the continuation token of the page
+            @param msince: minimum modification date/time
+            @param filters: URL filters for record extraction
+
+            @returns: the continuation token for the next page, or
+                      None if this is the last page
+        """
+
+        table = resource.table
+        tablename = resource.tablename
+
+        MTIME = current.xml.MTIME
+        if MTIME not in table.fields:
+            # Cannot page this resource
+            return None
+        mtime = FS(MTIME)
+        record_id = FS(table._id.name)
+
+        # Continue after the last record of the previous page
+        cursor = cls.decode_token(token)
+        if cursor:
+            last_mtime, last_id = cursor
+            resource.add_filter((mtime > last_mtime) |
+                                ((mtime == last_mtime) & (record_id > last_id)))
+        if msince:
+            resource.add_filter(mtime >= msince)
+        if filters and tablename in filters:
+            parsed_filters = S3URLQuery.parse(resource, filters[tablename])
+            for queries in parsed_filters.values():
+                for query in queries:
+                    resource.add_filter(query)
+
+        # Look up the records in the page (plus one to find out
+        # whether there are more)
+        mtime_field = table[MTIME]
+        data = resource.select([table._id.name, MTIME],
+                               limit = page_size + 1,
+                               orderby = mtime_field | table._id,
+                               represent = False,
+                               )
+        rows = data.rows
+        if not rows:
+            return None
+
+        colname = str(table._id)
+        ids = [row[colname] for row in rows[:page_size]]
+        resource.add_filter(record_id.belongs(ids))
+
+        if len(rows) > page_size:
+            last = rows[page_size - 1]
+            return cls.encode_token(last[str(mtime_field)], last[colname])
+        else:
+            return None
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def encode_token(mtime, record_id):
+        """
+            Encode a continuation token for paged transfers
+
+            @param mtime: the modification date/time of the last record
+            @param record_id: the record ID of the last record
+
+            @returns: the token (str)
+        """
+
+        cursor = json.dumps([mtime.isoformat() if mtime else None, record_id])
+        return s3_str(base64.urlsafe_b64encode(s3_str(cursor).encode("utf-8")))
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def decode_token(token):
+        """
+            Decode a continuation token for paged transfers
+
+            @param token: the token
+
+            @returns: tuple (mtime, record_id), or None if the token
+                      is empty or invalid
+        """
+
+        if not token:
+            return None
+        try:
+            mtime, record_id = json.loads(s3_str(base64.urlsafe_b64decode(s3_str(token))))
+            if mtime:
+                fmt = "%Y-%m-%dT%H:%M:%S.%f" if "." in mtime else "%Y-%m-%dT%H:%M:%S"
+                mtime = datetime.datetime.strptime(mtime, fmt)
+            record_id = int(record_id)
+        except (TypeError, ValueError):
+            return None
+        return (mtime, record_id)
+
+    # -------------------------------------------------------------------------
+    def _digests(self):
+        """
+            Get the registry of record digests exchanged with the peer
+            repository, if enabled
+
+            @returns: S3SyncDigests instance, or None
+        """
+
+        if current.deployment_settings.get_sync_record_digests():
+            return self.repository.digests
+        else:
+            return None
+
+    # -------------------------------------------------------------------------
+    def _fetch(self, url):
+        """
+            Fetch data from the peer repository
+
+            @param url: the URL
+
+            @returns: tuple (response, output, result, remote, message),
+                      with response=None if the request failed
+        """
+
+        xml = current.xml
+        log = self.repository.log
+
+        response = None
+        output = None
+        remote = False
+        message = None
+
+        opener = self._http_opener(url)
+        try:
+            f = opener.open(url)
+
+        except HTTPError as e:
+            result = log.ERROR
+            remote = True # Peer error
+            code = e.code
+            message = e.read()
+            try:
+                # Sahana-Eden would send a JSON message,
+                # try to extract the actual error message:
+                message_json = json.loads(message)
+            except JSONERRORS:
+                pass
+            else:
+                message = message_json.get("message", message)
+            # Prefix as peer error and strip XML markup from the message
+            # @todo: better method to do this?
+            message = "<message>%s</message>" % message
+            try:
+                markup = etree.XML(message)
+                message = markup.xpath(".//text()")
+                if message:
+                    message = " ".join(message)
+                else:
+                    message = ""
+            except etree.XMLSyntaxError:
+                pass
+            output = xml.json_message(False, code, message, tree=None)
+
+        except URLError as e:
+            # URL Error (network error)
+            result = log.ERROR
+            remote = True
+            message = "Peer repository unavailable (%s)" % e.reason
+            output = xml.json_message(False, 400, message)
+
+        except:
+            result = log.FATAL
+            message = sys.exc_info()[1]
+            output = xml.json_message(False, 400, message)
+
+        else:
+            result = log.SUCCESS
+            response = f
+
+        return response, output, result, remote, message
+
     # -------------------------------------------------------------------------
     def _get_archive(self, dataset_id):
         """
@@ -752,11 +1042,10 @@ class S3SyncAdapter(S3SyncBaseAdapter):
                 auth = False
 
             # Fetch the archive
-            opener = self._http_opener(url, auth=auth)
             error = None
             local_error = False
             try:
-                f = opener.open(url)
+                f = self._download(url, auth=auth)
             except HTTPError as e:
                 # HTTP status (remote error)
                 message = e.read()
@@ -830,6 +1119,76 @@ class S3SyncAdapter(S3SyncBaseAdapter):
         else:
             return None
 
+    # -------------------------------------------------------------------------
+    def _download(self, url, auth=True):
+        """
+            Download a file into a temporary file, resuming interrupted
+            downloads with HTTP range requests
+
+            @param url: the URL
+            @param auth: send the repository credentials
+
+            @return: the temporary file (positioned at the start)
+
+            @raises HTTPError, URLError: if the request failed
+            @raises IOError: if the download could not be completed
+        """
+
+        CHUNK_SIZE = S3SyncDataArchive.CHUNK_SIZE
+
+        fileobj = tempfile.TemporaryFile()
+
+        attempts = 0
+        while True:
+
+            offset = fileobj.tell()
+            if offset:
+                headers = [("Range", "bytes=%s-" % offset)]
+            else:
+                headers = None
+            opener = self._http_opener(url, headers=headers, auth=auth)
+
+            f = opener.open(url)
+            try:
+                # Determine the total size of the file
+                info = f.info()
+                content_range = info.get("Content-Range") or ""
+                if offset and f.getcode() == 206 and \
+                   content_range.startswith("bytes %s-" % offset):
+                    total = content_range.rsplit("/", 1)[-1]
+                else:
+                    # Peer does not support ranges => start over
+                    fileobj.seek(0)
+                    fileobj.truncate()
+                    total = info.get("Content-Length")
+                try:
+                    total = int(total)
+                except (TypeError, ValueError):
+                    total = None
+
+                # Copy the response
+                try:
+                    shutil.copyfileobj(f, fileobj, CHUNK_SIZE)
+                except Exception:
+                    # Connection interrupted
+                    if total is None:
+                        raise
+            finally:
+                f.close()
+
+            if total is None or fileobj.tell() >= total:
+                break
+
+            attempts += 1
+            if attempts > self.DOWNLOAD_ATTEMPTS:
+                raise IOError("Incomplete download (%s of %s bytes)" %
+                              (fileobj.tell(), total))
+            current.log.debug("S3Sync: resuming download of %s at %s bytes" %
+                              (url, fileobj.tell()))
+
+        fileobj.seek(0)
+        return fileobj
+
     # -------------------------------------------------------------------------
     def _update_dataset(self, dataset):
         """
@@ -358,7 +358,9 @@ class S3SyncAdapter(S3SyncBaseAdapter):
              msince=None,
              filters=None,
              mixed=False,
-             pretty_print=False):
+             pretty_print=False,
+             page_size=None,
+             token=None):
         """
             Respond to an incoming pull from the peer repository
 
@@ -369,6 +371,8 @@ class S3SyncAdapter(S3SyncBaseAdapter):
             @param filters: URL filters for record extraction
             @param mixed: negotiate resource with peer (disregard resource)
             @param pretty_print: make the output human-readable
+            @param page_size: paged transfer (not supported, ignored)
+            @param token: continuation token (not supported, ignored)
 
             @return: a dict {status, remote, message, response}, with:
                         - status....the outcome of the operation
@@ -203,6 +203,7 @@ class S3Config(Storage):
         self.proc = Storage()
         self.project = Storage()
         self.req = Storage()
+        self.scheduler = Storage()
         self.search = Storage()
         self.security = Storage()
         self.setup = Storage()
@@ -549,6 +550,23 @@ class S3Config(Storage):
         """
         return self.tasks.get(taskname)
 
+    def get_scheduler_queues(self):
+        """
+            Task queues, extending/overriding S3Task.QUEUES, a dict
+            {queue_name: {"group": worker group, "priority": priority}}
+            - tasks in queues with higher priority are run first
+            - workers for a particular group are started like:
+              python web2py.py -K eden:groupname
+        """
+        return self.scheduler.get("queues", {})
+
+    def get_scheduler_task_queues(self):
+        """
+            Queues for tasks, extending/overriding S3Task.TASK_QUEUES,
+            a dict {taskname: queue_name}
+        """
+        return self.scheduler.get("task_queues", {})
+
     # -------------------------------------------------------------------------
     # Authentication settings
     def get_auth_hmac_key(self):
@@ -1022,6 +1040,18 @@ class S3Config(Storage):
         return self.security.get("audit_read", False)
     def get_security_audit_write(self):
         return self.security.get("audit_write", False)
+    def get_security_audit_buffer(self):
+        """
+            Buffer audit entries during the request and write them in
+            bulk at the end of it (rather than one INSERT per entry)
+        """
+        return self.security.get("audit_buffer", True)
+    def get_security_audit_retention(self):
+        """
+            Number of days to keep audit entries for (None = keep forever),
+            older entries are removed by the s3_audit_prune task
+        """
+        return self.security.get("audit_retention", None)
     def get_security_policy(self):
         " Default is Simple Security Policy "
         return self.security.get("policy", 1)
@@ -1102,6 +1132,22 @@ class S3Config(Storage):
       """
         return self.base.get("bigtable", False)
 
+    def get_base_stream_exports(self):
+        """
+            Stream CSV, JSON and S3XML exports to the client in chunks
+            rather than serializing the complete document in memory
+            - can also be requested per URL with ?stream=1
+            - not applicable for exports which require an XSLT
+              transformation of the complete tree
+        """
+        return self.base.get("stream_exports", False)
+
+    def get_base_export_chunk_size(self):
+        """
+            Number of records to extract per chunk in streamed exports
+        """
+        return self.base.get("export_chunk_size", 1000)
+
     def get_base_cdn(self):
         """
             Should we use CDNs (Content Distribution Networks) to serve some common CSS/JS?
@@ -1487,9 +1533,32 @@ class S3Config(Storage):
                 "nominatim" (default)
                 "geonames"
                 "google"
+                "offline" (match names of existing locations, no external service)
         """
         return self.gis.get("geocode_service", "nominatim")
 
+    def get_gis_geocode_cache_ttl(self):
+        """
+            Number of days to cache Geocoder results (0 to disable caching),
+            negative results are cached for at most 1 day
+        """
+        return self.gis.get("geocode_cache_ttl", 90)
+
+    def get_gis_geocode_rate_limit(self):
+        """
+            Minimum time (in seconds) between two requests to the
+            Geocoder service (Nominatim usage policy: 1 request/second)
+        """
+        return self.gis.get("geocode_rate_limit", 1.0)
+
+    def get_gis_geocode_batch(self):
+        """
+            Geocode imported addresses in a background batch task (if a
+            scheduler worker is alive) rather than during the import
+            - requires gis.geocode_imported_addresses
+        """
+        return self.gis.get("geocode_batch", False)
+
     def get_gis_geocode_imported_addresses(self):
         """
             Should Addresses imported from CSV be passed to a
@@ -1626,6 +1695,13 @@ class S3Config(Storage):
         """
         return self.gis.get("max_features", 2000)
 
+    def get_gis_mvt_cache(self):
+        """
+            Cache vector tiles of Feature Layers (mvt method) on disk,
+            tiles are invalidated when records or locations change
+        """
+        return self.gis.get("mvt_cache", True)
+
     def get_gis_legend(self):
         """
             Should we display a Legend on the Map?
@@ -1770,6 +1846,15 @@ class S3Config(Storage):
         """
         return self.gis.get("simplify_tolerance", 0.01)
 
+    def get_gis_simplify_levels(self):
+        """
+            Tolerances at which simplified geometries of polygons are
+            precomputed, exports select the level appropriate to the
+            requested zoom or bbox
+            - set to None or empty tuple to always simplify on demand
+        """
+        return self.gis.get("simplify_levels", (0.0001, 0.001, 0.01, 0.1))
+
     def get_gis_precision(self):
         """
             Number of Decimal places to put in output
@@ -1788,6 +1873,38 @@ class S3Config(Storage):
         else:
             return self.gis.get("spatialdb", False)
 
+    def get_gis_config_cache(self):
+        """
+            Cache the merged GIS config and the map layer definitions
+            across requests for this number of seconds (0 to disable),
+            invalidated on writes to gis_config/gis_layer_*/gis_style
+        """
+        return self.gis.get("config_cache", 600)
+
+    def get_gis_hierarchy_cache(self):
+        """
+            Cache the location hierarchy data for S3LocationSelector
+            (gis/ldata and the initial Lx dropdown options) on disk,
+            per parent location, level and language
+        """
+        return self.gis.get("hierarchy_cache", True)
+
+    def get_gis_spatial_index(self):
+        """
+            Use an in-process spatial index (R-tree over location bounds)
+            to pre-select candidates for spatial lookups (polygon, radius,
+            bbox) - persisted on disk, updated on location writes
+        """
+        return self.gis.get("spatial_index", True)
+
+    def get_gis_tile_cache_size(self):
+        """
+            Maximum size (in MB) of the disk cache for tiles of WMS/TMS
+            layers served through the caching proxy, least recently used
+            tiles are evicted when the cache grows beyond this size
+        """
+        return self.gis.get("tile_cache_size", 512)
+
     def get_gis_widget_catalogue_layers(self):
         """
             Should Map Widgets display Catalogue Layers?
@@ -2094,6 +2211,23 @@ class S3Config(Storage):
         """
         return self.base.get("pdf_max_rows", 1000)
 
+    def get_pdf_chunk_size(self):
+        """
+            Number of records per chunk when rendering large PDF tables
+            in chunks (requires pypdf), e.g. 500
+                - None to always render the table as a whole
+                - chunks are rendered as plain text (without markup)
+        """
+        return self.base.get("pdf_chunk_size", None)
+
+    def get_pdf_workers(self):
+        """
+            Maximum number of worker processes to render PDF chunks
+                - 1 to render all chunks in the current process
+                - None for the number of CPUs
+        """
+        return self.base.get("pdf_workers", 1)
+
     # -------------------------------------------------------------------------
     # XLS Export Settings
     #
@@ -2914,6 +3048,32 @@ class S3Config(Storage):
         """
         return self.sync.get("upload_filename", "$s $r")
 
+    def get_sync_page_size(self):
+        """
+            Maximum number of master records per page when transferring
+            data between Eden repositories (interrupted transfers resume
+            from the last completed page)
+                - None to transfer all records in one document
+        """
+        return self.sync.get("page_size", 500)
+
+    def get_sync_record_digests(self):
+        """
+            Keep track of the content digests of records exchanged with
+            Eden peer repositories, and skip records the peer already
+            holds unchanged (e.g. echoes in bidirectional synchronization)
+        """
+        return self.sync.get("record_digests", True)
+
+    def get_sync_concurrency(self):
+        """
+            Maximum number of sync tasks (across all repositories) to
+            run in parallel - tasks writing to the same tables are always
+            run one after another; parallel runs require multiple
+            scheduler workers
+        """
+        return self.sync.get("concurrency", 4)
+
     def get_sync_data_repository(self):
         """ This deployment is a public data repository """
 
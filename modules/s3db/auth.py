@@ -35,6 +35,7 @@ __all__ = ("AuthDomainApproverModel",
            "auth_user_options_get_osm",
            "auth_UserRepresent",
            "AuthUserTempModel",
+           "AuthRealmSnapshotModel",
            )
 
 import datetime
@@ -1359,6 +1360,56 @@ class AuthUserTempModel(S3Model):
         return {}
 
 
+# =============================================================================
+class AuthRealmSnapshotModel(S3Model):
+    """
+        Model to persist the realms and delegations computed for users
+        (see AuthS3.s3_set_roles), so that they need not be re-computed
+        on every login
+    """
+
+    names = ("auth_realm_snapshot",
+             "auth_realm_version",
+             )
+
+    def model(self):
+
+        define_table = self.define_table
+
+        # ---------------------------------------------------------------------
+        # Realm Snapshots
+        # - valid only as long as the version matches the current version
+        #   stamp, and the digest matches the user's memberships
+        #
+        tablename = "auth_realm_snapshot"
+        define_table(tablename,
+                     Field("user_id", current.auth.settings.table_user,
+                           ondelete = "CASCADE",
+                           ),
+                     Field("version", "integer"),
+                     Field("digest", length=64),
+                     Field("realms", "json"),
+                     Field("delegations", "json"),
+                     S3MetaFields.modified_on(),
+                     )
+
+        # ---------------------------------------------------------------------
+        # Version Stamp
+        # - single record, incremented whenever affiliations, roles or
+        #   delegations change (see AuthS3.s3_bump_realms_version)
+        #
+        tablename = "auth_realm_version"
+        define_table(tablename,
+                     Field("version", "integer",
+                           default = 0,
+                           ),
+                     )
+
+        # ---------------------------------------------------------------------
+        # Pass names back to global scope (s3.*)
+        #
+        return {}
+
 # =============================================================================
 class auth_UserRepresent(S3Represent):
     """
@@ -2035,19 +2035,20 @@ class DiseaseStatsModel(S3Model):
                                 orderby = ~gtable.level,
                                 )
 
-        run_async = current.s3task.run_async
         from gluon.serializers import json as jsons
 
         dates = jsons(dates)
+        calls = []
         for row in rows:
             location_id = row.id
             children = [c.id for c in all_children if c.parent == location_id]
             children = json.dumps(children)
             for parameter_id in parameters:
-                run_async("disease_stats_update_location_aggregates",
-                          args = [location_id, children, parameter_id, dates],
-                          timeout = 1800 # 30m
-                          )
+                calls.append(([location_id, children, parameter_id, dates], None))
+        current.s3task.run_async_batch("disease_stats_update_location_aggregates",
+                                       calls,
+                                       timeout = 1800 # 30m
+                                       )
 
     # -------------------------------------------------------------------------
     @staticmethod
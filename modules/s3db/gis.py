@@ -31,6 +31,8 @@ from __future__ import division
 
 __all__ = ("S3LocationModel",
            "S3LocationNameModel",
+           "S3LocationSimplifiedModel",
+           "S3GeocodeCacheModel",
            "S3LocationTagModel",
            "S3LocationGroupModel",
            "S3LocationHierarchyModel",
@@ -466,6 +468,31 @@ class S3LocationModel(S3Model):
             db = current.db
             db(db.gis_location.id == location_id).update(path = None)
 
+        # Update the spatial index
+        S3SpatialIndex.update(location_id)
+
+        # Discard cached hierarchy data which include this location
+        # (under its old path, and under the new parent)
+        current.gis.clear_ldata([location_id, form_vars_get("parent")],
+                                ancestors = True,
+                                )
+
+        if "wkt" in form.vars:
+            # Discard outdated simplified geometries
+            db = current.db
+            stable = current.s3db.gis_location_simplified
+            db(stable.location_id == location_id).delete()
+
+            if not auth.override and \
+               not auth.rollback and \
+               str(form_vars_get("gis_feature_type")) in ("3", "6") and \
+               current.deployment_settings.get_gis_simplify_levels():
+                # Precompute simplified geometries (async if-possible)
+                # (skip during prepop)
+                current.s3task.run_async("gis_update_simplified",
+                                         args = [[location_id]],
+                                         )
+
         if not auth.override and \
            not auth.rollback:
             # Update the Path (async if-possible)
@@ -506,7 +533,16 @@ class S3LocationModel(S3Model):
         if addr_street and lat is None and lon is None and bulk:
 
             geocoder = settings.get_gis_geocode_imported_addresses()
-            if geocoder:
+            if geocoder and settings.get_gis_geocode_batch() and \
+               current.s3task._is_alive():
+                # Geocode imported addresses in a background task after
+                # the import (each distinct address only once)
+                if not s3.gis_geocode_scheduled:
+                    current.s3task.run_async("gis_geocode_pending",
+                                             timeout = 3600,
+                                             )
+                    s3.gis_geocode_scheduled = True
+            elif geocoder:
                 # Geocode imported addresses
                 postcode = vars_get("postcode", None)
                 # Build Path (won't be populated yet). Note get_parents will not
@@ -1272,6 +1308,8 @@ class S3LocationNameModel(S3Model):
                                                        "language",
                                                        ),
                                             ),
+                  onaccept = self.gis_location_name_onaccept,
+                  ondelete = self.gis_location_name_ondelete,
                   )
 
         # ---------------------------------------------------------------------
@@ -1305,6 +1343,102 @@ class S3LocationNameModel(S3Model):
         # Pass names back to global scope (s3.*)
         return {}
 
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def gis_location_name_onaccept(form):
+        """
+            Discard cached hierarchy data which include the location
+        """
+
+        record_id = form.vars.id
+        table = current.s3db.gis_location_name
+        row = current.db(table.id == record_id).select(table.location_id,
+                                                       limitby = (0, 1),
+                                                       ).first()
+        if row:
+            current.gis.clear_ldata(row.location_id, ancestors=True)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def gis_location_name_ondelete(row):
+        """
+            Discard cached hierarchy data which include the location
+        """
+
+        location_id = row.get("location_id")
+        if location_id:
+            current.gis.clear_ldata(location_id, ancestors=True)
+        else:
+            # Location unknown
+            current.gis.clear_ldata()
+
+# =============================================================================
+class S3LocationSimplifiedModel(S3Model):
+    """
+        Simplified Geometries model
+        - simplifications of polygon locations, precomputed at several
+          tolerance levels (settings.gis.simplify_levels)
+    """
+
+    names = ("gis_location_simplified",
+             )
+
+    def model(self):
+
+        # ---------------------------------------------------------------------
+        # Simplified Geometries
+        #
+        tablename = "gis_location_simplified"
+        self.define_table(tablename,
+                          self.gis_location_id(empty = False,
+                                               ondelete = "CASCADE",
+                                               ),
+                          Field("tolerance", "double",
+                                notnull = True,
+                                ),
+                          Field("wkt", "text"),
+                          Field("geojson", "text"),
+                          *s3_meta_fields())
+
+        # Pass names back to global scope (s3.*)
+        return {}
+
+# =============================================================================
+class S3GeocodeCacheModel(S3Model):
+    """
+        Geocoder Cache model
+        - results of GIS.geocode, to avoid repeated requests to the
+          geocoder service for the same address
+    """
+
+    names = ("gis_geocode_cache",
+             )
+
+    def model(self):
+
+        # ---------------------------------------------------------------------
+        # Geocoder Results
+        #
+        tablename = "gis_geocode_cache"
+        self.define_table(tablename,
+                          # Hash of normalised address, Lx context and geocoder
+                          Field("address_key", length=64,
+                                notnull = True,
+                                unique = True,
+                                ),
+                          # Normalised address
+                          Field("address", "text"),
+                          Field("geocoder", length=64),
+                          Field("lat", "double"),
+                          Field("lon", "double"),
+                          # Error message (if no usable result)
+                          Field("error"),
+                          Field("expires_on", "datetime"),
+                          *s3_meta_fields())
+
+        # Pass names back to global scope (s3.*)
+        return {}
+
 # =============================================================================
 class S3LocationTagModel(S3Model):
     """
@@ -2061,6 +2195,12 @@ class S3GISConfigModel(S3Model):
             # msg_record_deleted = T("Menu Entry deleted"),
             # msg_list_empty = T("No Menu Entries currently defined"))
 
+        # Discard cached GIS config & map layers on writes
+        gis_config_cache_hooks("gis_config",
+                               "gis_marker",
+                               "gis_projection",
+                               )
+
         # Pass names back to global scope (s3.*)
         return {"gis_config_form_setup": self.gis_config_form_setup,
                 "gis_config_id": config_id,
@@ -2758,6 +2898,12 @@ class S3LayerEntityModel(S3Model):
         )
 
         # ---------------------------------------------------------------------
+        # Discard cached GIS config & map layers on writes
+        gis_config_cache_hooks("gis_layer_entity",
+                               "gis_layer_config",
+                               "gis_style",
+                               )
+
         # Pass names back to global scope (s3.*)
         return {"gis_layer_types": layer_types,
                 # Run from config() controller when saving state
@@ -3016,6 +3162,9 @@ class S3FeatureLayerModel(S3Model):
                        super_entity = "gis_layer_entity",
                        )
 
+        # Discard cached GIS config & map layers on writes
+        gis_config_cache_hooks("gis_layer_feature")
+
         # Pass names back to global scope (s3.*)
         return {}
 
@@ -3077,6 +3226,7 @@ class S3MapModel(S3Model):
 
     names = ("gis_cache",
              "gis_cache2",
+             "gis_feed",
              "gis_feature_query",
              "gis_layer_arcrest",
              "gis_layer_bing",
@@ -3384,7 +3534,7 @@ class S3MapModel(S3Model):
                   deduplicate = S3Duplicate(primary = ("url",),
                                             ignore_case = False,
                                             ),
-                  onaccept = gis_layer_onaccept,
+                  onaccept = gis_layer_feed_onaccept,
                   super_entity = "gis_layer_entity",
                   )
 
@@ -3750,12 +3900,13 @@ class S3MapModel(S3Model):
                            label = T("Zoom Levels"),
                            requires = IS_INT_IN_RANGE(1, 30),
                            ),
+                     gis_tile_cache()(),
                      s3_role_required(),       # Single Role
                      #s3_roles_permitted(),    # Multiple Roles (needs implementing in modules/s3gis.py)
                      *s3_meta_fields())
 
         configure(tablename,
-                  onaccept = gis_layer_onaccept,
+                  onaccept = gis_layer_tile_onaccept,
                   super_entity = "gis_layer_entity",
                   )
 
@@ -3974,12 +4125,13 @@ class S3MapModel(S3Model):
                      #      label = T("Legend Format"),
                      #      requires = IS_EMPTY_OR(IS_IN_SET(gis_layer_wms_img_formats)),
                      #      ),
+                     gis_tile_cache()(),
                      s3_role_required(),       # Single Role
                      #s3_roles_permitted(),    # Multiple Roles (needs implementing in modules/s3gis.py)
                      *s3_meta_fields())
 
         configure(tablename,
-                  onaccept = gis_layer_onaccept,
+                  onaccept = gis_layer_tile_onaccept,
                   super_entity = "gis_layer_entity",
                   )
 
@@ -4046,6 +4198,27 @@ class S3MapModel(S3Model):
                      Field("source",
                            requires = IS_EMPTY_OR(IS_URL()),
                            ),
+                     # The feature as GeoJSON & its bounds, for serving
+                     # feeds from the cache (see GIS.get_cached_features)
+                     Field("geojson", "text"),
+                     Field("lat_min", "double"),
+                     Field("lat_max", "double"),
+                     Field("lon_min", "double"),
+                     Field("lon_max", "double"),
+                     *s3_meta_fields())
+
+        # Refresh status of remote GeoRSS/KML feeds
+        # - maintained by the gis_refresh_feeds task
+        #
+        tablename = "gis_feed"
+        define_table(tablename,
+                     layer_id(),
+                     Field("url"),
+                     # Validators of the last download, for conditional GET
+                     Field("etag"),
+                     Field("last_modified"),
+                     s3_datetime("refreshed_on"),
+                     Field("error"),
                      *s3_meta_fields())
 
         # Store downloaded KML feeds on the filesystem
@@ -4069,6 +4242,9 @@ class S3MapModel(S3Model):
                            ),
                      *s3_meta_fields())
 
+        # Discard cached GIS config & map layers on writes
+        gis_config_cache_hooks(*[tn for tn in self.names if tn.startswith("gis_layer_")])
+
         # Pass names back to global scope (s3.*)
         return {}
 
@@ -4202,8 +4378,8 @@ class S3MapModel(S3Model):
                                  refresh = 0,
                                  )
 
-        # Normal Layer onaccept
-        gis_layer_onaccept(form)
+        # Feed Layer onaccept
+        gis_layer_feed_onaccept(form)
 
     # -------------------------------------------------------------------------
     @staticmethod
@@ -4541,6 +4717,9 @@ class S3GISThemeModel(S3Model):
             msg_list_empty = T("No Data currently defined for this Theme Layer")
         )
 
+        # Discard cached GIS config & map layers on writes
+        gis_config_cache_hooks("gis_layer_theme")
+
         # Pass names back to global scope (s3.*)
         return {"gis_layer_theme_id": layer_theme_id,
                 }
@@ -5016,6 +5195,19 @@ def gis_refresh():
                            requires = IS_INT_IN_RANGE(0, 86400),    # 0 seconds - 24 hours
                            )
 
+# =============================================================================
+def gis_tile_cache():
+    T = current.T
+    TILE_CACHE = T("Tile Cache (seconds)")
+    return S3ReusableField("tile_cache", "integer",
+                           label = TILE_CACHE,
+                           requires = IS_EMPTY_OR(IS_INT_IN_RANGE(0, None)),
+                           represent = lambda v: current.messages["NONE"] if v is None else v,
+                           comment = DIV(_class="tooltip",
+                                         _title="%s|%s" % (TILE_CACHE,
+                                                           T("Load the tiles of this layer through the server, and cache them there for this number of seconds (0 = never expire). Leave empty to load the tiles directly from the service."))),
+                           )
+
 # =============================================================================
 def cluster_attribute():
     T = current.T
@@ -5027,6 +5219,28 @@ def cluster_attribute():
                                                            T("The attribute used to determine which features to cluster together (optional).")))
                            )
 
+# =============================================================================
+def gis_config_cache_hooks(*tablenames):
+    """
+        Invalidate the cached GIS config and map layer definitions
+        (see GIS.config_cache) on any writes to these tables - as DAL
+        callbacks, so that direct DB updates are covered too
+
+        @param tablenames: the table names
+    """
+
+    db = current.db
+    clear = current.gis.clear_config_cache
+
+    for tablename in tablenames:
+        table = db[tablename]
+        for callbacks in (table._after_insert,
+                          table._after_update,
+                          table._after_delete,
+                          ):
+            if clear not in callbacks:
+                callbacks.append(clear)
+
 # =============================================================================
 def gis_layer_onaccept(form):
     """
@@ -5060,6 +5274,38 @@ def gis_layer_onaccept(form):
                           layer_id = layer_id,
                           enabled = True)
 
+# =============================================================================
+def gis_layer_tile_onaccept(form):
+    """
+        Clear the Tile Cache of a WMS/TMS layer when its service URL
+        has changed, & process the enable checkbox
+    """
+
+    record = form.record
+    form_vars = form.vars
+    if record and "url" in form_vars and form_vars.url != record.url:
+        S3TileCache.clear(record.layer_id)
+
+    gis_layer_onaccept(form)
+
+# =============================================================================
+def gis_layer_feed_onaccept(form):
+    """
+        Refresh the cached copy of a GeoRSS/KML feed (async if-possible)
+        & process the enable checkbox
+    """
+
+    layer_id = form.vars.layer_id
+    if layer_id and not current.auth.override:
+        # Skip during prepop (scheduled refresh will pick it up)
+        current.s3task.run_async("gis_refresh_feeds",
+                                 vars = {"layer_ids": [layer_id],
+                                         "force": True,
+                                         },
+                                 )
+
+    gis_layer_onaccept(form)
+
 # =============================================================================
 def gis_hierarchy_editable(level, location_id):
     """
@@ -459,6 +459,9 @@ class PRPersonEntityModel(S3Model):
                   ondelete = self.pr_affiliation_ondelete,
                   )
 
+        # Invalidate the persisted realms of all users on any changes
+        pr_realms_version_hooks("pr_role", "pr_affiliation")
+
         # ---------------------------------------------------------------------
         # Pass names back to global scope (s3.*)
         #
@@ -6847,6 +6850,9 @@ class S3RoleDelegationModel(S3Model):
                                 ondelete="CASCADE"),
                           *s3_meta_fields())
 
+        # Invalidate the persisted realms of all users on any changes
+        pr_realms_version_hooks("pr_delegation")
+
         # ---------------------------------------------------------------------
         return {}
 
@@ -9810,6 +9816,28 @@ def pr_instance_type(pe_id):
             return row.instance_type
     return None
 
+# =============================================================================
+def pr_realms_version_hooks(*tablenames):
+    """
+        Invalidate the persisted realms of all users (see
+        AuthS3.s3_set_roles) on any writes to these tables - as DAL
+        callbacks, so that direct DB updates are covered too
+
+        @param tablenames: the table names
+    """
+
+    db = current.db
+    bump = current.auth.s3_bump_realms_version
+
+    for tablename in tablenames:
+        table = db[tablename]
+        for callbacks in (table._after_insert,
+                          table._after_update,
+                          table._after_delete,
+                          ):
+            if bump not in callbacks:
+                callbacks.append(bump)
+
 # =============================================================================
 def pr_realm(entity):
     """
@@ -30,10 +30,12 @@
 __all__ = ("S3HierarchyModel",
            "S3DashboardModel",
            "S3DynamicTablesModel",
+           "S3ExportJobModel",
            "s3_table_rheader",
            "s3_scheduler_rheader",
            )
 
+import os
 import random
 
 from gluon import *
@@ -170,6 +172,77 @@ class S3DashboardModel(S3Model):
                     (table.deleted != True)
             db(query).update(active = False)
 
+# =============================================================================
+class S3ExportJobModel(S3Model):
+    """ Model for asynchronous export jobs and their cached results """
+
+    names = ("s3_export_job",
+             )
+
+    def model(self):
+
+        # ---------------------------------------------------------------------
+        # Export Job
+        #
+        # - job_key identifies the result by resource, filter, fields,
+        #   format and permissions, so that identical requests can share it
+        # - data_mtime is the latest modified_on of the exported table at
+        #   the time of the export, the result is valid while unchanged
+        # - query is the SQL sub-select for the IDs of the records to
+        #   export (record_ids only if the filter can not be expressed
+        #   in SQL)
+        #
+        tablename = "s3_export_job"
+        self.define_table(tablename,
+                          Field("job_key", length=64,
+                                notnull = True,
+                                ),
+                          Field("auth_key", length=64),
+                          Field("tablename", length=128,
+                                notnull = True,
+                                ),
+                          Field("representation", length=16,
+                                notnull = True,
+                                ),
+                          Field("query", "text"),
+                          Field("record_ids", "json"),
+                          Field("fields", "json"),
+                          Field("status", length=16,
+                                default = "QUEUED",
+                                requires = IS_IN_SET(("QUEUED",
+                                                      "RUNNING",
+                                                      "COMPLETED",
+                                                      "FAILED",
+                                                      )),
+                                ),
+                          Field("task_id", "integer"),
+                          # Progress in percent (while RUNNING)
+                          Field("progress", "integer"),
+                          Field("file", "upload",
+                                autodelete = True,
+                                length = current.MAX_FILENAME_LENGTH,
+                                uploadfolder = os.path.join(current.request.folder,
+                                                            "uploads",
+                                                            "exports",
+                                                            ),
+                                ),
+                          Field("filename"),
+                          Field("data_mtime", "datetime"),
+                          Field("completed_on", "datetime"),
+                          Field("error", "text"),
+                          *s3_meta_fields())
+
+        # ---------------------------------------------------------------------
+        # Return global names to s3.*
+        #
+        return {}
+
+    # -------------------------------------------------------------------------
+    def defaults(self):
+        """ Safe defaults if module is disabled """
+
+        return {}
+
 # =============================================================================
 class S3DynamicTablesModel(S3Model):
     """ Model for dynamic tables """
@@ -31,7 +31,9 @@ __all__ = ("SyncConfigModel",
            "SyncStatusModel",
            "SyncTaskModel",
            "SyncScheduleModel",
+           "SyncRunModel",
            "SyncLogModel",
+           "SyncDigestModel",
            "SyncRepositoryModel",
            "SyncDatasetModel",
            "sync_rheader",
@@ -417,6 +419,7 @@ class SyncRepositoryModel(S3Model):
         self.add_components(tablename,
                             sync_task = "repository_id",
                             sync_log = "repository_id",
+                            sync_run = "repository_id",
                             sync_dataset = "repository_id",
                             # Scheduler Jobs
                             **{S3Task.TASK_TABLENAME: {"name": "job",
@@ -918,11 +921,52 @@ class SyncLogModel(S3Model):
         #
         return {}
 
+# =============================================================================
+class SyncDigestModel(S3Model):
+    """
+        Model for the content digests of records exchanged with peer
+        repositories, used to skip records the peer already holds
+    """
+
+    names = ("sync_digest",
+             )
+
+    def model(self):
+
+        # -------------------------------------------------------------------------
+        # Record Digests
+        #
+        tablename = "sync_digest"
+        self.define_table(tablename,
+                          self.sync_repository_id(ondelete = "CASCADE",
+                                                  readable = False,
+                                                  writable = False,
+                                                  ),
+                          Field("tablename", length=128,
+                                readable = False,
+                                writable = False,
+                                ),
+                          Field("uuid", length=128,
+                                readable = False,
+                                writable = False,
+                                ),
+                          Field("digest", length=40,
+                                readable = False,
+                                writable = False,
+                                ),
+                          )
+
+        # ---------------------------------------------------------------------
+        # Return global names to s3.*
+        #
+        return {}
+
 # =============================================================================
 class SyncTaskModel(S3Model):
 
     names = ("sync_task",
              "sync_resource_filter",
+             "sync_task_id",
              )
 
     def model(self):
@@ -1073,6 +1117,15 @@ class SyncTaskModel(S3Model):
                            writable = False,
                            represent = s3_datetime_represent,
                            ),
+                     # Continuation tokens of interrupted paged transfers
+                     Field("pull_token",
+                           readable = False,
+                           writable = False,
+                           ),
+                     Field("push_token",
+                           readable = False,
+                           writable = False,
+                           ),
                      Field("mode", "integer",
                            default = 3,
                            label = T("Mode"),
@@ -1218,7 +1271,8 @@ class SyncTaskModel(S3Model):
         # ---------------------------------------------------------------------
         # Return global names to s3.*
         #
-        return {}
+        return {"sync_task_id": task_id,
+                }
 
     # -------------------------------------------------------------------------
     @staticmethod
@@ -1359,6 +1413,130 @@ class SyncScheduleModel(S3Model):
         #
         return {}
 
+# =============================================================================
+class SyncRunModel(S3Model):
+    """
+        Model for concurrent synchronization runs (one per sync task),
+        and the table locks serializing runs which touch the same tables
+    """
+
+    names = ("sync_run",
+             "sync_lock",
+             )
+
+    def model(self):
+
+        T = current.T
+        s3 = current.response.s3
+
+        crud_strings = s3.crud_strings
+        define_table = self.define_table
+
+        s3_datetime_represent = lambda dt: \
+                                S3DateTime.datetime_represent(dt, utc=True)
+
+        # -------------------------------------------------------------------------
+        # Synchronization Run
+        #
+        run_status = {"QUEUED": T("Queued"),
+                      "STARTING": T("Starting"),
+                      "RUNNING": T("Running"),
+                      "SUCCESS": T("Completed"),
+                      "FAILED": T("Failed"),
+                      }
+
+        tablename = "sync_run"
+        define_table(tablename,
+                     self.sync_repository_id(ondelete = "CASCADE"),
+                     self.sync_task_id(ondelete = "CASCADE",
+                                       readable = False,
+                                       writable = False,
+                                       ),
+                     Field("resource_name",
+                           label = T("Resource"),
+                           ),
+                     # Tables the run writes to (=its table locks)
+                     Field("tablenames", "list:string",
+                           readable = False,
+                           writable = False,
+                           ),
+                     Field("status", length=16,
+                           default = "QUEUED",
+                           label = T("Status"),
+                           represent = S3Represent(options=run_status),
+                           requires = IS_IN_SET(run_status, zero=None),
+                           ),
+                     Field("queued_on", "datetime",
+                           label = T("Queued on"),
+                           represent = s3_datetime_represent,
+                           ),
+                     Field("started_on", "datetime",
+                           label = T("Started on"),
+                           represent = s3_datetime_represent,
+                           ),
+                     Field("finished_on", "datetime",
+                           label = T("Finished on"),
+                           represent = s3_datetime_represent,
+                           ),
+                     Field("duration", "double",
+                           label = T("Duration (seconds)"),
+                           represent = lambda v: \
+                                       "%.1f" % v if v is not None else "-",
+                           ),
+                     Field("message", "text",
+                           label = T("Message"),
+                           represent = s3_strip_markup,
+                           ),
+                     *s3_meta_fields())
+
+        # CRUD Strings
+        crud_strings[tablename] = Storage(
+            title_display = T("Synchronization Run"),
+            title_list = T("Synchronization Status"),
+            label_list_button = T("List Runs"),
+            msg_record_deleted = T("Run deleted"),
+            msg_list_empty = T("No synchronization runs found"),
+            msg_no_match = T("No synchronization runs found"),
+            )
+
+        # Resource Configuration
+        self.configure(tablename,
+                       editable = False,
+                       insertable = False,
+                       list_fields = ["repository_id",
+                                      "resource_name",
+                                      "status",
+                                      "queued_on",
+                                      "started_on",
+                                      "finished_on",
+                                      "duration",
+                                      "message",
+                                      ],
+                       orderby = "sync_run.queued_on desc",
+                       )
+
+        # -------------------------------------------------------------------------
+        # Table Locks
+        # - acquired by inserting a row (unique tablename), so that
+        #   concurrent dispatchers can not start conflicting runs
+        #
+        tablename = "sync_lock"
+        define_table(tablename,
+                     Field("tablename", length=128,
+                           notnull = True,
+                           unique = True,
+                           ),
+                     Field("run_id", "reference sync_run",
+                           ondelete = "CASCADE",
+                           ),
+                     Field("timestmp", "datetime"),
+                     )
+
+        # ---------------------------------------------------------------------
+        # Return global names to s3.*
+        #
+        return {}
+
 # =============================================================================
 def sync_rheader(r, tabs=None):
     """
@@ -1388,6 +1566,7 @@ def sync_rheader(r, tabs=None):
                 tabs = [(T("Configuration"), None),
                         (T("Resources"), "task"),
                         (T("Schedule"), "job"),
+                        (T("Status"), "run"),
                         (T("Log"), "log"),
                         ]
 
@@ -1021,17 +1021,18 @@ class S3VulnerabilityModel(S3Model):
 
         # Now that the time aggregate types have been set up correctly,
         # fire off requests for the location aggregates to be calculated
-        run_async = current.s3task.run_async
+        calls = []
         for (param_id, loc_dict) in parents_data.items():
             #for (loc_id, (changed_periods, loc_level)) in loc_dict.items():
             for (loc_id, (changed_periods,)) in loc_dict.items():
                 for (start_date, end_date) in changed_periods:
                     s, e = str(start_date), str(end_date)
-                    run_async("vulnerability_update_location_aggregate",
-                              args = [#loc_level,
-                                      loc_id, param_id, s, e],
-                              timeout = 1800 # 30m
-                              )
+                    calls.append(([#loc_level,
+                                   loc_id, param_id, s, e], None))
+        current.s3task.run_async_batch("vulnerability_update_location_aggregate",
+                                       calls,
+                                       timeout = 1800 # 30m
+                                       )
 
         # OPTIMISATION step 2
         # Get all the locations for which the resilence indicator needs to be
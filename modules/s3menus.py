@@ -509,6 +509,7 @@ class S3OptionsMenu(object):
                         M("Settings", f="config", args=[1], m="update"),
                         M("Repositories", f="repository"),
                         M("Public Data Sets", f="dataset", check=is_data_repository),
+                        M("Status", f="run"),
                         M("Log", f="log"),
                     ),
                     #M("Edit Application", a="admin", c="default", f="design",
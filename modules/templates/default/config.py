@@ -345,6 +345,10 @@ def config(settings):
     #settings.ui.pdf_logo = "static/img/mylogo.png"
     # Maximum number of records in PDF exports (None for unlimited)
     #settings.base.pdf_max_rows = 1000
+    # Uncomment to render large PDF tables in chunks of this many records (as plain text)
+    #settings.base.pdf_chunk_size = 500
+    # Number of worker processes to render PDF chunks (default 1, None for number of CPUs)
+    #settings.base.pdf_workers = 4
 
     #Uncomment to add a title row to XLS exports
     #settings.base.xls_title_row = True
@@ -361,6 +365,12 @@ def config(settings):
     #settings.gis.countries = ("US",)
     # Uncomment to pass Addresses imported from CSV to a Geocoder to try and automate Lat/Lon
     #settings.gis.geocode_imported_addresses = "google"
+    # Uncomment to geocode imported Addresses in a background task (if a worker is alive)
+    #settings.gis.geocode_batch = True
+    # Uncomment to use a Geocoder based on the names of existing locations (e.g. for air-gapped installs)
+    #settings.gis.geocode_service = "offline"
+    # Uncomment to modify the number of days Geocoder results are cached (0 to disable)
+    #settings.gis.geocode_cache_ttl = 30
     # Hide the Map-based selection tool in the Location Selector
     #settings.gis.map_selector = False
     # Show LatLon boxes in the Location Selector
@@ -447,8 +457,16 @@ def config(settings):
     #settings.gis.scaleline = False
     # Uncomment to hide the GeoNames search box
     #settings.gis.search_geonames = False
+    # Uncomment to disable the caching of GIS Config & Map Layers across requests (or set to a number of seconds)
+    #settings.gis.config_cache = 0
+    # Uncomment to disable the caching of Location Hierarchy data for the LocationSelector
+    #settings.gis.hierarchy_cache = False
+    # Uncomment to modify the maximum size (MB) of the Tile Cache for WMS/TMS Layers
+    #settings.gis.tile_cache_size = 1024
     # Uncomment to modify the Simplify Tolerance
     #settings.gis.simplify_tolerance = 0.001
+    # Uncomment to modify the Tolerances at which simplified Polygons are precomputed
+    #settings.gis.simplify_levels = (0.001, 0.01)
     # Uncomment this for highly-zoomed maps showing buildings
     #settings.gis.precision = 5
     # Uncomment to Hide the Toolbar from the main Map
@@ -503,6 +521,11 @@ def config(settings):
     # NB Auditing (especially Reads) slows system down & consumes diskspace
     #settings.security.audit_read = True
     #settings.security.audit_write = True
+    # Write audit entries in bulk at the end of the request (default True)
+    #settings.security.audit_buffer = False
+    # Remove audit entries older than this number of days
+    # (requires a schedule for the s3_audit_prune task)
+    #settings.security.audit_retention = 365
 
     # Lock-down access to Map Editing
     #settings.security.map = True
@@ -589,6 +612,20 @@ def config(settings):
     # Sync
     # Uncomment if this deployment exposes public data sets
     #settings.sync.data_repository = True
+    # Maximum number of sync tasks to run in parallel (default 4)
+    #settings.sync.concurrency = 2
+
+    # -------------------------------------------------------------------------
+    # Scheduler
+    # Task queues, extending/overriding the defaults ("high", "default", "low")
+    # - tasks in queues with higher priority are run first
+    # - a queue can have a dedicated group of workers, started like:
+    #   python web2py.py -K eden:bulk
+    #settings.scheduler.queues = {"low": {"group": "bulk", "priority": 0},
+    #                             }
+    # Queues for tasks, extending/overriding the defaults in S3Task.TASK_QUEUES
+    #settings.scheduler.task_queues = {"settings_task": "high",
+    #                                  }
 
     # -------------------------------------------------------------------------
     # Asset
@@ -28,6 +28,10 @@ class Daily():
         table = s3db.sync_log
         db(table.timestmp < month_past).delete()
 
+        # Cleanup export results
+        from s3 import S3ExportJob
+        S3ExportJob.cleanup(expire = now - datetime.timedelta(days=1))
+
         # Cleanup Sessions
         osjoin = os.path.join
         osstat = os.stat
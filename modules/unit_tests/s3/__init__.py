@@ -1,9 +1,11 @@
 from .s3aaa import *
 from .s3cfg import *
+from .s3codecs import *
 from .s3crud import *
 from .s3dashboard import *
 from .s3datatable import *
 from .s3datetime import *
+from .s3export import *
 from .s3fields import *
 from .s3filter import *
 from .s3forms import *
@@ -18,6 +20,7 @@ from .s3query import *
 from .s3resource import *
 from .s3rest import *
 from .s3sync import *
+from .s3task import *
 from .s3timeplot import *
 from .s3utils import *
 from .s3validators import *
@@ -10,8 +10,9 @@ import re
 
 from gluon import *
 from gluon.storage import Storage
-from s3.s3aaa import S3EntityRoleManager, S3Permission
+from s3.s3aaa import S3Audit, S3EntityRoleManager, S3Permission
 from s3.s3fields import s3_meta_fields
+from s3.s3utils import s3_run_on_commit
 
 from unit_tests import run_suite
 
@@ -448,6 +449,72 @@ class SetRolesTests(unittest.TestCase):
             current.db.rollback()
             auth.s3_impersonate(None)
 
+    # -------------------------------------------------------------------------
+    def testRealmsSnapshot(self):
+        """ Test persistence and invalidation of realm snapshots """
+
+        db = current.db
+        s3db = current.s3db
+        auth = current.auth
+        settings = current.deployment_settings
+
+        settings.security.policy = 7
+        auth.permission = S3Permission(auth)
+
+        assertEqual = self.assertEqual
+        assertTrue = self.assertTrue
+        assertFalse = self.assertFalse
+
+        try:
+            role = auth.s3_create_role("Example Role", uid="TESTROLE")
+
+            org1 = self.org1
+            org2 = self.org2
+            org3 = self.org3
+
+            user_id = auth.s3_get_user_id("normaluser@example.com")
+            auth.s3_assign_role(user_id, role, for_pe=org1)
+
+            # Computing the realms persists a snapshot
+            auth.s3_impersonate("normaluser@example.com")
+            assertEqual(auth.user.realms[role], [org1])
+
+            table = s3db.auth_realm_snapshot
+            query = (table.user_id == user_id)
+            row = db(query).select(table.version,
+                                   table.realms,
+                                   limitby = (0, 1),
+                                   ).first()
+            assertTrue(row is not None)
+            assertEqual(row.version, auth.s3_realms_version())
+
+            # A valid snapshot is used instead of re-computing the realms
+            db(query).update(realms = {str(role): [org3]})
+            auth.user.pop("realms_stamp", None)
+            auth.s3_set_roles()
+            assertEqual(auth.user.realms[role], [org3])
+
+            # Affiliation changes invalidate the snapshot
+            version = auth.s3_realms_version()
+            s3db.pr_add_affiliation(org1, org2, role="TestRole")
+            assertTrue(auth.s3_realms_version() > version)
+
+            auth.s3_set_roles()
+            realm = auth.user.realms[role]
+            assertTrue(org1 in realm)
+            assertTrue(org2 in realm)
+            assertFalse(org3 in realm)
+
+            # Membership changes invalidate the snapshot
+            auth.s3_assign_role(user_id, role, for_pe=org3)
+            auth.s3_set_roles()
+            assertTrue(org3 in auth.user.realms[role])
+
+        finally:
+            auth.s3_impersonate(None)
+            auth.s3_delete_role("TESTROLE")
+            current.db.rollback()
+
     # -------------------------------------------------------------------------
     #def testPerformance(self):
 
@@ -2833,6 +2900,56 @@ class AccessibleQueryTests(unittest.TestCase):
 
         return False
 
+    # -------------------------------------------------------------------------
+    def testHasPermissionBulk(self):
+        """ Test bulk record permission checks (policy 6) """
+
+        auth = current.auth
+
+        current.deployment_settings.security.policy = 6
+        auth.permission = S3Permission(auth)
+
+        has_permission = auth.s3_has_permission
+        has_permission_bulk = auth.s3_has_permission_bulk
+        c = "org"
+        f = "permission_test"
+        tablename = "org_permission_test"
+
+        assertEqual = self.assertEqual
+
+        record_ids = [self.record1, self.record2, self.record3]
+
+        # Check anonymous
+        auth.s3_impersonate(None)
+        permitted = has_permission_bulk("read", tablename, record_ids, c=c, f=f)
+        assertEqual(permitted, dict((i, False) for i in record_ids))
+
+        # Test with TESTREADER
+        auth.s3_impersonate("normaluser@example.com")
+        auth.s3_assign_role(auth.user.id, self.reader, for_pe=self.org[0])
+
+        permitted = has_permission_bulk("read", tablename, record_ids, c=c, f=f)
+        assertEqual(permitted, {self.record1: True,
+                                self.record2: False,
+                                self.record3: False,
+                                })
+        for record_id in record_ids:
+            assertEqual(permitted[record_id],
+                        bool(has_permission("read", tablename,
+                                            record_id = record_id,
+                                            c = c,
+                                            f = f,
+                                            )))
+
+        permitted = has_permission_bulk("delete", tablename, record_ids, c=c, f=f)
+        assertEqual(permitted, dict((i, False) for i in record_ids))
+
+        # Record IDs are returned as passed-in
+        permitted = has_permission_bulk("read", tablename, [str(self.record1)], c=c, f=f)
+        assertEqual(permitted, {str(self.record1): True})
+
+        auth.s3_withdraw_role(auth.user.id, self.reader)
+
 # =============================================================================
 class DelegationTests(unittest.TestCase):
     """ Test delegation of roles """
@@ -3748,6 +3865,100 @@ class RecordApprovalTests(unittest.TestCase):
 
             auth.s3_impersonate(None)
 
+    # -------------------------------------------------------------------------
+    def testHasPermissionBulkWithRecordApproval(self):
+        """ Test has_permission_bulk with record approval """
+
+        auth = current.auth
+        acl = auth.permission
+        s3db = current.s3db
+        settings = current.deployment_settings
+
+        has_permission = auth.s3_has_permission
+        has_permission_bulk = auth.s3_has_permission_bulk
+        AUTHENTICATED = auth.get_system_roles().AUTHENTICATED
+
+        # Store global settings
+        approval = settings.get_auth_record_approval()
+        approval_required = settings.get_auth_record_approval_required_for()
+
+        assertEqual = self.assertEqual
+
+        def check(method, record_ids, expected):
+            # Bulk check must agree with has_permission
+            permitted = has_permission_bulk(method, otable, record_ids,
+                                            c = "org",
+                                            f = "organisation",
+                                            )
+            assertEqual(permitted, expected)
+            for record_id in record_ids:
+                assertEqual(permitted[record_id],
+                            bool(has_permission(method, otable,
+                                                record_id = record_id,
+                                                c = "org",
+                                                f = "organisation",
+                                                )))
+
+        try:
+            settings.auth.record_approval = True
+            settings.auth.record_approval_required_for = ["org_organisation"]
+
+            # Impersonate as admin
+            auth.s3_impersonate("admin@example.com")
+
+            # Create an approved and an unapproved test record
+            otable = s3db.org_organisation
+            record_ids = []
+            for name, approved_by in (("Test Bulk Approved Organisation", 0),
+                                      ("Test Bulk Unapproved Organisation", None),
+                                      ):
+                org = Storage(name=name, approved_by=approved_by)
+                org_id = otable.insert(**org)
+                org.update(id=org_id)
+                s3db.update_super(otable, org)
+                record_ids.append(org_id)
+            approved_id, unapproved_id = record_ids
+
+            # Give AUTHENTICATED permissions to read all records and
+            # update own records in this table
+            for rule in ({"c": "org"},
+                         {"c": "org", "f": "organisation"},
+                         {"t": "org_organisation"},
+                         ):
+                acl.update_acl(AUTHENTICATED,
+                               uacl=acl.READ,
+                               oacl=acl.READ|acl.UPDATE,
+                               **rule)
+
+            # Normal user can not access the unapproved record
+            auth.s3_impersonate("normaluser@example.com")
+            check("read", record_ids, {approved_id: True, unapproved_id: False})
+            check("update", record_ids, {approved_id: True, unapproved_id: False})
+
+            # Give AUTHENTICATED permission to review records
+            for rule in ({"c": "org"},
+                         {"c": "org", "f": "organisation"},
+                         {"t": "org_organisation"},
+                         ):
+                acl.update_acl(AUTHENTICATED,
+                               uacl=acl.READ|acl.REVIEW,
+                               oacl=acl.READ|acl.UPDATE|acl.REVIEW,
+                               **rule)
+
+            # Reviewer can read and update the unapproved record
+            auth.s3_impersonate("normaluser@example.com")
+            check("read", record_ids, {approved_id: True, unapproved_id: True})
+            check("update", record_ids, {approved_id: True, unapproved_id: True})
+            check("delete", record_ids, {approved_id: False, unapproved_id: False})
+            check(["delete", "update"], record_ids, {approved_id: True, unapproved_id: True})
+
+        finally:
+            # Restore global settings
+            settings.auth.record_approval = approval
+            settings.auth.record_approval_required_for = approval_required
+
+            auth.s3_impersonate(None)
+
     # -------------------------------------------------------------------------
     def testAccessibleQueryWithRecordApproval(self):
         """ Test accessible_query with record approval """
@@ -4556,6 +4767,127 @@ class EntityRoleManagerTests(unittest.TestCase):
     def tearDownClass(cls):
         pass
 
+# =============================================================================
+class AuditTests(unittest.TestCase):
+    """ Test the buffered audit trail writer """
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        settings = current.deployment_settings
+        self.audit_write = settings.security.get("audit_write")
+        settings.security.audit_write = True
+
+        response = current.response
+        self.custom_commit = response.custom_commit
+        self.on_commit = response.s3.on_commit
+        response.s3.on_commit = None
+
+        current.auth.override = True
+
+        table = current.s3db.org_organisation
+        self.org_id = table.insert(name = "AuditTestsOrg")
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        settings = current.deployment_settings
+        settings.security.audit_write = self.audit_write
+
+        response = current.response
+        response.custom_commit = self.custom_commit
+        response.s3.on_commit = self.on_commit
+
+        current.auth.override = False
+        current.db.rollback()
+
+    # -------------------------------------------------------------------------
+    def testBufferedWrite(self):
+        """ Test buffering and bulk-writing of audit entries """
+
+        assertEqual = self.assertEqual
+        assertTrue = self.assertTrue
+
+        db = current.db
+        org_id = self.org_id
+
+        audit = S3Audit()
+        audit.buffered = True
+        table = audit.table
+
+        query = (table.tablename == "org_organisation") & \
+                (table.record_id == org_id)
+
+        # Entries are buffered, and the commit hook is installed
+        audit("update", "org", "organisation", record=org_id)
+        audit("delete", "org", "organisation", record=org_id)
+        assertEqual(len(audit.buffer), 2)
+        assertTrue(audit.hooked)
+        assertTrue(current.response.custom_commit is not self.custom_commit)
+        assertEqual(db(query).count(), 0)
+
+        # Flush writes all entries, and looks up the old values of deletions
+        audit.flush()
+        assertEqual(audit.buffer, [])
+        rows = db(query).select(table.method,
+                                table.old_value,
+                                orderby = table.id,
+                                )
+        assertEqual([row.method for row in rows], ["update", "delete"])
+        assertTrue("AuditTestsOrg" in rows[1].old_value)
+
+        # Flushing again writes nothing
+        audit.flush()
+        assertEqual(db(query).count(), 2)
+
+    # -------------------------------------------------------------------------
+    def testFlushOnCommit(self):
+        """ Test that buffered entries are written before explicit commits """
+
+        assertEqual = self.assertEqual
+
+        db = current.db
+        org_id = self.org_id
+
+        audit = S3Audit()
+        audit.buffered = True
+        table = audit.table
+
+        query = (table.tablename == "org_organisation") & \
+                (table.record_id == org_id)
+
+        audit("delete", "org", "organisation", record=org_id)
+        assertEqual(db(query).count(), 0)
+
+        # db.commit is wrapped to run the before-commit callbacks
+        self.assertTrue(getattr(db.commit, "on_commit", False))
+
+        # Run the before-commit callbacks as db.commit would (without
+        # actually committing, so that tearDown can roll back)
+        s3_run_on_commit("before")
+        assertEqual(audit.buffer, [])
+        assertEqual(db(query).count(), 1)
+
+    # -------------------------------------------------------------------------
+    def testUnbufferedWrite(self):
+        """ Test immediate writing of audit entries """
+
+        db = current.db
+        org_id = self.org_id
+
+        audit = S3Audit()
+        audit.buffered = False
+        table = audit.table
+
+        audit("delete", "org", "organisation", record=org_id)
+        self.assertEqual(audit.buffer, [])
+
+        query = (table.tablename == "org_organisation") & \
+                (table.record_id == org_id)
+        row = db(query).select(table.old_value, limitby=(0, 1)).first()
+        self.assertNotEqual(row, None)
+        self.assertTrue("AuditTestsOrg" in row.old_value)
+
 # =============================================================================
 if __name__ == "__main__":
 
@@ -4572,6 +4904,7 @@ if __name__ == "__main__":
         RealmEntityTests,
         LinkToPersonTests,
         EntityRoleManagerTests,
+        AuditTests,
         )
 
 # END ========================================================================
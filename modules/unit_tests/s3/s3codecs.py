@@ -0,0 +1,377 @@
+# -*- coding: utf-8 -*-
+#
+# S3 Codecs Unit Tests
+#
+# To run this script use:
+# python web2py.py -S eden -M -R applications/eden/modules/unit_tests/s3/s3codecs.py
+#
+import os
+import unittest
+
+from gluon import current
+
+from s3dal import Field
+from s3.codecs.pdf import S3RL_PDF, pypdfImported, reportLabImported
+from s3.codecs.xlsx import S3XLSX
+from s3.s3fields import s3_meta_fields
+
+from unit_tests import run_suite
+
+# =============================================================================
+class XLSXEncoderTests(unittest.TestCase):
+    """ Tests for the streaming XLSX codec """
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def setUpClass(cls):
+
+        s3db = current.s3db
+
+        s3db.define_table("test_xlsx_hierarchy",
+                          Field("name"),
+                          Field("parent", "reference test_xlsx_hierarchy"),
+                          *s3_meta_fields())
+
+        s3db.define_table("test_xlsx_record",
+                          Field("name"),
+                          Field("hierarchy_id", "reference test_xlsx_hierarchy",
+                                represent = lambda v: current.db.test_xlsx_hierarchy[v].name \
+                                                      if v else "",
+                                ),
+                          *s3_meta_fields())
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def tearDownClass(cls):
+
+        db = current.db
+        db.test_xlsx_record.drop()
+        db.test_xlsx_hierarchy.drop(mode="cascade")
+        db.commit()
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            self.skipTest("openpyxl not installed")
+        self.load_workbook = load_workbook
+
+        settings = current.deployment_settings
+        self.title_row = settings.base.get("xls_title_row")
+        settings.base.xls_title_row = False
+
+        current.auth.override = True
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        current.deployment_settings.base.xls_title_row = self.title_row
+
+        current.auth.override = False
+        current.db.rollback()
+
+    # -------------------------------------------------------------------------
+    def encode(self, resource, **attr):
+        """
+            Encode as XLSX and read back the worksheet rows
+
+            @returns: list of tuples of cell values
+        """
+
+        output = S3XLSX().encode(resource, as_stream=True, **attr)
+        book = self.load_workbook(output, read_only=True)
+        sheet = book.worksheets[0]
+        return [tuple(cell.value for cell in row) for row in sheet.iter_rows()]
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def data(groups, per_group):
+        """
+            Generate test data in dict-format
+
+            @param groups: the number of groups
+            @param per_group: the number of rows per group
+        """
+
+        rows = []
+        for i in range(groups):
+            for j in range(per_group):
+                rows.append({"group": "Group %s" % i,
+                             "name": "Name %s-%s" % (i, j),
+                             "number": str(j),
+                             })
+        return {"columns": ["group", "name", "number"],
+                "headers": {"group": "Group",
+                            "name": "Name",
+                            "number": "Number",
+                            },
+                "types": {"group": "string",
+                          "name": "string",
+                          "number": "integer",
+                          },
+                "rows": rows,
+                }
+
+    # -------------------------------------------------------------------------
+    def testEncode(self):
+        """ Test encoding of rows with native cell values """
+
+        assertEqual = self.assertEqual
+
+        rows = self.encode(self.data(1, 3))
+
+        assertEqual(len(rows), 4)
+        assertEqual(rows[0], ("Group", "Name", "Number"))
+        assertEqual(rows[1], ("Group 0", "Name 0-0", 0))
+        assertEqual(rows[3], ("Group 0", "Name 0-2", 2))
+
+    # -------------------------------------------------------------------------
+    def testGrouping(self):
+        """ Test grouping of rows with group header rows """
+
+        assertEqual = self.assertEqual
+
+        rows = self.encode(self.data(2, 2), dt_group=1)
+
+        # Group column is omitted, group headers are inserted
+        assertEqual(len(rows), 7)
+        assertEqual(rows[0], ("Name", "Number"))
+        assertEqual(rows[1], ("Group 0", None))
+        assertEqual(rows[2], ("Name 0-0", 0))
+        assertEqual(rows[3], ("Name 0-1", 1))
+        assertEqual(rows[4], ("Group 1", None))
+        assertEqual(rows[6], ("Name 1-1", 1))
+
+    # -------------------------------------------------------------------------
+    def testTruncation(self):
+        """ Test truncation at the maximum number of worksheet rows """
+
+        assertEqual = self.assertEqual
+
+        max_rows = S3XLSX.MAX_ROWS
+        S3XLSX.MAX_ROWS = 6
+        try:
+            # Header rows count towards the limit
+            rows = self.encode(self.data(1, 10))
+            assertEqual(len(rows), 6)
+            assertEqual(rows[-1][1], "Name 0-4")
+
+            # Group header rows count towards the limit, and a group
+            # header is never written without its first row
+            S3XLSX.MAX_ROWS = 5
+            rows = self.encode(self.data(3, 2), dt_group=1)
+            assertEqual(len(rows), 4)
+            assertEqual(rows[-1], ("Name 0-1", 1))
+
+            # Title rows count towards the limit
+            S3XLSX.MAX_ROWS = 6
+            current.deployment_settings.base.xls_title_row = True
+            rows = self.encode(self.data(1, 10), title="Test")
+            assertEqual(len(rows), 6)
+            assertEqual(rows[-1][1], "Name 0-1")
+        finally:
+            S3XLSX.MAX_ROWS = max_rows
+
+    # -------------------------------------------------------------------------
+    def testExpandHierarchy(self):
+        """ Test expansion of hierarchical foreign keys into columns """
+
+        assertEqual = self.assertEqual
+
+        db = current.db
+        s3db = current.s3db
+
+        htable = db.test_xlsx_hierarchy
+        root_id = htable.insert(name="Root")
+        child_id = htable.insert(name="Child", parent=root_id)
+
+        rtable = db.test_xlsx_record
+        rtable.insert(name="Record 1", hierarchy_id=child_id)
+        rtable.insert(name="Record 2", hierarchy_id=root_id)
+
+        s3db.configure("test_xlsx_hierarchy",
+                       hierarchy = "parent",
+                       )
+        s3db.configure("test_xlsx_record",
+                       xls_expand_hierarchy = {"hierarchy_id": ["Level 1",
+                                                                "Level 2",
+                                                                ],
+                                               },
+                       )
+
+        resource = s3db.resource("test_xlsx_record")
+        rows = self.encode(resource,
+                           list_fields = ["name", "hierarchy_id"],
+                           chunk_size = 1,
+                           )
+
+        # One column per level, also for rows from later chunks
+        assertEqual(len(rows), 3)
+        assertEqual(rows[0], ("Name", "Level 1", "Level 2"))
+        assertEqual(rows[1], ("Record 1", "Root", "Child"))
+        assertEqual(rows[2], ("Record 2", "Root", "-"))
+
+# =============================================================================
+class PDFChunkedExportTests(unittest.TestCase):
+    """ Tests for chunked rendering of PDF table exports """
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def setUpClass(cls):
+
+        current.s3db.define_table("test_pdf_record",
+                                  Field("name"),
+                                  Field("image", "upload"),
+                                  *s3_meta_fields())
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def tearDownClass(cls):
+
+        db = current.db
+        db.test_pdf_record.drop()
+        db.commit()
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        if not reportLabImported or not pypdfImported:
+            self.skipTest("reportlab or pypdf not installed")
+
+        from pypdf import PdfReader
+        self.PdfReader = PdfReader
+
+        settings = current.deployment_settings
+        self.settings = dict((key, settings.base.get(key))
+                             for key in ("pdf_chunk_size",
+                                         "pdf_max_rows",
+                                         "pdf_workers",
+                                         ))
+
+        current.auth.override = True
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        current.deployment_settings.base.update(self.settings)
+
+        current.auth.override = False
+        current.db.rollback()
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def spec(first, number, hint=None):
+        """
+            Generate a render specification for a chunk
+
+            @param first: the index of the first row
+            @param number: the number of rows
+            @param hint: the hint to add below the table
+        """
+
+        return {"pagesize": (595.27, 841.89),
+                "frame": (20, 20, 555, 800),
+                "fonts": [],
+                "font_name": "Helvetica",
+                "fontsize": 9,
+                "parts": [(["Name", "Number"], [200, 100], [], 0, 2)],
+                "rows": [["Name %s" % i, str(i)]
+                         for i in range(first, first + number)],
+                "hint": hint,
+                }
+
+    # -------------------------------------------------------------------------
+    def testRenderParts(self):
+        """ Test rendering of chunks, sequentially and in worker processes """
+
+        assertEqual = self.assertEqual
+        assertIn = self.assertIn
+
+        specs = [self.spec(0, 100),
+                 self.spec(100, 100),
+                 self.spec(200, 10, hint="Hint"),
+                 ]
+
+        for workers in (1, 2):
+            paths = list(S3RL_PDF.render_parts(iter(specs), workers))
+            try:
+                assertEqual(len(paths), 3)
+
+                # Partial documents in order of the specifications
+                for index, path in enumerate(paths):
+                    pages = self.PdfReader(path).pages
+                    first = pages[0].extract_text()
+                    assertIn("Name %s\n" % (index * 100), first)
+
+                # Hint on a separate page
+                pages = self.PdfReader(paths[-1]).pages
+                assertEqual(len(pages), 2)
+                assertIn("Hint", pages[-1].extract_text())
+            finally:
+                for path in paths:
+                    os.remove(path)
+
+    # -------------------------------------------------------------------------
+    def testChunkedExport(self):
+        """ Test concatenation of chunks with page numbers """
+
+        assertIn = self.assertIn
+
+        table = current.db.test_pdf_record
+        for i in range(120):
+            table.insert(name = "Record %03d" % i)
+
+        base = current.deployment_settings.base
+        base.pdf_chunk_size = 50
+        base.pdf_max_rows = 100
+        base.pdf_workers = 1
+
+        resource = current.s3db.resource("test_pdf_record")
+        output = S3RL_PDF().encode(resource,
+                                   list_fields = ["name"],
+                                   as_stream = True,
+                                   )
+        try:
+            pages = self.PdfReader(output).pages
+            page_count = len(pages)
+
+            # One partial document per chunk, with the hint on an extra page
+            self.assertTrue(page_count >= 3)
+
+            # Page numbers continue across the partial documents
+            for number, page in enumerate(pages, 1):
+                assertIn("%s / %s" % (number, page_count), page.extract_text())
+
+            text = pages[0].extract_text()
+            assertIn("Record 000", text)
+            text = pages[-2].extract_text()
+            assertIn("Record 099", text)
+            self.assertNotIn("Record 100", text)
+            assertIn("20 more records", pages[-1].extract_text())
+        finally:
+            output.close()
+
+    # -------------------------------------------------------------------------
+    def testImageFields(self):
+        """ Test that exports with image fields are not chunked """
+
+        base = current.deployment_settings.base
+        base.pdf_chunk_size = 50
+
+        resource = current.s3db.resource("test_pdf_record")
+        query = (["name", "image"], None, None)
+
+        chunked = S3RL_PDF().get_resource_chunked(resource, None, query)
+        self.assertEqual(chunked, None)
+
+# =============================================================================
+if __name__ == "__main__":
+
+    run_suite(
+        XLSXEncoderTests,
+        PDFChunkedExportTests,
+    )
+
+# END ========================================================================
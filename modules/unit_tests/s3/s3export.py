@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+#
+# S3Export Unit Tests
+#
+# To run this script use:
+# python web2py.py -S eden -M -R applications/eden/modules/unit_tests/s3/s3export.py
+#
+import datetime
+import json
+import unittest
+
+from gluon import current
+
+from s3dal import Field
+from s3 import FS, S3Exporter, S3ExportJob, s3_meta_fields
+
+from unit_tests import run_suite
+
+# =============================================================================
+class ExportJobTests(unittest.TestCase):
+    """ Tests for asynchronous export jobs """
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def setUpClass(cls):
+
+        current.s3db.define_table("test_export_job",
+                                  Field("name"),
+                                  Field("category"),
+                                  *s3_meta_fields())
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def tearDownClass(cls):
+
+        db = current.db
+        db.test_export_job.drop()
+        db.commit()
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        current.auth.override = True
+
+        table = current.db.test_export_job
+        self.record_ids = [table.insert(name = "Record %s" % i,
+                                        category = "A" if i % 2 else "B",
+                                        )
+                           for i in range(4)]
+
+        # Do not run the task, record the calls instead
+        s3task = current.s3task
+        self.run_async = s3task.run_async
+        self.calls = calls = []
+        def run_async(task, args=None, vars=None, timeout=300, queue=None):
+            calls.append((task, args))
+            return None
+        s3task.run_async = run_async
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        current.s3task.run_async = self.run_async
+
+        db = current.db
+        s3db = current.s3db
+
+        jtable = s3db.s3_export_job
+        db(jtable.tablename == "test_export_job").delete()
+        db(db.test_export_job.id > 0).delete()
+        db.commit()
+
+        current.auth.override = False
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def resource():
+        """ Get a filtered test resource """
+
+        resource = current.s3db.resource("test_export_job")
+        resource.add_filter(FS("category") == "A")
+        return resource
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def reload(job_id):
+        """ Reload a job record """
+
+        table = current.s3db.s3_export_job
+        return current.db(table.id == job_id).select(table.ALL,
+                                                     limitby = (0, 1),
+                                                     ).first()
+
+    # -------------------------------------------------------------------------
+    def testSubmit(self):
+        """ Test submission of a job, storing the filter rather than record IDs """
+
+        assertEqual = self.assertEqual
+        assertTrue = self.assertTrue
+
+        job = S3ExportJob.submit(self.resource(), "xml", ["name"])
+
+        assertEqual(job.status, "QUEUED")
+        assertEqual(self.calls, [(S3ExportJob.TASK, [job.id])])
+        assertTrue(job.query)
+        assertEqual(job.record_ids, None)
+
+        # The rebuilt resource contains the filtered records
+        resource = S3ExportJob.resource(job)
+        rows = resource.select(["id"], as_rows=True)
+        expected = [self.record_ids[i] for i in (1, 3)]
+        assertEqual(sorted(row.id for row in rows), expected)
+
+    # -------------------------------------------------------------------------
+    def testReuse(self):
+        """ Test reuse of pending and completed jobs, and invalidation """
+
+        assertEqual = self.assertEqual
+        assertNotEqual = self.assertNotEqual
+
+        job = S3ExportJob.submit(self.resource(), "xml", ["name"])
+
+        # Pending job is reused
+        pending = S3ExportJob.submit(self.resource(), "xml", ["name"])
+        assertEqual(pending.id, job.id)
+        assertEqual(len(self.calls), 1)
+
+        # Different fields => different job
+        other = S3ExportJob.submit(self.resource(), "xml", ["name", "category"])
+        assertNotEqual(other.id, job.id)
+
+        # Completed job is reused while the data are unchanged
+        assertEqual(S3ExportJob.run(job.id), "COMPLETED")
+        completed = S3ExportJob.submit(self.resource(), "xml", ["name"])
+        assertEqual(completed.id, job.id)
+
+        # Modifying the table invalidates the result
+        table = current.db.test_export_job
+        later = self.reload(job.id).data_mtime + datetime.timedelta(seconds=1)
+        current.db(table.id == self.record_ids[0]).update(name = "Modified",
+                                                           modified_on = later,
+                                                           )
+        renewed = S3ExportJob.submit(self.resource(), "xml", ["name"])
+        assertNotEqual(renewed.id, job.id)
+        assertEqual(renewed.status, "QUEUED")
+
+    # -------------------------------------------------------------------------
+    def testStale(self):
+        """ Test that stale jobs are failed and replaced """
+
+        assertEqual = self.assertEqual
+
+        db = current.db
+        table = current.s3db.s3_export_job
+
+        job = S3ExportJob.submit(self.resource(), "xml", ["name"])
+        job.update_record(status = "RUNNING")
+
+        # Recently updated => still running
+        running = S3ExportJob.submit(self.resource(), "xml", ["name"])
+        assertEqual(running.id, job.id)
+
+        # Not updated for longer than the task timeout => stale
+        timeout = S3ExportJob.TIMEOUT + S3ExportJob.GRACE
+        past = current.request.utcnow - datetime.timedelta(seconds=timeout + 60)
+        db(table.id == job.id).update(modified_on = past)
+
+        renewed = S3ExportJob.submit(self.resource(), "xml", ["name"])
+        self.assertNotEqual(renewed.id, job.id)
+        assertEqual(renewed.status, "QUEUED")
+
+        job = self.reload(job.id)
+        assertEqual(job.status, "FAILED")
+
+    # -------------------------------------------------------------------------
+    def testCleanup(self):
+        """ Test cleanup of expired and stale jobs """
+
+        assertEqual = self.assertEqual
+
+        db = current.db
+        table = current.s3db.s3_export_job
+
+        # A completed job
+        completed = S3ExportJob.submit(self.resource(), "xml", ["name"])
+        S3ExportJob.run(completed.id)
+
+        # A stale running job
+        stale = S3ExportJob.submit(self.resource(), "xml", ["category"])
+        timeout = S3ExportJob.TIMEOUT + S3ExportJob.GRACE
+        past = current.request.utcnow - datetime.timedelta(seconds=timeout + 60)
+        db(table.id == stale.id).update(status = "RUNNING",
+                                        modified_on = past,
+                                        )
+
+        # A pending job
+        pending = S3ExportJob.submit(self.resource(), "xml", ["id", "name"])
+
+        # Cleanup of results older than one day keeps everything,
+        # but fails the stale job
+        S3ExportJob.cleanup(expire = current.request.utcnow - datetime.timedelta(days=1))
+        assertEqual(self.reload(completed.id).status, "COMPLETED")
+        assertEqual(self.reload(stale.id).status, "FAILED")
+        assertEqual(self.reload(pending.id).status, "QUEUED")
+
+        # Cleanup of all results removes completed and failed jobs
+        S3ExportJob.cleanup(expire = current.request.utcnow + datetime.timedelta(days=1))
+        assertEqual(self.reload(completed.id), None)
+        assertEqual(self.reload(stale.id), None)
+        assertEqual(self.reload(pending.id).status, "QUEUED")
+
+    # -------------------------------------------------------------------------
+    def testProgress(self):
+        """ Test progress reporting while rendering streamed exports """
+
+        assertEqual = self.assertEqual
+
+        for representation in ("csv", "xml"):
+            calls = []
+            def progress(done, total):
+                calls.append((done, total))
+
+            output = S3ExportJob.render(self.resource(),
+                                        representation,
+                                        ["name"],
+                                        progress = progress,
+                                        )
+            self.assertTrue(output.read())
+            assertEqual(calls[-1], (2, 2))
+
+    # -------------------------------------------------------------------------
+    def testJSONStreamOrderby(self):
+        """ Test streamed JSON export with different types of orderby """
+
+        table = current.db.test_export_job
+        expected = ["Record 3", "Record 1"]
+
+        for orderby in (~table.name,
+                        [~table.name],
+                        (~table.name,),
+                        "test_export_job.name DESC",
+                        ):
+            stream = S3Exporter().json_stream(self.resource(),
+                                              ["id", "name"],
+                                              orderby = orderby,
+                                              chunk_size = 1,
+                                              )
+            rows = json.loads("".join(stream))
+            self.assertEqual([row["name"] for row in rows], expected)
+
+# =============================================================================
+if __name__ == "__main__":
+
+    run_suite(
+        ExportJobTests,
+    )
+
+# END ========================================================================
@@ -7,9 +7,12 @@
 
 import unittest
 import datetime
+import json
+import os
 from gluon import *
 from gluon.storage import Storage
 from s3 import *
+from s3compat import BytesIO
 
 from unit_tests import run_suite
 
@@ -308,6 +311,68 @@ class S3LocationTreeTests(unittest.TestCase):
         # Did we get the recursion error?
         self.assertNotIn("too much recursion", log_messages)
 
+    # -------------------------------------------------------------------------
+    def testULT5_update_location_tree_batch(self):
+        """ Test that the batch update sets paths and Lx names level by level """
+
+        table = self.table
+        db = current.db
+
+        # Insert a country
+        L0_id = table.insert(level = "L0",
+                             name = "s3gis.testULT5.L0",
+                             lat = 10.0,
+                             lon = -10.0,
+                             )
+        # Insert an L1 child location with a wrong path
+        L1_id = table.insert(level = "L1",
+                             name = "s3gis.testULT5.L1",
+                             parent = L0_id,
+                             path = "0/1",
+                             )
+        # And a child of that child, skipping over L2 to L3, with own lat/lon
+        L3_id = table.insert(level = "L3",
+                             name = "s3gis.testULT5.L3",
+                             parent = L1_id,
+                             lat = 11.0,
+                             lon = -11.0,
+                             )
+        # And a specific location at the end
+        specific_id = table.insert(name = "s3gis.testULT5.specific",
+                                   parent = L3_id,
+                                   )
+
+        current.gis.update_location_tree_batch()
+
+        L1_record = db(table.id == L1_id).select(*self.fields,
+                                                 limitby=(0, 1)
+                                                 ).first()
+        self.assertEqual(L1_record.path, "%s/%s" % (L0_id, L1_id))
+        self.assertEqual(L1_record.L0, "s3gis.testULT5.L0")
+        self.assertEqual(L1_record.L1, "s3gis.testULT5.L1")
+        self.assertEqual(L1_record.inherited, True)
+        self.assertEqual(L1_record.lat, 10.0)
+
+        L3_record = db(table.id == L3_id).select(*self.fields,
+                                                 limitby=(0, 1)
+                                                 ).first()
+        self.assertEqual(L3_record.path, "%s/%s/%s" % (L0_id, L1_id, L3_id))
+        self.assertEqual(L3_record.L2, None)
+        self.assertEqual(L3_record.L3, "s3gis.testULT5.L3")
+        self.assertEqual(L3_record.inherited, False)
+        self.assertEqual(L3_record.wkt, "POINT (-11.0 11.0)")
+
+        specific_record = db(table.id == specific_id).select(*self.fields,
+                                                             limitby=(0, 1)
+                                                             ).first()
+        self.assertEqual(specific_record.path, "%s/%s/%s/%s" % (L0_id, L1_id, L3_id, specific_id))
+        self.assertEqual(specific_record.L0, "s3gis.testULT5.L0")
+        self.assertEqual(specific_record.L1, "s3gis.testULT5.L1")
+        self.assertEqual(specific_record.L3, "s3gis.testULT5.L3")
+        self.assertEqual(specific_record.inherited, True)
+        self.assertEqual(specific_record.lat, 11.0)
+        self.assertEqual(specific_record.lon, -11.0)
+
     # -------------------------------------------------------------------------
     def testULT4_get_parents(self):
         """ Test get_parents in a case that causes it to call update_location_tree. """
@@ -810,12 +875,1145 @@ class S3NoGisConfigTests(unittest.TestCase):
         xml = map.xml()
         self.assertTrue(b"Map cannot display without GIS config!" in xml)
 
+# =============================================================================
+class S3MVTEncoderTests(unittest.TestCase):
+    """ Tests for the Mapbox Vector Tile encoder """
+
+    # -------------------------------------------------------------------------
+    def testBounds(self):
+        """ Test tile bounds and projection """
+
+        assertEqual = self.assertEqual
+        assertAlmostEqual = self.assertAlmostEqual
+
+        lon_min, lat_min, lon_max, lat_max = S3MVTEncoder.bounds(1, 1, 0)
+        assertAlmostEqual(lon_min, 0.0)
+        assertAlmostEqual(lat_min, 0.0)
+        assertAlmostEqual(lon_max, 180.0)
+        assertAlmostEqual(lat_max, 85.0511287798066)
+
+        encoder = S3MVTEncoder(1, 1, 0, extent=4096)
+        assertEqual(encoder.project(0.0, 0.0), (0, 4096))
+        assertEqual(encoder.project(90.0, 45.0), (2048, 2947))
+
+    # -------------------------------------------------------------------------
+    def testEncodePoints(self):
+        """ Test encoding of point features """
+
+        assertEqual = self.assertEqual
+
+        encoder = S3MVTEncoder(1, 1, 0, extent=4096)
+
+        # Points outside of the tile (and buffer) are skipped
+        self.assertFalse(encoder.add_point(-90.0, 45.0))
+
+        self.assertTrue(encoder.add_point(90.0, 45.0, {"id": 5}, feature_id=5))
+        feature_id, geom_type, geometry, properties = encoder.features[0]
+        assertEqual(geom_type, S3MVTEncoder.POINT)
+        # MoveTo(1), zigzag(2048), zigzag(2947)
+        assertEqual(geometry, [9, 4096, 5894])
+
+        tile = encoder.encode("test")
+        assertEqual(tile[:1], b"\x1a")
+        self.assertTrue(b"test" in tile)
+
+        # No features => empty tile
+        assertEqual(S3MVTEncoder(0, 0, 0).encode("test"), b"")
+
+    # -------------------------------------------------------------------------
+    def testPolygonWinding(self):
+        """ Test winding order of polygon rings """
+
+        try:
+            from shapely.geometry import Polygon
+        except ImportError:
+            self.skipTest("Shapely not installed")
+
+        encoder = S3MVTEncoder(0, 0, 0, extent=4096)
+        shape = Polygon([(0, 0), (0, 40), (40, 40), (40, 0)],
+                        [[(10, 10), (20, 10), (20, 20), (10, 20)]],
+                        )
+        encoder.add_shape(shape, {"id": 1}, feature_id=1)
+
+        exterior = encoder.ring(shape.exterior, clockwise=True)
+        interior = encoder.ring(shape.interiors[0], clockwise=False)
+
+        def area(path):
+            return sum(path[i - 1][0] * p[1] - p[0] * path[i - 1][1]
+                       for i, p in enumerate(path))
+
+        self.assertTrue(area(exterior) > 0)
+        self.assertTrue(area(interior) < 0)
+        self.assertEqual(encoder.features[0][1], S3MVTEncoder.POLYGON)
+
+# =============================================================================
+class S3VectorTileVersionTests(unittest.TestCase):
+    """ Tests for the data version stamps of the vector tile cache """
+
+    def setUp(self):
+
+        if not current.deployment_settings.get_gis_mvt_cache():
+            self.skipTest("Vector tile cache disabled")
+
+        current.auth.override = True
+
+        response = current.response
+        self.custom_commit = response.custom_commit
+        self.renewed = response.s3.mvt_renewed
+        self.on_commit = response.s3.on_commit
+        response.custom_commit = None
+        response.s3.mvt_renewed = None
+        response.s3.on_commit = None
+
+    def tearDown(self):
+
+        current.db.rollback()
+        current.auth.override = False
+
+        response = current.response
+        response.custom_commit = self.custom_commit
+        response.s3.mvt_renewed = self.renewed
+        response.s3.on_commit = self.on_commit
+
+    # -------------------------------------------------------------------------
+    def testVersioned(self):
+        """ Test which tables are tracked with version stamps """
+
+        s3db = current.s3db
+
+        self.assertTrue(S3VectorTiles.versioned(s3db.gis_location))
+        self.assertTrue(S3VectorTiles.versioned(s3db.org_office))
+        self.assertFalse(S3VectorTiles.versioned(s3db.gis_marker))
+
+    # -------------------------------------------------------------------------
+    def testRenewOnWrite(self):
+        """ Test renewal of the version stamp on writes and after commit """
+
+        assertEqual = self.assertEqual
+        assertNotEqual = self.assertNotEqual
+
+        data_version = S3VectorTiles.data_version
+
+        version = data_version("gis_location")
+        assertEqual(data_version("gis_location"), version)
+
+        # Writing renews the stamp
+        table = current.s3db.gis_location
+        location_id = table.insert(name = "MVTVersionTest",
+                                   lat = 10.0,
+                                   lon = 20.0,
+                                   )
+        renewed = data_version("gis_location")
+        assertNotEqual(renewed, version)
+
+        # Further writes within the same request do not
+        current.db(table.id == location_id).update(lat = 11.0)
+        assertEqual(data_version("gis_location"), renewed)
+
+        commits = []
+        class Adapter(object):
+            def commit(self):
+                commits.append(data_version("gis_location"))
+
+        # Commit at the end of the request renews the stamp again
+        current.response.custom_commit(Adapter())
+        assertEqual(commits, [renewed])
+        assertNotEqual(data_version("gis_location"), renewed)
+
+# =============================================================================
+class S3ClusterTests(unittest.TestCase):
+    """ Tests for server-side clustering of GeoJSON features """
+
+    def setUp(self):
+
+        current.auth.override = True
+
+        table = current.s3db.gis_location
+        for i in range(5):
+            table.insert(name = "ClusterTestLocation%s" % i,
+                         lat = 10.0 + i * 0.0001,
+                         lon = 20.0,
+                         )
+        table.insert(name = "ClusterTestLocationX",
+                     lat = -10.0,
+                     lon = -20.0,
+                     )
+
+    def tearDown(self):
+
+        current.db.rollback()
+        current.auth.override = False
+
+    # -------------------------------------------------------------------------
+    def testGridClusters(self):
+        """ Test grid clustering with individual features below threshold """
+
+        assertEqual = self.assertEqual
+
+        resource = current.s3db.resource("gis_location",
+                                         filter = FS("name").like("ClusterTestLocation%"),
+                                         )
+        output = GIS.get_clusters(resource, 5)
+
+        assertEqual(output["type"], "FeatureCollection")
+        features = output["features"]
+        assertEqual(len(features), 2)
+
+        clusters = [f for f in features if f["properties"].get("cluster")]
+        assertEqual(len(clusters), 1)
+        assertEqual(clusters[0]["properties"]["count"], 5)
+
+        single = [f for f in features if not f["properties"].get("cluster")]
+        assertEqual(single[0]["geometry"]["coordinates"], [-20.0, -10.0])
+
+        # Invalid zoom level
+        self.assertEqual(GIS.get_clusters(resource, "x"), None)
+
+# =============================================================================
+class S3SpatialIndexTests(unittest.TestCase):
+    """ Tests for the in-process spatial index """
+
+    # -------------------------------------------------------------------------
+    def testSearch(self):
+        """ Test bbox search with overlay updates """
+
+        assertEqual = self.assertEqual
+
+        index = S3SpatialIndex()
+        index.version = (0, None, 0)
+        index.entries = dict((i, (float(i), 0.0, i + 0.5, 1.0)) for i in range(1, 101))
+        index.pack()
+
+        assertEqual(sorted(index.search(10.2, 0.2, 12.1, 0.4)), [10, 11, 12])
+        assertEqual(index.search(200.0, 0.0, 201.0, 1.0), [])
+
+        # Move location 11 away, remove location 12, add location 200
+        index.apply(11, (50.0, 50.0, 51.0, 51.0))
+        index.apply(12, None)
+        index.apply(200, (11.0, 0.0, 11.0, 0.0))
+
+        assertEqual(sorted(index.search(10.2, 0.2, 12.1, 0.4)), [10])
+        assertEqual(sorted(index.search(10.2, 0.0, 12.1, 0.4)), [10, 200])
+        assertEqual(index.search(50.5, 50.5, 50.5, 50.5), [11])
+
+        # Re-packing keeps the same results
+        index.pack()
+        assertEqual(sorted(index.search(10.2, 0.0, 12.1, 0.4)), [10, 200])
+        assertEqual(index.search(50.5, 50.5, 50.5, 50.5), [11])
+
+# =============================================================================
+class S3SimplifyLevelTests(unittest.TestCase):
+    """ Tests for the selection of precomputed simplification levels """
+
+    def setUp(self):
+
+        gis_settings = current.deployment_settings.gis
+        self.saved = dict((key, gis_settings[key])
+                          for key in ("simplify_levels", "simplify_tolerance")
+                          if key in gis_settings)
+
+        gis_settings.simplify_levels = (0.0001, 0.001, 0.01, 0.1)
+        gis_settings.simplify_tolerance = 0.01
+
+    def tearDown(self):
+
+        gis_settings = current.deployment_settings.gis
+        for key in ("simplify_levels", "simplify_tolerance"):
+            if key in self.saved:
+                gis_settings[key] = self.saved[key]
+            else:
+                gis_settings.pop(key, None)
+
+    # -------------------------------------------------------------------------
+    def testSimplifyLevel(self):
+        """ Test selection of the simplification level by zoom or bbox """
+
+        assertEqual = self.assertEqual
+        get_simplify_level = GIS.get_simplify_level
+
+        # Default tolerance
+        assertEqual(get_simplify_level(), 0.01)
+
+        # Zoom 3 => ~0.17 degrees per pixel
+        assertEqual(get_simplify_level(zoom=3), 0.1)
+        # Zoom 10 => ~0.0014 degrees per pixel
+        assertEqual(get_simplify_level(zoom="10"), 0.001)
+        # Zoom 20 => finer than any level
+        assertEqual(get_simplify_level(zoom=20), None)
+
+        # Bbox of ~10 degrees width => ~0.01 degrees per pixel
+        assertEqual(get_simplify_level(bbox="0,0,10.5,5"), 0.01)
+
+        # Invalid zoom or bbox falls back to default tolerance
+        assertEqual(get_simplify_level(zoom="x", bbox="invalid"), 0.01)
+
+        # No levels
+        current.deployment_settings.gis.simplify_levels = None
+        assertEqual(get_simplify_level(zoom=3), None)
+
+# =============================================================================
+class S3GeocoderTests(unittest.TestCase):
+    """ Tests for the Geocoder cache key and the offline Geocoder """
+
+    def setUp(self):
+
+        current.auth.override = True
+
+        table = current.s3db.gis_location
+        for name, lat, lon in (("GeocoderTestCountry1", 1.0, 2.0),
+                               ("GeocoderTestCountry2", 5.0, 6.0),
+                               ):
+            table.insert(name = "GeocoderTestPlace",
+                         lat = lat + 1,
+                         lon = lon + 1,
+                         L0 = name,
+                         )
+
+    def tearDown(self):
+
+        current.db.rollback()
+        current.auth.override = False
+
+    # -------------------------------------------------------------------------
+    def testGeocodeKey(self):
+        """ Test normalisation of addresses for the Geocoder cache """
+
+        assertEqual = self.assertEqual
+        assertNotEqual = self.assertNotEqual
+        geocode_key = GIS.geocode_key
+
+        key1, address = geocode_key(" Main  Street 1", "12345", [3, 1], "nominatim")
+        assertEqual(address, "main street 1,12345")
+
+        key2 = geocode_key("main street 1", " 12345 ", [1, 3], "nominatim")[0]
+        assertEqual(key1, key2)
+
+        # Different Lx context or geocoder
+        assertNotEqual(key1, geocode_key("main street 1", "12345", [1], "nominatim")[0])
+        assertNotEqual(key1, geocode_key("main street 1", "12345", [1, 3], "google")[0])
+
+    # -------------------------------------------------------------------------
+    def testOfflineGeocoder(self):
+        """ Test geocoding with names of existing locations """
+
+        assertEqual = self.assertEqual
+
+        geocoder = S3OfflineGeocoder()
+
+        result = geocoder.geocode("GeocoderTestPlace, GeocoderTestCountry2")
+        assertEqual(result[1], (6.0, 7.0))
+
+        results = geocoder.geocode("Unknown Street, GeocoderTestPlace", exactly_one=False)
+        assertEqual(len(results), 2)
+
+        assertEqual(geocoder.geocode("Unknown Street"), None)
+
+    # -------------------------------------------------------------------------
+    def testConcurrentCacheInsert(self):
+        """ Test caching of a result that another request has cached meanwhile """
+
+        assertEqual = self.assertEqual
+
+        settings = current.deployment_settings
+        ttl = settings.gis.get("geocode_cache_ttl")
+        settings.gis.geocode_cache_ttl = 30
+
+        db = current.db
+        table = current.s3db.gis_geocode_cache
+
+        address = "Concurrent Street 1"
+        key, normalised = GIS.geocode_key(address, None, None, "test")
+
+        _geocode = GIS.__dict__["_geocode"]
+        def geocode(address, postcode, Lx_ids, geocoder):
+            # Another request caches the same address while geocoding
+            table.insert(address_key = key,
+                         address = normalised,
+                         geocoder = "test",
+                         lat = 0.0,
+                         lon = 0.0,
+                         )
+            return {"lat": 1.0, "lon": 2.0}, True
+        GIS._geocode = staticmethod(geocode)
+        try:
+            output = GIS.geocode(address, geocoder="test")
+        finally:
+            GIS._geocode = _geocode
+            if ttl is None:
+                settings.gis.pop("geocode_cache_ttl", None)
+            else:
+                settings.gis.geocode_cache_ttl = ttl
+
+        assertEqual(output, {"lat": 1.0, "lon": 2.0})
+
+        # The existing cache entry has been updated
+        rows = db(table.address_key == key).select(table.lat, table.lon)
+        assertEqual(len(rows), 1)
+        assertEqual((rows[0].lat, rows[0].lon), (1.0, 2.0))
+
+# =============================================================================
+class S3LocationHierarchyCacheTests(unittest.TestCase):
+    """ Tests for the location hierarchy (ldata) cache """
+
+    def setUp(self):
+
+        current.auth.override = True
+
+        gis_settings = current.deployment_settings.gis
+        self.saved = gis_settings.get("hierarchy_cache")
+        gis_settings.hierarchy_cache = True
+
+        response = current.response
+        self.custom_commit = response.custom_commit
+        self.cleared = response.s3.ldata_cleared
+        self.on_commit = response.s3.on_commit
+
+        table = current.s3db.gis_location
+        self.L0 = table.insert(name = "LDataTestCountry",
+                               level = "L0",
+                               )
+        self.L1 = table.insert(name = "LDataTestProvince",
+                               level = "L1",
+                               parent = self.L0,
+                               path = "%s" % self.L0,
+                               )
+
+    def tearDown(self):
+
+        current.db.rollback()
+        current.auth.override = False
+
+        GIS.clear_ldata([self.L0, self.L1])
+
+        response = current.response
+        response.custom_commit = self.custom_commit
+        response.s3.ldata_cleared = self.cleared
+        response.s3.on_commit = self.on_commit
+
+        gis_settings = current.deployment_settings.gis
+        if self.saved is None:
+            gis_settings.pop("hierarchy_cache", None)
+        else:
+            gis_settings.hierarchy_cache = self.saved
+
+    # -------------------------------------------------------------------------
+    def testCache(self):
+        """ Test caching and invalidation of hierarchy data """
+
+        assertEqual = self.assertEqual
+        assertTrue = self.assertTrue
+
+        get_ldata = GIS.get_ldata
+        L0, L1 = self.L0, self.L1
+
+        output, last_modified = get_ldata(L0)
+        assertTrue(last_modified is not None)
+        data = json.loads(output)
+        assertEqual(data[str(L1)]["n"], "LDataTestProvince")
+        assertEqual(data[str(L1)]["l"], 1)
+
+        # Changes are not visible until the cache is cleared
+        table = current.s3db.gis_location
+        current.db(table.id == L1).update(name = "LDataTestRegion")
+        data = json.loads(get_ldata(L0)[0])
+        assertEqual(data[str(L1)]["n"], "LDataTestProvince")
+
+        # Clearing the data of the child clears the data of its parent
+        GIS.clear_ldata(L1, ancestors=True)
+        data = json.loads(get_ldata(L0)[0])
+        assertEqual(data[str(L1)]["n"], "LDataTestRegion")
+
+        # Dropdown options
+        data = json.loads(get_ldata(L0, children=True)[0])
+        assertEqual(data[str(L1)]["f"], L0)
+
+    # -------------------------------------------------------------------------
+    def testClearOnCommit(self):
+        """ Test that hierarchy data are discarded again after commit """
+
+        assertTrue = self.assertTrue
+        assertFalse = self.assertFalse
+
+        response = current.response
+        response.custom_commit = None
+        response.s3.ldata_cleared = None
+        response.s3.on_commit = None
+
+        get_ldata = GIS.get_ldata
+        L0, L1 = self.L0, self.L1
+        folder = GIS.ldata_cache_path(L0)
+
+        get_ldata(L0)
+        assertTrue(os.path.exists(folder))
+
+        GIS.clear_ldata(L1, ancestors=True)
+        assertFalse(os.path.exists(folder))
+
+        # Rebuilt before commit (e.g. by a concurrent request)
+        get_ldata(L0)
+        assertTrue(os.path.exists(folder))
+
+        class Adapter(object):
+            def commit(self):
+                pass
+
+        # Commit at the end of the request discards it again
+        response.custom_commit(Adapter())
+        assertFalse(os.path.exists(folder))
+
+# =============================================================================
+class S3GISConfigCacheTests(unittest.TestCase):
+    """ Tests for the cross-request cache of GIS config & map layers """
+
+    def setUp(self):
+
+        current.auth.override = True
+
+        gis_settings = current.deployment_settings.gis
+        self.saved = gis_settings.get("config_cache")
+        gis_settings.config_cache = 600
+
+        response = current.response
+        self.custom_commit = response.custom_commit
+        self.hooked = response.s3.gis.config_cache_hooked
+        self.on_commit = response.s3.on_commit
+
+    def tearDown(self):
+
+        current.db.rollback()
+        current.auth.override = False
+
+        response = current.response
+        response.custom_commit = self.custom_commit
+        response.s3.gis.config_cache_hooked = self.hooked
+        response.s3.on_commit = self.on_commit
+
+        gis_settings = current.deployment_settings.gis
+        if self.saved is None:
+            gis_settings.pop("config_cache", None)
+        else:
+            gis_settings.config_cache = self.saved
+
+    # -------------------------------------------------------------------------
+    def testInvalidation(self):
+        """ Test invalidation of the cache on writes """
+
+        assertEqual = self.assertEqual
+        assertNotEqual = self.assertNotEqual
+
+        calls = []
+        def build():
+            calls.append(1)
+            return len(calls)
+
+        config_cache = GIS.config_cache
+        version = GIS.config_cache_version()
+
+        assertEqual(config_cache("test", build), 1)
+        assertEqual(config_cache("test", build), 1)
+
+        # Writing to gis_style invalidates the cache
+        current.s3db.gis_style.insert(opacity = 0.5)
+        assertNotEqual(GIS.config_cache_version(), version)
+        assertEqual(config_cache("test", build), 2)
+
+    # -------------------------------------------------------------------------
+    def testRenewOnCommit(self):
+        """ Test renewal of the version stamp after commit """
+
+        assertEqual = self.assertEqual
+        assertNotEqual = self.assertNotEqual
+
+        response = current.response
+        response.custom_commit = None
+        response.s3.gis.config_cache_hooked = None
+        response.s3.on_commit = None
+
+        current.s3db.gis_style.insert(opacity = 0.5)
+        version = GIS.config_cache_version()
+
+        # Item cached before the commit
+        assertEqual(GIS.config_cache("test", lambda: "outdated"), "outdated")
+
+        commits = []
+        class Adapter(object):
+            def commit(self):
+                commits.append(GIS.config_cache_version())
+
+        # Commit at the end of the request renews the stamp
+        response.custom_commit(Adapter())
+        assertEqual(commits, [version])
+        assertNotEqual(GIS.config_cache_version(), version)
+        assertEqual(GIS.config_cache("test", lambda: "current"), "current")
+
+    # -------------------------------------------------------------------------
+    def testConfig(self):
+        """ Test that the cached config can not be altered by callers """
+
+        config = GIS.set_config(0)
+        if not config:
+            self.skipTest("No site default config")
+        config.zoom = -1
+
+        config = GIS.set_config(0)
+        self.assertNotEqual(config.zoom, -1)
+
+# =============================================================================
+class S3FeedCacheTests(unittest.TestCase):
+    """ Tests for the background refresh of KML/GeoRSS feeds """
+
+    FEED = """<?xml version="1.0" encoding="utf-8"?>
+<rss version="2.0" xmlns:georss="http://www.georss.org/georss">
+<channel>
+<title>Test Feed</title>
+<item>
+<title>Inside</title>
+<guid>1</guid>
+<georss:point>10.5 20.5</georss:point>
+</item>
+<item>
+<title>Outside</title>
+<guid>2</guid>
+<georss:point>-40.0 -60.0</georss:point>
+</item>
+</channel>
+</rss>"""
+
+    KML = """<?xml version="1.0" encoding="UTF-8"?>
+<kml xmlns="http://www.opengis.net/kml/2.2">
+<Document>
+<Placemark>
+<name>Placemark</name>
+<Style><IconStyle><Icon><href>icon.png</href></Icon></IconStyle></Style>
+<Point><coordinates>20.5,10.5,0</coordinates></Point>
+</Placemark>
+</Document>
+</kml>"""
+
+    @classmethod
+    def setUpClass(cls):
+
+        import threading
+        import zipfile
+        try:
+            from http.server import BaseHTTPRequestHandler, HTTPServer
+        except ImportError:
+            from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+        kml = cls.KML.encode("utf-8")
+        kmz = BytesIO()
+        archive = zipfile.ZipFile(kmz, "w")
+        archive.writestr("doc.kml", kml)
+        archive.writestr("icon.png", b"PNG")
+        archive.close()
+
+        documents = {"/feed.rss": (cls.FEED.encode("utf-8"), "application/rss+xml"),
+                     "/feed.kml": (kml, "application/vnd.google-earth.kml+xml"),
+                     "/feed.kmz": (kmz.getvalue(), "application/vnd.google-earth.kmz"),
+                     }
+        requests = cls.requests = []
+
+        class Handler(BaseHTTPRequestHandler):
+            """ Local stand-in for a remote feed server """
+
+            def do_GET(self):
+                requests.append(self.headers.get("If-None-Match"))
+                if self.headers.get("If-None-Match") == '"v1"':
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                document, content_type = documents[self.path]
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("ETag", '"v1"')
+                self.end_headers()
+                self.wfile.write(document)
+
+            def log_message(self, *args):
+                pass
+
+        server = cls.server = HTTPServer(("127.0.0.1", 0), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        cls.base_url = base_url = "http://127.0.0.1:%s" % server.server_port
+        cls.url = "%s/feed.rss" % base_url
+
+    @classmethod
+    def tearDownClass(cls):
+
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+
+        current.auth.override = True
+
+        table = current.s3db.gis_layer_georss
+        layer_id = table.insert(name = "FeedCacheTestLayer",
+                                url = self.url,
+                                )
+        self.layer = current.db(table.id == layer_id).select(table.id,
+                                                             table.layer_id,
+                                                             table.name,
+                                                             table.url,
+                                                             table.data,
+                                                             table.image,
+                                                             limitby = (0, 1),
+                                                             ).first()
+        del self.requests[:]
+
+    def tearDown(self):
+
+        current.db.rollback()
+        current.auth.override = False
+
+    # -------------------------------------------------------------------------
+    def testRefresh(self):
+        """ Test conditional refresh and bbox-filtering of cached features """
+
+        assertEqual = self.assertEqual
+        assertTrue = self.assertTrue
+        assertFalse = self.assertFalse
+
+        layer = self.layer
+        url = self.url
+
+        # First refresh fetches and caches the features
+        assertTrue(GIS.refresh_feed("gis_layer_georss", layer))
+        assertEqual(self.requests, [None])
+
+        data = json.loads(GIS.get_cached_features(url))
+        assertEqual(len(data["features"]), 2)
+
+        # BBOX filter
+        data = json.loads(GIS.get_cached_features(url, "20,10,21,11"))
+        features = data["features"]
+        assertEqual(len(features), 1)
+        assertEqual(features[0]["properties"]["name"], "Inside")
+        assertEqual(features[0]["geometry"]["coordinates"], [20.5, 10.5])
+
+        # Second refresh uses a conditional GET, and keeps the cache
+        assertFalse(GIS.refresh_feed("gis_layer_georss", layer))
+        assertEqual(self.requests, [None, '"v1"'])
+
+        data = json.loads(GIS.get_cached_features(url))
+        assertEqual(len(data["features"]), 2)
+
+        # Feed state is recorded
+        ftable = current.s3db.gis_feed
+        feed = current.db(ftable.layer_id == layer.layer_id).select(ftable.etag,
+                                                                    ftable.error,
+                                                                    ftable.refreshed_on,
+                                                                    limitby = (0, 1),
+                                                                    ).first()
+        assertEqual(feed.etag, '"v1"')
+        assertEqual(feed.error, None)
+        assertTrue(feed.refreshed_on is not None)
+
+    # -------------------------------------------------------------------------
+    def refresh_kml(self, url):
+        """
+            Refresh a KML layer, and read back the cached KML file
+
+            @param url: the feed URL
+
+            @returns: the contents of the cached KML file
+        """
+
+        table = current.s3db.gis_layer_kml
+        layer_id = table.insert(name = "FeedCacheTestKML",
+                                url = url,
+                                )
+        layer = current.db(table.id == layer_id).select(table.id,
+                                                        table.layer_id,
+                                                        table.name,
+                                                        table.url,
+                                                        limitby = (0, 1),
+                                                        ).first()
+
+        self.assertTrue(GIS.refresh_feed("gis_layer_kml", layer))
+
+        data = json.loads(GIS.get_cached_features(url))
+        features = data["features"]
+        self.assertEqual(len(features), 1)
+        self.assertEqual(features[0]["geometry"]["coordinates"], [20.5, 10.5])
+
+        filepath = os.path.join(current.request.folder,
+                                "uploads",
+                                "gis_cache",
+                                GIS.kml_cache_filename(layer.name),
+                                )
+        try:
+            with open(filepath, "rb") as f:
+                return f.read().decode("utf-8")
+        finally:
+            os.remove(filepath)
+
+    # -------------------------------------------------------------------------
+    def testRefreshKML(self):
+        """ Test refresh of a KML feed """
+
+        content = self.refresh_kml("%s/feed.kml" % self.base_url)
+        self.assertTrue("<Placemark>" in content)
+
+    # -------------------------------------------------------------------------
+    def testRefreshKMZ(self):
+        """ Test refresh of a KMZ feed, with unzipping of other files """
+
+        content = self.refresh_kml("%s/feed.kmz" % self.base_url)
+        self.assertTrue("<Placemark>" in content)
+
+        # Other files are extracted, and references rewritten
+        path = os.path.join(current.request.folder, "static", "cache", "kml", "icon.png")
+        try:
+            self.assertTrue(os.path.exists(path))
+        finally:
+            os.remove(path)
+        self.assertTrue("static/cache/kml/icon.png" in content)
+
+# =============================================================================
+class S3TileCacheTests(unittest.TestCase):
+    """ Tests for the Tile Cache for WMS/TMS layers """
+
+    def setUp(self):
+
+        import tempfile
+
+        self.root = tempfile.mkdtemp()
+        self.cache_root = S3TileCache.cache_root
+        S3TileCache.cache_root = staticmethod(lambda: self.root)
+        S3TileCache._size = None
+
+    def tearDown(self):
+
+        import shutil
+
+        S3TileCache.cache_root = self.cache_root
+        S3TileCache._size = None
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    # -------------------------------------------------------------------------
+    def testWMSRequest(self):
+        """ Test normalisation of WMS GetMap requests """
+
+        assertEqual = self.assertEqual
+
+        layer = Storage(layer_id = 1,
+                        url = "http://example.com/wms?map=test",
+                        layers = "roads",
+                        map = None,
+                        )
+        cache = S3TileCache("gis_layer_wms", layer)
+
+        url, key, extension = cache.request([], {"service": "WMS",
+                                                 "request": "GetMap",
+                                                 "layers": "roads",
+                                                 "transparent": "true",
+                                                 "format": "image/png",
+                                                 "srs": "EPSG:900913",
+                                                 "bbox": "0,0,1000,1000",
+                                                 "width": "256",
+                                                 "height": "256",
+                                                 "_olSalt": "0.123",
+                                                 })
+        assertEqual(extension, "png")
+        self.assertTrue(url.startswith("http://example.com/wms?map=test&"))
+        self.assertFalse("olSalt" in url)
+
+        # Rounding differences and parameter case do not change the key
+        url, key2, extension = cache.request([], {"REQUEST": "GetMap",
+                                                  "LAYERS": "roads",
+                                                  "TRANSPARENT": "TRUE",
+                                                  "FORMAT": "image/png",
+                                                  "SRS": "EPSG:900913",
+                                                  "BBOX": "0.0000001,0,999.9999999,1000",
+                                                  "WIDTH": "256",
+                                                  "HEIGHT": "256",
+                                                  })
+        assertEqual(key, key2)
+
+        # Non-tile requests are rejected
+        with self.assertRaises(ValueError):
+            cache.request([], {"REQUEST": "GetFeatureInfo"})
+
+    # -------------------------------------------------------------------------
+    def testTMSRequest(self):
+        """ Test validation of TMS requests """
+
+        layer = Storage(layer_id = 1,
+                        url = "http://example.com/tms",
+                        layername = "base",
+                        img_format = "png",
+                        )
+        cache = S3TileCache("gis_layer_tms", layer)
+
+        url, key, extension = cache.request(["1.0.0", "base", "2", "1", "3.png"], {})
+        self.assertEqual(url, "http://example.com/tms/1.0.0/base/2/1/3.png")
+
+        for args in (["1.0.0", "other", "2", "1", "3.png"],
+                     ["1.0.0", "base", "2", "4", "3.png"],
+                     ["1.0.0", "base", "2", "1", "3.jpg"],
+                     ):
+            with self.assertRaises(ValueError):
+                cache.request(args, {})
+
+    # -------------------------------------------------------------------------
+    def testPrune(self):
+        """ Test eviction of least recently used tiles """
+
+        import os
+
+        cache = S3TileCache("gis_layer_tms", Storage(layer_id=1))
+
+        paths = []
+        for i in range(4):
+            path = cache.path("tile%s" % i, "png")
+            S3TileCache.store(path, b"x" * 1000)
+            # Tile 0 is the least recently used
+            os.utime(path, (1000 + i, 1000))
+            paths.append(path)
+
+        evicted = S3TileCache.prune(limit=3500)
+        self.assertEqual(evicted, 1)
+        self.assertFalse(os.path.exists(paths[0]))
+        self.assertTrue(all(os.path.exists(p) for p in paths[1:]))
+
+        stats = S3TileCache.statistics()
+        self.assertEqual(stats["tiles"], 3)
+        self.assertEqual(stats["layers"]["1"]["size"], 3000)
+
+# =============================================================================
+class S3ImportLocationsTests(unittest.TestCase):
+    """ Tests for the streaming bulk import of locations """
+
+    def setUp(self):
+
+        current.auth.override = True
+
+    def tearDown(self):
+
+        current.db.rollback()
+        current.auth.override = False
+
+    # -------------------------------------------------------------------------
+    def testImport(self):
+        """ Test chunked import with centroids computed in worker processes """
+
+        assertEqual = self.assertEqual
+
+        db = current.db
+        s3db = current.s3db
+
+        table = s3db.gis_location
+        ttable = s3db.gis_location_tag
+
+        existing = table.insert(name = "ImportTestExisting",
+                                level = "L1",
+                                )
+
+        def records():
+            for i in range(3):
+                yield {"name": "ImportTest%s" % i,
+                       "level": "L1",
+                       "gis_feature_type": 3,
+                       "wkt": "POLYGON ((%s 0, %s 0, %s 2, %s 2, %s 0))" % \
+                              (i, i + 2, i + 2, i, i),
+                       "tags": {"ImportTestCode": str(i)},
+                       }
+            yield {"id": existing,
+                   "gis_feature_type": 3,
+                   "wkt": "POLYGON ((10 10, 14 10, 14 14, 10 14, 10 10))",
+                   }
+
+        for processes in (1, 2):
+            reported = []
+            count = GIS.import_locations(records(),
+                                         chunk_size = 2,
+                                         processes = processes,
+                                         progress = reported.append,
+                                         commit = False,
+                                         )
+            assertEqual(count, 4)
+            assertEqual(reported, [2, 4])
+
+            query = (table.name == "ImportTest1") & \
+                    (table.deleted == False)
+            row = db(query).select(table.id,
+                                   table.lat,
+                                   table.lon,
+                                   table.lon_min,
+                                   table.lon_max,
+                                   orderby = ~table.id,
+                                   limitby = (0, 1),
+                                   ).first()
+            assertEqual((row.lon, row.lat), (2.0, 1.0))
+            assertEqual((row.lon_min, row.lon_max), (1.0, 3.0))
+
+            tag = db(ttable.location_id == row.id).select(ttable.tag,
+                                                          ttable.value,
+                                                          limitby = (0, 1),
+                                                          ).first()
+            assertEqual((tag.tag, tag.value), ("ImportTestCode", "1"))
+
+            row = db(table.id == existing).select(table.lat,
+                                                  table.lon,
+                                                  limitby = (0, 1),
+                                                  ).first()
+            assertEqual((row.lon, row.lat), (12.0, 12.0))
+
+            db(table.id == existing).update(lat=None, lon=None)
+
+# =============================================================================
+class S3BulkMarkerTests(unittest.TestCase):
+    """ Tests for the bulk resolution of markers from layer styles """
+
+    def setUp(self):
+
+        current.auth.override = True
+
+        db = current.db
+        s3db = current.s3db
+
+        mtable = s3db.gis_marker
+        self.marker_a = mtable.insert(name = "BulkMarkerTestA",
+                                      image = "bulk_marker_test_a.png",
+                                      height = 10,
+                                      width = 11,
+                                      )
+        self.marker_b = mtable.insert(name = "BulkMarkerTestB",
+                                      image = "bulk_marker_test_b.png",
+                                      height = 20,
+                                      width = 21,
+                                      )
+
+        # Disable any configured layers for gis_location
+        ftable = s3db.gis_layer_feature
+        query = (ftable.controller == "gis") & \
+                (ftable.function == "location")
+        db(query).update(function = "bulk_marker_test_disabled")
+
+        layer_id = ftable.insert(name = "BulkMarkerTestLayer",
+                                 controller = "gis",
+                                 function = "location",
+                                 )
+        s3db.update_super(ftable, {"id": layer_id})
+        layer = db(ftable.id == layer_id).select(ftable.layer_id,
+                                                 limitby = (0, 1),
+                                                 ).first()
+        self.layer_id = layer.layer_id
+
+        table = s3db.gis_location
+        self.l1 = table.insert(name = "BulkMarkerTestL1", level = "L1")
+        self.l2 = table.insert(name = "BulkMarkerTestL2", level = "L2")
+        self.l3 = table.insert(name = "BulkMarkerTestL3", level = "L1")
+
+    def tearDown(self):
+
+        current.db.rollback()
+        current.auth.override = False
+
+    # -------------------------------------------------------------------------
+    def resource(self):
+
+        return current.s3db.resource("gis_location",
+                                     filter = FS("name").like("BulkMarkerTest%"),
+                                     )
+
+    # -------------------------------------------------------------------------
+    def testLayerMarker(self):
+        """ Test a single marker for all features of a layer """
+
+        current.s3db.gis_style.insert(layer_id = self.layer_id,
+                                      marker_id = self.marker_a,
+                                      )
+
+        marker = GIS.get_markers(self.resource())
+        self.assertEqual(marker["image"], "bulk_marker_test_a.png")
+        self.assertEqual(marker["height"], 10)
+        self.assertEqual(marker["width"], 11)
+
+    # -------------------------------------------------------------------------
+    def testRules(self):
+        """ Test per-feature markers from style rules """
+
+        assertEqual = self.assertEqual
+
+        rules = [{"prop": "level",
+                  "cat": "L1",
+                  "externalGraphic": "img/markers/bulk_marker_test_a.png",
+                  },
+                 {"fallback": "Other",
+                  "externalGraphic": "img/markers/bulk_marker_test_b.png",
+                  },
+                 ]
+        current.s3db.gis_style.insert(layer_id = self.layer_id,
+                                      style = rules,
+                                      )
+
+        markers = GIS.get_markers(self.resource())
+        assertEqual(len(markers), 3)
+        assertEqual(markers[self.l1]["image"], "bulk_marker_test_a.png")
+        assertEqual(markers[self.l1]["width"], 11)
+        assertEqual(markers[self.l2]["image"], "bulk_marker_test_b.png")
+        assertEqual(markers[self.l2]["height"], 20)
+        assertEqual(markers[self.l3]["image"], "bulk_marker_test_a.png")
+
+    # -------------------------------------------------------------------------
+    def testFilteredLayers(self):
+        """ Test assignment of features to layers by their filters """
+
+        assertEqual = self.assertEqual
+
+        s3db = current.s3db
+        stable = s3db.gis_style
+        stable.insert(layer_id = self.layer_id,
+                      marker_id = self.marker_a,
+                      )
+
+        ftable = s3db.gis_layer_feature
+        layer_id = ftable.insert(name = "BulkMarkerTestFiltered",
+                                 controller = "gis",
+                                 function = "location",
+                                 filter = "~.level=L2",
+                                 style_default = False,
+                                 )
+        s3db.update_super(ftable, {"id": layer_id})
+        layer = current.db(ftable.id == layer_id).select(ftable.layer_id,
+                                                         limitby = (0, 1),
+                                                         ).first()
+        stable.insert(layer_id = layer.layer_id,
+                      marker_id = self.marker_b,
+                      )
+
+        markers = GIS.get_markers(self.resource())
+        assertEqual(markers[self.l1]["image"], "bulk_marker_test_a.png")
+        assertEqual(markers[self.l2]["image"], "bulk_marker_test_b.png")
+        assertEqual(markers[self.l3]["image"], "bulk_marker_test_a.png")
+
+        # Single layer selected
+        marker = GIS.get_markers(self.resource(), layer.layer_id)
+        assertEqual(marker["image"], "bulk_marker_test_b.png")
+
 # =============================================================================
 if __name__ == "__main__":
 
     run_suite(
         S3LocationTreeTests,
         S3NoGisConfigTests,
+        S3MVTEncoderTests,
+        S3VectorTileVersionTests,
+        S3ClusterTests,
+        S3SpatialIndexTests,
+        S3SimplifyLevelTests,
+        S3GeocoderTests,
+        S3LocationHierarchyCacheTests,
+        S3GISConfigCacheTests,
+        S3FeedCacheTests,
+        S3TileCacheTests,
+        S3ImportLocationsTests,
+        S3BulkMarkerTests,
         )
 
 # END ========================================================================
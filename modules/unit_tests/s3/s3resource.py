@@ -621,6 +621,43 @@ class ResourceExportTests(unittest.TestCase):
         finally:
             current.db.rollback()
 
+    # -------------------------------------------------------------------------
+    def testExportXMLStream(self):
+        """ Test incremental export of a resource as S3XML """
+
+        assertEqual = self.assertEqual
+        assertTrue = self.assertTrue
+
+        db = current.db
+        table = db.exporter_test
+
+        try:
+            for i in range(5):
+                table.insert(name="TestExportXMLStream%s" % i)
+
+            resource = current.s3db.resource("exporter_test")
+            progress = []
+            output = resource.export_xml(stream = True,
+                                         chunk_size = 2,
+                                         progress = lambda d, t: progress.append((d, t)),
+                                         )
+
+            # Produces a generator rather than a string
+            assertTrue(hasattr(output, "__next__") or hasattr(output, "next"))
+
+            tree = etree.fromstring(b"".join(output))
+            elements = tree.xpath("resource[@name='exporter_test']")
+            assertEqual(len(elements), 5)
+            assertEqual(tree.get("results"), "5")
+            assertEqual(progress[-1], (5, 5))
+
+            # No duplicates
+            uids = set(e.get("uuid") for e in elements)
+            assertEqual(len(uids), 5)
+
+        finally:
+            db.rollback()
+
 # =============================================================================
 class ResourceImportTests(unittest.TestCase):
     """ Test XML imports into resources """
@@ -5,16 +5,19 @@
 # To run this script use:
 # python web2py.py -S eden -M -R applications/eden/modules/unit_tests/s3/s3sync.py
 #
+import datetime
 import json
 import unittest
 
 from gluon import current
+from gluon.storage import Storage
 from lxml import etree
 
 from unit_tests import run_suite
 
-from s3 import S3SyncDataArchive
-from s3compat import PY2
+from s3 import FS, S3Sync, S3SyncDataArchive, S3SyncScheduler
+from s3.sync_adapter.eden import S3SyncAdapter
+from s3compat import PY2, BytesIO
 
 # =============================================================================
 class ExportMergeTests(unittest.TestCase):
@@ -463,6 +466,326 @@ class DataArchiveTests(unittest.TestCase):
         extracted = archive.extract("test2.xml").read()
         assertEqual(extracted, xmlstr2)
 
+    # -------------------------------------------------------------------------
+    def testArchiveStreaming(self):
+        """ Test archiving of file-like objects and streams """
+
+        assertEqual = self.assertEqual
+
+        archive = S3SyncDataArchive()
+
+        # Add a file-like object and a stream (generator)
+        xmlstr1 = b"<example>First Example</example>"
+        archive.add("test1.xml", BytesIO(xmlstr1))
+        chunks = [b"<example>", b"Second Example", b"</example>"]
+        archive.add("test2.xml", (chunk for chunk in chunks))
+
+        fileobj = archive.close()
+
+        # Open the archive from a non-seekable object
+        class Response(object):
+            def __init__(self, data):
+                self.data = BytesIO(data)
+            def read(self, size=-1):
+                return self.data.read(size)
+
+        archive = S3SyncDataArchive(Response(fileobj.read()))
+
+        # Verify archive contents
+        extracted = archive.extract("test1.xml").read()
+        assertEqual(extracted, xmlstr1)
+        extracted = archive.extract("test2.xml").read()
+        assertEqual(extracted, b"".join(chunks))
+        assertEqual(archive.extract("test3.xml"), None)
+
+# =============================================================================
+class PagedTransferTests(unittest.TestCase):
+    """ Tests for paged sync transfers with continuation tokens """
+
+    def setUp(self):
+
+        current.auth.override = True
+
+        table = current.s3db.org_organisation
+        for i in range(5):
+            table.insert(name = "PagedSyncTestOrg%s" % i)
+
+    def tearDown(self):
+
+        current.db.rollback()
+        current.auth.override = False
+
+    # -------------------------------------------------------------------------
+    def testTokenEncoding(self):
+        """ Test encoding/decoding of continuation tokens """
+
+        assertEqual = self.assertEqual
+
+        mtime = datetime.datetime(2021, 3, 4, 12, 30, 15, 123456)
+        token = S3SyncAdapter.encode_token(mtime, 17)
+        assertEqual(S3SyncAdapter.decode_token(token), (mtime, 17))
+
+        mtime = datetime.datetime(2021, 3, 4, 12, 30, 15)
+        token = S3SyncAdapter.encode_token(mtime, 4)
+        assertEqual(S3SyncAdapter.decode_token(token), (mtime, 4))
+
+        assertEqual(S3SyncAdapter.decode_token(None), None)
+        assertEqual(S3SyncAdapter.decode_token("invalid"), None)
+
+    # -------------------------------------------------------------------------
+    def testSelectPage(self):
+        """ Test paging through a resource with continuation tokens """
+
+        assertEqual = self.assertEqual
+
+        s3db = current.s3db
+        query = FS("name").like("PagedSyncTestOrg%")
+
+        token = None
+        pages = []
+        while True:
+            resource = s3db.resource("org_organisation", filter=query)
+            token = S3SyncAdapter.select_page(resource, 2, token=token)
+            rows = resource.select(["id"], limit=None).rows
+            pages.append([row["org_organisation.id"] for row in rows])
+            if not token:
+                break
+
+        assertEqual([len(page) for page in pages], [2, 2, 1])
+
+        # Each record is sent exactly once
+        ids = [record_id for page in pages for record_id in page]
+        assertEqual(len(set(ids)), 5)
+
+# =============================================================================
+class SyncSchedulerTests(unittest.TestCase):
+    """ Tests for the concurrent synchronization scheduler """
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        current.auth.override = True
+
+        db = current.db
+        s3db = current.s3db
+
+        # The scheduler commits, so clean up any leftovers first
+        self.cleanup()
+
+        table = s3db.sync_repository
+        repository_id = table.insert(name = "SyncSchedulerTest",
+                                     apitype = "eden",
+                                     url = "http://localhost",
+                                     )
+        self.repository = db(table.id == repository_id).select(limitby=(0, 1)).first()
+
+        table = s3db.sync_task
+        for resource_name in ("org_organisation", "pr_person"):
+            table.insert(repository_id = repository_id,
+                         resource_name = resource_name,
+                         components = False,
+                         )
+
+        table = s3db.sync_status
+        row = db().select(table.running, table.manual, limitby=(0, 1)).first()
+        self.status = row.as_dict() if row else None
+
+        db.commit()
+
+        # Do not start scheduler tasks, record the calls instead
+        s3task = current.s3task
+        self.run_async = s3task.run_async
+        self.is_alive = s3task._is_alive
+        self.calls = calls = []
+        def run_async(task, args=None, vars=None, timeout=300, queue=None):
+            calls.append((task, args))
+            return len(calls)
+        s3task.run_async = run_async
+        s3task._is_alive = lambda *args, **kwargs: True
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        s3task = current.s3task
+        s3task.run_async = self.run_async
+        s3task._is_alive = self.is_alive
+
+        self.cleanup()
+
+        if self.status:
+            S3Sync.set_status(**self.status)
+        current.db.commit()
+
+        current.auth.override = False
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def cleanup():
+        """ Remove all test records """
+
+        db = current.db
+        s3db = current.s3db
+
+        rtable = s3db.sync_repository
+        query = (rtable.name == "SyncSchedulerTest")
+        repository_ids = [row.id for row in db(query).select(rtable.id)]
+
+        table = s3db.sync_run
+        query = (table.repository_id.belongs(repository_ids)) | \
+                (table.resource_name.like("test_sync_%"))
+        run_ids = [row.id for row in db(query).select(table.id)]
+
+        db(s3db.sync_lock.run_id.belongs(run_ids)).delete()
+        db(table.id.belongs(run_ids)).delete()
+        db(s3db.sync_task.repository_id.belongs(repository_ids)).delete()
+        db(rtable.id.belongs(repository_ids)).delete()
+        db.commit()
+
+    # -------------------------------------------------------------------------
+    def queue(self, *tablenames):
+        """
+            Queue runs with the given table locks
+
+            @param tablenames: the table names of each run (lists)
+
+            @returns: list of sync_run IDs
+        """
+
+        table = current.s3db.sync_run
+        now = datetime.datetime.utcnow()
+
+        run_ids = [table.insert(repository_id = self.repository.id,
+                                resource_name = "test_sync_%s" % i,
+                                tablenames = names,
+                                status = "QUEUED",
+                                queued_on = now,
+                                )
+                   for i, names in enumerate(tablenames)]
+        current.db.commit()
+
+        return run_ids
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def status(run_id):
+        """ Get the status of a run """
+
+        table = current.s3db.sync_run
+        row = current.db(table.id == run_id).select(table.status,
+                                                    limitby = (0, 1),
+                                                    ).first()
+        return row.status if row else None
+
+    # -------------------------------------------------------------------------
+    def testSchedule(self):
+        """ Test queueing of runs for all tasks of a repository """
+
+        assertEqual = self.assertEqual
+
+        scheduler = S3SyncScheduler()
+        scheduler.limit = 1
+
+        run_ids = scheduler.schedule(self.repository)
+        assertEqual(len(run_ids), 2)
+
+        # One run started, the other queued
+        assertEqual(len(self.calls), 1)
+        assertEqual(self.calls[0], ("sync_run", [run_ids[0]]))
+        assertEqual(self.status(run_ids[0]), "STARTING")
+        assertEqual(self.status(run_ids[1]), "QUEUED")
+
+        # Repository is being synchronized
+        assertEqual(scheduler.schedule(self.repository), None)
+
+    # -------------------------------------------------------------------------
+    def testDispatch(self):
+        """ Test dispatch of queued runs up to the concurrency limit """
+
+        assertEqual = self.assertEqual
+
+        scheduler = S3SyncScheduler()
+        scheduler.limit = 2
+
+        run_ids = self.queue(["test_sync_a"],
+                             ["test_sync_a"],
+                             ["test_sync_b"],
+                             ["test_sync_c"],
+                             )
+        scheduler.dispatch()
+
+        # Limit reached, conflicting run skipped
+        assertEqual([args[0] for task, args in self.calls],
+                    [run_ids[0], run_ids[2]])
+        assertEqual([self.status(run_id) for run_id in run_ids],
+                    ["STARTING", "QUEUED", "STARTING", "QUEUED"])
+
+        # Finishing a run releases its locks
+        scheduler.finish(run_ids[0], None, None)
+        assertEqual(self.status(run_ids[0]), "SUCCESS")
+        scheduler.dispatch()
+        assertEqual(self.calls[-1][1], [run_ids[1]])
+        assertEqual(self.status(run_ids[3]), "QUEUED")
+
+    # -------------------------------------------------------------------------
+    def testExpire(self):
+        """ Test that stale locks do not block the repository """
+
+        assertEqual = self.assertEqual
+
+        db = current.db
+        s3db = current.s3db
+
+        scheduler = S3SyncScheduler()
+
+        # A run that has died while holding its locks
+        run_id = self.queue(["test_sync_a"])[0]
+        scheduler.dispatch()
+        assertEqual(self.status(run_id), "STARTING")
+
+        past = datetime.datetime.utcnow() - \
+               datetime.timedelta(seconds=scheduler.TIMEOUT + 60)
+        table = s3db.sync_lock
+        db(table.run_id == run_id).update(timestmp = past)
+        db.commit()
+
+        # Scheduling expires the dead run, and queues new runs
+        run_ids = scheduler.schedule(self.repository)
+        assertEqual(len(run_ids), 2)
+        assertEqual(self.status(run_id), "FAILED")
+        assertEqual(db(table.run_id == run_id).count(), 0)
+
+    # -------------------------------------------------------------------------
+    def testTablenames(self):
+        """ Test lookup of the tables a sync task writes to """
+
+        assertEqual = self.assertEqual
+        assertIn = self.assertIn
+        assertNotIn = self.assertNotIn
+
+        tablenames = S3SyncScheduler.tablenames
+
+        # Without components, but with referenced tables
+        task = Storage(resource_name = "org_office",
+                       components = False,
+                       )
+        names = tablenames(task)
+        assertIn("org_office", names)
+        assertIn("org_organisation", names)
+        assertIn("gis_location", names)
+        # No super-entities or meta-field references
+        assertNotIn("org_site", names)
+        assertNotIn("pr_pentity", names)
+        assertNotIn("auth_user", names)
+
+        # With components
+        task = Storage(resource_name = "org_organisation",
+                       components = True,
+                       )
+        names = tablenames(task)
+        assertIn("org_organisation", names)
+        assertIn("org_office", names)
+        assertEqual(names, sorted(set(names)))
+
 # =============================================================================
 if __name__ == "__main__":
 
@@ -474,6 +797,8 @@ if __name__ == "__main__":
         ImportMergeWithExistingDuplicate,
         ImportMergeWithoutExistingRecords,
         DataArchiveTests,
+        PagedTransferTests,
+        SyncSchedulerTests,
         )
 
 # END ========================================================================
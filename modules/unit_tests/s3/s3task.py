@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+#
+# S3Task Unit Tests
+#
+# To run this script use:
+# python web2py.py -S eden -M -R applications/eden/modules/unit_tests/s3/s3task.py
+#
+import datetime
+import json
+import unittest
+
+from gluon import current
+
+from s3.s3task import S3Task
+
+from unit_tests import run_suite
+
+# =============================================================================
+class TaskQueueTests(unittest.TestCase):
+    """ Tests for task queues and priorities """
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        scheduler = current.deployment_settings.scheduler
+        self.queues = scheduler.get("queues")
+        self.task_queues = scheduler.get("task_queues")
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        scheduler = current.deployment_settings.scheduler
+        scheduler.queues = self.queues
+        scheduler.task_queues = self.task_queues
+
+    # -------------------------------------------------------------------------
+    def testGetQueue(self):
+        """ Test lookup of the queue for a task """
+
+        assertEqual = self.assertEqual
+
+        scheduler = current.deployment_settings.scheduler
+        scheduler.queues = {"bulk": {"group": "bulk"},
+                            "high": {"priority": 5},
+                            }
+        scheduler.task_queues = {"dummy": "bulk",
+                                 "msg_process_outbox": "default",
+                                 }
+
+        # Configured queues extend/override the defaults
+        queues = S3Task.get_queues()
+        assertEqual(queues["bulk"], {"group": "bulk", "priority": 0})
+        assertEqual(queues["high"], {"group": "main", "priority": 5})
+        assertEqual(queues["low"], {"group": "main", "priority": 0})
+
+        # Default task queues
+        assertEqual(S3Task.get_queue("gis_update_location_tree"), ("high", "main", 5))
+        assertEqual(S3Task.get_queue("sync_synchronize"), ("low", "main", 0))
+        assertEqual(S3Task.get_queue("undefined_task"), ("default", "main", 1))
+
+        # Configured task queues
+        assertEqual(S3Task.get_queue("dummy"), ("bulk", "bulk", 0))
+        assertEqual(S3Task.get_queue("msg_process_outbox"), ("default", "main", 1))
+
+        # Explicit queue overrides configuration, unknown queue falls back to default
+        assertEqual(S3Task.get_queue("dummy", queue="high"), ("high", "main", 5))
+        assertEqual(S3Task.get_queue("dummy", queue="nonexistent"), ("default", "main", 1))
+
+    # -------------------------------------------------------------------------
+    def testNextRunTime(self):
+        """ Test that higher priority brings the next run time forward """
+
+        now = datetime.datetime(2021, 6, 1, 12, 0, 0)
+        step = datetime.timedelta(seconds=S3Task.PRIORITY_STEP)
+
+        self.assertEqual(S3Task._next_run_time(now, 0), now)
+        self.assertEqual(S3Task._next_run_time(now, 2), now - 2 * step)
+
+# =============================================================================
+class QueueTaskTests(unittest.TestCase):
+    """ Tests for queuing of tasks and queue status """
+
+    TASK = "s3task_unit_test"
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        s3task = current.s3task
+        if not s3task or not s3task.scheduler:
+            self.skipTest("Scheduler not available")
+
+        scheduler = current.deployment_settings.scheduler
+        self.queues = scheduler.get("queues")
+        scheduler.queues = {"bulk": {"group": "bulk", "priority": 0},
+                            "urgent": {"group": "main", "priority": 4},
+                            }
+
+        # Register a dummy task, recording synchronous calls
+        tasks = current.response.s3.tasks
+        self.calls = calls = []
+        def dummy(*args, **vars):
+            calls.append((args, vars))
+        tasks[self.TASK] = dummy
+
+        # Pretend workers are alive
+        self.alive = True
+        s3task._is_alive = lambda group_name=None: self.alive
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        s3task = current.s3task
+        if "_is_alive" in s3task.__dict__:
+            del s3task._is_alive
+
+        current.response.s3.tasks.pop(self.TASK, None)
+
+        current.deployment_settings.scheduler.queues = self.queues
+
+        current.db.rollback()
+
+    # -------------------------------------------------------------------------
+    def testRunAsyncBatch(self):
+        """ Test queuing of a batch of calls """
+
+        assertEqual = self.assertEqual
+
+        s3task = current.s3task
+        ttable = current.db[S3Task.TASK_TABLENAME]
+
+        calls = [(["a"], {"x": 1}),
+                 (("b",), None),
+                 (None, {"x": 3}),
+                 ]
+        task_ids = s3task.run_async_batch(self.TASK, calls, queue="urgent")
+        assertEqual(len(task_ids), 3)
+
+        rows = current.db(ttable.id.belongs(task_ids)).select(orderby=ttable.id)
+        assertEqual(len(rows), 3)
+
+        step = datetime.timedelta(seconds=S3Task.PRIORITY_STEP)
+        for row, (args, vars) in zip(rows, calls):
+            assertEqual(row.task_name, self.TASK)
+            assertEqual(row.function_name, self.TASK)
+            assertEqual(row.group_name, "main")
+            assertEqual(row.status, "QUEUED")
+
+            # Next run time brought forward according to priority
+            assertEqual(row.next_run_time, row.start_time - 4 * step)
+
+            assertEqual(json.loads(row.args), list(args) if args else [])
+            row_vars = json.loads(row.vars)
+            row_vars.pop("user_id", None)
+            assertEqual(row_vars, vars or {})
+
+        # Nothing run synchronously
+        assertEqual(self.calls, [])
+
+        # Queue in a different worker group, without priority
+        task_ids = s3task.run_async_batch(self.TASK, calls[:1], queue="bulk")
+        row = current.db(ttable.id == task_ids[0]).select(limitby=(0, 1)).first()
+        assertEqual(row.group_name, "bulk")
+        assertEqual(row.next_run_time, row.start_time)
+
+    # -------------------------------------------------------------------------
+    def testRunAsyncBatchSync(self):
+        """ Test synchronous fallback when no workers are alive """
+
+        self.alive = False
+
+        calls = [(["a"], {"x": 1}),
+                 (["b"], None),
+                 ]
+        result = current.s3task.run_async_batch(self.TASK, calls)
+        self.assertEqual(result, None)
+        self.assertEqual(self.calls, [(("a",), {"x": 1}),
+                                      (("b",), {}),
+                                      ])
+
+        # Undefined task
+        result = current.s3task.run_async_batch("undefined_task", calls)
+        self.assertFalse(result)
+
+    # -------------------------------------------------------------------------
+    def testQueueStatus(self):
+        """ Test counting of queued and running tasks per queue """
+
+        assertEqual = self.assertEqual
+
+        db = current.db
+        s3task = current.s3task
+        ttable = db[S3Task.TASK_TABLENAME]
+
+        def counts():
+            status = S3Task.queue_status()
+            return dict((name, (item["queued"], item["running"]))
+                        for name, item in status.items())
+        before = counts()
+
+        urgent = s3task.run_async_batch(self.TASK, [(["a"], None)] * 3, queue="urgent")
+        s3task.run_async_batch(self.TASK, [(["b"], None)] * 2, queue="bulk")
+        s3task.run_async_batch(self.TASK, [(["c"], None)], queue="default")
+
+        # One of the urgent tasks is running
+        db(ttable.id == urgent[0]).update(status = "RUNNING")
+
+        # A task that is not due yet does not count as queued
+        later = datetime.datetime.now() + datetime.timedelta(hours=1)
+        db(ttable.id == urgent[1]).update(start_time = later,
+                                          next_run_time = later,
+                                          )
+
+        after = counts()
+        changes = dict((name, (after[name][0] - before[name][0],
+                               after[name][1] - before[name][1],
+                               ))
+                       for name in after)
+
+        assertEqual(changes["urgent"], (1, 1))
+        assertEqual(changes["bulk"], (2, 0))
+        assertEqual(changes["default"], (1, 0))
+        assertEqual(changes["high"], (0, 0))
+
+# =============================================================================
+if __name__ == "__main__":
+
+    run_suite(
+        TaskQueueTests,
+        QueueTaskTests,
+    )
+
+# END ========================================================================
@@ -13,7 +13,7 @@ from lxml import etree
 
 from gluon import *
 
-from s3 import S3Hierarchy, s3_meta_fields, S3Represent, S3RepresentLazy, S3XMLFormat, IS_ONE_OF
+from s3 import S3Hierarchy, s3_meta_fields, S3Represent, S3RepresentLazy, S3XMLFormat, S3XSLTCache, IS_ONE_OF
 from s3compat import BytesIO, StringIO
 
 from unit_tests import run_suite
@@ -263,6 +263,133 @@ class XMLFormatTests(unittest.TestCase):
         self.assertEqual(len(root), 0)
         self.assertEqual(root.text, "Test")
 
+# =============================================================================
+class XSLTCacheTests(unittest.TestCase):
+    """ Test process-wide caching of compiled XSLT stylesheets """
+
+    stylesheet = """<?xml version="1.0"?>
+<xsl:stylesheet
+    xmlns:xsl="http://www.w3.org/1999/XSL/Transform" version="1.0"
+    xmlns:s3="http://eden.sahanafoundation.org/wiki/S3">
+
+    <xsl:output method="xml"/>
+
+    <s3:fields tables="ANY" select="location_id"/>
+
+    <xsl:template match="/">
+        <test>%s</test>
+    </xsl:template>
+</xsl:stylesheet>"""
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        import tempfile
+        handle, self.path = tempfile.mkstemp(suffix=".xsl")
+        with os.fdopen(handle, "w") as f:
+            f.write(self.stylesheet % "Test1")
+
+        self.tree = etree.ElementTree(etree.fromstring("""<?xml version="1.0"?><s3xml/>"""))
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        S3XSLTCache.clear()
+        os.remove(self.path)
+
+    # -------------------------------------------------------------------------
+    def testCaching(self):
+        """ Test that compiled stylesheets and field analysis are reused """
+
+        assertEqual = self.assertEqual
+        assertIs = self.assertIs
+
+        entry = S3XSLTCache.get(self.path)
+        self.assertNotEqual(entry, None)
+        assertIs(S3XSLTCache.get(self.path), entry)
+
+        xmlformat = S3XMLFormat(self.path)
+        assertIs(xmlformat.transformer, entry.transformer)
+        include, exclude = xmlformat.get_fields("org_office")
+        assertEqual(include, ["location_id"])
+        assertEqual(entry.select, {"ANY": {"location_id"}})
+
+        # Second instance re-uses the field analysis
+        xmlformat = S3XMLFormat(self.path)
+        assertIs(xmlformat.select, entry.select)
+
+        result = current.xml.transform(self.tree, self.path)
+        assertEqual(result.getroot().text, "Test1")
+
+    # -------------------------------------------------------------------------
+    def testInvalidation(self):
+        """ Test that modified stylesheets are re-compiled """
+
+        entry = S3XSLTCache.get(self.path)
+
+        with open(self.path, "w") as f:
+            f.write(self.stylesheet % "Test2")
+        mtime = entry.files[os.path.realpath(self.path)]
+        os.utime(self.path, (mtime + 10, mtime + 10))
+
+        updated = S3XSLTCache.get(self.path)
+        self.assertIsNot(updated, entry)
+
+        result = current.xml.transform(self.tree, self.path)
+        self.assertEqual(result.getroot().text, "Test2")
+
+# =============================================================================
+class DigestTests(unittest.TestCase):
+    """ Tests for record content digests """
+
+    # -------------------------------------------------------------------------
+    def testDigest(self):
+        """ Test that digests only reflect the record contents """
+
+        xml = current.xml
+        digest = lambda s: xml.digest(etree.fromstring(s))
+
+        element = """
+<resource name="org_organisation" uuid="ORG1" modified_on="2021-01-01T00:00:00Z">
+    <data field="name">Example</data>
+    <reference field="organisation_type_id" resource="org_organisation_type" uuid="TYPE1">Type</reference>
+    <resource name="org_office" uuid="OFFICE1">
+        <data field="name">Office 1</data>
+    </resource>
+    <resource name="org_office" uuid="OFFICE2">
+        <data field="name">Office 2</data>
+    </resource>
+</resource>"""
+
+        # Different meta-data, representations and order of components
+        same = """
+<resource name="org_organisation" uuid="ORG1" modified_on="2021-02-01T00:00:00Z" url="http://example.com/org/1">
+    <resource name="org_office" uuid="OFFICE2">
+        <data field="name">Office 2</data>
+    </resource>
+    <reference field="organisation_type_id" resource="org_organisation_type" uuid="TYPE1">Other Type</reference>
+    <data field="name">Example</data>
+    <resource name="org_office" uuid="OFFICE1">
+        <data field="name">Office 1</data>
+    </resource>
+</resource>"""
+
+        # Changed component
+        changed = """
+<resource name="org_organisation" uuid="ORG1" modified_on="2021-01-01T00:00:00Z">
+    <data field="name">Example</data>
+    <reference field="organisation_type_id" resource="org_organisation_type" uuid="TYPE1">Type</reference>
+    <resource name="org_office" uuid="OFFICE1">
+        <data field="name">Office 1</data>
+    </resource>
+    <resource name="org_office" uuid="OFFICE2">
+        <data field="name">Office 3</data>
+    </resource>
+</resource>"""
+
+        self.assertEqual(digest(element), digest(same))
+        self.assertNotEqual(digest(element), digest(changed))
+
 # =============================================================================
 class GetFieldOptionsTests(unittest.TestCase):
     """ Test field options introspection method """
@@ -1106,6 +1233,8 @@ if __name__ == "__main__":
         TreeBuilderTests,
         JSONMessageTests,
         XMLFormatTests,
+        XSLTCacheTests,
+        DigestTests,
         GetFieldOptionsTests,
         S3JSONParsingTests,
         LookupListRepresentTests,
@@ -17,7 +17,10 @@ countries = ["AF", "AU", "BD", "BN", "CK", "CN", "FJ",
              "VN", "VU", "WS",
              ]
 
-gis.import_admin_areas(countries=countries)
+def progress(level, count):
+    sys.stderr.write("%s: %s features imported\n" % (level, count))
+
+gis.import_admin_areas(countries=countries, progress=progress)
 db.commit()
 
 sys.stderr.write("Total Time: %s\n" % (time.mktime(time.localtime()) - secs))